@@ -12,6 +12,7 @@ pip install python-telegram-bot Flask pandas openpyxl
 # Fix UTF-8 encoding for Windows console
 import sys
 import io
+import csv
 if sys.platform == 'win32':
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
     sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
@@ -81,19 +82,30 @@ import time
 import jdatetime
 import json # For parsing scopes from FormData
 import requests
+import httpx
+import threading
+import weakref
+import queue
+import concurrent.futures
+import atexit
 from datetime import datetime, timedelta
 from io import BytesIO
 import hashlib
+import functools
+import zlib
+import base64
+import binascii
 import tempfile
 import shutil
 from urllib.parse import urlparse
+from collections import OrderedDict
 from threading import Thread
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.interval import IntervalTrigger
-from typing import Dict, List, Set, Any, Optional, Tuple, Union, BinaryIO
+from typing import Dict, List, Set, Any, Optional, Tuple, Union, BinaryIO, Iterator, Iterable, Callable
 from telegram import Bot, InputFile
 from telegram.error import BadRequest, TelegramError, RetryAfter
 
@@ -104,14 +116,14 @@ try:
 except Exception:
     jdatetime = None
     pytz = None
-from flask import Flask, jsonify, render_template, request, abort, send_file
+from flask import Flask, jsonify, render_template, request, abort, send_file, Response
 from werkzeug.utils import secure_filename # For secure file names
 
 # --- Telegram Imports ---
 from telegram import Update as TelegramUpdate, Bot as TelegramBot, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application as TelegramApplication, CommandHandler, ChatMemberHandler, ContextTypes as TelegramContextTypes, CallbackQueryHandler, MessageHandler, filters
 from telegram.constants import ChatType, ParseMode
-from telegram.error import BadRequest, Forbidden, TimedOut
+from telegram.error import BadRequest, Forbidden, TimedOut, NetworkError
 
 # --- Bale Configuration (using python-telegram-bot with Bale API) ---
 BALE_API_BASE_URL = "https://tapi.bale.ai/bot"
@@ -160,6 +172,25 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # --- Broadcast de-duplication ---
 BROADCAST_DEDUPE_TTL_SECONDS = 60
+BROADCAST_DEDUPE_MAX_ENTRIES = 10000
+# برای اجرای چند پروسه‌ای، کلیدها علاوه بر حافظه در جدول broadcast_dedupe هم ثبت شوند
+BROADCAST_DEDUPE_PERSIST = getattr(config, 'BROADCAST_DEDUPE_PERSIST', False)
+
+def _media_fingerprint(media: Optional[str]) -> str:
+    """اثر انگشت رسانه: هش محتوای فایل محلی، یا خود file_id/URL"""
+    if not media:
+        return ''
+    media = str(media)
+    if os.path.isfile(media):
+        digest = hashlib.sha1()
+        try:
+            with open(media, 'rb') as media_file:
+                for chunk in iter(lambda: media_file.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            return f"file:{digest.hexdigest()}"
+        except OSError:
+            pass
+    return media
 
 def build_broadcast_key(platform: str,
                         content_text: Optional[str],
@@ -168,51 +199,220 @@ def build_broadcast_key(platform: str,
                         document_id: Optional[str],
                         forward_chat_id: Optional[str],
                         forward_message_id: Optional[int],
-                        source_platform: Optional[str] = None) -> str:
-    # Only apply deduplication for cross-platform broadcasts
-    # For same-platform broadcasts, use a unique key to avoid blocking
-    source_platform_str = source_platform or platform
-    
-    if platform == source_platform_str:
-        # Same platform broadcast - use timestamp to make it unique
-        import time
-        timestamp = str(int(time.time() * 1000))  # milliseconds for uniqueness
-        base = f"{platform}|{source_platform_str}|{timestamp}|{forward_chat_id or ''}|{forward_message_id or ''}|{image_id or ''}|{video_id or ''}|{document_id or ''}|{(content_text or '')[:200]}"
+                        source_platform: Optional[str] = None,
+                        scopes: Optional[List[str]] = None,
+                        target_chats: Optional[Dict[str, Any]] = None) -> str:
+    """
+    اثر انگشت محتوای یک broadcast: پلتفرم مقصد، هش متن، هش رسانه، پیام فوروارد و مجموعه مقصدها
+    """
+    if target_chats:
+        targets = "|".join(f"{scope}:{','.join(sorted(str(cid) for cid in ids))}" for scope, ids in sorted(target_chats.items()))
     else:
-        # Cross-platform broadcast - use timestamp to make it unique per target platform
-        import time
-        timestamp = str(int(time.time() * 1000))  # milliseconds for uniqueness
-        base = f"{platform}|{source_platform_str}|{timestamp}|{forward_chat_id or ''}|{forward_message_id or ''}|{image_id or ''}|{video_id or ''}|{document_id or ''}|{(content_text or '')[:200]}"
-    
-    return hashlib.sha1(base.encode('utf-8', errors='ignore')).hexdigest()
-
-def is_duplicate_broadcast(dedupe_key: str, ttl_seconds: int = BROADCAST_DEDUPE_TTL_SECONDS) -> bool:
-    now_ts = int(time.time())
-    try:
-        with get_db_connection() as conn:
-            cur = conn.cursor()
-            cur.execute("CREATE TABLE IF NOT EXISTS broadcast_dedupe (key TEXT PRIMARY KEY, created_at INTEGER)")
-            
-            # ابتدا پاکسازی کلیدهای قدیمی
-            cur.execute("DELETE FROM broadcast_dedupe WHERE created_at < ?", (now_ts - ttl_seconds,))
-            conn.commit()
-            
-            # بررسی وجود کلید
-            cur.execute("SELECT created_at FROM broadcast_dedupe WHERE key = ?", (dedupe_key,))
-            existing_row = cur.fetchone()
-            
-            if existing_row:
-                # کلید از قبل وجود دارد → duplicate
+        targets = ",".join(sorted(scopes or []))
+    parts = [
+        platform,
+        source_platform or platform,
+        hashlib.sha1((content_text or '').encode('utf-8', errors='ignore')).hexdigest(),
+        _media_fingerprint(image_id),
+        _media_fingerprint(video_id),
+        _media_fingerprint(document_id),
+        str(forward_chat_id or ''),
+        str(forward_message_id or ''),
+        hashlib.sha1(targets.encode('utf-8', errors='ignore')).hexdigest(),
+    ]
+    return hashlib.sha1("|".join(parts).encode('utf-8', errors='ignore')).hexdigest()
+
+class BroadcastDedupeStore:
+    """
+    ذخیره کلیدهای broadcast اخیر در حافظه (TTL + LRU)
+    - انقضا به صورت lazy هنگام دسترسی انجام می‌شود
+    - در حالت persist، کلید جدید با یک UPSERT در SQLite هم ثبت می‌شود تا پروسه‌های دیگر آن را ببینند
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int, persist: bool = False):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.persist = persist
+        self._entries: "OrderedDict[str, float]" = OrderedDict()  # key -> expires_at
+        self._lock = threading.Lock()
+        self._last_db_sweep = 0.0
+
+    def _evict(self, now: float):
+        # کلیدها به ترتیب ثبت هستند؛ قدیمی‌ترها زودتر منقضی می‌شوند
+        while self._entries:
+            key, expires_at = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    def check_and_add(self, key: str, ttl_seconds: Optional[int] = None) -> bool:
+        """True اگر کلید در TTL قبلاً دیده شده باشد؛ در غیر این صورت کلید ثبت می‌شود"""
+        ttl = ttl_seconds or self.ttl_seconds
+        now = time.time()
+        with self._lock:
+            expires_at = self._entries.get(key)
+            if expires_at is not None and expires_at > now:
                 return True
-            else:
-                # کلید جدید → اضافه کردن
-                cur.execute("INSERT INTO broadcast_dedupe (key, created_at) VALUES (?, ?)", (dedupe_key, now_ts))
-                conn.commit()
-                return False
-    except Exception as e:
-        logger.warning(f"[dedupe] Could not access dedupe table, proceeding without dedupe: {e}")
+            self._entries[key] = now + ttl
+            self._entries.move_to_end(key)
+            self._evict(now)
+        if self.persist and not self._claim_in_db(key, now, ttl):
+            return True
         return False
 
+    def release(self, key: str):
+        """آزاد کردن کلیدی که ارسالش انجام نشد تا تلاش مجدد تکراری حساب نشود"""
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.persist:
+            try:
+                with get_db_connection() as conn:
+                    conn.execute("DELETE FROM broadcast_dedupe WHERE key = ?", (key,))
+                    conn.commit()
+            except Exception as e:
+                logger.warning(f"[dedupe] Could not release dedupe key: {e}")
+
+    def _claim_in_db(self, key: str, now: float, ttl: int) -> bool:
+        """ثبت کلید در دیتابیس؛ False اگر پروسه دیگری آن را در TTL ثبت کرده باشد"""
+        now_ts = int(now)
+        try:
+            with get_db_connection() as conn:
+                claimed = conn.execute("""
+                    INSERT INTO broadcast_dedupe (key, created_at) VALUES (?, ?)
+                    ON CONFLICT(key) DO UPDATE SET created_at = excluded.created_at
+                    WHERE broadcast_dedupe.created_at < ?
+                """, (key, now_ts, now_ts - ttl)).rowcount
+                if now - self._last_db_sweep > ttl:
+                    conn.execute("DELETE FROM broadcast_dedupe WHERE created_at < ?", (now_ts - ttl,))
+                    self._last_db_sweep = now
+                conn.commit()
+            return bool(claimed)
+        except Exception as e:
+            logger.warning(f"[dedupe] Could not access dedupe table, using in-memory dedupe only: {e}")
+            return True
+
+broadcast_dedupe_store = BroadcastDedupeStore(BROADCAST_DEDUPE_TTL_SECONDS, BROADCAST_DEDUPE_MAX_ENTRIES, BROADCAST_DEDUPE_PERSIST)
+
+def is_duplicate_broadcast(dedupe_key: str, ttl_seconds: int = BROADCAST_DEDUPE_TTL_SECONDS) -> bool:
+    return broadcast_dedupe_store.check_and_add(dedupe_key, ttl_seconds)
+
+# --- Broadcast fan-out ---
+# تعداد worker های همزمان ارسال در هر پلتفرم (قابل override در config.py)
+BROADCAST_CONCURRENCY = {'telegram': 25, 'bale': 10, 'ita': 5}
+BROADCAST_CONCURRENCY.update(getattr(config, 'BROADCAST_CONCURRENCY', {}) or {})
+BROADCAST_CHECKPOINT_INTERVAL = getattr(config, 'BROADCAST_CHECKPOINT_INTERVAL', 2)  # فاصله (ثانیه) ذخیره پیشرفت ارسال
+
+# --- Rate governor ---
+# بودجه ارسال هر ربات: rate = پیام در ثانیه (کل ربات)، group_interval = حداقل فاصله (ثانیه) دو پیام به یک گروه/کانال
+RATE_LIMITS = {
+    'telegram': {'rate': 30, 'burst': 30, 'group_interval': 3.0},
+    'bale': {'rate': 15, 'burst': 15, 'group_interval': 1.0},
+    'ita': {'rate': 10, 'burst': 10, 'group_interval': 1.0},
+}
+for _platform, _limits in (getattr(config, 'RATE_LIMITS', {}) or {}).items():
+    RATE_LIMITS.setdefault(_platform, {}).update(_limits)
+
+class RateGovernor:
+    """
+    token bucket مشترک برای همه ارسال‌های یک ربات
+    - سقف کلی پیام در ثانیه و حداقل فاصله بین پیام‌ها به یک گروه/کانال
+    - با RetryAfter یا HTTP 429 کل ربات متوقف و نرخ نصف می‌شود (یک بار برای هر دوره توقف)، سپس به تدریج بازیابی می‌شود
+    - فاصله هر گروه جدا از bucket کلی نگه داشته می‌شود تا انتظار یک گروه ارسال به بقیه چت‌ها را متوقف نکند
+    - بین event loop ها مشترک است (state با threading.Lock محافظت می‌شود و فقط انتظار async است)
+    """
+
+    RECOVERY_INTERVAL = 10.0  # هر چند ثانیه بدون خطا نرخ افزایش یابد
+    RECOVERY_STEP = 0.1  # افزایش نرخ به نسبت نرخ حداکثر
+    DECREASE_FACTOR = 0.5
+    MIN_RATE = 1.0
+
+    def __init__(self, name: str, rate: float, burst: float = 1, group_interval: float = 0.0):
+        self.name = name
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.group_interval = float(group_interval)
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._last_adjust = time.monotonic()
+        self._chat_next_slot: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_group_chat(chat_id: Any) -> bool:
+        # شناسه گروه‌ها و کانال‌ها در تلگرام/بله منفی است
+        return chat_id is not None and str(chat_id).startswith('-')
+
+    def _recover(self, now: float):
+        if self.rate < self.max_rate and now - self._last_adjust >= self.RECOVERY_INTERVAL and now >= self._paused_until:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * self.RECOVERY_STEP)
+            self._last_adjust = now
+
+    def reserve_chat(self, chat_id: Any) -> float:
+        """رزرو نوبت یک گروه/کانال (مستقل از bucket کلی) و برگرداندن مدت انتظار (ثانیه)"""
+        if not (self.group_interval and self._is_group_chat(chat_id)):
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            chat_key = str(chat_id)
+            slot = max(now, self._chat_next_slot.get(chat_key, 0.0))
+            self._chat_next_slot[chat_key] = slot + self.group_interval
+            if len(self._chat_next_slot) > 10000:
+                self._chat_next_slot = {k: v for k, v in self._chat_next_slot.items() if v > now}
+            return slot - now
+
+    def reserve(self) -> float:
+        """رزرو یک token از bucket کلی و برگرداندن مدت انتظار (ثانیه) تا زمان مجاز ارسال"""
+        with self._lock:
+            now = time.monotonic()
+            self._recover(now)
+            # اجازه burst: نوبت بعدی حداکثر به اندازه burst توکن عقب‌تر از زمان حال است
+            slot = max(self._next_slot, now - (self.burst - 1) / self.rate, self._paused_until)
+            self._next_slot = slot + 1.0 / self.rate
+            return max(0.0, slot - now)
+
+    async def acquire(self, chat_id: Any = None):
+        # ابتدا نوبت خود گروه، سپس token کلی؛ token فقط وقتی گرفته می‌شود که ارسال واقعاً انجام می‌شود
+        chat_wait = self.reserve_chat(chat_id)
+        if chat_wait > 0:
+            await asyncio.sleep(chat_wait)
+        wait_time = self.reserve()
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+
+    def penalize(self, retry_after: float):
+        """واکنش به RetryAfter/429: توقف کل ربات و کاهش نرخ"""
+        with self._lock:
+            now = time.monotonic()
+            # workerهای همزمانی که در یک دوره flood خطا می‌گیرند فقط یک بار نرخ را کاهش می‌دهند
+            decrease = now >= self._paused_until
+            self._paused_until = max(self._paused_until, now + retry_after)
+            if decrease:
+                self.rate = max(self.MIN_RATE, self.rate * self.DECREASE_FACTOR)
+            self._next_slot = max(self._next_slot, self._paused_until)
+            self._last_adjust = now
+        if decrease:
+            logger.warning(f"[RateGovernor:{self.name}] Flood control hit, pausing {retry_after:.1f}s and lowering rate to {self.rate:.1f} msg/s")
+        else:
+            logger.info(f"[RateGovernor:{self.name}] Flood control hit during an active pause, extending it to {retry_after:.1f}s")
+
+rate_governors = {platform: RateGovernor(platform, **limits) for platform, limits in RATE_LIMITS.items()}
+
+def get_rate_governor(platform: str) -> RateGovernor:
+    """governor مربوط به ربات یک پلتفرم"""
+    if platform not in rate_governors:
+        rate_governors[platform] = RateGovernor(platform, **RATE_LIMITS['telegram'])
+    return rate_governors[platform]
+
+def rate_governor_for_bot(bot) -> RateGovernor:
+    """تشخیص ربات (تلگرام یا بله) از روی base_url آن"""
+    return get_rate_governor('bale' if 'bale' in str(getattr(bot, 'base_url', '')) else 'telegram')
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """مقدار retry_after در نسخه‌های جدید PTB ممکن است timedelta باشد"""
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
 # --- Flask Uploads Configuration ---
 UPLOAD_FOLDER = 'uploads' # دایرکتوری برای ذخیره موقت فایل‌های آپلود شده
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'mp4', 'mov', 'avi', 'mkv', 'webp', 'zip', 'rar', 'doc', 'docx', 'xls', 'xlsx', 'mp3', 'wav', 'ogg', 'm4a', 'flac', 'aac'}
@@ -227,6 +427,9 @@ telegram_bot_loop: Optional[asyncio.AbstractEventLoop] = None
 bale_app: Optional[TelegramApplication] = None
 bale_bot_loop: Optional[asyncio.AbstractEventLoop] = None
 
+# در post_init هر ربات set می‌شود؛ worker های صف ارسال تا آماده شدن ربات منتظر آن می‌مانند
+bot_ready_events: Dict[str, threading.Event] = {'telegram': threading.Event(), 'bale': threading.Event()}
+
 # Scheduler for scheduled broadcasts
 scheduler: Optional[BackgroundScheduler] = None
 
@@ -362,6 +565,137 @@ async def get_file_info(platform: str, file_id: str, media_type: str = 'document
         return None
 
 # =========== ITA API Functions ===========
+ITA_HTTP_MAX_CONNECTIONS = getattr(config, 'ITA_HTTP_MAX_CONNECTIONS', 20)
+ITA_HTTP_MAX_CONCURRENCY = getattr(config, 'ITA_HTTP_MAX_CONCURRENCY', 10)
+
+class ItaClient:
+    """
+    کلاینت غیرهمزمان HTTP برای API ایتا
+    - connection pool با keep-alive (یک pool برای هر event loop)
+    - timeout جداگانه برای هر فراخوانی
+    - محدودیت تعداد درخواست‌های همزمان
+    - تلاش مجدد در خطاهای موقت شبکه و HTTP 429/5xx
+    """
+
+    RETRY_STATUS_CODES = {429, 502, 503, 504}
+    DEFAULT_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+
+    def __init__(self, max_connections: int = 20, max_concurrency: int = 10,
+                 timeout: float = 30.0, max_retries: int = 3):
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        # httpx.AsyncClient به event loop سازنده‌اش وابسته است؛ ربات‌های تلگرام/بله و
+        # Flask هر کدام loop جداگانه دارند، پس برای هر loop یک pool مستقل نگه می‌داریم
+        self._states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[httpx.AsyncClient, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+        self._states_lock = threading.Lock()
+
+    def _get_state(self) -> Tuple[httpx.AsyncClient, asyncio.Semaphore]:
+        loop = asyncio.get_running_loop()
+        with self._states_lock:
+            state = self._states.get(loop)
+            if state is None:
+                client = httpx.AsyncClient(
+                    timeout=self.timeout,
+                    limits=httpx.Limits(max_connections=self.max_connections,
+                                        max_keepalive_connections=self.max_connections,
+                                        keepalive_expiry=60),
+                    headers=self.DEFAULT_HEADERS,
+                    follow_redirects=True,
+                )
+                state = (client, asyncio.Semaphore(self.max_concurrency))
+                self._states[loop] = state
+            return state
+
+    async def aclose(self):
+        """بستن pool مربوط به event loop جاری"""
+        loop = asyncio.get_running_loop()
+        with self._states_lock:
+            state = self._states.pop(loop, None)
+        if state:
+            await state[0].aclose()
+
+    def close_for_loop(self, loop: asyncio.AbstractEventLoop):
+        """
+        بستن pool یک loop متوقف‌شده؛ درست قبل از loop.close() صدا زده می‌شود تا loopهای موقت
+        endpointها و loop ربات‌ها اتصال‌ها و socketهای باز را رها نکنند
+        """
+        with self._states_lock:
+            has_state = loop in self._states
+        if not has_state or loop.is_closed() or loop.is_running():
+            return
+        try:
+            loop.run_until_complete(self.aclose())
+        except Exception as e:
+            logger.warning(f"[ITA HTTP] Error closing client pool: {e}")
+
+    async def run_and_close(self, coro):
+        """اجرای coroutine و بستن pool همان loop در پایان؛ برای asyncio.run در کدهای همگام"""
+        try:
+            return await coro
+        finally:
+            await self.aclose()
+
+    def api_url(self, method: str) -> str:
+        """آدرس متد bot API ایتا"""
+        return f"{ITA_API_BASE_URL}/{ITA_BOT_TOKEN}/{method}"
+
+    async def request(self, method: str, url: str, timeout: Optional[float] = None, **kwargs) -> httpx.Response:
+        """
+        ارسال درخواست با retry؛ POST فقط وقتی تکرار می‌شود که مطمئن باشیم سرور آن را پردازش نکرده
+        (خطای اتصال یا 429) تا پیام تکراری ارسال نشود
+        """
+        client, semaphore = self._get_state()
+        idempotent = method.upper() == 'GET'
+        # درخواست‌های POST (ارسال/ویرایش/حذف پیام) از بودجه مشترک ربات ایتا استفاده می‌کنند
+        governor = get_rate_governor('ita') if not idempotent else None
+        chat_id = (kwargs.get('data') or {}).get('chat_id') if isinstance(kwargs.get('data'), dict) else None
+        files = kwargs.get('files')
+        for attempt in range(self.max_retries):
+            if governor:
+                await governor.acquire(chat_id)
+            if files and attempt:
+                # فایل‌ها در تلاش قبلی خوانده شده‌اند؛ به ابتدای فایل برگرد
+                for file_tuple in files.values():
+                    file_obj = file_tuple[1] if isinstance(file_tuple, tuple) else file_tuple
+                    if hasattr(file_obj, 'seek'):
+                        file_obj.seek(0)
+            try:
+                async with semaphore:
+                    response = await client.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                if attempt == self.max_retries - 1:
+                    raise
+                wait_time = 2 ** attempt
+                logger.warning(f"[ITA HTTP] Connection error for {method} {url.replace(ITA_BOT_TOKEN, '***')}: {e}, retrying in {wait_time}s")
+            except httpx.TransportError as e:
+                if not idempotent or attempt == self.max_retries - 1:
+                    raise
+                wait_time = 2 ** attempt
+                logger.warning(f"[ITA HTTP] Transport error for {method} {url.replace(ITA_BOT_TOKEN, '***')}: {e}, retrying in {wait_time}s")
+            else:
+                retryable = response.status_code == 429 or (idempotent and response.status_code in self.RETRY_STATUS_CODES)
+                if not retryable or attempt == self.max_retries - 1:
+                    return response
+                try:
+                    wait_time = min(float(response.headers.get('Retry-After', 2 ** attempt)), 60)
+                except ValueError:
+                    wait_time = 2 ** attempt
+                logger.warning(f"[ITA HTTP] {response.status_code} for {method} {url.replace(ITA_BOT_TOKEN, '***')}, retrying in {wait_time}s")
+                if governor and response.status_code == 429:
+                    governor.penalize(wait_time)
+                    continue  # انتظار توسط governor اعمال می‌شود
+            await asyncio.sleep(wait_time)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request('POST', url, **kwargs)
+
+ita_client = ItaClient(max_connections=ITA_HTTP_MAX_CONNECTIONS, max_concurrency=ITA_HTTP_MAX_CONCURRENCY)
+
 async def send_ita_message(chat_id: str, text: str, parse_mode: str = "HTML") -> Tuple[bool, int]:
     """
     ارسال پیام متنی به ایتا
@@ -382,7 +716,7 @@ async def send_ita_message(chat_id: str, text: str, parse_mode: str = "HTML") ->
         logger.info(f"[ITA] Sending message to {chat_id} via {url}")
         logger.info(f"[ITA] Data: {data}")
         
-        response = requests.post(url, data=data, headers=headers, timeout=30)
+        response = await ita_client.post(url, data=data, headers=headers, timeout=30)
         
         logger.info(f"[ITA] Response status: {response.status_code}")
         logger.info(f"[ITA] Response text: {response.text[:200]}...")
@@ -444,7 +778,7 @@ async def send_ita_message_with_full_response(chat_id: str, text: str, parse_mod
         logger.info(f"[ITA Full] Sending message to {chat_id} via {url}")
         logger.info(f"[ITA Full] Data: {data}")
         
-        response = requests.post(url, data=data, headers=headers, timeout=30)
+        response = await ita_client.post(url, data=data, headers=headers, timeout=30)
         
         logger.info(f"[ITA Full] Response status: {response.status_code}")
         logger.info(f"[ITA Full] Response text: {response.text}")
@@ -490,7 +824,6 @@ async def get_ita_chat_title_from_username(username: str) -> str:
         
         # روش 2: Scraping از صفحه عمومی
         try:
-            import requests
             from bs4 import BeautifulSoup
             
             urls = [
@@ -503,7 +836,7 @@ async def get_ita_chat_title_from_username(username: str) -> str:
             
             for url in urls:
                 try:
-                    response = requests.get(url, timeout=10, headers={
+                    response = await ita_client.get(url, timeout=10, headers={
                         'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
                     })
                     if response.status_code == 200:
@@ -582,7 +915,7 @@ async def send_ita_file(chat_id: str, file_path: str, caption: str = None, file_
         with open(file_path, 'rb') as f:
             files = {"file": (final_filename, f)}
             
-            response = requests.post(url, data=data, files=files, timeout=60)
+            response = await ita_client.post(url, data=data, files=files, timeout=60)
             logger.info(f"[ITA] Upload response: {response.status_code} {response.text}")
         
         # پردازش پاسخ
@@ -619,7 +952,7 @@ async def forward_ita_message(chat_id: str, from_chat_id: str, message_id: int)
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
         
-        response = requests.post(url, data=data, headers=headers, timeout=30)
+        response = await ita_client.post(url, data=data, headers=headers, timeout=30)
         
         if response.status_code == 200:
             result = response.json()
@@ -648,7 +981,7 @@ async def delete_ita_message(chat_id: str, message_id: int) -> bool:
         }
         
         logger.info(f"[ITA] Attempting to delete message {message_id} from chat {chat_id}")
-        response = requests.post(url, data=data, headers=headers, timeout=30)
+        response = await ita_client.post(url, data=data, headers=headers, timeout=30)
         
         logger.info(f"[ITA] Delete response status: {response.status_code}")
         logger.info(f"[ITA] Delete response text: {response.text[:200]}...")
@@ -683,7 +1016,7 @@ async def get_ita_chat_info(chat_id: str) -> Optional[dict]:
         logger.info(f"[ITA] Request URL: {url}")
         logger.info(f"[ITA] Request data: {data}")
         
-        response = requests.post(url, data=data, headers=headers, timeout=30)
+        response = await ita_client.post(url, data=data, headers=headers, timeout=30)
         
         logger.info(f"[ITA] Response status: {response.status_code}")
         logger.info(f"[ITA] Response content: {response.text}")
@@ -828,7 +1161,7 @@ async def _try_ita_chat_enhancement_methods(chat_id: str, base_info: dict) -> di
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
-            response = requests.post(url, data=data, headers=headers, timeout=15)
+            response = await ita_client.post(url, data=data, headers=headers, timeout=15)
             if response.status_code == 200:
                 result = response.json()
                 if result.get('ok'):
@@ -855,7 +1188,7 @@ async def _try_ita_chat_enhancement_methods(chat_id: str, base_info: dict) -> di
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
-            response = requests.post(url, data=data, headers=headers, timeout=15)
+            response = await ita_client.post(url, data=data, headers=headers, timeout=15)
             if response.status_code == 200:
                 result = response.json()
                 if result.get('ok'):
@@ -876,7 +1209,7 @@ async def _get_ita_info_from_database(chat_id: str) -> Optional[dict]:
     دریافت اطلاعات چت ایتا از دیتابیس محلی
     """
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         cursor.execute("""
@@ -928,7 +1261,6 @@ async def _get_ita_public_chat_info(chat_id: str) -> Optional[dict]:
     دریافت اطلاعات چت از API عمومی ایتا (برای شناسه‌های عددی)
     """
     try:
-        import requests
         import re
         
         # تلاش برای دریافت از API عمومی ایتا
@@ -951,7 +1283,7 @@ async def _get_ita_public_chat_info(chat_id: str) -> Optional[dict]:
         for endpoint in endpoints:
             try:
                 logger.debug(f"[ITA] Trying public API endpoint: {endpoint}")
-                response = requests.get(endpoint, headers=headers, timeout=15)
+                response = await ita_client.get(endpoint, headers=headers, timeout=15)
                 
                 if response.status_code == 200:
                     try:
@@ -984,7 +1316,7 @@ async def _get_ita_public_chat_info(chat_id: str) -> Optional[dict]:
         # حتی برای شناسه‌های عددی ممکن است صفحه‌ای وجود داشته باشد
         try:
             url = f"https://eitaa.com/c/{chat_id}"
-            response = requests.get(url, headers=headers, timeout=15)
+            response = await ita_client.get(url, headers=headers, timeout=15)
             
             if response.status_code == 200:
                 content = response.text
@@ -1032,7 +1364,6 @@ async def _get_ita_username_from_id(chat_id: str) -> Optional[dict]:
     تلاش برای دریافت username از شناسه عددی ایتا
     """
     try:
-        import requests
         import re
         
         headers = {
@@ -1067,7 +1398,7 @@ async def _get_ita_username_from_id(chat_id: str) -> Optional[dict]:
         for endpoint in endpoints:
             try:
                 logger.debug(f"[ITA] Trying username endpoint: {endpoint}")
-                response = requests.get(endpoint, headers=headers, timeout=15)
+                response = await ita_client.get(endpoint, headers=headers, timeout=15)
                 
                 if response.status_code == 200:
                     try:
@@ -1113,7 +1444,7 @@ async def _get_ita_username_from_id(chat_id: str) -> Optional[dict]:
         
         for url in urls_to_try:
             try:
-                response = requests.get(url, headers=headers, timeout=15)
+                response = await ita_client.get(url, headers=headers, timeout=15)
                 
                 if response.status_code == 200:
                     content = response.text
@@ -1196,7 +1527,6 @@ async def _get_ita_advanced_info(chat_id: str) -> Optional[dict]:
     روش‌های پیشرفته برای دریافت اطلاعات چت ایتا
     """
     try:
-        import requests
         import re
         import json
         
@@ -1226,7 +1556,7 @@ async def _get_ita_advanced_info(chat_id: str) -> Optional[dict]:
                 """
             }
             
-            response = requests.post(graphql_url, json=graphql_query, headers=headers, timeout=15)
+            response = await ita_client.post(graphql_url, json=graphql_query, headers=headers, timeout=15)
             if response.status_code == 200:
                 data = response.json()
                 if data.get('data', {}).get('chat'):
@@ -1246,7 +1576,7 @@ async def _get_ita_advanced_info(chat_id: str) -> Optional[dict]:
         # روش 2: تلاش برای دریافت از WebSocket endpoint
         try:
             ws_url = f"https://eitaa.com/ws/chat/{chat_id}"
-            response = requests.get(ws_url, headers=headers, timeout=15)
+            response = await ita_client.get(ws_url, headers=headers, timeout=15)
             if response.status_code == 200:
                 content = response.text
                 # جستجوی JSON در response
@@ -1289,7 +1619,7 @@ async def _get_ita_advanced_info(chat_id: str) -> Optional[dict]:
             
             for feed_url in feed_urls:
                 try:
-                    response = requests.get(feed_url, headers=headers, timeout=15)
+                    response = await ita_client.get(feed_url, headers=headers, timeout=15)
                     if response.status_code == 200:
                         content = response.text
                         
@@ -1324,7 +1654,7 @@ async def _get_ita_advanced_info(chat_id: str) -> Optional[dict]:
         # روش 4: تلاش برای دریافت از robots.txt یا sitemap
         try:
             robots_url = "https://eitaa.com/robots.txt"
-            response = requests.get(robots_url, headers=headers, timeout=15)
+            response = await ita_client.get(robots_url, headers=headers, timeout=15)
             if response.status_code == 200:
                 content = response.text
                 
@@ -1334,7 +1664,7 @@ async def _get_ita_advanced_info(chat_id: str) -> Optional[dict]:
                 
                 for sitemap_url in sitemaps:
                     try:
-                        sitemap_response = requests.get(sitemap_url, headers=headers, timeout=15)
+                        sitemap_response = await ita_client.get(sitemap_url, headers=headers, timeout=15)
                         if sitemap_response.status_code == 200:
                             sitemap_content = sitemap_response.text
                             
@@ -1371,7 +1701,6 @@ async def _get_ita_external_info(chat_id: str) -> Optional[dict]:
     تلاش برای دریافت اطلاعات از منابع خارجی
     """
     try:
-        import requests
         import re
         
         headers = {
@@ -1385,7 +1714,7 @@ async def _get_ita_external_info(chat_id: str) -> Optional[dict]:
             search_query = f"site:eitaa.com {chat_id}"
             google_url = f"https://www.google.com/search?q={search_query}"
             
-            response = requests.get(google_url, headers=headers, timeout=15)
+            response = await ita_client.get(google_url, headers=headers, timeout=15)
             if response.status_code == 200:
                 content = response.text
                 
@@ -1413,7 +1742,7 @@ async def _get_ita_external_info(chat_id: str) -> Optional[dict]:
             search_query = f"site:eitaa.com {chat_id}"
             ddg_url = f"https://duckduckgo.com/html/?q={search_query}"
             
-            response = requests.get(ddg_url, headers=headers, timeout=15)
+            response = await ita_client.get(ddg_url, headers=headers, timeout=15)
             if response.status_code == 200:
                 content = response.text
                 
@@ -1439,7 +1768,7 @@ async def _get_ita_external_info(chat_id: str) -> Optional[dict]:
         # روش 3: تلاش برای دریافت از Wayback Machine
         try:
             wayback_url = f"https://web.archive.org/web/*/https://eitaa.com/{chat_id}"
-            response = requests.get(wayback_url, headers=headers, timeout=15)
+            response = await ita_client.get(wayback_url, headers=headers, timeout=15)
             
             if response.status_code == 200:
                 content = response.text
@@ -1486,7 +1815,6 @@ async def _scrape_ita_chat_info(chat_id: str) -> Optional[dict]:
         # حذف @ از ابتدای username اگر وجود دارد
         username = chat_id.lstrip('@')
         
-        import requests
         import re
         
         # تلاش با URL های مختلف
@@ -1510,7 +1838,7 @@ async def _scrape_ita_chat_info(chat_id: str) -> Optional[dict]:
         
         for url in urls_to_try:
             try:
-                response = requests.get(url, headers=headers, timeout=15)
+                response = await ita_client.get(url, headers=headers, timeout=15)
                 if response.status_code == 200:
                     content = response.text
                     
@@ -1643,7 +1971,7 @@ async def get_chat_administrators(platform: str, chat_id: str) -> List[dict]:
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
-            response = requests.post(url, data=data, headers=headers, timeout=30)
+            response = await ita_client.post(url, data=data, headers=headers, timeout=30)
             if response.status_code == 200:
                 result = response.json()
                 if result.get('ok'):
@@ -1677,38 +2005,78 @@ def get_sample_members(platform: str, chat_id: str) -> List[dict]:
     """
     return []
 
+# upsert به جای INSERT OR REPLACE تا created_at و joined_at ردیف‌های موجود حفظ شوند
+UPSERT_UNIQUE_MEMBER_SQL = """
+    INSERT INTO unique_members (user_id, platform, first_name, last_name, username, is_bot, last_seen)
+    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(user_id, platform) DO UPDATE SET
+        first_name = COALESCE(excluded.first_name, first_name),
+        last_name = COALESCE(excluded.last_name, last_name),
+        username = COALESCE(excluded.username, username),
+        is_bot = excluded.is_bot,
+        last_seen = excluded.last_seen
+"""
+UPSERT_CHAT_MEMBERSHIP_SQL = """
+    INSERT INTO chat_memberships (user_id, platform, chat_id, chat_type, joined_at, is_active)
+    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, 1)
+    ON CONFLICT(user_id, platform, chat_id) DO UPDATE SET
+        chat_type = excluded.chat_type,
+        is_active = 1
+"""
+MEMBER_INGEST_CHUNK = getattr(config, 'MEMBER_INGEST_CHUNK', 1000)
+
 def save_unique_member(user_id: str, platform: str, first_name: str = None, last_name: str = None, username: str = None, is_bot: bool = False) -> None:
     """ذخیره یا به‌روزرسانی عضو یکتا"""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        conn.execute("""
-            INSERT OR REPLACE INTO unique_members 
-            (user_id, platform, first_name, last_name, username, is_bot, last_seen)
-            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        """, (user_id, platform, first_name, last_name, username, 1 if is_bot else 0))
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            conn.execute(UPSERT_UNIQUE_MEMBER_SQL, (user_id, platform, first_name, last_name, username, 1 if is_bot else 0))
     except Exception as e:
         logger.error(f"Error saving unique member: {e}")
 
 def save_chat_membership(user_id: str, platform: str, chat_id: str, chat_type: str) -> None:
     """ذخیره عضویت در چت"""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        conn.execute("""
-            INSERT OR REPLACE INTO chat_memberships 
-            (user_id, platform, chat_id, chat_type, joined_at, is_active)
-            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, 1)
-        """, (user_id, platform, chat_id, chat_type))
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            conn.execute(UPSERT_CHAT_MEMBERSHIP_SQL, (user_id, platform, chat_id, chat_type))
     except Exception as e:
         logger.error(f"Error saving chat membership: {e}")
 
+def ingest_chat_members(platform: str, chat_id: str, chat_type: str, members: Iterable[Dict[str, Any]],
+                        chunk_size: int = MEMBER_INGEST_CHUNK) -> int:
+    """
+    ذخیره دسته‌ای اعضای یک چت در unique_members و chat_memberships
+    - اعضای تکراری (همان user_id) در حافظه یکی می‌شوند؛ آخرین نسخه می‌ماند
+    - هر دو جدول با executemany در تکه‌های chunk_size و در یک تراکنش upsert می‌شوند
+    خروجی: تعداد اعضای یکتای ذخیره‌شده
+    """
+    unique: Dict[str, Dict[str, Any]] = {}
+    for member in members:
+        user_id = member.get('user_id')
+        user_id = str(user_id) if user_id is not None else ''
+        if user_id:
+            unique[user_id] = member
+    if not unique:
+        return 0
+    chat_id = str(chat_id)
+    items = list(unique.items())
+    with get_db_connection() as conn:
+        for start in range(0, len(items), chunk_size):
+            chunk = items[start:start + chunk_size]
+            conn.executemany(UPSERT_UNIQUE_MEMBER_SQL, [
+                (user_id, platform, member.get('first_name'), member.get('last_name'),
+                 member.get('username'), 1 if member.get('is_bot', False) else 0)
+                for user_id, member in chunk
+            ])
+            conn.executemany(UPSERT_CHAT_MEMBERSHIP_SQL, [
+                (user_id, platform, chat_id, chat_type) for user_id, _ in chunk
+            ])
+        conn.commit()
+    return len(items)
+
 def get_unique_member_stats() -> Dict[str, Any]:
     """دریافت آمار اعضای یکتا"""
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         # آمار کلی اعضای یکتا
@@ -1777,32 +2145,10 @@ def get_unique_member_stats() -> Dict[str, Any]:
             'total_unique_members': 0
         }
 
-def update_member_tracking_from_chat(platform: str, chat_id: str, chat_type: str, members: List[Dict[str, Any]]) -> None:
+def update_member_tracking_from_chat(platform: str, chat_id: str, chat_type: str, members: Iterable[Dict[str, Any]]) -> None:
     """به‌روزرسانی ردیابی اعضا از لیست چت"""
     try:
-        for member in members:
-            user_id = str(member.get('user_id', ''))
-            if not user_id:
-                continue
-                
-            # ذخیره عضو یکتا
-            save_unique_member(
-                user_id=user_id,
-                platform=platform,
-                first_name=member.get('first_name'),
-                last_name=member.get('last_name'),
-                username=member.get('username'),
-                is_bot=member.get('is_bot', False)
-            )
-            
-            # ذخیره عضویت در چت
-            save_chat_membership(
-                user_id=user_id,
-                platform=platform,
-                chat_id=chat_id,
-                chat_type=chat_type
-            )
-            
+        ingest_chat_members(platform, chat_id, chat_type, members)
     except Exception as e:
         logger.error(f"Error updating member tracking: {e}")
 
@@ -1962,7 +2308,7 @@ async def get_chat_members(platform: str, chat_id: str) -> List[dict]:
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
-            response = requests.post(url, data=data, headers=headers, timeout=30)
+            response = await ita_client.post(url, data=data, headers=headers, timeout=30)
             if response.status_code == 200:
                 result = response.json()
                 if result.get('ok'):
@@ -2038,7 +2384,7 @@ async def promote_chat_member(platform: str, chat_id: str, user_id: int, can_cha
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
-            response = requests.post(url, data=data, headers=headers, timeout=30)
+            response = await ita_client.post(url, data=data, headers=headers, timeout=30)
             if response.status_code == 200:
                 result = response.json()
                 return result.get('ok', False)
@@ -2090,7 +2436,7 @@ async def demote_chat_member(platform: str, chat_id: str, user_id: int) -> bool:
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
-            response = requests.post(url, data=data, headers=headers, timeout=30)
+            response = await ita_client.post(url, data=data, headers=headers, timeout=30)
             if response.status_code == 200:
                 result = response.json()
                 return result.get('ok', False)
@@ -2108,7 +2454,7 @@ async def pin_chat_message(platform: str, chat_id: str, message_id: int, disable
     try:
         if platform == 'telegram' and 'telegram_app' in globals():
             bot = telegram_app.bot
-            await bot.pin_chat_message(
+            await handle_rate_limit_with_backoff(bot.pin_chat_message,
                 chat_id=chat_id,
                 message_id=message_id,
                 disable_notification=disable_notification
@@ -2117,7 +2463,7 @@ async def pin_chat_message(platform: str, chat_id: str, message_id: int, disable
         
         elif platform == 'bale' and 'bale_app' in globals():
             bot = bale_app.bot
-            await bot.pin_chat_message(
+            await handle_rate_limit_with_backoff(bot.pin_chat_message,
                 chat_id=chat_id,
                 message_id=message_id,
                 disable_notification=disable_notification
@@ -2136,7 +2482,7 @@ async def pin_chat_message(platform: str, chat_id: str, message_id: int, disable
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
-            response = requests.post(url, data=data, headers=headers, timeout=30)
+            response = await ita_client.post(url, data=data, headers=headers, timeout=30)
             if response.status_code == 200:
                 result = response.json()
                 return result.get('ok', False)
@@ -2155,17 +2501,17 @@ async def unpin_chat_message(platform: str, chat_id: str, message_id: int = None
         if platform == 'telegram' and 'telegram_app' in globals():
             bot = telegram_app.bot
             if message_id:
-                await bot.unpin_chat_message(chat_id=chat_id, message_id=message_id)
+                await handle_rate_limit_with_backoff(bot.unpin_chat_message, chat_id=chat_id, message_id=message_id)
             else:
-                await bot.unpin_all_chat_messages(chat_id=chat_id)
+                await handle_rate_limit_with_backoff(bot.unpin_all_chat_messages, chat_id=chat_id)
             return True
         
         elif platform == 'bale' and 'bale_app' in globals():
             bot = bale_app.bot
             if message_id:
-                await bot.unpin_chat_message(chat_id=chat_id, message_id=message_id)
+                await handle_rate_limit_with_backoff(bot.unpin_chat_message, chat_id=chat_id, message_id=message_id)
             else:
-                await bot.unpin_all_chat_messages(chat_id=chat_id)
+                await handle_rate_limit_with_backoff(bot.unpin_all_chat_messages, chat_id=chat_id)
             return True
         
         elif platform == 'ita':
@@ -2181,7 +2527,7 @@ async def unpin_chat_message(platform: str, chat_id: str, message_id: int = None
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
-            response = requests.post(url, data=data, headers=headers, timeout=30)
+            response = await ita_client.post(url, data=data, headers=headers, timeout=30)
             if response.status_code == 200:
                 result = response.json()
                 return result.get('ok', False)
@@ -2199,7 +2545,7 @@ async def edit_message_text(platform: str, chat_id: str, message_id: int, text:
     try:
         if platform == 'telegram' and 'telegram_app' in globals():
             bot = telegram_app.bot
-            await bot.edit_message_text(
+            await handle_rate_limit_with_backoff(bot.edit_message_text,
                 chat_id=chat_id,
                 message_id=message_id,
                 text=text,
@@ -2210,7 +2556,7 @@ async def edit_message_text(platform: str, chat_id: str, message_id: int, text:
         
         elif platform == 'bale' and 'bale_app' in globals():
             bot = bale_app.bot
-            await bot.edit_message_text(
+            await handle_rate_limit_with_backoff(bot.edit_message_text,
                 chat_id=chat_id,
                 message_id=message_id,
                 text=text,
@@ -2235,7 +2581,7 @@ async def edit_message_text(platform: str, chat_id: str, message_id: int, text:
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
-            response = requests.post(url, data=data, headers=headers, timeout=30)
+            response = await ita_client.post(url, data=data, headers=headers, timeout=30)
             if response.status_code == 200:
                 result = response.json()
                 return result.get('ok', False)
@@ -2253,7 +2599,7 @@ async def edit_message_caption(platform: str, chat_id: str, message_id: int, cap
     try:
         if platform == 'telegram' and 'telegram_app' in globals():
             bot = telegram_app.bot
-            await bot.edit_message_caption(
+            await handle_rate_limit_with_backoff(bot.edit_message_caption,
                 chat_id=chat_id,
                 message_id=message_id,
                 caption=caption,
@@ -2264,7 +2610,7 @@ async def edit_message_caption(platform: str, chat_id: str, message_id: int, cap
         
         elif platform == 'bale' and 'bale_app' in globals():
             bot = bale_app.bot
-            await bot.edit_message_caption(
+            await handle_rate_limit_with_backoff(bot.edit_message_caption,
                 chat_id=chat_id,
                 message_id=message_id,
                 caption=caption,
@@ -2289,7 +2635,7 @@ async def edit_message_caption(platform: str, chat_id: str, message_id: int, cap
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
-            response = requests.post(url, data=data, headers=headers, timeout=30)
+            response = await ita_client.post(url, data=data, headers=headers, timeout=30)
             if response.status_code == 200:
                 result = response.json()
                 return result.get('ok', False)
@@ -2308,7 +2654,7 @@ async def send_poll(platform: str, chat_id: str, question: str, options: List[st
     try:
         if platform == 'telegram' and 'telegram_app' in globals():
             bot = telegram_app.bot
-            message = await bot.send_poll(
+            message = await handle_rate_limit_with_backoff(bot.send_poll,
                 chat_id=chat_id,
                 question=question,
                 options=options,
@@ -2324,7 +2670,7 @@ async def send_poll(platform: str, chat_id: str, question: str, options: List[st
         
         elif platform == 'bale' and 'bale_app' in globals():
             bot = bale_app.bot
-            message = await bot.send_poll(
+            message = await handle_rate_limit_with_backoff(bot.send_poll,
                 chat_id=chat_id,
                 question=question,
                 options=options,
@@ -2362,7 +2708,7 @@ async def send_poll(platform: str, chat_id: str, question: str, options: List[st
                 'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
             }
             
-            response = requests.post(url, data=data, headers=headers, timeout=30)
+            response = await ita_client.post(url, data=data, headers=headers, timeout=30)
             if response.status_code == 200:
                 result = response.json()
                 if result.get('ok'):
@@ -2390,7 +2736,7 @@ async def test_ita_member_count(chat_id: str) -> dict:
         logger.info(f"[ITA TEST] Getting member count for chat {chat_id} via {url}")
         logger.info(f"[ITA TEST] Request data: {data}")
         
-        response = requests.post(url, data=data, headers=headers, timeout=30)
+        response = await ita_client.post(url, data=data, headers=headers, timeout=30)
         logger.info(f"[ITA TEST] Response status: {response.status_code}")
         logger.info(f"[ITA TEST] Response text: {response.text}")
         
@@ -2581,7 +2927,6 @@ async def _scrape_ita_member_count(chat_id: str) -> int:
         # حذف @ از ابتدای username اگر وجود دارد
         username = chat_id.lstrip('@')
         
-        import requests
         import re
         
         # تلاش با URL های مختلف
@@ -2605,7 +2950,7 @@ async def _scrape_ita_member_count(chat_id: str) -> int:
         
         for url in urls_to_try:
             try:
-                response = requests.get(url, headers=headers, timeout=15)
+                response = await ita_client.get(url, headers=headers, timeout=15)
                 if response.status_code == 200:
                     content = response.text
                     
@@ -2746,122 +3091,351 @@ async def get_file_content(platform: str, file_id: str) -> Optional[BytesIO]:
 # =================================================================
 # --- دیتابیس ---
 # =================================================================
+# --- SQLite connection pool ---
+# یک پیاده‌سازی مشترک با پکیج app؛ اینجا فقط تنظیمات pool های app.py تعیین می‌شود
+from app.utils.database import ConnectionPool
+DB_CACHED_STATEMENTS = 512
+DB_POOL_IDLE_PER_THREAD = 4
+DB_CONNECTION_PRAGMAS = (
+    # فقط روی دیتابیس تازه (پیش از journal_mode) اثر دارد؛ دیتابیس موجود با VACUUM در run_retention تبدیل می‌شود
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",  # ~20MB
+    "PRAGMA mmap_size=268435456",  # 256MB
+    "PRAGMA temp_store=MEMORY",
+)
+# اتصال‌های فقط‌خواندنی؛ حالت WAL را اتصال نویسنده تعیین می‌کند
+DB_READ_PRAGMAS = DB_CONNECTION_PRAGMAS[3:] + ("PRAGMA query_only=ON",)
+# --- DB writer ---
+DB_WRITER_MAX_BATCH = getattr(config, 'DB_WRITER_MAX_BATCH', 500)
+DB_WRITER_LINGER = getattr(config, 'DB_WRITER_LINGER', 0.005)
+DB_READER_THREADS = getattr(config, 'DB_READER_THREADS', 4)
+
+db_connection_pool = ConnectionPool(DB_FILE, pragmas=DB_CONNECTION_PRAGMAS, max_idle_per_thread=DB_POOL_IDLE_PER_THREAD,
+                                    cached_statements=DB_CACHED_STATEMENTS)
+# خواندن‌های async از اتصال‌های جداگانه فقط‌خواندنی (در WAL پشت نویسنده نمی‌مانند)
+db_read_pool = ConnectionPool(DB_FILE, pragmas=DB_READ_PRAGMAS, max_idle_per_thread=DB_POOL_IDLE_PER_THREAD,
+                              read_only=True, cached_statements=DB_CACHED_STATEMENTS)
+
 def get_db_connection():
-    logger.debug(f"[DB] Connecting to database: {DB_FILE}")
-    conn = sqlite3.connect(DB_FILE, timeout=10, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    logger.debug(f"[DB] Database connection established")
-    return conn
-
-def backup_chats_to_backup_db():
-    """Backup چت‌ها از دیتابیس اصلی به backup - فقط برای بازیابی در صورت حذف دیتابیس اصلی"""
+    return db_connection_pool.acquire()
+
+class DBWriter:
+    """
+    تنها نویسنده دیتابیس برای مسیرهای پرتکرار (ارسال‌ها، metrics، فعالیت چت‌ها)
+    - کارها در یک صف جمع می‌شوند و thread نویسنده هر دسته را در یک تراکنش commit می‌کند
+    - هر کار در savepoint خودش اجرا می‌شود تا خطای یک کار بقیه دسته را باطل نکند
+    - نتیجه هر کار یک concurrent.futures.Future است (در event loop ها با run قابل await)
+    """
+
+    def __init__(self, max_batch: int = DB_WRITER_MAX_BATCH, linger: float = DB_WRITER_LINGER):
+        self.max_batch = max(1, max_batch)
+        self.linger = linger
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[Thread] = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, work: Callable[[sqlite3.Connection], Any]) -> concurrent.futures.Future:
+        """ثبت یک کار نوشتن؛ work با اتصال نویسنده و بدون commit اجرا می‌شود"""
+        future = concurrent.futures.Future()
+        if self._closed:
+            # پس از خاموشی (مثلا در atexit) کار در همین thread انجام می‌شود
+            self._write_batch([(work, future)])
+            return future
+        self._ensure_started()
+        self._queue.put((work, future))
+        return future
+
+    def execute(self, query: str, params: tuple = ()) -> concurrent.futures.Future:
+        return self.submit(lambda conn: conn.execute(query, params).lastrowid)
+
+    def executemany(self, query: str, seq_of_params) -> concurrent.futures.Future:
+        return self.submit(lambda conn: conn.executemany(query, seq_of_params).rowcount)
+
+    async def run(self, work: Callable[[sqlite3.Connection], Any]) -> Any:
+        return await asyncio.wrap_future(self.submit(work))
+
+    def close(self, timeout: float = 10.0):
+        """نوشتن کارهای باقی‌مانده صف و توقف thread نویسنده"""
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True, name="db-writer")
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.max_batch:
+                try:
+                    remaining = deadline - time.monotonic()
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write_batch(batch)
+        # کارهایی که پس از sentinel رسیده‌اند
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                leftovers.append(item)
+        if leftovers:
+            self._write_batch(leftovers)
+
+    def _write_batch(self, batch: List[Tuple[Callable[[sqlite3.Connection], Any], concurrent.futures.Future]]):
+        outcomes = []
+        try:
+            with get_db_connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for work, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    conn.execute("SAVEPOINT db_writer_item")
+                    try:
+                        outcomes.append((future, work(conn), None))
+                        conn.execute("RELEASE db_writer_item")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO db_writer_item")
+                        conn.execute("RELEASE db_writer_item")
+                        outcomes.append((future, None, e))
+        except Exception as e:
+            logger.error(f"[DB Writer] Failed to commit batch of {len(batch)} writes: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        logger.debug(f"[DB Writer] Committed {len(batch)} writes in one transaction")
+
+db_writer = DBWriter()
+_db_read_executor = concurrent.futures.ThreadPoolExecutor(max_workers=DB_READER_THREADS, thread_name_prefix="db-reader")
+
+def db_read_fetchone(query: str, params: tuple = ()) -> Optional[sqlite3.Row]:
     try:
-        # Connect to main database (multi_bot_platform.db)
-        main_conn = sqlite3.connect(DB_FILE)
-        main_cursor = main_conn.cursor()
-        
-        # Connect to backup database (bot_database.db)
-        backup_conn = sqlite3.connect('bot_database.db')
-        backup_cursor = backup_conn.cursor()
-        
-        # Create backup tables if they don't exist (including tags column)
-        backup_cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id TEXT NOT NULL,
-            platform TEXT NOT NULL,
-            chat_type TEXT NOT NULL,
-            name TEXT,
-            username TEXT,
-            tags TEXT DEFAULT '',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_active INTEGER DEFAULT 1,
-            UNIQUE(chat_id, platform)
-        )
-        ''')
-        
-        # Get all chats from main database (including tags)
-        main_cursor.execute("SELECT chat_id, platform, chat_type, name, username, tags, created_at, last_active, is_active FROM chats")
-        chats = main_cursor.fetchall()
-        
-        # Clear backup database and insert fresh data
-        backup_cursor.execute("DELETE FROM chats")
-        
-        # Insert all chats from main database to backup (including tags)
-        for chat in chats:
-            backup_cursor.execute('''
-            INSERT INTO chats (chat_id, platform, chat_type, name, username, tags, created_at, last_active, is_active)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', chat)
-        
-        backup_conn.commit()
-        
-        logger.info(f"✅ Backup completed: {len(chats)} chats backed up from {DB_FILE} to bot_database.db")
-        
-        main_conn.close()
-        backup_conn.close()
-        
-        return True
-        
+        with db_read_pool.acquire() as conn: return conn.execute(query, params).fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"DB FetchOne Error: {e}")
+        return None
+
+def db_read_fetchall(query: str, params: tuple = ()) -> List[sqlite3.Row]:
+    try:
+        with db_read_pool.acquire() as conn: return conn.execute(query, params).fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"DB FetchAll Error: {e}")
+        return []
+
+# =========== Database Snapshots ===========
+# snapshot کامل multi_bot_platform.db با online backup API؛ در حالت WAL کپی از یک snapshot خواندنی انجام می‌شود و نویسنده‌ها متوقف نمی‌شوند
+DB_BACKUP_DIR = getattr(config, 'DB_BACKUP_DIR', 'backups')
+DB_BACKUP_GENERATIONS = max(1, int(getattr(config, 'DB_BACKUP_GENERATIONS', 7)))
+DB_BACKUP_INTERVAL_HOURS = getattr(config, 'DB_BACKUP_INTERVAL_HOURS', 6)
+_db_backup_lock = threading.Lock()
+
+def list_database_backups() -> List[str]:
+    """مسیر snapshotهای موجود، از جدیدترین به قدیمی‌ترین"""
+    if not os.path.isdir(DB_BACKUP_DIR):
+        return []
+    prefix = os.path.splitext(os.path.basename(DB_FILE))[0] + "-"
+    names = [n for n in os.listdir(DB_BACKUP_DIR) if n.startswith(prefix) and n.endswith(".db")]
+    return [os.path.join(DB_BACKUP_DIR, n) for n in sorted(names, reverse=True)]
+
+def create_chats_latest_metrics(conn):
+    """ساخت جدول chats_latest_metrics و triggerهای نگه‌دارنده آن؛ بار اول از روی تاریخچه پر می‌شود"""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chats_latest_metrics'").fetchone()
+    conn.execute("""CREATE TABLE IF NOT EXISTS chats_latest_metrics (
+        chat_id TEXT NOT NULL,
+        platform TEXT NOT NULL,
+        date_key TEXT NOT NULL,
+        members_count INTEGER,
+        PRIMARY KEY (chat_id, platform)
+    )""")
+    # INSERT OR REPLACE روی chats_metrics فقط trigger درج را اجرا می‌کند (recursive_triggers خاموش است)
+    for event in ("INSERT", "UPDATE OF date_key, members_count"):
+        name = "trg_chats_metrics_latest_" + event.split()[0].lower()
+        conn.execute(f"""CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON chats_metrics
+        BEGIN
+            INSERT INTO chats_latest_metrics (chat_id, platform, date_key, members_count)
+            VALUES (NEW.chat_id, NEW.platform, NEW.date_key, NEW.members_count)
+            ON CONFLICT(chat_id, platform) DO UPDATE SET
+                date_key = excluded.date_key, members_count = excluded.members_count
+            WHERE excluded.date_key >= chats_latest_metrics.date_key;
+        END""")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS trg_chats_metrics_latest_delete AFTER DELETE ON chats_metrics
+    BEGIN
+        DELETE FROM chats_latest_metrics
+        WHERE chat_id = OLD.chat_id AND platform = OLD.platform AND date_key = OLD.date_key;
+        INSERT OR IGNORE INTO chats_latest_metrics (chat_id, platform, date_key, members_count)
+        SELECT chat_id, platform, date_key, members_count FROM chats_metrics
+        WHERE chat_id = OLD.chat_id AND platform = OLD.platform
+        ORDER BY date_key DESC LIMIT 1;
+    END""")
+    if not exists:
+        # SQLite ستون‌های غیرتجمعی را از همان ردیف MAX برمی‌گرداند
+        conn.execute("""INSERT OR IGNORE INTO chats_latest_metrics (chat_id, platform, date_key, members_count)
+            SELECT chat_id, platform, MAX(date_key), members_count FROM chats_metrics
+            WHERE date_key IS NOT NULL
+            GROUP BY chat_id, platform""")
+        logger.info("Created chats_latest_metrics table")
+
+def split_tags(tags) -> List[str]:
+    """تبدیل رشته تگ‌های جدا شده با کاما (یا لیست) به لیست تگ‌های یکتا و تمیز"""
+    if not tags:
+        return []
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    return list(dict.fromkeys(str(tag).strip() for tag in tags if tag and str(tag).strip()))
+
+def create_chat_tags_table(conn):
+    """ساخت جدول نرمال chat_tags؛ بار اول از ستون chats.tags پر می‌شود"""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_tags'").fetchone()
+    conn.execute("""CREATE TABLE IF NOT EXISTS chat_tags (
+        chat_id TEXT NOT NULL,
+        platform TEXT NOT NULL,
+        tag TEXT NOT NULL,
+        PRIMARY KEY (chat_id, platform, tag)
+    ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_tags_tag ON chat_tags(tag, platform, chat_id)")
+    conn.execute("""CREATE TRIGGER IF NOT EXISTS trg_chats_tags_delete AFTER DELETE ON chats
+    BEGIN
+        DELETE FROM chat_tags WHERE chat_id = OLD.chat_id AND platform = OLD.platform;
+    END""")
+    # LIKE روی ستون tags از ایندکس استفاده نمی‌کرد
+    conn.execute("DROP INDEX IF EXISTS idx_chats_tags")
+    if not exists:
+        rows = conn.execute("SELECT chat_id, platform, tags FROM chats WHERE tags IS NOT NULL AND tags != ''").fetchall()
+        conn.executemany("INSERT OR IGNORE INTO chat_tags (chat_id, platform, tag) VALUES (?, ?, ?)",
+                         [(row[0], row[1], tag) for row in rows for tag in split_tags(row[2])])
+        logger.info(f"Created chat_tags table from {len(rows)} tagged chats")
+
+def sync_chat_tags(conn, chat_id: str, platform: str, tags) -> None:
+    """هم‌گام کردن chat_tags با مقدار جدید chats.tags در همان تراکنش فراخواننده"""
+    conn.execute("DELETE FROM chat_tags WHERE chat_id = ? AND platform = ?", (chat_id, platform))
+    conn.executemany("INSERT OR IGNORE INTO chat_tags (chat_id, platform, tag) VALUES (?, ?, ?)",
+                     [(chat_id, platform, tag) for tag in split_tags(tags)])
+
+def chat_tags_condition(tags, platform: str = None, match_all: bool = False, alias: str = "") -> Tuple[str, List[Any]]:
+    """
+    شرط SQL برای فیلتر چت‌ها بر اساس تگ (OR پیش‌فرض، AND با match_all) روی ایندکس idx_chat_tags_tag
+    خروجی: (شرط، پارامترها) برای افزودن به WHERE کوئری روی chats
+    """
+    tag_list = split_tags(tags)
+    prefix = f"{alias}." if alias else ""
+    placeholders = ",".join("?" for _ in tag_list)
+    condition = f"({prefix}chat_id, {prefix}platform) IN (SELECT chat_id, platform FROM chat_tags WHERE tag IN ({placeholders})"
+    params: List[Any] = list(tag_list)
+    if platform:
+        condition += " AND platform = ?"
+        params.append(platform)
+    if match_all and len(tag_list) > 1:
+        condition += " GROUP BY chat_id, platform HAVING COUNT(*) = ?"
+        params.append(len(tag_list))
+    return condition + ")", params
+
+def backup_database() -> Optional[str]:
+    """
+    گرفتن snapshot کامل از دیتابیس اصلی در DB_BACKUP_DIR و نگه‌داشتن DB_BACKUP_GENERATIONS نسخه آخر.
+    کپی در یک گام (یک تراکنش خواندنی روی snapshot فعلی WAL) انجام می‌شود؛ کپی چندگامی با هر نوشتن
+    اتصال دیگر از اول شروع می‌شد و روی دیتابیس پرنوشتن ممکن بود هرگز تمام نشود.
+    """
+    if not _db_backup_lock.acquire(blocking=False):
+        logger.info("Database backup already in progress, skipping")
+        return None
+    try:
+        os.makedirs(DB_BACKUP_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        name = f"{os.path.splitext(os.path.basename(DB_FILE))[0]}-{stamp}.db"
+        path = os.path.join(DB_BACKUP_DIR, name)
+        tmp_path = path + ".tmp"
+        started = time.monotonic()
+
+        src = sqlite3.connect(DB_FILE, timeout=30)
+        dst = sqlite3.connect(tmp_path)
+        try:
+            src.backup(dst, pages=-1)
+        finally:
+            dst.close()
+            src.close()
+        os.replace(tmp_path, path)
+
+        for old in list_database_backups()[DB_BACKUP_GENERATIONS:]:
+            try:
+                os.remove(old)
+            except OSError as e:
+                logger.warning(f"Could not remove old database backup {old}: {e}")
+
+        logger.info(f"✅ Database backup completed: {path} ({os.path.getsize(path)} bytes in {time.monotonic() - started:.1f}s)")
+        return path
     except Exception as e:
-        logger.error(f"❌ Backup failed: {str(e)}")
-        return False
+        logger.error(f"❌ Database backup failed: {str(e)}")
+        try:
+            os.remove(tmp_path)
+        except (OSError, UnboundLocalError):
+            pass
+        return None
+    finally:
+        _db_backup_lock.release()
 
-def restore_chats_from_backup():
-    """Restore چت‌ها از backup به دیتابیس اصلی - فقط در صورت حذف دیتابیس اصلی"""
+def restore_database_from_backup(path: str = None) -> Optional[str]:
+    """
+    بازگرداندن کل دیتابیس اصلی از یک snapshot (پیش‌فرض: جدیدترین نسخه).
+    کپی در یک گام و در سطح صفحه انجام می‌شود، پس زمان آن به حجم فایل بستگی دارد نه تعداد ردیف‌ها.
+    """
+    if path is None:
+        backups = list_database_backups()
+        if not backups:
+            logger.error("❌ Restore failed: no database backups found")
+            return None
+        path = backups[0]
+    if not os.path.isfile(path):
+        logger.error(f"❌ Restore failed: backup {path} not found")
+        return None
     try:
-        # Connect to backup database
-        backup_conn = sqlite3.connect('bot_database.db')
-        backup_cursor = backup_conn.cursor()
-        
-        # Connect to main database (multi_bot_platform.db)
-        main_conn = sqlite3.connect(DB_FILE)
-        main_cursor = main_conn.cursor()
-        
-        # Create main tables if they don't exist (including tags column)
-        main_cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chats (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id TEXT NOT NULL,
-            platform TEXT NOT NULL,
-            chat_type TEXT NOT NULL,
-            name TEXT,
-            username TEXT,
-            tags TEXT DEFAULT '',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_active TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_active INTEGER DEFAULT 1,
-            UNIQUE(chat_id, platform)
-        )
-        ''')
-        
-        # Get all chats from backup database (including tags)
-        backup_cursor.execute("SELECT chat_id, platform, chat_type, name, username, tags, created_at, last_active, is_active FROM chats")
-        chats = backup_cursor.fetchall()
-        
-        # Clear main database and restore from backup
-        main_cursor.execute("DELETE FROM chats")
-        
-        # Insert all chats from backup to main database (including tags)
-        for chat in chats:
-            main_cursor.execute('''
-            INSERT INTO chats (chat_id, platform, chat_type, name, username, tags, created_at, last_active, is_active)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', chat)
-        
-        main_conn.commit()
-        
-        logger.info(f"✅ Restore completed: {len(chats)} chats restored from bot_database.db to {DB_FILE}")
-        
-        backup_conn.close()
-        main_conn.close()
-        
-        return True
-        
+        started = time.monotonic()
+        chat_activity_registry.flush()
+        src = sqlite3.connect(path)
+        dst = sqlite3.connect(DB_FILE, timeout=30)
+        try:
+            integrity = src.execute("PRAGMA quick_check").fetchone()[0]
+            if integrity != "ok":
+                logger.error(f"❌ Restore failed: backup {path} is corrupt ({integrity})")
+                return None
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+        # اتصال‌های pool پس از بازگردانی از نو ساخته شوند
+        db_connection_pool.close_all()
+        logger.info(f"✅ Restore completed from {path} to {DB_FILE} in {time.monotonic() - started:.1f}s")
+        return path
     except Exception as e:
         logger.error(f"❌ Restore failed: {str(e)}")
-        return False
+        return None
 
 def check_user_tag_status(user_id: str, platform: str) -> bool:
     """بررسی اینکه آیا کاربر تگ‌های خود را انتخاب کرده است یا نه"""
@@ -2887,65 +3461,67 @@ def update_user_tag_status(user_id: str, platform: str, selected_tags: str):
     except Exception as e:
         logger.error(f"Error updating user tag status: {e}")
 
-def migrate_user_tag_data():
-    """انتقال داده‌های تگ‌گذاری کاربران از user_tag_status به chats"""
+def migrate_user_tag_data(conn) -> bool:
+    """
+    انتقال داده‌های تگ‌گذاری کاربران از user_tag_status به chats (commit با فراخواننده)
+    خطا دوباره raise می‌شود تا run_schema_migrations تراکنش را برگرداند و user_version بالا نرود
+    """
     try:
-        with get_db_connection() as conn:
-            cur = conn.cursor()
-            
-            # بررسی وجود جدول user_tag_status
-            cur.execute("""
-                SELECT name FROM sqlite_master 
-                WHERE type='table' AND name='user_tag_status'
-            """)
-            if not cur.fetchone():
-                logger.info("جدول user_tag_status وجود ندارد - انتقال داده‌ها انجام شد")
-                return True
-            
-            # دریافت تمام داده‌های user_tag_status
-            cur.execute("""
-                SELECT user_id, platform, selected_tags, created_at
-                FROM user_tag_status 
-                WHERE has_selected_tags = 1 AND selected_tags IS NOT NULL AND selected_tags != ''
-            """)
-            user_tags = cur.fetchall()
-            
-            migrated_count = 0
-            for user_id, platform, selected_tags, created_at in user_tags:
-                try:
-                    # بررسی وجود چت در جدول chats
+        cur = conn.cursor()
+        
+        # بررسی وجود جدول user_tag_status
+        cur.execute("""
+            SELECT name FROM sqlite_master 
+            WHERE type='table' AND name='user_tag_status'
+        """)
+        if not cur.fetchone():
+            logger.info("جدول user_tag_status وجود ندارد - انتقال داده‌ها انجام شد")
+            return True
+        
+        # دریافت تمام داده‌های user_tag_status
+        cur.execute("""
+            SELECT user_id, platform, selected_tags, created_at
+            FROM user_tag_status 
+            WHERE has_selected_tags = 1 AND selected_tags IS NOT NULL AND selected_tags != ''
+        """)
+        user_tags = cur.fetchall()
+        
+        migrated_count = 0
+        for user_id, platform, selected_tags, created_at in user_tags:
+            try:
+                # بررسی وجود چت در جدول chats
+                cur.execute("""
+                    SELECT chat_id FROM chats 
+                    WHERE chat_id = ? AND platform = ?
+                """, (user_id, platform))
+                
+                if cur.fetchone():
+                    # به‌روزرسانی تگ‌های موجود
                     cur.execute("""
-                        SELECT chat_id FROM chats 
+                        UPDATE chats SET tags = ?, last_active = CURRENT_TIMESTAMP
                         WHERE chat_id = ? AND platform = ?
-                    """, (user_id, platform))
-                    
-                    if cur.fetchone():
-                        # به‌روزرسانی تگ‌های موجود
-                        cur.execute("""
-                            UPDATE chats SET tags = ?, last_active = CURRENT_TIMESTAMP
-                            WHERE chat_id = ? AND platform = ?
-                        """, (selected_tags, user_id, platform))
-                    else:
-                        # ایجاد چت جدید
-                        cur.execute("""
-                            INSERT INTO chats (chat_id, platform, chat_type, tags, created_at, last_active, is_active)
-                            VALUES (?, ?, 'private', ?, ?, CURRENT_TIMESTAMP, 1)
-                        """, (user_id, platform, selected_tags, created_at))
-                    
-                    migrated_count += 1
-                    logger.info(f"Migrated user {user_id} on {platform} with tags: {selected_tags}")
-                    
-                except Exception as e:
-                    logger.error(f"Error migrating user {user_id} on {platform}: {e}")
-                    continue
-            
-            conn.commit()
-            logger.info(f"✅ Migration completed: {migrated_count} users migrated from user_tag_status to chats")
-            return True
-            
+                    """, (selected_tags, user_id, platform))
+                else:
+                    # ایجاد چت جدید
+                    cur.execute("""
+                        INSERT INTO chats (chat_id, platform, chat_type, tags, created_at, last_active, is_active)
+                        VALUES (?, ?, 'private', ?, ?, CURRENT_TIMESTAMP, 1)
+                    """, (user_id, platform, selected_tags, created_at))
+                sync_chat_tags(conn, user_id, platform, selected_tags)
+                
+                migrated_count += 1
+                logger.info(f"Migrated user {user_id} on {platform} with tags: {selected_tags}")
+                
+            except Exception as e:
+                logger.error(f"Error migrating user {user_id} on {platform}: {e}")
+                raise
+        
+        logger.info(f"✅ Migration completed: {migrated_count} users migrated from user_tag_status to chats")
+        return True
+        
     except Exception as e:
         logger.error(f"Error in migrate_user_tag_data: {e}")
-        return False
+        raise
 
 def build_tag_selection_keyboard(platform: str):
     """ایجاد کیبورد انتخاب تگ‌ها برای کاربران جدید"""
@@ -2978,328 +3554,666 @@ def build_tag_selection_keyboard(platform: str):
         
         return InlineKeyboardMarkup(keyboard)
 
-def init_db():
+# =========== Data Retention ===========
+# پاکسازی دوره‌ای جداولی که بدون سقف رشد می‌کنند؛ مقدار 0 برای هر تعداد روز آن گام را غیرفعال می‌کند
+RETENTION_ENABLED = getattr(config, 'RETENTION_ENABLED', True)
+RETENTION_HOUR = getattr(config, 'RETENTION_HOUR', 3)
+RETENTION_SENT_MESSAGES_DAYS = getattr(config, 'RETENTION_SENT_MESSAGES_DAYS', 90)
+RETENTION_METRICS_DAILY_DAYS = getattr(config, 'RETENTION_METRICS_DAILY_DAYS', 180)
+RETENTION_POSTS_STATS_DAYS = getattr(config, 'RETENTION_POSTS_STATS_DAYS', 0)
+RETENTION_PURGE_DELETED_BATCHES = getattr(config, 'RETENTION_PURGE_DELETED_BATCHES', True)
+RETENTION_CHUNK_SIZE = getattr(config, 'RETENTION_CHUNK_SIZE', 2000)
+RETENTION_VACUUM_PAGES = getattr(config, 'RETENTION_VACUUM_PAGES', 2000)
+RETENTION_VACUUM_STEP_SLEEP = getattr(config, 'RETENTION_VACUUM_STEP_SLEEP', 0.005)  # مکث بین گام‌های vacuum تا نویسنده‌ها ادامه دهند
+RETENTION_CONVERT_AUTO_VACUUM = getattr(config, 'RETENTION_CONVERT_AUTO_VACUUM', False)
+_retention_lock = threading.Lock()
+
+def create_retention_tables(conn):
+    """آرشیو فشرده sent_messages (یک ردیف برای هر batch) و وضعیت پیشرفت retention"""
+    conn.execute("""CREATE TABLE IF NOT EXISTS sent_messages_archive (
+        batch_id INTEGER PRIMARY KEY,
+        platform TEXT,
+        message_count INTEGER NOT NULL,
+        private_cnt INTEGER DEFAULT 0,
+        group_cnt INTEGER DEFAULT 0,
+        channel_cnt INTEGER DEFAULT 0,
+        messages BLOB NOT NULL,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+    conn.execute("CREATE TABLE IF NOT EXISTS retention_state (key TEXT PRIMARY KEY, value TEXT)")
+
+def _pack_sent_messages(pairs: List[List[str]]) -> bytes:
+    return zlib.compress(json.dumps(pairs, separators=(',', ':')).encode('utf-8'), 9)
+
+def _unpack_sent_messages(blob: Optional[bytes]) -> List[List[str]]:
+    return json.loads(zlib.decompress(blob).decode('utf-8')) if blob else []
+
+async def async_fetch_batch_messages(batch_id: int) -> List[Tuple[str, str]]:
+    """(chat_id, message_id) پیام‌های یک batch، شامل پیام‌های آرشیو شده"""
+    rows = await async_db_fetchall("SELECT chat_id, message_id FROM sent_messages WHERE batch_id = ?", (batch_id,))
+    archived = await async_db_fetchone("SELECT messages FROM sent_messages_archive WHERE batch_id = ?", (batch_id,))
+    messages = [(row['chat_id'], row['message_id']) for row in rows or []]
+    if archived:
+        messages.extend((chat_id, message_id) for chat_id, message_id in _unpack_sent_messages(archived['messages']))
+    return messages
+
+def _retention_cutoff(conn, days: int, fmt: str = 'datetime') -> str:
+    return conn.execute(f"SELECT {fmt}('now', ?)", (f"-{int(days)} days",)).fetchone()[0]
+
+def _purge_deleted_batches(conn, limit: int) -> Tuple[int, int]:
+    """حذف پیام‌ها و ردیف batchهای حذف‌شده (is_deleted = 1)؛ خروجی: (batch، پیام)"""
+    messages = conn.execute("""
+        DELETE FROM sent_messages WHERE rowid IN (
+            SELECT s.rowid FROM broadcast_batches b
+            JOIN sent_messages s ON s.batch_id = b.batch_id
+            WHERE b.is_deleted = 1 AND b.status IS NOT 'running'
+            LIMIT ?)
+    """, (limit,)).rowcount
+    if messages >= limit:
+        return 0, messages
+    conn.execute("""DELETE FROM sent_messages_archive WHERE batch_id IN
+        (SELECT batch_id FROM broadcast_batches WHERE is_deleted = 1 AND status IS NOT 'running')""")
+    batches = conn.execute("DELETE FROM broadcast_batches WHERE is_deleted = 1 AND status IS NOT 'running'").rowcount
+    return batches, messages
+
+def _archive_sent_messages(conn, cutoff: str, limit: int) -> Tuple[int, int]:
+    """انتقال پیام‌های batchهای قدیمی‌تر از cutoff به sent_messages_archive تا حدود limit پیام؛ خروجی: (batch، پیام)"""
+    candidates = conn.execute("""
+        SELECT b.batch_id, b.platform FROM broadcast_batches b
+        WHERE b.timestamp < ? AND b.status IS NOT 'running'
+          AND EXISTS (SELECT 1 FROM sent_messages s WHERE s.batch_id = b.batch_id)
+        ORDER BY b.timestamp LIMIT 50
+    """, (cutoff,)).fetchall()
+    batches = moved = 0
+    for batch_id, platform in candidates:
+        rows = conn.execute("""
+            SELECT s.chat_id, s.message_id, c.chat_type FROM sent_messages s
+            LEFT JOIN chats c ON c.chat_id = s.chat_id AND c.platform = ?
+            WHERE s.batch_id = ?
+        """, (platform, batch_id)).fetchall()
+        pairs = [[chat_id, message_id] for chat_id, message_id, _ in rows]
+        counts = {t: 0 for t in ('private', 'group', 'channel')}
+        for _, _, chat_type in rows:
+            if chat_type in counts:
+                counts[chat_type] += 1
+        previous = conn.execute(
+            "SELECT messages, private_cnt, group_cnt, channel_cnt FROM sent_messages_archive WHERE batch_id = ?",
+            (batch_id,)).fetchone()
+        if previous:
+            pairs = _unpack_sent_messages(previous[0]) + pairs
+            for t, prev_cnt in zip(('private', 'group', 'channel'), previous[1:]):
+                counts[t] += prev_cnt or 0
+        conn.execute("""
+            INSERT OR REPLACE INTO sent_messages_archive
+            (batch_id, platform, message_count, private_cnt, group_cnt, channel_cnt, messages)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (batch_id, platform, len(pairs), counts['private'], counts['group'], counts['channel'],
+              _pack_sent_messages(pairs)))
+        conn.execute("DELETE FROM sent_messages WHERE batch_id = ?", (batch_id,))
+        batches += 1
+        moved += len(rows)
+        if moved >= limit:
+            break
+    return batches, moved
+
+# ردیف روز D حذف می‌شود اگر در همان هفته (دوشنبه تا یکشنبه) و پیش از cutoff ردیف جدیدتری برای چت باشد؛
+# پس از هر هفته قدیمی فقط آخرین نقطه می‌ماند
+_METRICS_DOWNSAMPLE_COND = """EXISTS (
+    SELECT 1 FROM chats_metrics x
+    WHERE x.chat_id = m.chat_id AND x.platform = m.platform
+      AND x.date_key > m.date_key AND x.date_key <= date(m.date_key, 'weekday 0') AND x.date_key < ?)"""
+
+def _metrics_downsample_start(conn) -> str:
+    """اولین روزی که ممکن است هنوز نقطه روزانه داشته باشد (دوشنبه هفته آخرین cutoff اجرا شده)"""
+    row = conn.execute("SELECT value FROM retention_state WHERE key = 'metrics_downsampled_until'").fetchone()
+    if not row:
+        return ''
+    return conn.execute("SELECT date(?, '-6 days', 'weekday 1')", (row[0],)).fetchone()[0] or ''
+
+def _downsample_metrics_day(conn, day: str, cutoff: str, limit: int) -> int:
+    return conn.execute(f"""
+        DELETE FROM chats_metrics WHERE rowid IN (
+            SELECT m.rowid FROM chats_metrics m
+            WHERE m.date_key = ? AND {_METRICS_DOWNSAMPLE_COND}
+            LIMIT ?)
+    """, (day, cutoff, limit)).rowcount
+
+def _retention_write(work: Callable[[sqlite3.Connection], Any]) -> Any:
+    """اجرای یک گام کوچک retention در نویسنده مشترک تا قفل نوشتن کوتاه بماند"""
+    return db_writer.submit(work).result()
+
+def _drain(step: Callable[[sqlite3.Connection], int], limit: int) -> int:
+    """تکرار یک گام حذف تا وقتی کمتر از limit ردیف برگرداند"""
+    total = 0
+    while True:
+        count = _retention_write(step)
+        total += count
+        if count < limit:
+            return total
+
+def _incremental_vacuum(dry_run: bool) -> Dict[str, Any]:
+    """آزاد کردن صفحات خالی فایل دیتابیس در گام‌های RETENTION_VACUUM_PAGES صفحه‌ای"""
     with get_db_connection() as conn:
-        # فعال‌سازی WAL mode برای بهتر شدن همزمانی
-        conn.execute("PRAGMA journal_mode=WAL")
-        conn.execute("PRAGMA synchronous=NORMAL")
-        conn.execute("PRAGMA cache_size=10000")
-        conn.execute("PRAGMA temp_store=MEMORY")
-        
-        conn.execute('''CREATE TABLE IF NOT EXISTS chats (
-            chat_id TEXT,
-            platform TEXT,
-            chat_type TEXT,
-            created_at TEXT,
-            name TEXT,
-            username TEXT,
-            tags TEXT DEFAULT '',
-            last_active TIMESTAMP,
-            is_active INTEGER DEFAULT 1,
-            member_count INTEGER,
-            description TEXT,
-            invite_link TEXT,
-            PRIMARY KEY (chat_id, platform)
-        )''')
-        conn.execute('CREATE TABLE IF NOT EXISTS broadcast_batches (batch_id INTEGER PRIMARY KEY AUTOINCREMENT, scope TEXT NOT NULL, platform TEXT, content_preview TEXT, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, is_deleted INTEGER DEFAULT 0)')
-        conn.execute('CREATE TABLE IF NOT EXISTS sent_messages (message_id TEXT, chat_id TEXT, batch_id INTEGER, FOREIGN KEY(batch_id) REFERENCES broadcast_batches(batch_id) ON DELETE CASCADE)')
-        
-        # جدول جلوگیری از ارسال تکراری
-        conn.execute('''CREATE TABLE IF NOT EXISTS broadcast_dedupe (
-            key TEXT PRIMARY KEY,
-            created_at INTEGER
-        )''')
-        
-        # جدول user_tag_status حذف شده - تگ‌گذاری کاربران حالا در جدول chats انجام می‌شود
-        
-        # جدول ارسال‌های زماندار
-        conn.execute('''CREATE TABLE IF NOT EXISTS scheduled_broadcasts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            message TEXT NOT NULL,
-            platforms TEXT NOT NULL,
-            scopes TEXT NOT NULL,
-            scheduled_time TIMESTAMP NOT NULL,
-            solar_date TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            status TEXT DEFAULT 'pending',
-            job_id TEXT,
-            repeat_type TEXT DEFAULT 'once',
-            repeat_interval INTEGER DEFAULT 0,
-            last_sent TIMESTAMP,
-            total_sent INTEGER DEFAULT 0,
-            send_to_tagged BOOLEAN DEFAULT 0,
-            tag_filter TEXT DEFAULT '',
-            content_type TEXT DEFAULT 'text',
-            content_data TEXT,
-            pin_message BOOLEAN DEFAULT 0
-        )''')
-        
-        # مهاجرت ستون های جدید برای آمار/گزارش بهتر (فقط برای دیتابیس‌های قدیمی)
-        try:
-            cols = [r[1] for r in conn.execute("PRAGMA table_info('chats')").fetchall()]
-            
-            # بررسی و اضافه کردن ستون‌های مورد نیاز برای scheduled_broadcasts
-            scheduled_cols = [r[1] for r in conn.execute("PRAGMA table_info('scheduled_broadcasts')").fetchall()]
-            
-            # اضافه کردن ستون title اگر وجود ندارد
-            if 'title' not in scheduled_cols:
-                conn.execute("ALTER TABLE scheduled_broadcasts ADD COLUMN title TEXT")
-                logger.info("Added title column to scheduled_broadcasts table")
-            
-            # اضافه کردن ستون‌های دیگر اگر وجود ندارند
-            required_columns = [
-                ('message', 'TEXT'),
-                ('platforms', 'TEXT'),
-                ('platform', 'TEXT'),  # ستون platform برای سازگاری
-                ('scopes', 'TEXT'),
-                ('solar_date', 'TEXT'),
-                ('send_to_tagged', 'BOOLEAN DEFAULT 0'),
-                ('tag_filter', 'TEXT DEFAULT ""'),
-                ('content_type', 'TEXT DEFAULT "text"'),
-                ('content_data', 'TEXT'),
-                ('pin_message', 'BOOLEAN DEFAULT 0'),
-                ('content_text', 'TEXT'),
-                ('is_recurring', 'INTEGER DEFAULT 0'),
-                ('recurring_pattern', 'TEXT'),
-                ('executed_at', 'TIMESTAMP'),
-                ('notification_message_id', 'INTEGER')
-            ]
-            
-            for col_name, col_type in required_columns:
-                if col_name not in scheduled_cols:
-                    conn.execute(f"ALTER TABLE scheduled_broadcasts ADD COLUMN {col_name} {col_type}")
-                    logger.info(f"Added {col_name} column to scheduled_broadcasts table")
-            if 'created_at' not in cols:
-                conn.execute("ALTER TABLE chats ADD COLUMN created_at TEXT")
-            if 'name' not in cols:
-                conn.execute("ALTER TABLE chats ADD COLUMN name TEXT")
-            if 'username' not in cols:
-                conn.execute("ALTER TABLE chats ADD COLUMN username TEXT")
-            if 'tags' not in cols:
-                conn.execute("ALTER TABLE chats ADD COLUMN tags TEXT DEFAULT ''")
-            if 'last_active' not in cols:
-                conn.execute("ALTER TABLE chats ADD COLUMN last_active TIMESTAMP")
-                # به‌روزرسانی رکوردهای موجود
-                conn.execute("UPDATE chats SET last_active = datetime('now') WHERE last_active IS NULL")
-            if 'is_active' not in cols:
-                conn.execute("ALTER TABLE chats ADD COLUMN is_active INTEGER DEFAULT 1")
-            if 'member_count' not in cols:
-                conn.execute("ALTER TABLE chats ADD COLUMN member_count INTEGER")
-            if 'description' not in cols:
-                conn.execute("ALTER TABLE chats ADD COLUMN description TEXT")
-            if 'invite_link' not in cols:
-                conn.execute("ALTER TABLE chats ADD COLUMN invite_link TEXT")
-            
-            # مهاجرت جدول scheduled_broadcasts
-            try:
-                scheduled_cols = [r[1] for r in conn.execute("PRAGMA table_info('scheduled_broadcasts')").fetchall()]
-                if 'executed_at' not in scheduled_cols:
-                    conn.execute("ALTER TABLE scheduled_broadcasts ADD COLUMN executed_at TIMESTAMP")
-                if 'notification_message_id' not in scheduled_cols:
-                    conn.execute("ALTER TABLE scheduled_broadcasts ADD COLUMN notification_message_id INTEGER")
-            except sqlite3.Error as e:
-                logger.warning(f"DB migration warning (adding columns to scheduled_broadcasts): {e}")
-            
-            # جدول ذخیره روزانه تعداد اعضا
-            conn.execute("CREATE TABLE IF NOT EXISTS chats_metrics (chat_id TEXT, platform TEXT, date_key TEXT, members_count INTEGER, is_daily_snapshot BOOLEAN DEFAULT 0, PRIMARY KEY (chat_id, platform, date_key))")
-            
-            # اضافه کردن ستون is_daily_snapshot اگر موجود نباشد
-            try:
-                metrics_cols = [r[1] for r in conn.execute("PRAGMA table_info('chats_metrics')").fetchall()]
-                if 'is_daily_snapshot' not in metrics_cols:
-                    conn.execute("ALTER TABLE chats_metrics ADD COLUMN is_daily_snapshot BOOLEAN DEFAULT 0")
-                    logger.info("Added is_daily_snapshot column to chats_metrics table")
-            except sqlite3.Error as e:
-                logger.warning(f"DB migration warning (adding is_daily_snapshot column): {e}")
-            
-            # جدول آمار پست‌ها و بازدید
-            conn.execute("""CREATE TABLE IF NOT EXISTS channel_posts_stats (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id TEXT NOT NULL,
-                platform TEXT NOT NULL,
-                message_id TEXT NOT NULL,
-                post_date TIMESTAMP NOT NULL,
-                content_type TEXT,
-                content_preview TEXT,
-                views_count INTEGER DEFAULT 0,
-                forwards_count INTEGER DEFAULT 0,
-                reactions_count INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(chat_id, platform, message_id)
-            )""")
-            
-            # جدول ردیابی اعضای یکتا
-            conn.execute("""CREATE TABLE IF NOT EXISTS unique_members (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                platform TEXT NOT NULL,
-                first_name TEXT,
-                last_name TEXT,
-                username TEXT,
-                is_bot INTEGER DEFAULT 0,
-                last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, platform)
-            )""")
-            
-            # جدول عضویت در چت‌ها
-            conn.execute("""CREATE TABLE IF NOT EXISTS chat_memberships (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                platform TEXT NOT NULL,
-                chat_id TEXT NOT NULL,
-                chat_type TEXT NOT NULL,
-                joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_active INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(user_id, platform, chat_id)
-            )""")
-            # جدول زمان‌بندی ارسال‌ها
-            conn.execute("""CREATE TABLE IF NOT EXISTS scheduled_broadcasts (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                scheduled_time TIMESTAMP NOT NULL,
-                platform TEXT NOT NULL,
-                scopes TEXT NOT NULL,
-                content_text TEXT,
-                content_type TEXT,
-                content_data TEXT,
-                is_recurring INTEGER DEFAULT 0,
-                recurring_pattern TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                status TEXT DEFAULT 'pending',
-                executed_at TIMESTAMP,
-                notification_message_id INTEGER
-            )""")
-        except sqlite3.Error as e:
-            logger.warning(f"DB migration warning (adding columns to chats): {e}")
-        
-        # ایجاد ایندکس‌ها برای بهبود عملکرد
-        try:
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_platform_type ON chats(platform, chat_type)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_metrics_date ON chats_metrics(date_key)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_batches_timestamp ON broadcast_batches(timestamp)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_sent_messages_batch ON sent_messages(batch_id)")
-            
-            # بررسی وجود ستون‌ها قبل از ایجاد ایندکس
-            cols = [r[1] for r in conn.execute("PRAGMA table_info('chats')").fetchall()]
-            if 'last_active' in cols:
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_last_active ON chats(last_active)")
-            if 'tags' in cols:
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_tags ON chats(tags)")
-            if 'is_active' in cols:
-                conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_is_active ON chats(is_active)")
-            
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_broadcasts_time ON scheduled_broadcasts(scheduled_time)")
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_broadcasts_status ON scheduled_broadcasts(status)")
-        except sqlite3.Error as e:
-            logger.warning(f"DB index creation warning: {e}")
-        
-        # مهاجرت ستون is_deleted برای broadcast_batches
-        try:
-            batch_cols = [r[1] for r in conn.execute("PRAGMA table_info('broadcast_batches')").fetchall()]
-            if 'is_deleted' not in batch_cols:
-                conn.execute("ALTER TABLE broadcast_batches ADD COLUMN is_deleted INTEGER DEFAULT 0")
-        except Exception as e:
-            logger.warning(f"Migration error for broadcast_batches table: {e}")
-            
-        # =================================================================
-        # User Authentication Tables
-        # =================================================================
-        conn.execute('''CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            mobile TEXT UNIQUE NOT NULL,
-            full_name TEXT,
-            is_verified INTEGER DEFAULT 0,
-            balance INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_login TIMESTAMP,
-            is_active INTEGER DEFAULT 1
-        )''')
-        
-        conn.execute('''CREATE TABLE IF NOT EXISTS user_otp_codes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            mobile TEXT NOT NULL,
-            code TEXT NOT NULL,
-            expires_at TIMESTAMP NOT NULL,
-            is_used INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            attempts INTEGER DEFAULT 0
-        )''')
-        
-        conn.execute('''CREATE TABLE IF NOT EXISTS user_sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            session_token TEXT UNIQUE NOT NULL,
-            expires_at TIMESTAMP NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-        )''')
-        
-        conn.execute('''CREATE TABLE IF NOT EXISTS user_tokens (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            telegram_token TEXT,
-            bale_token TEXT,
-            ita_token TEXT,
-            telegram_owner_id TEXT,
-            bale_owner_id TEXT,
-            ita_owner_id TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-        )''')
-        
-        conn.execute('''CREATE TABLE IF NOT EXISTS user_billing (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            amount INTEGER NOT NULL,
-            transaction_id TEXT UNIQUE,
-            payping_ref_id TEXT,
-            status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            verified_at TIMESTAMP,
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-        )''')
-        
-        conn.execute('''CREATE TABLE IF NOT EXISTS user_transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            type TEXT NOT NULL,
-            amount INTEGER NOT NULL,
-            description TEXT,
-            balance_before INTEGER,
-            balance_after INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
-        )''')
-        
-        # Add admin column to users table
-        try:
-            user_cols = [r[1] for r in conn.execute("PRAGMA table_info('users')").fetchall()]
-            if 'is_admin' not in user_cols:
-                conn.execute("ALTER TABLE users ADD COLUMN is_admin INTEGER DEFAULT 0")
-                logger.info("Added is_admin column to users table")
-        except sqlite3.Error as e:
-            logger.warning(f"Migration warning (is_admin column): {e}")
-        
-        # Indexes for user tables
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_users_mobile ON users(mobile)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_token ON user_sessions(session_token)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_user ON user_sessions(user_id)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_user_otp_mobile ON user_otp_codes(mobile)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_user_tokens_user ON user_tokens(user_id)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_user_billing_user ON user_billing(user_id)")
-        conn.execute("CREATE INDEX IF NOT EXISTS idx_user_billing_ref ON user_billing(payping_ref_id)")
-        
-        conn.commit()
-        
-        # انتقال داده‌های تگ‌گذاری کاربران از user_tag_status به chats
+        mode = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        report = {'auto_vacuum': {0: 'none', 1: 'full', 2: 'incremental'}.get(mode, mode),
+                  'free_pages': free_pages, 'freed_pages': 0}
+        if dry_run:
+            return report
+        if mode == 0 and RETENTION_CONVERT_AUTO_VACUUM:
+            # تبدیل یکباره؛ VACUUM کل فایل را بازنویسی می‌کند و در طول آن نوشتن‌ها منتظر می‌مانند
+            logger.info("Converting database to incremental auto_vacuum (full VACUUM)")
+            conn.commit()
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            report['auto_vacuum'] = 'incremental'
+            report['freed_pages'] = free_pages
+        elif mode == 2:
+            while free_pages > 0:
+                # execute فقط یک گام (یک صفحه) اجرا می‌کند؛ executescript دستور را تا انتها اجرا می‌کند
+                conn.executescript(f"PRAGMA incremental_vacuum({int(RETENTION_VACUUM_PAGES)})")
+                remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if remaining >= free_pages:
+                    break
+                report['freed_pages'] += free_pages - remaining
+                free_pages = remaining
+                if RETENTION_VACUUM_STEP_SLEEP:
+                    time.sleep(RETENTION_VACUUM_STEP_SLEEP)
+        return report
+
+def run_retention(dry_run: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    اجرای سیاست نگه‌داری داده‌ها:
+    - حذف کامل batchهای حذف‌شده (is_deleted = 1) و پیام‌هایشان
+    - انتقال sent_messages قدیمی‌تر از RETENTION_SENT_MESSAGES_DAYS به sent_messages_archive
+    - کاهش نقاط روزانه chats_metrics قدیمی‌تر از RETENTION_METRICS_DAILY_DAYS به یک نقطه در هفته
+    - حذف channel_posts_stats قدیمی‌تر از RETENTION_POSTS_STATS_DAYS و کلیدهای منقضی broadcast_dedupe
+    - incremental vacuum
+    با dry_run=True هیچ تغییری داده نمی‌شود و فقط تعداد ردیف‌های مشمول گزارش می‌شود.
+    هر گام در تکه‌های RETENTION_CHUNK_SIZE ردیفی از طریق db_writer نوشته می‌شود.
+    """
+    if not _retention_lock.acquire(blocking=False):
+        logger.info("Data retention already in progress, skipping")
+        return None
+    try:
+        started = time.monotonic()
+        chunk = max(1, int(RETENTION_CHUNK_SIZE))
+        report: Dict[str, Any] = {'dry_run': dry_run}
+
+        with get_db_connection() as conn:
+            if RETENTION_PURGE_DELETED_BATCHES:
+                if dry_run:
+                    row = conn.execute("""
+                        SELECT COUNT(DISTINCT b.batch_id), COUNT(s.batch_id) FROM broadcast_batches b
+                        LEFT JOIN sent_messages s ON s.batch_id = b.batch_id
+                        WHERE b.is_deleted = 1 AND b.status IS NOT 'running'
+                    """).fetchone()
+                    report['deleted_batches'] = {'batches': row[0], 'messages': row[1]}
+                else:
+                    batches = messages = 0
+                    while True:
+                        b, m = _retention_write(lambda c: _purge_deleted_batches(c, chunk))
+                        batches += b
+                        messages += m
+                        if m < chunk:
+                            break
+                    report['deleted_batches'] = {'batches': batches, 'messages': messages}
+
+            if RETENTION_SENT_MESSAGES_DAYS:
+                cutoff = _retention_cutoff(conn, RETENTION_SENT_MESSAGES_DAYS)
+                if dry_run:
+                    # batchهای حذف‌شده در گام قبل پاک می‌شوند، نه آرشیو
+                    skip_deleted = "AND b.is_deleted = 0" if RETENTION_PURGE_DELETED_BATCHES else ""
+                    row = conn.execute(f"""
+                        SELECT COUNT(DISTINCT b.batch_id), COUNT(*) FROM broadcast_batches b
+                        JOIN sent_messages s ON s.batch_id = b.batch_id
+                        WHERE b.timestamp < ? AND b.status IS NOT 'running' {skip_deleted}
+                    """, (cutoff,)).fetchone()
+                    batches, messages = row[0], row[1]
+                else:
+                    batches = messages = 0
+                    while True:
+                        b, m = _retention_write(lambda c: _archive_sent_messages(c, cutoff, chunk))
+                        batches += b
+                        messages += m
+                        if not b:
+                            break
+                report['sent_messages'] = {'cutoff': cutoff, 'batches': batches, 'messages': messages}
+
+            if RETENTION_METRICS_DAILY_DAYS:
+                cutoff = _retention_cutoff(conn, RETENTION_METRICS_DAILY_DAYS, 'date')
+                start = _metrics_downsample_start(conn)
+                if dry_run:
+                    rows = conn.execute(f"""
+                        SELECT COUNT(*) FROM chats_metrics m
+                        WHERE m.date_key >= ? AND m.date_key < ? AND {_METRICS_DOWNSAMPLE_COND}
+                    """, (start, cutoff, cutoff)).fetchone()[0]
+                else:
+                    days = [r[0] for r in conn.execute(
+                        "SELECT DISTINCT date_key FROM chats_metrics WHERE date_key >= ? AND date_key < ? ORDER BY date_key",
+                        (start, cutoff)).fetchall()]
+                    rows = 0
+                    for day in days:
+                        rows += _drain(lambda c, day=day: _downsample_metrics_day(c, day, cutoff, chunk), chunk)
+                    _retention_write(lambda c: c.execute(
+                        "INSERT OR REPLACE INTO retention_state (key, value) VALUES ('metrics_downsampled_until', ?)",
+                        (cutoff,)))
+                report['chats_metrics'] = {'cutoff': cutoff, 'since': start or None, 'rows': rows}
+
+            if RETENTION_POSTS_STATS_DAYS:
+                cutoff = _retention_cutoff(conn, RETENTION_POSTS_STATS_DAYS)
+                if dry_run:
+                    rows = conn.execute("SELECT COUNT(*) FROM channel_posts_stats WHERE post_date < ?", (cutoff,)).fetchone()[0]
+                else:
+                    rows = _drain(lambda c: c.execute(
+                        "DELETE FROM channel_posts_stats WHERE id IN (SELECT id FROM channel_posts_stats WHERE post_date < ? LIMIT ?)",
+                        (cutoff, chunk)).rowcount, chunk)
+                report['channel_posts_stats'] = {'cutoff': cutoff, 'rows': rows}
+
+            expired = int(time.time()) - BROADCAST_DEDUPE_TTL_SECONDS
+            if dry_run:
+                rows = conn.execute("SELECT COUNT(*) FROM broadcast_dedupe WHERE created_at < ?", (expired,)).fetchone()[0]
+            else:
+                rows = _retention_write(lambda c: c.execute("DELETE FROM broadcast_dedupe WHERE created_at < ?", (expired,)).rowcount)
+            report['broadcast_dedupe'] = {'rows': rows}
+
+        report['vacuum'] = _incremental_vacuum(dry_run)
+        report['elapsed'] = round(time.monotonic() - started, 2)
+        logger.info(f"{'[dry-run] ' if dry_run else ''}Data retention finished: {report}")
+        return report
+    except Exception as e:
+        logger.error(f"❌ Data retention failed: {e}", exc_info=True)
+        return None
+    finally:
+        _retention_lock.release()
+
+# --- Schema migrations ---
+# هر گام یک بار و به ترتیب اجرا می‌شود و نسخه در PRAGMA user_version ثبت می‌شود.
+# گام‌ها idempotent هستند تا روی دیتابیس‌های قدیمی بدون user_version (نسخه 0) هم درست اجرا شوند.
+# گام جدید فقط به انتهای SCHEMA_MIGRATIONS اضافه شود؛ گام‌های قبلی تغییر نکنند.
+
+def _table_columns(conn, table: str) -> Set[str]:
+    return {r[1] for r in conn.execute(f"PRAGMA table_info('{table}')").fetchall()}
+
+def _add_missing_columns(conn, table: str, columns: List[Tuple[str, str]]):
+    existing = _table_columns(conn, table)
+    for col_name, col_type in columns:
+        if col_name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {col_name} {col_type}")
+            logger.info(f"Added {col_name} column to {table} table")
+
+def _migration_base_schema(conn):
+    """جداول اصلی و ستون‌هایی که دیتابیس‌های قدیمی ممکن است نداشته باشند"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS chats (
+        chat_id TEXT,
+        platform TEXT,
+        chat_type TEXT,
+        created_at TEXT,
+        name TEXT,
+        username TEXT,
+        tags TEXT DEFAULT '',
+        last_active TIMESTAMP,
+        is_active INTEGER DEFAULT 1,
+        member_count INTEGER,
+        description TEXT,
+        invite_link TEXT,
+        PRIMARY KEY (chat_id, platform)
+    )''')
+    conn.execute('CREATE TABLE IF NOT EXISTS broadcast_batches (batch_id INTEGER PRIMARY KEY AUTOINCREMENT, scope TEXT NOT NULL, platform TEXT, content_preview TEXT, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, is_deleted INTEGER DEFAULT 0)')
+    conn.execute('CREATE TABLE IF NOT EXISTS sent_messages (message_id TEXT, chat_id TEXT, batch_id INTEGER, FOREIGN KEY(batch_id) REFERENCES broadcast_batches(batch_id) ON DELETE CASCADE)')
+    
+    # جدول ارسال‌های زماندار
+    conn.execute('''CREATE TABLE IF NOT EXISTS scheduled_broadcasts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        message TEXT NOT NULL,
+        platforms TEXT NOT NULL,
+        scopes TEXT NOT NULL,
+        scheduled_time TIMESTAMP NOT NULL,
+        solar_date TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        status TEXT DEFAULT 'pending',
+        job_id TEXT,
+        repeat_type TEXT DEFAULT 'once',
+        repeat_interval INTEGER DEFAULT 0,
+        last_sent TIMESTAMP,
+        total_sent INTEGER DEFAULT 0,
+        send_to_tagged BOOLEAN DEFAULT 0,
+        tag_filter TEXT DEFAULT '',
+        content_type TEXT DEFAULT 'text',
+        content_data TEXT,
+        pin_message BOOLEAN DEFAULT 0
+    )''')
+    
+    # جدول ذخیره روزانه تعداد اعضا
+    conn.execute("CREATE TABLE IF NOT EXISTS chats_metrics (chat_id TEXT, platform TEXT, date_key TEXT, members_count INTEGER, is_daily_snapshot BOOLEAN DEFAULT 0, PRIMARY KEY (chat_id, platform, date_key))")
+    
+    # جدول آمار پست‌ها و بازدید
+    conn.execute("""CREATE TABLE IF NOT EXISTS channel_posts_stats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id TEXT NOT NULL,
+        platform TEXT NOT NULL,
+        message_id TEXT NOT NULL,
+        post_date TIMESTAMP NOT NULL,
+        content_type TEXT,
+        content_preview TEXT,
+        views_count INTEGER DEFAULT 0,
+        forwards_count INTEGER DEFAULT 0,
+        reactions_count INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(chat_id, platform, message_id)
+    )""")
+    
+    # جدول ردیابی اعضای یکتا
+    conn.execute("""CREATE TABLE IF NOT EXISTS unique_members (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        platform TEXT NOT NULL,
+        first_name TEXT,
+        last_name TEXT,
+        username TEXT,
+        is_bot INTEGER DEFAULT 0,
+        last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, platform)
+    )""")
+    
+    # جدول عضویت در چت‌ها
+    conn.execute("""CREATE TABLE IF NOT EXISTS chat_memberships (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        platform TEXT NOT NULL,
+        chat_id TEXT NOT NULL,
+        chat_type TEXT NOT NULL,
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        is_active INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, platform, chat_id)
+    )""")
+    
+    # مهاجرت ستون‌های جدید برای دیتابیس‌های قدیمی
+    _add_missing_columns(conn, 'chats', [
+        ('created_at', 'TEXT'),
+        ('name', 'TEXT'),
+        ('username', 'TEXT'),
+        ('tags', "TEXT DEFAULT ''"),
+        ('last_active', 'TIMESTAMP'),
+        ('is_active', 'INTEGER DEFAULT 1'),
+        ('member_count', 'INTEGER'),
+        ('description', 'TEXT'),
+        ('invite_link', 'TEXT'),
+    ])
+    conn.execute("UPDATE chats SET last_active = datetime('now') WHERE last_active IS NULL")
+    _add_missing_columns(conn, 'scheduled_broadcasts', [
+        ('title', 'TEXT'),
+        ('message', 'TEXT'),
+        ('platforms', 'TEXT'),
+        ('platform', 'TEXT'),  # ستون platform برای سازگاری
+        ('scopes', 'TEXT'),
+        ('solar_date', 'TEXT'),
+        ('send_to_tagged', 'BOOLEAN DEFAULT 0'),
+        ('tag_filter', 'TEXT DEFAULT ""'),
+        ('content_type', 'TEXT DEFAULT "text"'),
+        ('content_data', 'TEXT'),
+        ('pin_message', 'BOOLEAN DEFAULT 0'),
+        ('content_text', 'TEXT'),
+        ('is_recurring', 'INTEGER DEFAULT 0'),
+        ('recurring_pattern', 'TEXT'),
+        ('executed_at', 'TIMESTAMP'),
+        ('notification_message_id', 'INTEGER'),
+    ])
+    _add_missing_columns(conn, 'chats_metrics', [('is_daily_snapshot', 'BOOLEAN DEFAULT 0')])
+    _add_missing_columns(conn, 'broadcast_batches', [('is_deleted', 'INTEGER DEFAULT 0')])
+    
+    # ایجاد ایندکس‌ها برای بهبود عملکرد
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_metrics_date ON chats_metrics(date_key)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_batches_timestamp ON broadcast_batches(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sent_messages_batch ON sent_messages(batch_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_last_active ON chats(last_active)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_is_active ON chats(is_active)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_broadcasts_time ON scheduled_broadcasts(scheduled_time)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_broadcasts_status ON scheduled_broadcasts(status)")
+
+def _migration_user_tables(conn):
+    """User Authentication Tables"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        mobile TEXT UNIQUE NOT NULL,
+        full_name TEXT,
+        is_verified INTEGER DEFAULT 0,
+        balance INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_login TIMESTAMP,
+        is_active INTEGER DEFAULT 1
+    )''')
+    
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_otp_codes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        mobile TEXT NOT NULL,
+        code TEXT NOT NULL,
+        expires_at TIMESTAMP NOT NULL,
+        is_used INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        attempts INTEGER DEFAULT 0
+    )''')
+    
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        session_token TEXT UNIQUE NOT NULL,
+        expires_at TIMESTAMP NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )''')
+    
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_tokens (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        telegram_token TEXT,
+        bale_token TEXT,
+        ita_token TEXT,
+        telegram_owner_id TEXT,
+        bale_owner_id TEXT,
+        ita_owner_id TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )''')
+    
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_billing (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        amount INTEGER NOT NULL,
+        transaction_id TEXT UNIQUE,
+        payping_ref_id TEXT,
+        status TEXT DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        verified_at TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )''')
+    
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        description TEXT,
+        balance_before INTEGER,
+        balance_after INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )''')
+    
+    _add_missing_columns(conn, 'users', [('is_admin', 'INTEGER DEFAULT 0')])
+    
+    # Indexes for user tables
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_mobile ON users(mobile)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_token ON user_sessions(session_token)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_sessions_user ON user_sessions(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_otp_mobile ON user_otp_codes(mobile)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_tokens_user ON user_tokens(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_billing_user ON user_billing(user_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_billing_ref ON user_billing(payping_ref_id)")
+
+def _migration_broadcast_jobs(conn):
+    """جدول dedupe و صف پایدار ارسال‌های انبوه"""
+    # جدول جلوگیری از ارسال تکراری
+    conn.execute('''CREATE TABLE IF NOT EXISTS broadcast_dedupe (
+        key TEXT PRIMARY KEY,
+        created_at INTEGER
+    )''')
+    
+    # صف پایدار ارسال‌های انبوه: api_broadcast فقط job ثبت می‌کند و worker ها آن را اجرا می‌کنند
+    conn.execute('''CREATE TABLE IF NOT EXISTS broadcast_jobs (
+        job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        platforms TEXT,
+        status TEXT DEFAULT 'queued',
+        params TEXT,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        total INTEGER DEFAULT 0,
+        progress TEXT,
+        result TEXT,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP
+    )''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs(status)")
+
+def _migration_broadcast_checkpoints(conn):
+    """ستون‌های checkpoint برای ادامه ارسال پس از ری‌استارت"""
+    _add_missing_columns(conn, 'broadcast_batches', [
+        ('status', "TEXT DEFAULT 'done'"),
+        ('job_id', 'INTEGER'),
+        ('checkpoint_cursor', 'INTEGER DEFAULT 0'),
+    ])
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_batches_job ON broadcast_batches(job_id, platform)")
+
+def _migration_audience_index(conn):
+    """ایندکس پوششی مخاطبان؛ جایگزین idx_chats_platform_type (پیشوند آن را پوشش می‌دهد)"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_audience ON chats(platform, chat_type, is_active, chat_id)")
+    conn.execute("DROP INDEX IF EXISTS idx_chats_platform_type")
+
+def _migration_batch_outcomes(conn):
+    """شمارنده‌های نتیجه هر batch (در پایان ارسال نوشته می‌شوند) و ایندکس جزئی تاریخچه"""
+    _add_missing_columns(conn, 'broadcast_batches', [
+        ('target_count', 'INTEGER'),
+        ('sent_count', 'INTEGER'),
+        ('failed_count', 'INTEGER'),
+        ('scope_counts', 'TEXT'),  # JSON: {scope: {"target", "sent", "failed"}}
+    ])
+    # batchهای قدیمی: فقط تعداد ارسال موفق قابل بازسازی است (مخاطبان زمان ارسال معلوم نیست)
+    conn.execute("""
+        UPDATE broadcast_batches SET sent_count =
+            (SELECT COUNT(*) FROM sent_messages s WHERE s.batch_id = broadcast_batches.batch_id)
+            + COALESCE((SELECT a.message_count FROM sent_messages_archive a WHERE a.batch_id = broadcast_batches.batch_id), 0)
+        WHERE sent_count IS NULL AND status IS NOT 'running'
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_broadcast_batches_history ON broadcast_batches(timestamp) WHERE is_deleted = 0")
+
+def _migration_chat_list_indexes(conn):
+    """ایندکس‌های عبارتی مرتب‌سازی لیست چت‌ها (باید دقیقاً با CHAT_LIST_SORTS یکسان باشند)"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_list_created ON chats(COALESCE(created_at, ''))")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_list_platform_created ON chats(platform, COALESCE(created_at, ''))")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_list_name ON chats(COALESCE(name, '') COLLATE NOCASE)")
+
+# ستون‌هایی که داده گزارش‌ها و آمار را تغییر می‌دهند؛ درج و حذف ردیف همیشه نسخه را افزایش می‌دهد.
+# last_active و checkpoint ها عمداً شامل نیستند (در مسیر پرتکرار پیام‌ها و ارسال‌ها نوشته می‌شوند)
+DATA_VERSION_COLUMNS = {
+    'chats': ('chat_id', 'platform', 'chat_type', 'name', 'username', 'tags', 'is_active', 'member_count', 'created_at'),
+    'chats_metrics': ('chat_id', 'platform', 'date_key', 'members_count', 'is_daily_snapshot'),
+    'broadcast_batches': ('is_deleted', 'status', 'sent_count', 'failed_count'),
+}
+
+def create_data_version_triggers(conn):
+    """
+    (باز)سازی triggerهای data_versions
+    trigger به‌روزرسانی فقط وقتی اجرا می‌شود که مقدار یکی از ستون‌ها واقعاً تغییر کند؛ SQLite
+    UPDATE OF را برای هر ستونی که در SET آمده اجرا می‌کند، حتی اگر مقدار آن ثابت بماند (مثل is_active = 1)
+    """
+    for table, columns in DATA_VERSION_COLUMNS.items():
+        conn.execute("INSERT OR IGNORE INTO data_versions (name, version) VALUES (?, 0)", (table,))
+        changed = " OR ".join(f"OLD.{c} IS NOT NEW.{c}" for c in columns)
+        for event, condition in (("INSERT", ""), ("DELETE", ""),
+                                 (f"UPDATE OF {', '.join(columns)}", f"WHEN {changed}")):
+            name = f"trg_data_version_{table}_{event.split()[0].lower()}"
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            conn.execute(f"""CREATE TRIGGER {name} AFTER {event} ON {table} {condition}
+                BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE name = '{table}';
+                END""")
+
+def _migration_report_data_versions(conn):
+    """شمارنده نسخه داده هر جدول که triggerها با هر تغییر افزایش می‌دهند (اثر انگشت کش گزارش‌ها)"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS data_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    )''')
+    create_data_version_triggers(conn)
+
+def _migration_broadcast_checkpoint_key(conn):
+    """کلید آخرین چت پردازش‌شده (به جای موقعیت در لیست) برای ادامه ارسال پس از ری‌استارت"""
+    _add_missing_columns(conn, 'broadcast_batches', [('checkpoint_key', 'TEXT')])  # JSON: [scope, chat_id]
+
+# (نسخه، توضیح، گام) به ترتیب اجرا
+SCHEMA_MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "base tables", _migration_base_schema),
+    (2, "user authentication tables", _migration_user_tables),
+    (3, "broadcast dedupe and job queue", _migration_broadcast_jobs),
+    (4, "broadcast checkpoints", _migration_broadcast_checkpoints),
+    (5, "audience covering index", _migration_audience_index),
+    # آخرین تعداد اعضای هر چت؛ با trigger روی chats_metrics به‌روز می‌ماند
+    (6, "chats_latest_metrics", create_chats_latest_metrics),
+    # جدول نرمال تگ‌ها برای جستجوی ایندکس‌دار (جایگزین LIKE روی chats.tags)
+    (7, "chat_tags", create_chat_tags_table),
+    # انتقال داده‌های تگ‌گذاری کاربران از user_tag_status به chats
+    (8, "user_tag_status data", migrate_user_tag_data),
+    # آرشیو فشرده sent_messages و وضعیت retention
+    (9, "retention tables", create_retention_tables),
+    (10, "broadcast batch outcome counts", _migration_batch_outcomes),
+    (11, "chat list indexes", _migration_chat_list_indexes),
+    # شمارنده‌های نسخه داده برای کش فایل گزارش‌ها (report_builder)
+    (12, "report data versions", _migration_report_data_versions),
+    (13, "broadcast checkpoint key", _migration_broadcast_checkpoint_key),
+    # triggerهای نسخه ۱۲ با هر SET بدون تغییر (مثلاً is_active = 1) نسخه را بالا می‌بردند
+    (14, "data version triggers on changed values", create_data_version_triggers),
+]
+SCHEMA_VERSION = SCHEMA_MIGRATIONS[-1][0]
+
+def run_schema_migrations(conn) -> int:
+    """
+    اجرای گام‌های مهاجرتی که هنوز روی دیتابیس اعمال نشده‌اند.
+    روی دیتابیس به‌روز فقط یک PRAGMA user_version خوانده می‌شود.
+    خروجی: نسخه schema پس از اجرا
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return version
+    for step_version, description, step in SCHEMA_MIGRATIONS:
+        if step_version <= version:
+            continue
+        started = time.monotonic()
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            migrate_user_tag_data()
-        except Exception as e:
-            logger.error(f"Error during user tag migration: {e}")
+            # ممکن است process دیگری همزمان همین گام را اجرا کرده باشد
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= step_version:
+                conn.rollback()
+                continue
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {int(step_version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.error(f"DB migration {step_version} ({description}) failed", exc_info=True)
+            raise
+        logger.info(f"DB migration {step_version} ({description}) applied in {time.monotonic() - started:.3f}s")
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def init_db():
+    with get_db_connection() as conn:
+        run_schema_migrations(conn)
 
 def register_chat(chat_id: str, chat_type: str, platform: str, name: Optional[str] = None, 
                   username: Optional[str] = None, tags: Optional[str] = None, member_count: int = 0) -> bool:
@@ -3424,7 +4338,7 @@ def register_chat(chat_id: str, chat_type: str, platform: str, name: Optional[st
                     'created_at': created_at,
                     'name': name,
                     'username': username,
-                    'tags': tags,
+                    'tags': tags if tags is not None else (existing_chat['tags'] if existing_chat else None),
                     'member_count': member_count,
                     'now': time.strftime('%Y-%m-%d %H:%M:%S')
                 }
@@ -3463,6 +4377,8 @@ def register_chat(chat_id: str, chat_type: str, platform: str, name: Optional[st
                 logger.debug(f"[Register Chat {request_id}] With params: {params}")
                 
                 cur.execute(query, params)
+                if tags is not None:
+                    sync_chat_tags(conn, chat_id_str, platform, tags)
                 
                 logger.info(f"[Register Chat {request_id}] Successfully updated database for chat {chat_id_str}")
                 
@@ -3519,6 +4435,7 @@ def register_chat(chat_id: str, chat_type: str, platform: str, name: Optional[st
                                 loop = asyncio.new_event_loop()
                                 asyncio.set_event_loop(loop)
                                 result = loop.run_until_complete(get_ita_chat_info_simple(chat_id_str))
+                                ita_client.close_for_loop(loop)
                                 loop.close()
                                 return result
                             except Exception as e:
@@ -3553,6 +4470,7 @@ def register_chat(chat_id: str, chat_type: str, platform: str, name: Optional[st
                             result = loop.run_until_complete(
                                 create_chat_snapshot(chat_id_str, platform, normalized_type)
                             )
+                            ita_client.close_for_loop(loop)
                             loop.close()
                             return result
                         except Exception as e:
@@ -3587,6 +4505,298 @@ def register_chat(chat_id: str, chat_type: str, platform: str, name: Optional[st
     
     logger.info(f"[{platform}] Registered chat {chat_id} with API type: {chat_type}, stored as: {normalized_type}")
 
+# =========== Stats Cache ===========
+STATS_CACHE_TTL = getattr(config, 'STATS_CACHE_TTL', 30)  # ثانیه
+
+class StatsCache:
+    """
+    کش در حافظه برای نتایج آماری پرهزینه (مثل /api/stats)
+    - هر نتیجه همراه شمارنده‌های data_versions زمان محاسبه ذخیره می‌شود و با هر تغییر chats یا chats_metrics
+      (که triggerهای دیتابیس ثبت می‌کنند) خودبه‌خود باطل است؛ نیازی به invalidate دستی در مسیرهای نوشتن نیست
+    - ttl سقف عمر هر نتیجه است
+    - محاسبه یک کلید single-flight است: اگر چند درخواست همزمان برسند فقط یکی کوئری‌ها را اجرا می‌کند و بقیه منتظر همان نتیجه می‌مانند
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[tuple, float, Any]] = {}
+        self._inflight: Dict[Tuple[str, tuple], concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _data_versions() -> tuple:
+        return tuple(
+            (r['name'], r['version'])
+            for r in db_fetchall("SELECT name, version FROM data_versions WHERE name IN ('chats', 'chats_metrics') ORDER BY name")
+        )
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Tuple[Any, bool]:
+        """خروجی: (مقدار، True اگر کوئری‌ها در این فراخوانی اجرا نشده‌اند)"""
+        versions = self._data_versions()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == versions and entry[1] > time.monotonic():
+                return entry[2], True
+            future = self._inflight.get((key, versions))
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._inflight[(key, versions)] = future
+        if not owner:
+            return future.result(), True
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop((key, versions), None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._inflight.pop((key, versions), None)
+            self._entries[key] = (versions, time.monotonic() + self.ttl, value)
+        future.set_result(value)
+        return value, False
+
+stats_cache = StatsCache(STATS_CACHE_TTL)
+
+# =========== Chat List Pagination ===========
+CHAT_LIST_DEFAULT_LIMIT = getattr(config, 'CHAT_LIST_DEFAULT_LIMIT', 100)
+CHAT_LIST_MAX_LIMIT = getattr(config, 'CHAT_LIST_MAX_LIMIT', 1000)
+
+# کلید مرتب‌سازی: (عبارت ایندکس‌شده در migration 11، جهت)؛ rowid ترتیب را یکتا می‌کند
+CHAT_LIST_SORTS = {
+    'created_at': ("COALESCE(c.created_at, '')", 'DESC'),
+    'name': ("COALESCE(c.name, '') COLLATE NOCASE", 'ASC'),
+}
+
+def _encode_chat_cursor(sort: str, sort_key: Any, rowid: int) -> str:
+    raw = json.dumps([sort, sort_key, rowid], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def _decode_chat_cursor(cursor: str, sort: str) -> Tuple[Any, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, sort_key, rowid = json.loads(raw.decode('utf-8'))
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort or not isinstance(sort_key, str) or not isinstance(rowid, int):
+        raise ValueError("Invalid cursor")
+    return sort_key, rowid
+
+def _chat_list_paging_args(default_limit: Optional[int] = None) -> Tuple[Optional[int], Optional[str], str]:
+    """
+    خواندن limit/cursor/sort از query string
+    اگر نه limit و نه cursor داده شده باشد (و default_limit هم None باشد) limit=None یعنی حالت قدیمی: همه ردیف‌ها
+    """
+    cursor = request.args.get('cursor') or None
+    limit = request.args.get('limit', type=int)
+    if limit is None and (cursor or default_limit is not None):
+        limit = default_limit or CHAT_LIST_DEFAULT_LIMIT
+    if limit is not None:
+        limit = max(1, min(limit, CHAT_LIST_MAX_LIMIT))
+    sort = request.args.get('sort', 'created_at')
+    if sort not in CHAT_LIST_SORTS:
+        sort = 'created_at'
+    return limit, cursor, sort
+
+def fetch_chats_page(columns: str, platform: Optional[str] = None, chat_type: Optional[str] = None,
+                     active: Optional[bool] = None, search: str = '', sort: str = 'created_at',
+                     limit: Optional[int] = None, cursor: Optional[str] = None, offset: int = 0,
+                     join: str = '') -> Dict[str, Any]:
+    """
+    یک صفحه از لیست چت‌ها با صفحه‌بندی keyset روی (کلید مرتب‌سازی، rowid)
+    - فیلترها و مرتب‌سازی در SQL و روی ایندکس‌های migration 11 اجرا می‌شوند
+    - columns با alias c (و join اختیاری) نوشته می‌شود
+    - limit=None: همه ردیف‌ها بدون total (حالت قدیمی endpoint ها)
+    - total از شمارش کش‌شده در stats_cache می‌آید (جستجوی متنی کش نمی‌شود)
+    خروجی: {"rows": [dict], "next_cursor": str | None, "total": int | None}
+    ValueError برای cursor نامعتبر
+    """
+    sort_expr, direction = CHAT_LIST_SORTS[sort]
+    conds, params = [], []
+    if platform:
+        conds.append("c.platform = ?")
+        params.append(platform)
+    if chat_type:
+        conds.append("c.chat_type = ?")
+        params.append(chat_type)
+    if active is not None:
+        conds.append("c.is_active = ?")
+        params.append(1 if active else 0)
+    if search:
+        conds.append("(c.chat_id LIKE ? OR c.name LIKE ? OR c.username LIKE ?)")
+        params.extend([f"%{search}%"] * 3)
+    filter_sql = " AND ".join(conds) or "1=1"
+
+    total = None
+    if limit is not None:
+        count_sql = f"SELECT COUNT(*) FROM chats c WHERE {filter_sql}"
+        if search:
+            total = db_fetchone(count_sql, tuple(params))[0]
+        else:
+            cache_key = "chats_count:" + json.dumps([platform, chat_type, active])
+            total, _ = stats_cache.get_or_compute(cache_key, lambda: db_fetchone(count_sql, tuple(params))[0])
+
+    page_conds, page_params = list(conds), list(params)
+    if cursor:
+        sort_key, rowid = _decode_chat_cursor(cursor, sort)
+        op = '<' if direction == 'DESC' else '>'
+        # شرط تکراری روی خود کلید لازم است: SQLite مقایسه row value را به جستجوی بازه روی ایندکس تبدیل نمی‌کند
+        page_conds.append(f"{sort_expr} {op}= ? AND ({sort_expr}, c.rowid) {op} (?, ?)")
+        page_params.extend([sort_key, sort_key, rowid])
+    query = f"""
+        SELECT {columns}, {sort_expr} AS _sort_key, c.rowid AS _rowid
+        FROM chats c {join}
+        WHERE {" AND ".join(page_conds) or "1=1"}
+        ORDER BY {sort_expr} {direction}, c.rowid {direction}
+    """
+    if limit is not None:
+        # یک ردیف اضافه فقط برای تشخیص وجود صفحه بعد
+        query += " LIMIT ?"
+        page_params.append(limit + 1)
+        if offset and not cursor:
+            query += " OFFSET ?"
+            page_params.append(offset)
+    rows = [dict(r) for r in db_fetchall(query, tuple(page_params))]
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_chat_cursor(sort, rows[-1]['_sort_key'], rows[-1]['_rowid'])
+    for r in rows:
+        del r['_sort_key'], r['_rowid']
+    return {"rows": rows, "next_cursor": next_cursor, "total": total}
+
+# =========== Chat Activity Write-Behind ===========
+CHAT_ACTIVITY_FLUSH_INTERVAL = getattr(config, 'CHAT_ACTIVITY_FLUSH_INTERVAL', 5)  # ثانیه
+
+class ChatActivityRegistry:
+    """
+    ثبت فعالیت چت‌ها در مسیر پرتکرار پیام‌ها
+    - چت‌های شناخته‌شده با نام/یوزرنیم بدون تغییر فقط last_active را در حافظه به‌روز می‌کنند
+    - last_active های تغییرکرده هر چند ثانیه در یک تراکنش در دیتابیس نوشته می‌شوند
+    - چت جدید، تغییر یافته یا غیرفعال از مسیر کامل register_chat ثبت (و فعال) می‌شود
+    - مسیرهای غیرفعال‌سازی/حذف چت باید forget یا reset را صدا بزنند تا flush بعدی وضعیت آن‌ها را برنگرداند
+    """
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._known: Dict[Tuple[str, str], Tuple[str, Optional[str], Optional[str]]] = {}
+        self._dirty: Dict[Tuple[str, str], str] = {}
+        self._lock = threading.Lock()
+        self._flusher_started = False
+
+    @staticmethod
+    def _normalize(chat_type: str, name: Optional[str], username: Optional[str]) -> Tuple[str, Optional[str], Optional[str]]:
+        # همان نرمال‌سازی register_chat
+        normalized_type = (chat_type or '').lower()
+        if normalized_type == 'supergroup':
+            normalized_type = 'group'
+        elif normalized_type not in ['channel', 'group', 'private']:
+            normalized_type = 'channel'
+        name = name.strip() if name and isinstance(name, str) else None
+        username = username.lstrip('@').strip() if username and isinstance(username, str) else None
+        return normalized_type, name, username
+
+    def touch(self, chat_id: str, chat_type: str, platform: str, name: Optional[str] = None,
+              username: Optional[str] = None) -> bool:
+        """ثبت فعالیت یک چت؛ True در صورت موفقیت"""
+        key = (str(chat_id).strip(), (platform or '').lower())
+        info = self._normalize(chat_type, name, username)
+        with self._lock:
+            known = self._known.get(key)
+            if known == info:
+                self._dirty[key] = time.strftime('%Y-%m-%d %H:%M:%S')
+                self._start_flusher()
+                return True
+
+        if known is None:
+            # اولین پیام پس از ری‌استارت: اگر رکورد دیتابیس تغییری ندارد، ثبت کامل لازم نیست
+            row = db_fetchone("SELECT chat_type, name, username, is_active FROM chats WHERE chat_id = ? AND platform = ?", key)
+            if row and row['is_active'] == 1 and (row['chat_type'], row['name'], row['username']) == info:
+                with self._lock:
+                    self._known[key] = info
+                    self._dirty[key] = time.strftime('%Y-%m-%d %H:%M:%S')
+                    self._start_flusher()
+                return True
+
+        success = register_chat(key[0], chat_type, platform, name=name, username=username)
+        if success:
+            with self._lock:
+                self._known[key] = info
+                self._dirty.pop(key, None)
+        return success
+
+    def forget(self, chat_id: str, platform: str):
+        """فراموش کردن یک چت (پس از غیرفعال‌سازی یا حذف)؛ پیام بعدی آن از مسیر کامل ثبت می‌شود"""
+        key = (str(chat_id).strip(), (platform or '').lower())
+        with self._lock:
+            self._known.pop(key, None)
+            self._dirty.pop(key, None)
+
+    def reset(self):
+        """فراموش کردن همه چت‌های شناخته‌شده (پس از غیرفعال‌سازی گروهی)؛ last_active های در انتظار حفظ می‌شوند"""
+        with self._lock:
+            self._known.clear()
+
+    def flush(self) -> int:
+        """
+        نوشتن last_active های در انتظار در یک تراکنش
+        is_active عمداً نوشته نمی‌شود: touch در صف نباید چتی را که در این فاصله غیرفعال شده دوباره فعال کند
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return 0
+
+        def _write(conn):
+            missing = []
+            for (chat_id, platform), last_active in dirty.items():
+                updated = conn.execute(
+                    "UPDATE chats SET last_active = ? WHERE chat_id = ? AND platform = ?",
+                    (last_active, chat_id, platform)
+                ).rowcount
+                if not updated:
+                    missing.append((chat_id, platform))
+            return missing
+
+        try:
+            missing = db_writer.submit(_write).result()
+        except sqlite3.Error as e:
+            logger.error(f"[Chat Activity] Failed to flush {len(dirty)} last_active updates: {e}")
+            with self._lock:
+                for key, last_active in dirty.items():
+                    self._dirty.setdefault(key, last_active)
+            return 0
+        # چت‌های حذف‌شده از دیتابیس در پیام بعدی دوباره به صورت کامل ثبت می‌شوند
+        with self._lock:
+            for key in missing:
+                self._known.pop(key, None)
+        logger.debug(f"[Chat Activity] Flushed {len(dirty)} last_active updates")
+        return len(dirty)
+
+    def _start_flusher(self):
+        if self._flusher_started:
+            return
+        self._flusher_started = True
+        Thread(target=self._flush_loop, daemon=True, name="chat-activity-flusher").start()
+        atexit.register(self.flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[Chat Activity] Flush error: {e}", exc_info=True)
+
+chat_activity_registry = ChatActivityRegistry(CHAT_ACTIVITY_FLUSH_INTERVAL)
+
+def touch_chat(chat_id: str, chat_type: str, platform: str, name: Optional[str] = None,
+               username: Optional[str] = None) -> bool:
+    """ثبت فعالیت چت در مسیر پیام‌ها (write-behind)؛ برای ثبت کامل از register_chat استفاده کنید"""
+    return chat_activity_registry.touch(chat_id, chat_type, platform, name=name, username=username)
+
 def manual_register_chat(chat_id: str, chat_type: str, platform: str, name: Optional[str] = None, 
                        username: Optional[str] = None, tags: Optional[str] = None, member_count: int = 0) -> bool:
     """
@@ -3722,6 +4932,7 @@ def manual_register_chat(chat_id: str, chat_type: str, platform: str, name: Opti
                             loop = asyncio.new_event_loop()
                             asyncio.set_event_loop(loop)
                             result = loop.run_until_complete(get_ita_chat_info_simple(chat_id_str))
+                            ita_client.close_for_loop(loop)
                             loop.close()
                             return result
                         except Exception as e:
@@ -3745,13 +4956,6 @@ def manual_register_chat(chat_id: str, chat_type: str, platform: str, name: Opti
                 except Exception as e:
                     logger.warning(f"[Manual Register {request_id}] Error getting ITA chat name: {e}")
             
-            # Update backup database
-            try:
-                backup_chats_to_backup_db()
-                logger.info(f"[Manual Register {request_id}] Backup updated successfully")
-            except Exception as e:
-                logger.warning(f"[Manual Register {request_id}] Backup update failed: {e}")
-            
             return True
         else:
             error_msg = "Failed to verify chat registration in database"
@@ -3868,6 +5072,7 @@ def create_snapshots_for_all_chats():
                         loop = asyncio.new_event_loop()
                         asyncio.set_event_loop(loop)
                         result = loop.run_until_complete(create_chat_snapshot(chat['chat_id'], chat['platform'], chat['chat_type']))
+                        ita_client.close_for_loop(loop)
                         loop.close()
                         return result
                     except Exception as e:
@@ -3975,25 +5180,42 @@ def create_bulk_sync_command():
         logger.error(f"Error creating bulk sync command: {e}")
         return "خطا در ایجاد راهنمای sync"
 
-def get_target_ids_by_scope(scopes: List[str], platform: str) -> Dict[str, Set[str]]:
-    target_ids_by_scope = {}
+def iter_audience(scopes: List[str], platform: str, tags: Optional[List[str]] = None,
+                  batch_size: int = 1000, match_all_tags: bool = False) -> Iterator[Tuple[str, str]]:
+    """
+    یافتن مخاطبان همه scope ها (و در صورت نیاز فیلتر تگ) با یک کوئری روی ایندکس idx_chats_audience
+    خروجی (chat_type, chat_id) به ترتیب ایندکس است و دسته‌ای از cursor خوانده می‌شود
+    match_all_tags: چت باید همه تگ‌ها را داشته باشد (پیش‌فرض: حداقل یکی)
+    """
+    if not scopes:
+        return
+    placeholders = ",".join("?" for _ in scopes)
+    query = f"SELECT chat_type, chat_id FROM chats WHERE platform = ? AND chat_type IN ({placeholders}) AND is_active = 1"
+    params: List[Any] = [platform, *scopes]
+    # ادمین ربات در چت خصوصی جزو مخاطبان نیست
+    owner_id = {'telegram': OWNER_ID, 'bale': BALE_OWNER_ID}.get(platform)
+    if owner_id is not None:
+        query += " AND NOT (chat_type = 'private' AND chat_id = ?)"
+        params.append(str(owner_id))
+    if tags:
+        condition, tag_params = chat_tags_condition(tags, platform, match_all_tags)
+        query += " AND " + condition
+        params.extend(tag_params)
+    query += " ORDER BY chat_type, chat_id"
     with get_db_connection() as conn:
-        cursor = conn.cursor()
-        for scope in scopes:
-            # Only select active chats to avoid sending to inactive/duplicate chats
-            # Also exclude admin users from the target list
-            if scope == 'private':
-                # For private chats, exclude admin users
-                if platform == 'telegram':
-                    cursor.execute("SELECT chat_id FROM chats WHERE chat_type = ? AND platform = ? AND is_active = 1 AND chat_id != ?", (scope, platform, str(OWNER_ID)))
-                elif platform == 'bale':
-                    cursor.execute("SELECT chat_id FROM chats WHERE chat_type = ? AND platform = ? AND is_active = 1 AND chat_id != ?", (scope, platform, str(BALE_OWNER_ID)))
-                else:
-                    cursor.execute("SELECT chat_id FROM chats WHERE chat_type = ? AND platform = ? AND is_active = 1", (scope, platform))
-            else:
-                cursor.execute("SELECT chat_id FROM chats WHERE chat_type = ? AND platform = ? AND is_active = 1", (scope, platform))
-            ids = {row[0] for row in cursor.fetchall()} # Correctly extract chat_id from sqlite3.Row object
-            target_ids_by_scope[scope] = ids
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row[0], row[1]
+
+def get_target_ids_by_scope(scopes: List[str], platform: str, tags: Optional[List[str]] = None,
+                            match_all_tags: bool = False) -> Dict[str, Set[str]]:
+    target_ids_by_scope = {scope: set() for scope in scopes}
+    for chat_type, chat_id in iter_audience(scopes, platform, tags, match_all_tags=match_all_tags):
+        target_ids_by_scope[chat_type].add(chat_id)
     return target_ids_by_scope
 
 def cleanup_inactive_chats():
@@ -4011,6 +5233,7 @@ def cleanup_inactive_chats():
             affected_rows = cursor.rowcount
             conn.commit()
             if affected_rows > 0:
+                chat_activity_registry.reset()
                 logger.info(f"Marked {affected_rows} chats as inactive")
             return affected_rows
     except Exception as e:
@@ -4100,6 +5323,7 @@ def remove_duplicate_chats():
             conn.commit()
             
             if removed_count > 0:
+                chat_activity_registry.reset()
                 logger.info(f"Removed {removed_count} duplicate private chats")
             else:
                 logger.info("No duplicate private chats found")
@@ -4179,6 +5403,19 @@ def db_fetchall(query: str, params: tuple = ()) -> List[sqlite3.Row]:
         logger.error(f"DB FetchAll Error: {e}")
         return []
 
+def db_iterate(query: str, params: tuple = (), chunk_size: int = 500) -> Iterator[sqlite3.Row]:
+    """
+    خواندن تدریجی نتیجه کوئری برای خروجی‌های بزرگ (در حافظه حداکثر chunk_size ردیف)
+    روی اتصال فقط‌خواندنی اجرا می‌شود: کل خروجی از یک snapshot است و نویسنده معطل نمی‌ماند
+    """
+    with db_read_pool.acquire() as conn:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield from rows
+
 def db_fetchone(query: str, params: tuple = ()) -> Optional[sqlite3.Row]:
     try:
         with get_db_connection() as conn: return conn.cursor().execute(query, params).fetchone()
@@ -4374,6 +5611,7 @@ async def delete_user_completely(chat_id: str, platform: str):
     try:
         # حذف از جدول chats
         await async_db_execute("DELETE FROM chats WHERE chat_id = ? AND platform = ?", (chat_id, platform))
+        chat_activity_registry.forget(chat_id, platform)
 
         # حذف پیام‌های ارسال شده به این کاربر
         await async_db_execute("DELETE FROM sent_messages WHERE chat_id = ? AND platform = ?", (chat_id, platform))
@@ -4392,7 +5630,7 @@ async def send_admin_notification(message: str, platform: str = None):
         # ارسال به تلگرام
         if telegram_app and telegram_app.bot:
             try:
-                await telegram_app.bot.send_message(
+                await handle_rate_limit_with_backoff(telegram_app.bot.send_message,
                     chat_id=TELEGRAM_OWNER_ID,
                     text=f"🔔 اطلاعیه جدید:\n\n{message}",
                     parse_mode='HTML'
@@ -4404,7 +5642,7 @@ async def send_admin_notification(message: str, platform: str = None):
         # ارسال به بله
         if bale_app and bale_app.bot:
             try:
-                await bale_app.bot.send_message(
+                await handle_rate_limit_with_backoff(bale_app.bot.send_message,
                     chat_id=BALE_OWNER_ID,
                     text=f"🔔 اطلاعیه جدید:\n\n{message}",
                     parse_mode='HTML'
@@ -4451,11 +5689,9 @@ def generate_unified_chat_stats() -> str:
     # دریافت مجموع اعضا از جدول metrics (با fallback به جدول chats)
     telegram_members = db_fetchall("""
         SELECT c.chat_type, SUM(m.members_count) as total_members
-        FROM chats_metrics m
+        FROM chats_latest_metrics m
         JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
-        WHERE m.platform = 'telegram' AND c.chat_type != 'private' AND m.date_key = (
-            SELECT MAX(date_key) FROM chats_metrics WHERE chat_id = m.chat_id AND platform = m.platform
-        )
+        WHERE m.platform = 'telegram' AND c.chat_type != 'private'
         GROUP BY c.chat_type
     """)
     telegram_member_counts = {r['chat_type']: r['total_members'] for r in telegram_members}
@@ -4466,11 +5702,9 @@ def generate_unified_chat_stats() -> str:
     
     bale_members = db_fetchall("""
         SELECT c.chat_type, SUM(m.members_count) as total_members
-        FROM chats_metrics m
+        FROM chats_latest_metrics m
         JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
-        WHERE m.platform = 'bale' AND c.chat_type != 'private' AND m.date_key = (
-            SELECT MAX(date_key) FROM chats_metrics WHERE chat_id = m.chat_id AND platform = m.platform
-        )
+        WHERE m.platform = 'bale' AND c.chat_type != 'private'
         GROUP BY c.chat_type
     """)
     bale_member_counts = {r['chat_type']: r['total_members'] for r in bale_members}
@@ -4482,11 +5716,9 @@ def generate_unified_chat_stats() -> str:
     # دریافت آمار اعضای ایتا
     ita_members = db_fetchall("""
         SELECT c.chat_type, SUM(m.members_count) as total_members
-        FROM chats_metrics m
+        FROM chats_latest_metrics m
         JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
-        WHERE m.platform = 'ita' AND c.chat_type != 'private' AND m.date_key = (
-            SELECT MAX(date_key) FROM chats_metrics WHERE chat_id = m.chat_id AND platform = m.platform
-        )
+        WHERE m.platform = 'ita' AND c.chat_type != 'private'
         GROUP BY c.chat_type
     """)
     ita_member_counts = {r['chat_type']: r['total_members'] for r in ita_members}
@@ -4602,23 +5834,32 @@ def update_post_views(chat_id: str, platform: str, message_id: str, views: int,
         logger.error(f"Error updating post views: {e}")
 
 def get_post_stats_by_batch(batch_id: int):
-    """دریافت آمار پست‌های یک batch"""
+    """دریافت آمار پست‌های یک batch (شامل پیام‌هایی که retention به sent_messages_archive منتقل کرده است)"""
     try:
+        archived = db_fetchone("SELECT messages FROM sent_messages_archive WHERE batch_id = ?", (batch_id,))
+        archived_json = json.dumps(_unpack_sent_messages(archived['messages'])) if archived else '[]'
         return db_fetchall("""
+            WITH batch_messages(chat_id, message_id) AS (
+                SELECT chat_id, message_id FROM sent_messages WHERE batch_id = ?
+                UNION ALL
+                SELECT json_extract(j.value, '$[0]'), json_extract(j.value, '$[1]') FROM json_each(?) j
+            )
             SELECT cps.*, c.name as channel_name, c.username as channel_username
-            FROM channel_posts_stats cps
+            FROM batch_messages sm
+            JOIN channel_posts_stats cps ON cps.chat_id = sm.chat_id AND cps.message_id = sm.message_id
             LEFT JOIN chats c ON c.chat_id = cps.chat_id AND c.platform = cps.platform
-            LEFT JOIN sent_messages sm ON sm.chat_id = cps.chat_id AND sm.message_id = cps.message_id
-            WHERE sm.batch_id = ?
             ORDER BY cps.post_date DESC
-        """, (batch_id,))
+        """, (batch_id, archived_json))
     except Exception as e:
         logger.error(f"Error getting post stats by batch: {e}")
         return []
 
-def save_broadcast_to_db(scope_str: str, preview: str, platform: str, messages: List[Tuple[Any, Any]]) -> Optional[int]:
+def save_broadcast_to_db(scope_str: str, preview: str, platform: str, messages: List[Tuple[Any, Any]],
+                         failed_count: int = 0) -> Optional[int]:
     # Always save broadcast attempt to database, even if no messages were sent
-    batch_id = db_execute("INSERT INTO broadcast_batches (scope, content_preview, platform) VALUES (?, ?, ?)", (scope_str, preview, platform))
+    batch_id = db_execute(
+        "INSERT INTO broadcast_batches (scope, content_preview, platform, target_count, sent_count, failed_count) VALUES (?, ?, ?, ?, ?, ?)",
+        (scope_str, preview, platform, len(messages) + failed_count, len(messages), failed_count))
     if batch_id and messages:
         msg_data = [(str(mid), str(cid), batch_id) for cid, mid in messages]
         try:
@@ -4630,35 +5871,43 @@ def save_broadcast_to_db(scope_str: str, preview: str, platform: str, messages:
             # Don't delete the batch if there's an error saving messages
     return batch_id
 
-async def async_save_broadcast_to_db(scope_str: str, preview: str, platform: str, messages: List[Tuple[Any, Any]]) -> Optional[int]:
+async def async_save_broadcast_to_db(scope_str: str, preview: str, platform: str, messages: List[Tuple[Any, Any]],
+                                     failed_count: int = 0) -> Optional[int]:
     """
     ذخیره نتایج broadcast به صورت async
     """
     # Always save broadcast attempt to database, even if no messages were sent
     # تبدیل scope_str به string اگر لیست باشد
     scope_str_final = scope_str if isinstance(scope_str, str) else str(scope_str)
-    batch_id = await async_db_execute("INSERT INTO broadcast_batches (scope, content_preview, platform) VALUES (?, ?, ?)", (scope_str_final, preview, platform))
+    batch_id = await async_db_execute(
+        "INSERT INTO broadcast_batches (scope, content_preview, platform, target_count, sent_count, failed_count) VALUES (?, ?, ?, ?, ?, ?)",
+        (scope_str_final, preview, platform, len(messages) + failed_count, len(messages), failed_count))
     if batch_id and messages:
         msg_data = [(str(mid), str(cid), batch_id) for cid, mid in messages]
         try:
-            loop = asyncio.get_running_loop()
-            await loop.run_in_executor(None, lambda: save_sent_messages_sync(msg_data))
+            await asyncio.wrap_future(db_writer.executemany(
+                "INSERT OR IGNORE INTO sent_messages (message_id, chat_id, batch_id) VALUES (?, ?, ?)", msg_data))
         except Exception as e:
             logger.error(f"Error saving sent messages: {e}")
             # Don't delete the batch if there's an error saving messages
     return batch_id
 
-def save_sent_messages_sync(msg_data: List[Tuple[str, str, int]]):
+def save_broadcast_checkpoint(batch_id: int, messages: List[Tuple[Any, Any]], cursor: int,
+                              cursor_key: Optional[Tuple[str, str]] = None) -> concurrent.futures.Future:
     """
-    ذخیره پیام‌های ارسال شده به صورت sync (برای استفاده در executor)
+    ذخیره تدریجی پیام‌های ارسال‌شده و cursor یک batch به صورت اتمیک از طریق thread نویسنده
+    cursor_key: (scope, chat_id) آخرین چتی که خودش و همه چت‌های قبل از آن پردازش شده‌اند
     """
-    try:
-        with get_db_connection() as conn:
-            conn.cursor().executemany("INSERT OR IGNORE INTO sent_messages (message_id, chat_id, batch_id) VALUES (?, ?, ?)", msg_data)
-            conn.commit()
-    except sqlite3.Error as e:
-        logger.error(f"Error saving sent messages: {e}")
-        raise
+    msg_data = [(str(mid), str(cid), batch_id) for cid, mid in messages]
+    checkpoint_key = json.dumps(list(cursor_key)) if cursor_key else None
+
+    def _write(conn):
+        if msg_data:
+            conn.executemany("INSERT OR IGNORE INTO sent_messages (message_id, chat_id, batch_id) VALUES (?, ?, ?)", msg_data)
+        conn.execute("UPDATE broadcast_batches SET checkpoint_cursor = ?, checkpoint_key = COALESCE(?, checkpoint_key) WHERE batch_id = ?",
+                     (cursor, checkpoint_key, batch_id))
+
+    return db_writer.submit(_write)
 
 def delete_batch_from_db(batch_id: int):
     db_execute("DELETE FROM broadcast_batches WHERE batch_id = ?", (batch_id,))
@@ -4765,7 +6014,10 @@ async def perform_broadcast_async(app: TelegramApplication, scopes: List[str], p
                                original_media_name: Optional[str] = None,
                                original_file_id: Optional[str] = None,
                                pin_message: bool = False,
-                               target_chats: Optional[Dict[str, List[str]]] = None):
+                               target_chats: Optional[Dict[str, List[str]]] = None,
+                               progress: Optional[Dict[str, Any]] = None,
+                               job_id: Optional[int] = None,
+                               resume_batch_id: Optional[int] = None):
     """
     Perform a broadcast to multiple chats with support for cross-platform file transfers.
     
@@ -4783,28 +6035,17 @@ async def perform_broadcast_async(app: TelegramApplication, scopes: List[str], p
         source_platform: Platform where the file was originally uploaded ('telegram' or 'bale')
         original_media_name: Optional original media name for the file
         original_file_id: Original file_id from the source platform for cross-platform transfers
+        progress: Optional dict updated in place with live sent/failed/total counters (used by broadcast jobs)
+        job_id: Broadcast job that owns this run (stored on the batch so it can be resumed)
+        resume_batch_id: Unfinished batch to continue from its checkpoint instead of starting a new one
     """
     logger.info(f"[{platform}] Starting broadcast with scopes: {scopes}")
     logger.info(f"[{platform}] Content - text: {bool(text)}, photo: {bool(photo_path)}, video: {bool(video_path)}, document: {bool(document_path)}")
     logger.info(f"[{platform}] Forward - from_chat: {forward_from_chat_id}, message_id: {forward_from_message_id}")
     
-    # Dedupe guard to avoid repeated broadcasts
-    dedupe_key = build_broadcast_key(
-        platform,
-        text,
-        photo_path,
-        video_path,
-        document_path,
-        forward_from_chat_id,
-        forward_from_message_id,
-        source_platform
-    )
-    if is_duplicate_broadcast(dedupe_key):
-        logger.info(f"[{platform}] Duplicate broadcast detected within TTL. Skipping.")
-        return {'sent': 0, 'failed': 0, 'batch_id': None, 'platform': platform, 'content_preview': 'duplicate-skipped'}
-    
-    # Semaphore for controlling concurrency (max 30 concurrent requests)
-    semaphore = asyncio.Semaphore(30)
+    # Semaphore for controlling concurrency (per-platform worker pool size)
+    concurrency = BROADCAST_CONCURRENCY.get(platform, 10)
+    semaphore = asyncio.Semaphore(concurrency)
     
     # برای ایتا، app برابر None است
     bot_instance = app.bot if app else None
@@ -4848,6 +6089,42 @@ async def perform_broadcast_async(app: TelegramApplication, scopes: List[str], p
         preview_content = f"فوروارد از پیام {forward_from_message_id}" + (f" (متن: {text[:50]}{'...' if text and len(text)>50 else ''})" if text else "")
     preview = preview_content[:100]  # محدودیت طول پیش‌نمایش در تاریخچه
 
+    logger.info(f"[{platform}] Starting broadcast to scopes: {scopes}")
+    total_targets = 0
+    for scope, ids_set in target_ids_by_scope.items():
+        logger.info(f"[{platform}] Scope '{scope}' has {len(ids_set)} targets")
+        total_targets += len(ids_set)
+    
+    if total_targets == 0:
+        logger.warning(f"[{platform}] No targets found for scopes: {scopes}")
+        return {
+            "sent": 0,
+            "failed": 0,
+            "detailed_results": detailed_results,
+            "batch_id": None,
+            "preview_content": preview_content
+        }
+    
+    # Dedupe guard to avoid repeated broadcasts
+    # کلید فقط بعد از اعتبارسنجی محتوا و مخاطبان گرفته می‌شود تا درخواست رد‌شده تلاش مجدد را مسدود نکند
+    # هش فایل‌های رسانه بزرگ نباید event loop (و بقیه ارسال‌ها) را متوقف کند
+    dedupe_key = await asyncio.to_thread(
+        build_broadcast_key,
+        platform,
+        text,
+        photo_path,
+        video_path,
+        document_path,
+        forward_from_chat_id,
+        forward_from_message_id,
+        source_platform,
+        scopes=scopes,
+        target_chats=target_chats
+    )
+    if not resume_batch_id and is_duplicate_broadcast(dedupe_key):
+        logger.info(f"[{platform}] Duplicate broadcast detected within TTL. Skipping.")
+        return {'sent': 0, 'failed': 0, 'batch_id': None, 'platform': platform, 'content_preview': 'duplicate-skipped'}
+    
     temp_files = []
     try:
         # Copy existing temp files for cross-platform broadcasts to prevent cleanup conflicts
@@ -5119,6 +6396,8 @@ async def perform_broadcast_async(app: TelegramApplication, scopes: List[str], p
                 if text:
                     logger.info(f"Attempting to send text fallback after media download failure: {text[:50]}...")
                 else:
+                    if not resume_batch_id:
+                        broadcast_dedupe_store.release(dedupe_key)
                     return {"error": f"Failed to download media from {source_platform}: {str(e)}"}
         
         # Track temporary files for cleanup
@@ -5131,389 +6410,635 @@ async def perform_broadcast_async(app: TelegramApplication, scopes: List[str], p
         
     except Exception as e:
         logger.error(f"Error handling file downloads: {e}")
+        if not resume_batch_id:
+            broadcast_dedupe_store.release(dedupe_key)
         raise
 
-    logger.info(f"[{platform}] Starting broadcast to scopes: {scopes}")
-    total_targets = 0
-    for scope, ids_set in target_ids_by_scope.items():
-        logger.info(f"[{platform}] Scope '{scope}' has {len(ids_set)} targets")
-        total_targets += len(ids_set)
-    
-    if total_targets == 0:
-        logger.warning(f"[{platform}] No targets found for scopes: {scopes}")
-        return {
-            "sent": 0,
-            "failed": 0,
-            "detailed_results": detailed_results,
-            "batch_id": None,
-            "preview_content": preview_content
-        }
-    
-    for scope, ids_set in target_ids_by_scope.items():
-        for cid_str in ids_set:
-            try: 
-                cid = int(cid_str)
-            except ValueError:
-                logger.warning(f"[{platform}] Invalid chat_id '{cid_str}' found in DB for scope '{scope}'. Skipping.")
-                detailed_results[scope]['failed'] += 1
-                total_failed += 1
-                continue
-            if cid == owner_id: 
-                logger.debug(f"[{platform}] Skipping owner chat {cid}")
-                continue
+    # ترتیب ثابت چت‌ها؛ checkpoint کلید (scope, chat_id) آخرین چت پردازش‌شده را نگه می‌دارد، نه موقعیت آن،
+    # تا حذف/غیرفعال شدن چت‌ها بین توقف و ری‌استارت (که لیست را جابه‌جا می‌کند) باعث جا افتادن چتی نشود
+    ordered_targets = [(scope, str(cid_str)) for scope in sorted(target_ids_by_scope)
+                       for cid_str in sorted(str(c) for c in target_ids_by_scope[scope])]
+
+    # batch از ابتدا ساخته می‌شود تا پیام‌های ارسال‌شده به صورت تدریجی در sent_messages ذخیره شوند
+    resume_after: Optional[Tuple[str, str]] = None
+    delivered_ids: Set[str] = set()
+    if resume_batch_id:
+        batch_id = resume_batch_id
+        batch_row = await async_db_fetchone("SELECT checkpoint_key FROM broadcast_batches WHERE batch_id = ?", (batch_id,))
+        if batch_row and batch_row['checkpoint_key']:
+            resume_after = tuple(json.loads(batch_row['checkpoint_key']))
+        delivered_ids = {row['chat_id'] for row in await async_db_fetchall("SELECT chat_id FROM sent_messages WHERE batch_id = ?", (batch_id,))}
+        logger.info(f"[{platform}] Resuming batch {batch_id} after {resume_after} ({len(delivered_ids)} chats already delivered)")
+    else:
+        batch_id = await async_db_execute(
+            "INSERT INTO broadcast_batches (scope, content_preview, platform, status, job_id) VALUES (?, ?, ?, 'running', ?)",
+            (",".join(scopes), preview, platform, job_id)
+        )
+    total_sent = len(delivered_ids)
+
+    # صف سراسری چت‌های هدف؛ worker ها به ترتیب از آن برداشت می‌کنند
+    broadcast_queue: asyncio.Queue = asyncio.Queue()
+    target_done = [False] * len(ordered_targets)
+    for index, (scope, cid_str) in enumerate(ordered_targets):
+        if (resume_after and (scope, cid_str) <= resume_after) or cid_str in delivered_ids:
+            target_done[index] = True
+            continue
+        broadcast_queue.put_nowait((index, scope, cid_str))
+    low_watermark = 0
+    checkpointed_count = 0
+
+    async def _flush_checkpoint():
+        """ذخیره پیام‌های ارسال‌شده جدید و cursor (همه چت‌های قبل از cursor پردازش شده‌اند)"""
+        nonlocal checkpointed_count
+        if not batch_id:
+            return
+        flush_end = len(all_sent_info)
+        new_messages = all_sent_info[checkpointed_count:flush_end]
+        cursor_key = ordered_targets[low_watermark - 1] if low_watermark else None
+        try:
+            await asyncio.wrap_future(save_broadcast_checkpoint(batch_id, new_messages, low_watermark, cursor_key))
+        except Exception as e:
+            logger.error(f"[{platform}] Failed to save checkpoint for batch {batch_id}: {e}")
+            return
+        # فقط بعد از نوشته شدن واقعی جلو می‌رود؛ در غیر این صورت همین پیام‌ها دفعه بعد دوباره ذخیره می‌شوند
+        checkpointed_count = flush_end
 
+    checkpoint_stop = asyncio.Event()
+
+    async def _checkpoint_loop():
+        # با event متوقف می‌شود نه cancel، تا checkpoint در حال نوشتن نیمه‌کاره رها نشود
+        while not checkpoint_stop.is_set():
             try:
-                sent_msg = None
-                parse_mode_option = ParseMode.HTML if platform == 'telegram' else ParseMode.HTML
+                await asyncio.wait_for(checkpoint_stop.wait(), timeout=BROADCAST_CHECKPOINT_INTERVAL)
+            except asyncio.TimeoutError:
+                await _flush_checkpoint()
+
+    # آپلود یک‌باره رسانه: اولین ارسال موفق file_id را برمی‌گرداند و بقیه چت‌ها با همان file_id ارسال می‌شوند
+    uploaded_file_ids: Dict[str, str] = {}
+    media_reuse_stats: Dict[str, Dict[str, int]] = {}
+    media_upload_lock = asyncio.Lock()
+
+    async def _send_media_once(media_type: str, file_path: str, cid: int, filename: str):
+        """ارسال فایل محلی؛ فقط بار اول آپلود می‌شود و بعد از آن file_id برگشتی استفاده می‌شود"""
+        send_func = getattr(bot_instance, f"send_{media_type}")
+        send_kwargs = {
+            'chat_id': cid,
+            'caption': text[:1024] if text else None,
+            'parse_mode': ParseMode.HTML,
+            'disable_notification': True,
+        }
+        if media_type not in uploaded_file_ids:
+            async with media_upload_lock:
+                if media_type not in uploaded_file_ids:
+                    sent_msg = await upload_media_with_retry(send_func, media_type, file_path, filename, **send_kwargs)
+                    file_id = extract_sent_file_id(sent_msg, media_type)
+                    if file_id:
+                        uploaded_file_ids[media_type] = file_id
+                        media_reuse_stats[media_type] = {'size': os.path.getsize(file_path), 'reused': 0}
+                        logger.info(f"[{platform}] Uploaded {media_type} once ({media_reuse_stats[media_type]['size']} bytes), reusing file_id for remaining chats")
+                    return sent_msg
+        media_reuse_stats[media_type]['reused'] += 1
+        send_kwargs[media_type] = uploaded_file_ids[media_type]
+        return await send_with_concurrency_control(semaphore, send_func, **send_kwargs)
+
+    async def _deliver_to_chat(scope: str, cid_str: str):
+        """ارسال محتوا به یک چت و ثبت نتیجه در شمارنده‌های مشترک broadcast"""
+        nonlocal total_sent, total_failed
+        try: 
+            cid = int(cid_str)
+        except ValueError:
+            logger.warning(f"[{platform}] Invalid chat_id '{cid_str}' found in DB for scope '{scope}'. Skipping.")
+            detailed_results[scope]['failed'] += 1
+            total_failed += 1
+            return
+        if cid == owner_id: 
+            logger.debug(f"[{platform}] Skipping owner chat {cid}")
+            return
 
-                if forward_from_chat_id and forward_from_message_id:
-                    try:
-                        # Convert chat_id to integer for forwarding
-                        forward_chat_id = int(forward_from_chat_id)
+        try:
+            sent_msg = None
+            parse_mode_option = ParseMode.HTML if platform == 'telegram' else ParseMode.HTML
+
+            if forward_from_chat_id and forward_from_message_id:
+                try:
+                    # Convert chat_id to integer for forwarding
+                    forward_chat_id = int(forward_from_chat_id)
                         
-                        # بررسی معتبر بودن chat_id برای Bale
-                        if platform == 'bale' and forward_chat_id < 0:
-                            logger.warning(f"[{platform}] Skipping forward from negative chat_id {forward_chat_id} (not valid for Bale)")
-                            raise Exception("Invalid chat_id for Bale platform")
+                    # بررسی معتبر بودن chat_id برای Bale
+                    if platform == 'bale' and forward_chat_id < 0:
+                        logger.warning(f"[{platform}] Skipping forward from negative chat_id {forward_chat_id} (not valid for Bale)")
+                        raise Exception("Invalid chat_id for Bale platform")
                         
-                        # برای cross-platform broadcasts، forward را غیرفعال کن
-                        if source_platform and source_platform != platform:
-                            logger.info(f"[{platform}] Cross-platform broadcast detected - skipping forward, will send media with caption instead")
-                            raise Exception("Cross-platform forward not supported")
+                    # برای cross-platform broadcasts، forward را غیرفعال کن
+                    if source_platform and source_platform != platform:
+                        logger.info(f"[{platform}] Cross-platform broadcast detected - skipping forward, will send media with caption instead")
+                        raise Exception("Cross-platform forward not supported")
                         
-                        logger.info(f"[{platform}] Attempting to forward message {forward_from_message_id} from chat {forward_chat_id} to {cid}")
-                        if platform == 'ita':
-                            # فوروارد پیام در ایتا
-                            success = await forward_ita_message(cid, forward_chat_id, forward_from_message_id)
-                            if success:
-                                all_sent_info.append((cid, 0))  # ایتا message_id ندارد
+                    logger.info(f"[{platform}] Attempting to forward message {forward_from_message_id} from chat {forward_chat_id} to {cid}")
+                    if platform == 'ita':
+                        # فوروارد پیام در ایتا
+                        success = await forward_ita_message(cid, forward_chat_id, forward_from_message_id)
+                        if success:
+                            all_sent_info.append((cid, 0))  # ایتا message_id ندارد
+                            detailed_results[scope]['sent'] += 1
+                            total_sent += 1
+                            logger.info(f"[{platform}] Forwarding successful to {cid}, skipping media sending")
+                            return
+                        else:
+                            raise Exception("Failed to forward message to Ita")
+                    else:
+                        sent_msg = await send_with_concurrency_control(
+                        semaphore,
+                        bot_instance.forward_message,
+                        chat_id=cid,
+                        from_chat_id=forward_chat_id,
+                        message_id=forward_from_message_id,
+                        disable_notification=True
+                    )
+                    # Note: For forwarded messages, we don't send additional text
+                    # The forwarded message itself contains all the content
+                    all_sent_info.append((cid, sent_msg.message_id))
+                    detailed_results[scope]['sent'] += 1
+                    total_sent += 1
+                    logger.info(f"[{platform}] Forwarding successful to {cid}, skipping media sending")
+                    return
+                except Exception as e:
+                    logger.error(f"Error forwarding message to {cid} from chat {forward_chat_id} message {forward_from_message_id}: {e}")
+                    # Handle "Chat not found" errors by removing the chat from database
+                    if "Chat not found" in str(e).lower():
+                        try:
+                            await delete_user_completely(str(cid), platform)
+                            logger.info(f"[{platform}] Removed chat {cid} from database due to 'Chat not found' error")
+                        except Exception as db_error:
+                            logger.error(f"[{platform}] Failed to remove chat {cid} from database: {db_error}")
+                        detailed_results[scope]['failed'] += 1
+                        total_failed += 1
+                        return
+                    # If forwarding fails, try to send media with caption if available
+                    logger.debug(f"[{platform}] Forward failed, checking media and text: text='{text}', photo={bool(photo_path)}, video={bool(video_path)}, document={bool(document_path)}")
+                    if any([photo_path, video_path, document_path]):
+                        logger.info(f"[{platform}] Forward failed, attempting to send media with caption to {cid}")
+                        # Continue to media sending logic below instead of skipping
+                    elif text:
+                        logger.info(f"[{platform}] Forward failed, attempting to send text directly to {cid}")
+                        try:
+                            if platform == 'ita':
+                                # برای ایتا از API مستقیم استفاده می‌کنیم
+                                success, message_id = await send_ita_message(cid, text, parse_mode_option)
+                                if success:
+                                    all_sent_info.append((cid, message_id))
+                                    detailed_results[scope]['sent'] += 1
+                                    total_sent += 1
+                                    logger.info(f"[{platform}] Successfully sent text message to {cid} after forward failure")
+                                else:
+                                    raise Exception("Failed to send text message to Ita")
+                            else:
+                                sent_msg = await send_with_concurrency_control(
+                                    semaphore,
+                                    bot_instance.send_message,
+                                    chat_id=cid,
+                                    text=text,
+                                    parse_mode=parse_mode_option,
+                                    disable_notification=True
+                                )
+                                all_sent_info.append((cid, sent_msg.message_id))
                                 detailed_results[scope]['sent'] += 1
                                 total_sent += 1
-                                logger.info(f"[{platform}] Forwarding successful to {cid}, skipping media sending")
-                                continue
-                            else:
-                                raise Exception("Failed to forward message to Ita")
+                                logger.info(f"[{platform}] Successfully sent text message to {cid} after forward failure")
+                                return
+                        except Exception as text_error:
+                            logger.error(f"Failed to send text message to {cid} after forward failure: {text_error}")
+                            # Handle "Chat not found" errors by removing the chat from database
+                            if "Chat not found" in str(text_error).lower():
+                                try:
+                                    await delete_user_completely(str(cid), platform)
+                                    logger.info(f"[{platform}] Removed chat {cid} from database due to 'Chat not found' error")
+                                except Exception as db_error:
+                                    logger.error(f"[{platform}] Failed to remove chat {cid} from database: {db_error}")
+                            detailed_results[scope]['failed'] += 1
+                            total_failed += 1
+                            return
+                    else:
+                        logger.info(f"[{platform}] Forward failed, no content to send to {cid}")
+                        detailed_results[scope]['failed'] += 1
+                        total_failed += 1
+                        return
+
+            # Only text message
+            if text and not any([photo_path, video_path, document_path]):
+                try:
+                    if platform == 'ita':
+                        # ارسال پیام به ایتا
+                        success, message_id = await send_ita_message(cid, text)
+                        if success:
+                            all_sent_info.append((cid, message_id))  # ایتا message_id دارد
+                            detailed_results[scope]['sent'] += 1
+                            total_sent += 1
+                            logger.debug(f"[{platform}] Successfully sent text message to {cid} with message_id {message_id}. Total sent: {total_sent}")
+                            sent_msg = "success"  # برای ایتا، نشان‌دهنده موفقیت
                         else:
-                            sent_msg = await send_with_concurrency_control(
+                            raise Exception("Failed to send message to Ita")
+                    else:
+                        sent_msg = await send_with_concurrency_control(
                             semaphore,
-                            bot_instance.forward_message,
+                            bot_instance.send_message,
                             chat_id=cid,
-                            from_chat_id=forward_chat_id,
-                            message_id=forward_from_message_id,
+                            text=text,
+                            parse_mode=parse_mode_option,
                             disable_notification=True
                         )
-                        # Note: For forwarded messages, we don't send additional text
-                        # The forwarded message itself contains all the content
                         all_sent_info.append((cid, sent_msg.message_id))
                         detailed_results[scope]['sent'] += 1
                         total_sent += 1
-                        logger.info(f"[{platform}] Forwarding successful to {cid}, skipping media sending")
-                        continue
-                    except Exception as e:
-                        logger.error(f"Error forwarding message to {cid} from chat {forward_chat_id} message {forward_from_message_id}: {e}")
-                        # Handle "Chat not found" errors by removing the chat from database
-                        if "Chat not found" in str(e).lower():
-                            try:
-                                await delete_user_completely(str(cid), platform)
-                                logger.info(f"[{platform}] Removed chat {cid} from database due to 'Chat not found' error")
-                            except Exception as db_error:
-                                logger.error(f"[{platform}] Failed to remove chat {cid} from database: {db_error}")
-                            detailed_results[scope]['failed'] += 1
-                            total_failed += 1
-                            continue
-                        # If forwarding fails, try to send media with caption if available
-                        logger.debug(f"[{platform}] Forward failed, checking media and text: text='{text}', photo={bool(photo_path)}, video={bool(video_path)}, document={bool(document_path)}")
-                        if any([photo_path, video_path, document_path]):
-                            logger.info(f"[{platform}] Forward failed, attempting to send media with caption to {cid}")
-                            # Continue to media sending logic below instead of skipping
-                        elif text:
-                            logger.info(f"[{platform}] Forward failed, attempting to send text directly to {cid}")
-                            try:
-                                if platform == 'ita':
-                                    # برای ایتا از API مستقیم استفاده می‌کنیم
-                                    success, message_id = await send_ita_message(cid, text, parse_mode_option)
+                        logger.debug(f"[{platform}] Successfully sent text message to {cid}. Total sent: {total_sent}")
+                except Exception as e:
+                    logger.error(f"Failed to send text message to {cid}: {e}")
+                    # Handle "Chat not found" errors by removing the chat from database
+                    if "Chat not found" in str(e).lower():
+                        try:
+                            await delete_user_completely(str(cid), platform)
+                            logger.info(f"[{platform}] Removed chat {cid} from database due to 'Chat not found' error")
+                        except Exception as db_error:
+                            logger.error(f"[{platform}] Failed to remove chat {cid} from database: {db_error}")
+                    detailed_results[scope]['failed'] += 1
+                    total_failed += 1
+                    return
+
+            # Handle media with retry logic
+            if any([photo_path, video_path, document_path]):
+                logger.info(f"[{platform}] About to process media for {cid} - photo_path: {photo_path}, video_path: {video_path}, document_path: {document_path}")
+                    
+                # Note: Cross-platform file conversion is handled in the media sending sections below
+                    
+                max_retries = 2
+                for attempt in range(max_retries + 1):
+                    # Photo with optional caption
+                    if photo_path:
+                        try:
+                            if platform == 'ita':
+                                # تشخیص بهتر file_id vs file path برای ایتا
+                                is_file_id = isinstance(photo_path, str) and (
+                                    photo_path.startswith('BAAD') or  # Bale file_id
+                                    photo_path.startswith('AgAC') or  # Telegram photo file_id
+                                    photo_path.startswith('BAAH') or  # Telegram document file_id
+                                    photo_path.startswith('CAAH') or  # Telegram video file_id
+                                    (len(photo_path) > 20 and not os.path.exists(photo_path) and not photo_path.startswith('C:\\') and not photo_path.startswith('/') and not photo_path.startswith('C:\\Users\\'))  # Other file_ids (but not Windows/Unix paths)
+                                )
+                                is_local_file = isinstance(photo_path, str) and os.path.exists(photo_path) and not is_file_id
+                                is_url = isinstance(photo_path, str) and (photo_path.startswith('http://') or photo_path.startswith('https://'))
+                                logger.info(f"[{platform}] Photo path: {photo_path}, is_local_file: {is_local_file}, is_url: {is_url}")
+                                    
+                                # اگر فایل محلی است، مستقیماً ارسال کن
+                                if is_local_file:
+                                    logger.info(f"[{platform}] Sending photo (file) to {cid} (scope: {scope}). File: {photo_path}")
+                                    logger.info(f"[{platform}] Passing original_media_name to Ita: {original_media_name}")
+                                    success, message_id = await send_ita_file(cid, photo_path, text, "photo", original_media_name)
+                                    sent_msg = "success" if success else None
                                     if success:
                                         all_sent_info.append((cid, message_id))
                                         detailed_results[scope]['sent'] += 1
                                         total_sent += 1
-                                        logger.info(f"[{platform}] Successfully sent text message to {cid} after forward failure")
+                                        logger.info(f"[{platform}] Successfully sent photo to {cid}. Total sent: {total_sent}")
+                                        sent_msg = "success"
+                                        break
                                     else:
-                                        raise Exception("Failed to send text message to Ita")
+                                        logger.warning(f"[{platform}] Failed to send photo to {cid} (attempt {attempt + 1}/{max_retries + 1})")
+                                        if attempt < max_retries:
+                                            logger.info(f"[{platform}] Will retry sending photo to {cid}")
+                                        raise Exception("Failed to send photo to Ita")
                                 else:
-                                    sent_msg = await send_with_concurrency_control(
-                                        semaphore,
-                                        bot_instance.send_message,
-                                        chat_id=cid,
-                                        text=text,
-                                        parse_mode=parse_mode_option,
-                                        disable_notification=True
-                                    )
+                                    # ارسال عکس به ایتا (برای file_id یا URL)
+                                    logger.info(f"[{platform}] Attempting to send photo to {cid} (attempt {attempt + 1}/{max_retries + 1})")
+                                    logger.info(f"[{platform}] Passing original_media_name to Ita: {original_media_name}")
+                                    success, message_id = await send_ita_file(cid, photo_path, text, "photo", original_media_name)
+                                    sent_msg = "success" if success else None
+                                    if success:
+                                        all_sent_info.append((cid, message_id))  # ایتا message_id دارد
+                                        detailed_results[scope]['sent'] += 1
+                                        total_sent += 1
+                                        logger.info(f"[{platform}] Successfully sent photo to {cid}. Total sent: {total_sent}")
+                                        sent_msg = "success"  # برای ایتا، نشان‌دهنده موفقیت
+                                        break
+                                    else:
+                                        logger.warning(f"[{platform}] Failed to send photo to {cid} (attempt {attempt + 1}/{max_retries + 1})")
+                                        if attempt < max_retries:
+                                            logger.info(f"[{platform}] Will retry sending photo to {cid}")
+                                        raise Exception("Failed to send photo to Ita")
+                            else:
+                                # تشخیص ساده و دقیق فایل محلی برای تلگرام و بله
+                                is_local_file = os.path.exists(photo_path) if isinstance(photo_path, str) else False
+                                is_url = isinstance(photo_path, str) and photo_path.startswith(('http://', 'https://'))
+                                logger.info(f"[{platform}] Photo path: {photo_path}, is_local_file: {is_local_file}, is_url: {is_url}")
+                                    
+                                # اگر فایل به صورت محلی وجود دارد، مستقیماً ارسال شود
+                                if is_local_file:
+                                    logger.info(f"[{platform}] Sending photo (local file) to {cid}. File: {photo_path}")
+                                    sent_msg = await _send_media_once('photo', photo_path, cid, original_media_name or 'photo.jpg')
                                     all_sent_info.append((cid, sent_msg.message_id))
                                     detailed_results[scope]['sent'] += 1
                                     total_sent += 1
-                                    logger.info(f"[{platform}] Successfully sent text message to {cid} after forward failure")
-                                    continue
-                            except Exception as text_error:
-                                logger.error(f"Failed to send text message to {cid} after forward failure: {text_error}")
-                                # Handle "Chat not found" errors by removing the chat from database
-                                if "Chat not found" in str(text_error).lower():
-                                    try:
-                                        await delete_user_completely(str(cid), platform)
-                                        logger.info(f"[{platform}] Removed chat {cid} from database due to 'Chat not found' error")
-                                    except Exception as db_error:
-                                        logger.error(f"[{platform}] Failed to remove chat {cid} from database: {db_error}")
-                                detailed_results[scope]['failed'] += 1
-                                total_failed += 1
-                                continue
-                        else:
-                            logger.info(f"[{platform}] Forward failed, no content to send to {cid}")
-                            detailed_results[scope]['failed'] += 1
-                            total_failed += 1
-                            continue
-
-                # Only text message
-                if text and not any([photo_path, video_path, document_path]):
-                    try:
-                        if platform == 'ita':
-                            # ارسال پیام به ایتا
-                            success, message_id = await send_ita_message(cid, text)
-                            if success:
-                                all_sent_info.append((cid, message_id))  # ایتا message_id دارد
-                                detailed_results[scope]['sent'] += 1
-                                total_sent += 1
-                                logger.debug(f"[{platform}] Successfully sent text message to {cid} with message_id {message_id}. Total sent: {total_sent}")
-                                sent_msg = "success"  # برای ایتا، نشان‌دهنده موفقیت
-                            else:
-                                raise Exception("Failed to send message to Ita")
-                        else:
-                            sent_msg = await send_with_concurrency_control(
-                                semaphore,
-                                bot_instance.send_message,
-                                chat_id=cid,
-                                text=text,
-                                parse_mode=parse_mode_option,
-                                disable_notification=True
-                            )
-                            all_sent_info.append((cid, sent_msg.message_id))
-                            detailed_results[scope]['sent'] += 1
-                            total_sent += 1
-                            logger.debug(f"[{platform}] Successfully sent text message to {cid}. Total sent: {total_sent}")
-                    except Exception as e:
-                        logger.error(f"Failed to send text message to {cid}: {e}")
-                        # Handle "Chat not found" errors by removing the chat from database
-                        if "Chat not found" in str(e).lower():
-                            try:
-                                await delete_user_completely(str(cid), platform)
-                                logger.info(f"[{platform}] Removed chat {cid} from database due to 'Chat not found' error")
-                            except Exception as db_error:
-                                logger.error(f"[{platform}] Failed to remove chat {cid} from database: {db_error}")
-                        detailed_results[scope]['failed'] += 1
-                        total_failed += 1
-                        continue
-
-                # Handle media with retry logic
-                if any([photo_path, video_path, document_path]):
-                    logger.info(f"[{platform}] About to process media for {cid} - photo_path: {photo_path}, video_path: {video_path}, document_path: {document_path}")
-                    
-                    # Note: Cross-platform file conversion is handled in the media sending sections below
-                    
-                    max_retries = 2
-                    for attempt in range(max_retries + 1):
-                        # Photo with optional caption
-                        if photo_path:
-                            try:
-                                if platform == 'ita':
-                                    # تشخیص بهتر file_id vs file path برای ایتا
-                                    is_file_id = isinstance(photo_path, str) and (
-                                        photo_path.startswith('BAAD') or  # Bale file_id
-                                        photo_path.startswith('AgAC') or  # Telegram photo file_id
-                                        photo_path.startswith('BAAH') or  # Telegram document file_id
-                                        photo_path.startswith('CAAH') or  # Telegram video file_id
-                                        (len(photo_path) > 20 and not os.path.exists(photo_path) and not photo_path.startswith('C:\\') and not photo_path.startswith('/') and not photo_path.startswith('C:\\Users\\'))  # Other file_ids (but not Windows/Unix paths)
-                                    )
-                                    is_local_file = isinstance(photo_path, str) and os.path.exists(photo_path) and not is_file_id
-                                    is_url = isinstance(photo_path, str) and (photo_path.startswith('http://') or photo_path.startswith('https://'))
-                                    logger.info(f"[{platform}] Photo path: {photo_path}, is_local_file: {is_local_file}, is_url: {is_url}")
+                                    logger.info(f"[{platform}] Successfully sent photo to {cid}. Total sent: {total_sent}")
+                                    break
                                     
-                                    # اگر فایل محلی است، مستقیماً ارسال کن
-                                    if is_local_file:
-                                        logger.info(f"[{platform}] Sending photo (file) to {cid} (scope: {scope}). File: {photo_path}")
-                                        logger.info(f"[{platform}] Passing original_media_name to Ita: {original_media_name}")
-                                        success, message_id = await send_ita_file(cid, photo_path, text, "photo", original_media_name)
-                                        sent_msg = "success" if success else None
-                                        if success:
-                                            all_sent_info.append((cid, message_id))
-                                            detailed_results[scope]['sent'] += 1
-                                            total_sent += 1
-                                            logger.info(f"[{platform}] Successfully sent photo to {cid}. Total sent: {total_sent}")
-                                            sent_msg = "success"
-                                            break
-                                        else:
-                                            logger.warning(f"[{platform}] Failed to send photo to {cid} (attempt {attempt + 1}/{max_retries + 1})")
-                                            if attempt < max_retries:
-                                                logger.info(f"[{platform}] Will retry sending photo to {cid}")
-                                            raise Exception("Failed to send photo to Ita")
-                                    else:
-                                        # ارسال عکس به ایتا (برای file_id یا URL)
-                                        logger.info(f"[{platform}] Attempting to send photo to {cid} (attempt {attempt + 1}/{max_retries + 1})")
-                                        logger.info(f"[{platform}] Passing original_media_name to Ita: {original_media_name}")
-                                        success, message_id = await send_ita_file(cid, photo_path, text, "photo", original_media_name)
-                                        sent_msg = "success" if success else None
-                                        if success:
-                                            all_sent_info.append((cid, message_id))  # ایتا message_id دارد
+                                # اگر فایل محلی نیست و یک انتقال بین پلتفرمی است، آن را دانلود کن
+                                elif source_platform and source_platform != platform:
+                                    logger.info(f"[{platform}] Cross-platform photo detected. Downloading from {source_platform} for {cid}")
+                                    try:
+                                        # `photo_path` در اینجا همان file_id است
+                                        downloaded_photo_path = await download_file_to_temp(source_platform, photo_path, 'photo.jpg')
+                                        if downloaded_photo_path:
+                                            temp_files.append(downloaded_photo_path) # اضافه کردن به لیست پاکسازی
+                                            logger.info(f"[{platform}] Sending downloaded photo file to {cid}. File: {downloaded_photo_path}")
+                                            sent_msg = await _send_media_once('photo', downloaded_photo_path, cid, original_media_name or 'photo.jpg')
+                                            all_sent_info.append((cid, sent_msg.message_id))
                                             detailed_results[scope]['sent'] += 1
                                             total_sent += 1
-                                            logger.info(f"[{platform}] Successfully sent photo to {cid}. Total sent: {total_sent}")
-                                            sent_msg = "success"  # برای ایتا، نشان‌دهنده موفقیت
+                                            logger.info(f"[{platform}] Successfully sent downloaded photo to {cid}. Total sent: {total_sent}")
                                             break
                                         else:
-                                            logger.warning(f"[{platform}] Failed to send photo to {cid} (attempt {attempt + 1}/{max_retries + 1})")
-                                            if attempt < max_retries:
-                                                logger.info(f"[{platform}] Will retry sending photo to {cid}")
-                                            raise Exception("Failed to send photo to Ita")
+                                            raise Exception("Failed to download cross-platform photo")
+                                    except Exception as e:
+                                        logger.error(f"[{platform}] Error handling cross-platform photo for {cid}: {e}")
+                                        # به تلاش بعدی در حلقه retry ادامه بده یا شکست بخور
+                                        if attempt == max_retries:
+                                            raise e # اگر آخرین تلاش بود، خطا را نمایش بده
+                                        await asyncio.sleep(1) # قبل از تلاش مجدد صبر کن
+                                        continue # به تلاش بعدی برو
                                 else:
-                                    # تشخیص ساده و دقیق فایل محلی برای تلگرام و بله
-                                    is_local_file = os.path.exists(photo_path) if isinstance(photo_path, str) else False
-                                    is_url = isinstance(photo_path, str) and photo_path.startswith(('http://', 'https://'))
-                                    logger.info(f"[{platform}] Photo path: {photo_path}, is_local_file: {is_local_file}, is_url: {is_url}")
-                                    
-                                    # اگر فایل به صورت محلی وجود دارد، مستقیماً ارسال شود
-                                    if is_local_file:
-                                        logger.info(f"[{platform}] Sending photo (local file) to {cid}. File: {photo_path}")
-                                        with open(photo_path, 'rb') as photo_file:
-                                            sent_msg = await bot_instance.send_photo(
+                                    # در غیر این صورت، آن را به عنوان file_id یا URL ارسال کن
+                                    logger.info(f"[{platform}] Sending photo (id/url) to {cid}")
+                                    sent_msg = await send_with_concurrency_control(semaphore, bot_instance.send_photo,
                                                 chat_id=cid,
-                                                photo=InputFile(photo_file, filename=original_media_name or 'photo.jpg'),
+                                        photo=photo_path,
                                                 caption=text[:1024] if text else None,
-                                                parse_mode=parse_mode_option,
-                                                disable_notification=True
+                                            parse_mode=parse_mode_option,
+                                            disable_notification=True
+                                        )
+                                    all_sent_info.append((cid, sent_msg.message_id))
+                                    detailed_results[scope]['sent'] += 1
+                                    total_sent += 1
+                                    logger.info(f"[{platform}] Successfully sent photo to {cid}. Total sent: {total_sent}")
+                                    break
+                        except Exception as e:
+                            logger.error(f"[{platform}] Error sending photo to {cid}: {e}")
+                            if attempt == max_retries:
+                                raise e
+                            await asyncio.sleep(1)
+                            continue
+                        
+                    # اگر photo ارسال شد، به چت بعدی برو
+                    if sent_msg:
+                            continue
+
+                    # Video with optional caption
+                    if video_path:
+                        try:
+                            is_local_file = False
+                            if platform == 'ita':
+                                # تشخیص ساده و دقیق فایل محلی برای ایتا
+                                is_local_file = os.path.exists(video_path) if isinstance(video_path, str) else False
+                                is_url = isinstance(video_path, str) and video_path.startswith(('http://', 'https://'))
+                                logger.info(f"[{platform}] Video path: {video_path}, is_local_file: {is_local_file}, is_url: {is_url}")
+                            else:
+                                # کد مربوط به پلتفرم‌های دیگر
+                                is_local_file = os.path.exists(video_path) if isinstance(video_path, str) else False
+                                
+                                
+                            # اگر فایل محلی است، مستقیماً ارسال کن
+                            if is_local_file:
+                                logger.info(f"[{platform}] Sending video (file) to {cid} (scope: {scope}). File: {video_path}")
+                                if platform == 'ita':
+                                    success, message_id = await send_ita_file(cid, video_path, text, "video", original_media_name)
+                                    sent_msg = "success" if success else None
+                                else:
+                                    # برای تلگرام و بله از API خودشان استفاده کن
+                                    sent_msg = await _send_media_once('video', video_path, cid, original_media_name or 'video.mp4')
+                                    success, message_id = True, sent_msg.message_id
+                                if success:
+                                    all_sent_info.append((cid, message_id))
+                                    detailed_results[scope]['sent'] += 1
+                                    total_sent += 1
+                                    logger.info(f"[{platform}] Successfully sent video to {cid}. Total sent: {total_sent}")
+                                    sent_msg = "success"
+                                    break
+                                else:
+                                    logger.warning(f"[{platform}] Failed to send video to {cid} (attempt {attempt + 1}/{max_retries + 1})")
+                                    if attempt < max_retries:
+                                        logger.info(f"[{platform}] Will retry sending video to {cid}")
+                                    raise Exception("Failed to send video to Ita")
+                            else:
+                                # ارسال ویدیو (برای file_id یا URL)
+                                logger.info(f"[{platform}] Attempting to send video to {cid} (attempt {attempt + 1}/{max_retries + 1})")
+                                if platform == 'ita':
+                                    success, message_id = await send_ita_file(cid, video_path, text, "video", original_media_name)
+                                    sent_msg = "success" if success else None
+                                else:
+                                    # برای تلگرام و بله از API خودشان استفاده کن
+                                    with open(video_path, 'rb') as video_file:
+                                        if platform == 'telegram':
+                                            sent_msg = await telegram_app.bot.send_video(
+                                                chat_id=cid,
+                                                video=video_file,
+                                                caption=text,
+                                                parse_mode='HTML'
                                             )
+                                        elif platform == 'bale':
+                                            sent_msg = await bale_app.bot.send_video(
+                                                chat_id=cid,
+                                                video=video_file,
+                                                caption=text,
+                                                parse_mode='HTML'
+                                            )
+                                        success = sent_msg is not None
+                                        message_id = sent_msg.message_id if sent_msg else 0
+                                if success:
+                                    all_sent_info.append((cid, message_id))  # ایتا message_id دارد
+                                    detailed_results[scope]['sent'] += 1
+                                    total_sent += 1
+                                    logger.info(f"[{platform}] Successfully sent video to {cid}. Total sent: {total_sent}")
+                                    sent_msg = "success"  # برای ایتا، نشان‌دهنده موفقیت
+                                    break
+                                else:
+                                    logger.warning(f"[{platform}] Failed to send video to {cid} (attempt {attempt + 1}/{max_retries + 1})")
+                                    if attempt < max_retries:
+                                        logger.info(f"[{platform}] Will retry sending video to {cid}")
+                                    raise Exception("Failed to send video to Ita")
+                                
+                            # اگر فایل به صورت محلی وجود دارد، مستقیماً ارسال شود
+                            if is_local_file:
+                                logger.info(f"[{platform}] Sending video (local file) to {cid}. File: {video_path}")
+                                sent_msg = await _send_media_once('video', video_path, cid, original_media_name or 'video.mp4')
+                                all_sent_info.append((cid, sent_msg.message_id))
+                                detailed_results[scope]['sent'] += 1
+                                total_sent += 1
+                                logger.info(f"[{platform}] Successfully sent video to {cid}. Total sent: {total_sent}")
+                                break
+                                    
+                            # اگر فایل محلی نیست و یک انتقال بین پلتفرمی است، آن را دانلود کن
+                            elif source_platform and source_platform != platform:
+                                logger.info(f"[{platform}] Cross-platform video detected. Downloading from {source_platform} for {cid}")
+                                try:
+                                    # `video_path` در اینجا همان file_id است
+                                    downloaded_video_path = await download_file_to_temp(source_platform, video_path, 'video.mp4')
+                                    if downloaded_video_path:
+                                        temp_files.append(downloaded_video_path) # اضافه کردن به لیست پاکسازی
+                                        logger.info(f"[{platform}] Sending downloaded video file to {cid}. File: {downloaded_video_path}")
+                                        sent_msg = await _send_media_once('video', downloaded_video_path, cid, original_media_name or 'video.mp4')
                                         all_sent_info.append((cid, sent_msg.message_id))
                                         detailed_results[scope]['sent'] += 1
                                         total_sent += 1
-                                        logger.info(f"[{platform}] Successfully sent photo to {cid}. Total sent: {total_sent}")
+                                        logger.info(f"[{platform}] Successfully sent downloaded video to {cid}. Total sent: {total_sent}")
                                         break
-                                    
-                                    # اگر فایل محلی نیست و یک انتقال بین پلتفرمی است، آن را دانلود کن
-                                    elif source_platform and source_platform != platform:
-                                        logger.info(f"[{platform}] Cross-platform photo detected. Downloading from {source_platform} for {cid}")
-                                        try:
-                                            # `photo_path` در اینجا همان file_id است
-                                            downloaded_photo_path = await download_file_to_temp(source_platform, photo_path, 'photo.jpg')
-                                            if downloaded_photo_path:
-                                                temp_files.append(downloaded_photo_path) # اضافه کردن به لیست پاکسازی
-                                                logger.info(f"[{platform}] Sending downloaded photo file to {cid}. File: {downloaded_photo_path}")
-                                                with open(downloaded_photo_path, 'rb') as photo_file:
-                                                    sent_msg = await bot_instance.send_photo(
+                                    else:
+                                        raise Exception("Failed to download cross-platform video")
+                                except Exception as e:
+                                    logger.error(f"[{platform}] Error handling cross-platform video for {cid}: {e}")
+                                    # به تلاش بعدی در حلقه retry ادامه بده یا شکست بخور
+                                    if attempt == max_retries:
+                                        raise e # اگر آخرین تلاش بود، خطا را نمایش بده
+                                    await asyncio.sleep(1) # قبل از تلاش مجدد صبر کن
+                                    continue # به تلاش بعدی برو
+                                else:
+                                    # در غیر این صورت، آن را به عنوان file_id یا URL ارسال کن
+                                    logger.info(f"[{platform}] Sending video (id/url) to {cid}")
+                                    sent_msg = await send_with_concurrency_control(semaphore, bot_instance.send_video,
                                         chat_id=cid,
-                                                        photo=InputFile(photo_file, filename=original_media_name or 'photo.jpg'),
+                                        video=video_path,
                                         caption=text[:1024] if text else None,
                                         parse_mode=parse_mode_option,
                                         disable_notification=True
                                     )
-                                                    all_sent_info.append((cid, sent_msg.message_id))
-                                                    detailed_results[scope]['sent'] += 1
-                                                    total_sent += 1
-                                                    logger.info(f"[{platform}] Successfully sent downloaded photo to {cid}. Total sent: {total_sent}")
-                                                    break
-                                            else:
-                                                raise Exception("Failed to download cross-platform photo")
-                                        except Exception as e:
-                                            logger.error(f"[{platform}] Error handling cross-platform photo for {cid}: {e}")
-                                            # به تلاش بعدی در حلقه retry ادامه بده یا شکست بخور
-                                            if attempt == max_retries:
-                                                raise e # اگر آخرین تلاش بود، خطا را نمایش بده
-                                            await asyncio.sleep(1) # قبل از تلاش مجدد صبر کن
-                                            continue # به تلاش بعدی برو
-                                    else:
-                                        # در غیر این صورت، آن را به عنوان file_id یا URL ارسال کن
-                                        logger.info(f"[{platform}] Sending photo (id/url) to {cid}")
-                                        sent_msg = await bot_instance.send_photo(
-                                                    chat_id=cid,
-                                            photo=photo_path,
-                                                    caption=text[:1024] if text else None,
-                                                parse_mode=parse_mode_option,
-                                                disable_notification=True
-                                            )
-                                        all_sent_info.append((cid, sent_msg.message_id))
+                                    all_sent_info.append((cid, sent_msg.message_id))
+                                    detailed_results[scope]['sent'] += 1
+                                    total_sent += 1
+                                    logger.info(f"[{platform}] Successfully sent video to {cid}. Total sent: {total_sent}")
+                                    break
+                        except Exception as e:
+                            logger.error(f"[{platform}] Error sending video to {cid}: {e}")
+                            if attempt == max_retries:
+                                raise e
+                            await asyncio.sleep(1)
+                            continue
+                        
+                    # اگر video ارسال شد، به چت بعدی برو
+                    if sent_msg:
+                            continue
+
+                    # Document with optional caption
+                    if document_path:
+                        try:
+                            is_local_file = False
+                            if platform == 'ita':
+                                # تشخیص ساده و دقیق فایل محلی برای ایتا
+                                is_local_file = os.path.exists(document_path) if isinstance(document_path, str) else False
+                                is_url = isinstance(document_path, str) and document_path.startswith(('http://', 'https://'))
+                                logger.info(f"[{platform}] Document path: {document_path}, is_local_file: {is_local_file}, is_url: {is_url}")
+                                    
+                                # اگر فایل محلی است، مستقیماً ارسال کن
+                                if is_local_file:
+                                    logger.info(f"[{platform}] Sending document (file) to {cid} (scope: {scope}). File: {document_path}")
+                                    logger.info(f"[{platform}] Passing original_media_name to Ita: {original_media_name}")
+                                    logger.info(f"[{platform}] About to call send_ita_file with: cid={cid}, document_path={document_path}, text={text}, file_type=document, original_media_name={original_media_name}")
+                                    success, message_id = await send_ita_file(cid, document_path, text, "document", original_media_name)
+                                    logger.info(f"[{platform}] send_ita_file returned: success={success}, message_id={message_id}")
+                                    sent_msg = "success" if success else None
+                                    logger.info(f"[{platform}] sent_msg set to: {sent_msg}")
+                                        
+                                    if success:
+                                        all_sent_info.append((cid, message_id))
                                         detailed_results[scope]['sent'] += 1
                                         total_sent += 1
-                                        logger.info(f"[{platform}] Successfully sent photo to {cid}. Total sent: {total_sent}")
+                                        logger.info(f"[{platform}] Successfully sent document to {cid}. Total sent: {total_sent}")
+                                        sent_msg = "success"
                                         break
-                            except Exception as e:
-                                logger.error(f"[{platform}] Error sending photo to {cid}: {e}")
-                                if attempt == max_retries:
-                                    raise e
-                                await asyncio.sleep(1)
-                                continue
-                        
-                        # اگر photo ارسال شد، به چت بعدی برو
-                        if sent_msg:
-                                continue
-
-                        # Video with optional caption
-                        if video_path:
-                            try:
-                                is_local_file = False
-                                if platform == 'ita':
-                                    # تشخیص ساده و دقیق فایل محلی برای ایتا
-                                    is_local_file = os.path.exists(video_path) if isinstance(video_path, str) else False
-                                    is_url = isinstance(video_path, str) and video_path.startswith(('http://', 'https://'))
-                                    logger.info(f"[{platform}] Video path: {video_path}, is_local_file: {is_local_file}, is_url: {is_url}")
+                                    else:
+                                        logger.warning(f"[{platform}] Failed to send document to {cid} (attempt {attempt + 1}/{max_retries + 1})")
+                                        if attempt < max_retries:
+                                            logger.info(f"[{platform}] Will retry sending document to {cid}")
+                                        raise Exception("Failed to send document to Ita")
                                 else:
-                                    # کد مربوط به پلتفرم‌های دیگر
-                                    is_local_file = os.path.exists(video_path) if isinstance(video_path, str) else False
-                                
-                                
+                                    # ارسال فایل (برای file_id یا URL)
+                                    logger.info(f"[{platform}] Attempting to send document to {cid} (attempt {attempt + 1}/{max_retries + 1})")
+                                    logger.info(f"[{platform}] Passing original_media_name to Ita: {original_media_name}")
+                                    success, message_id = await send_ita_file(cid, document_path, text, "document", original_media_name)
+                                    sent_msg = "success" if success else None
+                                        
+                                    if success:
+                                        all_sent_info.append((cid, message_id))
+                                        detailed_results[scope]['sent'] += 1
+                                        total_sent += 1
+                                        logger.info(f"[{platform}] Successfully sent document to {cid}. Total sent: {total_sent}")
+                                        sent_msg = "success"
+                                        break
+                                    else:
+                                        logger.warning(f"[{platform}] Failed to send document to {cid} (attempt {attempt + 1}/{max_retries + 1})")
+                                        if attempt < max_retries:
+                                            logger.info(f"[{platform}] Will retry sending document to {cid}")
+                                        raise Exception("Failed to send document to Ita")
+                            else:
+                                # کد مربوط به پلتفرم‌های دیگر
+                                is_local_file = os.path.exists(document_path) if isinstance(document_path, str) else False
+                                logger.info(f"[{platform}] DEBUG: document_path={document_path}, is_local_file={is_local_file}")
+                                    
                                 # اگر فایل محلی است، مستقیماً ارسال کن
                                 if is_local_file:
-                                    logger.info(f"[{platform}] Sending video (file) to {cid} (scope: {scope}). File: {video_path}")
+                                    logger.info(f"[{platform}] Sending document (file) to {cid} (scope: {scope}). File: {document_path}")
+                                    logger.info(f"[{platform}] DEBUG: platform value is '{platform}', checking if platform == 'ita': {platform == 'ita'}")
                                     if platform == 'ita':
-                                        success, message_id = await send_ita_file(cid, video_path, text, "video", original_media_name)
+                                        logger.info(f"[{platform}] Passing original_media_name to Ita: {original_media_name}")
+                                        logger.info(f"[{platform}] About to call send_ita_file with: cid={cid}, document_path={document_path}, text={text}, file_type=document, original_media_name={original_media_name}")
+                                        success, message_id = await send_ita_file(cid, document_path, text, "document", original_media_name)
+                                        logger.info(f"[{platform}] send_ita_file returned: success={success}, message_id={message_id}")
                                         sent_msg = "success" if success else None
+                                        logger.info(f"[{platform}] sent_msg set to: {sent_msg}")
                                     else:
                                         # برای تلگرام و بله از API خودشان استفاده کن
-                                        with open(video_path, 'rb') as video_file:
-                                            sent_msg = await bot_instance.send_video(
-                                                chat_id=cid,
-                                                video=InputFile(video_file, filename=original_media_name or 'video.mp4'),
-                                                caption=text[:1024] if text else None,
-                                                parse_mode=parse_mode_option,
-                                                disable_notification=True
-                                            )
+                                        # حذف پیشوند mbot_platform_ از نام فایل برای نمایش بهتر
+                                        display_filename = original_media_name
+                                        if display_filename and display_filename.startswith(('mbot_telegram_', 'mbot_bale_', 'mbot_ita_')):
+                                            # استخراج نام فایل اصلی بعد از آخرین _
+                                            parts = display_filename.split('_')
+                                            if len(parts) > 3:
+                                                # فرمت: mbot_platform_type_hash_originalname.ext
+                                                display_filename = '_'.join(parts[4:])
+                                                logger.info(f"[{platform}] Cleaned filename from {original_media_name} to {display_filename}")
+                                            
+                                        logger.info(f"[{platform}] Sending document with filename: {display_filename or 'document'}")
+                                        sent_msg = await _send_media_once('document', document_path, cid, display_filename or 'document')
                                         success, message_id = True, sent_msg.message_id
                                     if success:
                                         all_sent_info.append((cid, message_id))
                                         detailed_results[scope]['sent'] += 1
                                         total_sent += 1
-                                        logger.info(f"[{platform}] Successfully sent video to {cid}. Total sent: {total_sent}")
+                                        logger.info(f"[{platform}] Successfully sent document to {cid}. Total sent: {total_sent}")
                                         sent_msg = "success"
                                         break
                                     else:
-                                        logger.warning(f"[{platform}] Failed to send video to {cid} (attempt {attempt + 1}/{max_retries + 1})")
+                                        logger.warning(f"[{platform}] Failed to send document to {cid} (attempt {attempt + 1}/{max_retries + 1})")
                                         if attempt < max_retries:
-                                            logger.info(f"[{platform}] Will retry sending video to {cid}")
-                                        raise Exception("Failed to send video to Ita")
+                                            logger.info(f"[{platform}] Will retry sending document to {cid}")
+                                        raise Exception("Failed to send document to Ita")
                                 else:
-                                    # ارسال ویدیو (برای file_id یا URL)
-                                    logger.info(f"[{platform}] Attempting to send video to {cid} (attempt {attempt + 1}/{max_retries + 1})")
+                                    # ارسال فایل (برای file_id یا URL)
+                                    logger.info(f"[{platform}] Attempting to send document to {cid} (attempt {attempt + 1}/{max_retries + 1})")
                                     if platform == 'ita':
-                                        success, message_id = await send_ita_file(cid, video_path, text, "video", original_media_name)
+                                        logger.info(f"[{platform}] Passing original_media_name to Ita: {original_media_name}")
+                                        success, message_id = await send_ita_file(cid, document_path, text, "document", original_media_name)
                                         sent_msg = "success" if success else None
                                     else:
                                         # برای تلگرام و بله از API خودشان استفاده کن
-                                        with open(video_path, 'rb') as video_file:
+                                        with open(document_path, 'rb') as document_file:
                                             if platform == 'telegram':
-                                                sent_msg = await telegram_app.bot.send_video(
+                                                sent_msg = await telegram_app.bot.send_document(
                                                     chat_id=cid,
-                                                    video=video_file,
+                                                    document=document_file,
                                                     caption=text,
                                                     parse_mode='HTML'
                                                 )
                                             elif platform == 'bale':
-                                                sent_msg = await bale_app.bot.send_video(
+                                                sent_msg = await bale_app.bot.send_document(
                                                     chat_id=cid,
-                                                    video=video_file,
+                                                    document=document_file,
                                                     caption=text,
                                                     parse_mode='HTML'
                                                 )
@@ -5523,58 +7048,49 @@ async def perform_broadcast_async(app: TelegramApplication, scopes: List[str], p
                                         all_sent_info.append((cid, message_id))  # ایتا message_id دارد
                                         detailed_results[scope]['sent'] += 1
                                         total_sent += 1
-                                        logger.info(f"[{platform}] Successfully sent video to {cid}. Total sent: {total_sent}")
+                                        logger.info(f"[{platform}] Successfully sent document to {cid}. Total sent: {total_sent}")
                                         sent_msg = "success"  # برای ایتا، نشان‌دهنده موفقیت
                                         break
                                     else:
-                                        logger.warning(f"[{platform}] Failed to send video to {cid} (attempt {attempt + 1}/{max_retries + 1})")
+                                        logger.warning(f"[{platform}] Failed to send document to {cid} (attempt {attempt + 1}/{max_retries + 1})")
                                         if attempt < max_retries:
-                                            logger.info(f"[{platform}] Will retry sending video to {cid}")
-                                        raise Exception("Failed to send video to Ita")
-                                
+                                            logger.info(f"[{platform}] Will retry sending document to {cid}")
+                                        raise Exception("Failed to send document to Ita")
+                                            
+                                # تشخیص ساده و دقیق فایل محلی برای تلگرام و بله
+                                is_local_file = os.path.exists(document_path) if isinstance(document_path, str) else False
+                                is_url = isinstance(document_path, str) and document_path.startswith(('http://', 'https://'))
+                                logger.info(f"[{platform}] Document path: {document_path}, is_local_file: {is_local_file}, is_url: {is_url}")
+                                    
                                 # اگر فایل به صورت محلی وجود دارد، مستقیماً ارسال شود
                                 if is_local_file:
-                                    logger.info(f"[{platform}] Sending video (local file) to {cid}. File: {video_path}")
-                                    with open(video_path, 'rb') as video_file:
-                                        sent_msg = await bot_instance.send_video(
-                                            chat_id=cid,
-                                            video=InputFile(video_file, filename=original_media_name or 'video.mp4'),
-                                            caption=text[:1024] if text else None,
-                                            parse_mode=parse_mode_option,
-                                            disable_notification=True
-                                        )
+                                    logger.info(f"[{platform}] Sending document (local file) to {cid}. File: {document_path}")
+                                    sent_msg = await _send_media_once('document', document_path, cid, original_media_name or os.path.basename(document_path))
                                     all_sent_info.append((cid, sent_msg.message_id))
                                     detailed_results[scope]['sent'] += 1
                                     total_sent += 1
-                                    logger.info(f"[{platform}] Successfully sent video to {cid}. Total sent: {total_sent}")
+                                    logger.info(f"[{platform}] Successfully sent document to {cid}. Total sent: {total_sent}")
                                     break
                                     
                                 # اگر فایل محلی نیست و یک انتقال بین پلتفرمی است، آن را دانلود کن
                                 elif source_platform and source_platform != platform:
-                                    logger.info(f"[{platform}] Cross-platform video detected. Downloading from {source_platform} for {cid}")
+                                    logger.info(f"[{platform}] Cross-platform document detected. Downloading from {source_platform} for {cid}")
                                     try:
-                                        # `video_path` در اینجا همان file_id است
-                                        downloaded_video_path = await download_file_to_temp(source_platform, video_path, 'video.mp4')
-                                        if downloaded_video_path:
-                                            temp_files.append(downloaded_video_path) # اضافه کردن به لیست پاکسازی
-                                            logger.info(f"[{platform}] Sending downloaded video file to {cid}. File: {downloaded_video_path}")
-                                            with open(downloaded_video_path, 'rb') as video_file:
-                                                sent_msg = await bot_instance.send_video(
-                                                    chat_id=cid,
-                                                    video=InputFile(video_file, filename=original_media_name or 'video.mp4'),
-                                                    caption=text[:1024] if text else None,
-                                                    parse_mode=parse_mode_option,
-                                                    disable_notification=True
-                                                )
+                                        # `document_path` در اینجا همان file_id است
+                                        downloaded_document_path = await download_file_to_temp(source_platform, document_path, 'document')
+                                        if downloaded_document_path:
+                                            temp_files.append(downloaded_document_path) # اضافه کردن به لیست پاکسازی
+                                            logger.info(f"[{platform}] Sending downloaded document file to {cid}. File: {downloaded_document_path}")
+                                            sent_msg = await _send_media_once('document', downloaded_document_path, cid, original_media_name or os.path.basename(downloaded_document_path))
                                             all_sent_info.append((cid, sent_msg.message_id))
                                             detailed_results[scope]['sent'] += 1
                                             total_sent += 1
-                                            logger.info(f"[{platform}] Successfully sent downloaded video to {cid}. Total sent: {total_sent}")
+                                            logger.info(f"[{platform}] Successfully sent downloaded document to {cid}. Total sent: {total_sent}")
                                             break
                                         else:
-                                            raise Exception("Failed to download cross-platform video")
+                                            raise Exception("Failed to download cross-platform document")
                                     except Exception as e:
-                                        logger.error(f"[{platform}] Error handling cross-platform video for {cid}: {e}")
+                                        logger.error(f"[{platform}] Error handling cross-platform document for {cid}: {e}")
                                         # به تلاش بعدی در حلقه retry ادامه بده یا شکست بخور
                                         if attempt == max_retries:
                                             raise e # اگر آخرین تلاش بود، خطا را نمایش بده
@@ -5582,10 +7098,10 @@ async def perform_broadcast_async(app: TelegramApplication, scopes: List[str], p
                                         continue # به تلاش بعدی برو
                                     else:
                                         # در غیر این صورت، آن را به عنوان file_id یا URL ارسال کن
-                                        logger.info(f"[{platform}] Sending video (id/url) to {cid}")
-                                        sent_msg = await bot_instance.send_video(
+                                        logger.info(f"[{platform}] Sending document (id/url) to {cid}")
+                                        sent_msg = await send_with_concurrency_control(semaphore, bot_instance.send_document,
                                             chat_id=cid,
-                                            video=video_path,
+                                            document=document_path,
                                             caption=text[:1024] if text else None,
                                             parse_mode=parse_mode_option,
                                             disable_notification=True
@@ -5593,313 +7109,131 @@ async def perform_broadcast_async(app: TelegramApplication, scopes: List[str], p
                                         all_sent_info.append((cid, sent_msg.message_id))
                                         detailed_results[scope]['sent'] += 1
                                         total_sent += 1
-                                        logger.info(f"[{platform}] Successfully sent video to {cid}. Total sent: {total_sent}")
-                                        break
-                            except Exception as e:
-                                logger.error(f"[{platform}] Error sending video to {cid}: {e}")
-                                if attempt == max_retries:
-                                    raise e
-                                await asyncio.sleep(1)
-                                continue
-                        
-                        # اگر video ارسال شد، به چت بعدی برو
-                        if sent_msg:
-                                continue
-
-                        # Document with optional caption
-                        if document_path:
-                            try:
-                                is_local_file = False
-                                if platform == 'ita':
-                                    # تشخیص ساده و دقیق فایل محلی برای ایتا
-                                    is_local_file = os.path.exists(document_path) if isinstance(document_path, str) else False
-                                    is_url = isinstance(document_path, str) and document_path.startswith(('http://', 'https://'))
-                                    logger.info(f"[{platform}] Document path: {document_path}, is_local_file: {is_local_file}, is_url: {is_url}")
-                                    
-                                    # اگر فایل محلی است، مستقیماً ارسال کن
-                                    if is_local_file:
-                                        logger.info(f"[{platform}] Sending document (file) to {cid} (scope: {scope}). File: {document_path}")
-                                        logger.info(f"[{platform}] Passing original_media_name to Ita: {original_media_name}")
-                                        logger.info(f"[{platform}] About to call send_ita_file with: cid={cid}, document_path={document_path}, text={text}, file_type=document, original_media_name={original_media_name}")
-                                        success, message_id = await send_ita_file(cid, document_path, text, "document", original_media_name)
-                                        logger.info(f"[{platform}] send_ita_file returned: success={success}, message_id={message_id}")
-                                        sent_msg = "success" if success else None
-                                        logger.info(f"[{platform}] sent_msg set to: {sent_msg}")
-                                        
-                                        if success:
-                                            all_sent_info.append((cid, message_id))
-                                            detailed_results[scope]['sent'] += 1
-                                            total_sent += 1
-                                            logger.info(f"[{platform}] Successfully sent document to {cid}. Total sent: {total_sent}")
-                                            sent_msg = "success"
-                                            break
-                                        else:
-                                            logger.warning(f"[{platform}] Failed to send document to {cid} (attempt {attempt + 1}/{max_retries + 1})")
-                                            if attempt < max_retries:
-                                                logger.info(f"[{platform}] Will retry sending document to {cid}")
-                                            raise Exception("Failed to send document to Ita")
-                                    else:
-                                        # ارسال فایل (برای file_id یا URL)
-                                        logger.info(f"[{platform}] Attempting to send document to {cid} (attempt {attempt + 1}/{max_retries + 1})")
-                                        logger.info(f"[{platform}] Passing original_media_name to Ita: {original_media_name}")
-                                        success, message_id = await send_ita_file(cid, document_path, text, "document", original_media_name)
-                                        sent_msg = "success" if success else None
-                                        
-                                        if success:
-                                            all_sent_info.append((cid, message_id))
-                                            detailed_results[scope]['sent'] += 1
-                                            total_sent += 1
-                                            logger.info(f"[{platform}] Successfully sent document to {cid}. Total sent: {total_sent}")
-                                            sent_msg = "success"
-                                            break
-                                        else:
-                                            logger.warning(f"[{platform}] Failed to send document to {cid} (attempt {attempt + 1}/{max_retries + 1})")
-                                            if attempt < max_retries:
-                                                logger.info(f"[{platform}] Will retry sending document to {cid}")
-                                            raise Exception("Failed to send document to Ita")
-                                else:
-                                    # کد مربوط به پلتفرم‌های دیگر
-                                    is_local_file = os.path.exists(document_path) if isinstance(document_path, str) else False
-                                    logger.info(f"[{platform}] DEBUG: document_path={document_path}, is_local_file={is_local_file}")
-                                    
-                                    # اگر فایل محلی است، مستقیماً ارسال کن
-                                    if is_local_file:
-                                        logger.info(f"[{platform}] Sending document (file) to {cid} (scope: {scope}). File: {document_path}")
-                                        logger.info(f"[{platform}] DEBUG: platform value is '{platform}', checking if platform == 'ita': {platform == 'ita'}")
-                                        if platform == 'ita':
-                                            logger.info(f"[{platform}] Passing original_media_name to Ita: {original_media_name}")
-                                            logger.info(f"[{platform}] About to call send_ita_file with: cid={cid}, document_path={document_path}, text={text}, file_type=document, original_media_name={original_media_name}")
-                                            success, message_id = await send_ita_file(cid, document_path, text, "document", original_media_name)
-                                            logger.info(f"[{platform}] send_ita_file returned: success={success}, message_id={message_id}")
-                                            sent_msg = "success" if success else None
-                                            logger.info(f"[{platform}] sent_msg set to: {sent_msg}")
-                                        else:
-                                            # برای تلگرام و بله از API خودشان استفاده کن
-                                            # حذف پیشوند mbot_platform_ از نام فایل برای نمایش بهتر
-                                            display_filename = original_media_name
-                                            if display_filename and display_filename.startswith(('mbot_telegram_', 'mbot_bale_', 'mbot_ita_')):
-                                                # استخراج نام فایل اصلی بعد از آخرین _
-                                                parts = display_filename.split('_')
-                                                if len(parts) > 3:
-                                                    # فرمت: mbot_platform_type_hash_originalname.ext
-                                                    display_filename = '_'.join(parts[4:])
-                                                    logger.info(f"[{platform}] Cleaned filename from {original_media_name} to {display_filename}")
-                                            
-                                            logger.info(f"[{platform}] Sending document with filename: {display_filename or 'document'}")
-                                            with open(document_path, 'rb') as document_file:
-                                                sent_msg = await bot_instance.send_document(
-                                                    chat_id=cid,
-                                                    document=InputFile(document_file, filename=display_filename or 'document'),
-                                                    caption=text[:1024] if text else None,
-                                                    parse_mode=parse_mode_option,
-                                                    disable_notification=True
-                                                )
-                                            success, message_id = True, sent_msg.message_id
-                                        if success:
-                                            all_sent_info.append((cid, message_id))
-                                            detailed_results[scope]['sent'] += 1
-                                            total_sent += 1
-                                            logger.info(f"[{platform}] Successfully sent document to {cid}. Total sent: {total_sent}")
-                                            sent_msg = "success"
-                                            break
-                                        else:
-                                            logger.warning(f"[{platform}] Failed to send document to {cid} (attempt {attempt + 1}/{max_retries + 1})")
-                                            if attempt < max_retries:
-                                                logger.info(f"[{platform}] Will retry sending document to {cid}")
-                                            raise Exception("Failed to send document to Ita")
-                                    else:
-                                        # ارسال فایل (برای file_id یا URL)
-                                        logger.info(f"[{platform}] Attempting to send document to {cid} (attempt {attempt + 1}/{max_retries + 1})")
-                                        if platform == 'ita':
-                                            logger.info(f"[{platform}] Passing original_media_name to Ita: {original_media_name}")
-                                            success, message_id = await send_ita_file(cid, document_path, text, "document", original_media_name)
-                                            sent_msg = "success" if success else None
-                                        else:
-                                            # برای تلگرام و بله از API خودشان استفاده کن
-                                            with open(document_path, 'rb') as document_file:
-                                                if platform == 'telegram':
-                                                    sent_msg = await telegram_app.bot.send_document(
-                                                        chat_id=cid,
-                                                        document=document_file,
-                                                        caption=text,
-                                                        parse_mode='HTML'
-                                                    )
-                                                elif platform == 'bale':
-                                                    sent_msg = await bale_app.bot.send_document(
-                                                        chat_id=cid,
-                                                        document=document_file,
-                                                        caption=text,
-                                                        parse_mode='HTML'
-                                                    )
-                                                success = sent_msg is not None
-                                                message_id = sent_msg.message_id if sent_msg else 0
-                                        if success:
-                                            all_sent_info.append((cid, message_id))  # ایتا message_id دارد
-                                            detailed_results[scope]['sent'] += 1
-                                            total_sent += 1
-                                            logger.info(f"[{platform}] Successfully sent document to {cid}. Total sent: {total_sent}")
-                                            sent_msg = "success"  # برای ایتا، نشان‌دهنده موفقیت
-                                            break
-                                        else:
-                                            logger.warning(f"[{platform}] Failed to send document to {cid} (attempt {attempt + 1}/{max_retries + 1})")
-                                            if attempt < max_retries:
-                                                logger.info(f"[{platform}] Will retry sending document to {cid}")
-                                            raise Exception("Failed to send document to Ita")
-                                            
-                                    # تشخیص ساده و دقیق فایل محلی برای تلگرام و بله
-                                    is_local_file = os.path.exists(document_path) if isinstance(document_path, str) else False
-                                    is_url = isinstance(document_path, str) and document_path.startswith(('http://', 'https://'))
-                                    logger.info(f"[{platform}] Document path: {document_path}, is_local_file: {is_local_file}, is_url: {is_url}")
-                                    
-                                    # اگر فایل به صورت محلی وجود دارد، مستقیماً ارسال شود
-                                    if is_local_file:
-                                        logger.info(f"[{platform}] Sending document (local file) to {cid}. File: {document_path}")
-                                        with open(document_path, 'rb') as document_file:
-                                            sent_msg = await bot_instance.send_document(
-                                                chat_id=cid,
-                                                document=InputFile(document_file, filename=original_media_name or os.path.basename(document_path)),
-                                                caption=text[:1024] if text else None,
-                                                parse_mode=parse_mode_option,
-                                                disable_notification=True
-                                            )
-                                        all_sent_info.append((cid, sent_msg.message_id))
-                                        detailed_results[scope]['sent'] += 1
-                                        total_sent += 1
                                         logger.info(f"[{platform}] Successfully sent document to {cid}. Total sent: {total_sent}")
                                         break
-                                    
-                                    # اگر فایل محلی نیست و یک انتقال بین پلتفرمی است، آن را دانلود کن
-                                    elif source_platform and source_platform != platform:
-                                        logger.info(f"[{platform}] Cross-platform document detected. Downloading from {source_platform} for {cid}")
-                                        try:
-                                            # `document_path` در اینجا همان file_id است
-                                            downloaded_document_path = await download_file_to_temp(source_platform, document_path, 'document')
-                                            if downloaded_document_path:
-                                                temp_files.append(downloaded_document_path) # اضافه کردن به لیست پاکسازی
-                                                logger.info(f"[{platform}] Sending downloaded document file to {cid}. File: {downloaded_document_path}")
-                                                with open(downloaded_document_path, 'rb') as document_file:
-                                                    sent_msg = await bot_instance.send_document(
-                                                        chat_id=cid,
-                                                        document=InputFile(document_file, filename=original_media_name or os.path.basename(downloaded_document_path)),
-                                                        caption=text[:1024] if text else None,
-                                                        parse_mode=parse_mode_option,
-                                                        disable_notification=True
-                                                    )
-                                                all_sent_info.append((cid, sent_msg.message_id))
-                                                detailed_results[scope]['sent'] += 1
-                                                total_sent += 1
-                                                logger.info(f"[{platform}] Successfully sent downloaded document to {cid}. Total sent: {total_sent}")
-                                                break
-                                            else:
-                                                raise Exception("Failed to download cross-platform document")
-                                        except Exception as e:
-                                            logger.error(f"[{platform}] Error handling cross-platform document for {cid}: {e}")
-                                            # به تلاش بعدی در حلقه retry ادامه بده یا شکست بخور
-                                            if attempt == max_retries:
-                                                raise e # اگر آخرین تلاش بود، خطا را نمایش بده
-                                            await asyncio.sleep(1) # قبل از تلاش مجدد صبر کن
-                                            continue # به تلاش بعدی برو
-                                        else:
-                                            # در غیر این صورت، آن را به عنوان file_id یا URL ارسال کن
-                                            logger.info(f"[{platform}] Sending document (id/url) to {cid}")
-                                            sent_msg = await bot_instance.send_document(
-                                                chat_id=cid,
-                                                document=document_path,
-                                                caption=text[:1024] if text else None,
-                                                parse_mode=parse_mode_option,
-                                                disable_notification=True
-                                            )
-                                            all_sent_info.append((cid, sent_msg.message_id))
-                                            detailed_results[scope]['sent'] += 1
-                                            total_sent += 1
-                                            logger.info(f"[{platform}] Successfully sent document to {cid}. Total sent: {total_sent}")
-                                            break
-                            except Exception as e:
-                                logger.error(f"[{platform}] Error sending document to {cid}: {e}")
-                                if attempt == max_retries:
-                                    raise e
-                                await asyncio.sleep(1)
-                                continue
+                        except Exception as e:
+                            logger.error(f"[{platform}] Error sending document to {cid}: {e}")
+                            if attempt == max_retries:
+                                raise e
+                            await asyncio.sleep(1)
+                            continue
 
-                    # برای ایتا، sent_msg = "success" است که باعث دوبله شدن total_sent می‌شود
-                    # پس این بخش را برای ایتا اجرا نمی‌کنیم
-                    if sent_msg and platform != 'ita':
-                        logger.info(f"[{platform}] sent_msg is truthy: {sent_msg} for {cid}")
-                        # all_sent_info و detailed_results قبلاً در حلقه retry اضافه شده‌اند
-                        # پس اینجا دوباره اضافه نمی‌کنیم
-                    elif platform == 'ita' and sent_msg == "success":
-                        # برای ایتا، "success" نشان‌دهنده موفقیت است
-                        logger.info(f"[{platform}] Ita send successful: {sent_msg} for {cid}")
-                        # total_sent قبلاً در بخش ایتا اضافه شده است
-                    else:
-                        logger.warning(f"[{platform}] sent_msg is falsy: {sent_msg} for {cid}")
-                        # If media sending failed completely, try sending just text (Telegram only)
-                        if text and platform == 'telegram':
-                            try:
-                                sent_msg = await send_with_concurrency_control(
-                                    semaphore,
-                                    bot_instance.send_message,
-                                    chat_id=cid,
-                                    text=f"⚠️ Could not send media. {text}",
-                                    parse_mode=parse_mode_option,
-                                    disable_notification=True
-                                )
-                                all_sent_info.append((cid, sent_msg.message_id))
-                                detailed_results[scope]['sent'] += 1
-                                total_sent += 1
-                            except Exception as text_error:
-                                logger.error(f"Failed to send fallback text to {cid}: {text_error}")
-                                # Handle "Chat not found" errors by removing the chat from database
-                                if "Chat not found" in str(text_error).lower():
-                                    try:
-                                        await delete_user_completely(str(cid), platform)
-                                        logger.info(f"[{platform}] Removed chat {cid} from database due to 'Chat not found' error")
-                                    except Exception as db_error:
-                                        logger.error(f"[{platform}] Failed to remove chat {cid} from database: {db_error}")
-                                    detailed_results[scope]['failed'] += 1
-                                    total_failed += 1
-                                else:
-                                    raise Exception("Failed to send media and fallback text")
-                        else:
-                            # برای ایتا، اگر ارسال موفق بوده، نباید failed محسوب شود
-                            if platform == 'ita':
-                                # ایتا message_id ندارد، پس اگر به اینجا رسیدیم یعنی ارسال ناموفق بوده
+                # برای ایتا، sent_msg = "success" است که باعث دوبله شدن total_sent می‌شود
+                # پس این بخش را برای ایتا اجرا نمی‌کنیم
+                if sent_msg and platform != 'ita':
+                    logger.info(f"[{platform}] sent_msg is truthy: {sent_msg} for {cid}")
+                    # all_sent_info و detailed_results قبلاً در حلقه retry اضافه شده‌اند
+                    # پس اینجا دوباره اضافه نمی‌کنیم
+                elif platform == 'ita' and sent_msg == "success":
+                    # برای ایتا، "success" نشان‌دهنده موفقیت است
+                    logger.info(f"[{platform}] Ita send successful: {sent_msg} for {cid}")
+                    # total_sent قبلاً در بخش ایتا اضافه شده است
+                else:
+                    logger.warning(f"[{platform}] sent_msg is falsy: {sent_msg} for {cid}")
+                    # If media sending failed completely, try sending just text (Telegram only)
+                    if text and platform == 'telegram':
+                        try:
+                            sent_msg = await send_with_concurrency_control(
+                                semaphore,
+                                bot_instance.send_message,
+                                chat_id=cid,
+                                text=f"⚠️ Could not send media. {text}",
+                                parse_mode=parse_mode_option,
+                                disable_notification=True
+                            )
+                            all_sent_info.append((cid, sent_msg.message_id))
+                            detailed_results[scope]['sent'] += 1
+                            total_sent += 1
+                        except Exception as text_error:
+                            logger.error(f"Failed to send fallback text to {cid}: {text_error}")
+                            # Handle "Chat not found" errors by removing the chat from database
+                            if "Chat not found" in str(text_error).lower():
+                                try:
+                                    await delete_user_completely(str(cid), platform)
+                                    logger.info(f"[{platform}] Removed chat {cid} from database due to 'Chat not found' error")
+                                except Exception as db_error:
+                                    logger.error(f"[{platform}] Failed to remove chat {cid} from database: {db_error}")
                                 detailed_results[scope]['failed'] += 1
                                 total_failed += 1
-                                logger.warning(f"[{platform}] Ita media send failed for {cid}, marking as failed")
                             else:
-                                detailed_results[scope]['failed'] += 1
-                                total_failed += 1
+                                raise Exception("Failed to send media and fallback text")
+                    else:
+                        # برای ایتا، اگر ارسال موفق بوده، نباید failed محسوب شود
+                        if platform == 'ita':
+                            # ایتا message_id ندارد، پس اگر به اینجا رسیدیم یعنی ارسال ناموفق بوده
+                            detailed_results[scope]['failed'] += 1
+                            total_failed += 1
+                            logger.warning(f"[{platform}] Ita media send failed for {cid}, marking as failed")
+                        else:
+                            detailed_results[scope]['failed'] += 1
+                            total_failed += 1
 
-            except (BadRequest, Forbidden) as e:
-                logger.warning(f"[{platform}] Failed to send message to {cid} (scope '{scope}'): {e}")
-                # Handle "Chat not found" errors by removing the chat from database
-                if "Chat not found" in str(e).lower():
-                    try:
-                        await delete_user_completely(str(cid), platform)
-                        logger.info(f"[{platform}] Removed chat {cid} from database due to 'Chat not found' error")
-                    except Exception as db_error:
-                        logger.error(f"[{platform}] Failed to remove chat {cid} from database: {db_error}")
-                detailed_results[scope]['failed'] += 1
-                total_failed += 1
-            except TimedOut:
-                logger.warning(f"[{platform}] Timed out sending to {cid} (scope '{scope}'). Skipping.")
-                detailed_results[scope]['failed'] += 1
-                total_failed += 1
+        except (BadRequest, Forbidden) as e:
+            logger.warning(f"[{platform}] Failed to send message to {cid} (scope '{scope}'): {e}")
+            # Handle "Chat not found" errors by removing the chat from database
+            if "Chat not found" in str(e).lower():
+                try:
+                    await delete_user_completely(str(cid), platform)
+                    logger.info(f"[{platform}] Removed chat {cid} from database due to 'Chat not found' error")
+                except Exception as db_error:
+                    logger.error(f"[{platform}] Failed to remove chat {cid} from database: {db_error}")
+            detailed_results[scope]['failed'] += 1
+            total_failed += 1
+        except TimedOut:
+            logger.warning(f"[{platform}] Timed out sending to {cid} (scope '{scope}'). Skipping.")
+            detailed_results[scope]['failed'] += 1
+            total_failed += 1
+        except Exception as e:
+            logger.error(f"[{platform}] Unexpected error sending to {cid} (scope '{scope}'): {e}", exc_info=True)
+            # Handle "Chat not found" errors by removing the chat from database
+            if "Chat not found" in str(e).lower():
+                try:
+                    await delete_user_completely(str(cid), platform)
+                    logger.info(f"[{platform}] Removed chat {cid} from database due to 'Chat not found' error")
+                except Exception as db_error:
+                    logger.error(f"[{platform}] Failed to remove chat {cid} from database: {db_error}")
+            detailed_results[scope]['failed'] += 1
+            total_failed += 1
+
+    async def _broadcast_worker(worker_id: int):
+        """برداشتن چت بعدی از صف و ارسال تا زمانی که صف خالی شود"""
+        nonlocal total_failed, low_watermark
+        while True:
+            try:
+                index, scope, cid_str = broadcast_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                await _deliver_to_chat(scope, cid_str)
             except Exception as e:
-                logger.error(f"[{platform}] Unexpected error sending to {cid} (scope '{scope}'): {e}", exc_info=True)
-                # Handle "Chat not found" errors by removing the chat from database
-                if "Chat not found" in str(e).lower():
-                    try:
-                        await delete_user_completely(str(cid), platform)
-                        logger.info(f"[{platform}] Removed chat {cid} from database due to 'Chat not found' error")
-                    except Exception as db_error:
-                        logger.error(f"[{platform}] Failed to remove chat {cid} from database: {db_error}")
+                logger.error(f"[{platform}] Worker {worker_id} failed on {cid_str} (scope '{scope}'): {e}", exc_info=True)
                 detailed_results[scope]['failed'] += 1
                 total_failed += 1
-            
-            # Small delay to avoid rate limiting
-            await asyncio.sleep(0.1)
+            finally:
+                broadcast_queue.task_done()
+                target_done[index] = True
+                while low_watermark < len(target_done) and target_done[low_watermark]:
+                    low_watermark += 1
+                if progress is not None:
+                    progress['sent'], progress['failed'] = total_sent, total_failed
+
+    if progress is not None:
+        progress.update({'total': total_targets, 'sent': total_sent, 'failed': 0, 'status': 'running'})
+
+    worker_count = max(1, min(concurrency, total_targets))
+    logger.info(f"[{platform}] Fan-out: {total_targets} targets across {worker_count} workers")
+    fanout_started = time.monotonic()
+    checkpoint_task = asyncio.create_task(_checkpoint_loop())
+    try:
+        await asyncio.gather(*(_broadcast_worker(i) for i in range(worker_count)))
+    finally:
+        checkpoint_stop.set()
+        await checkpoint_task
+    await _flush_checkpoint()
+    logger.info(f"[{platform}] Fan-out finished in {time.monotonic() - fanout_started:.1f}s")
+    for media_type, stats in media_reuse_stats.items():
+        saved_bytes = stats['size'] * stats['reused']
+        logger.info(f"[{platform}] {media_type} uploaded once and reused {stats['reused']} times, saved {saved_bytes / (1024 * 1024):.1f} MB of upload")
 
     # Clean up temporary files after ALL sending is complete
     # Note: For cross-platform broadcasts, we delay cleanup to allow other platform to copy files
@@ -5934,33 +7268,70 @@ async def perform_broadcast_async(app: TelegramApplication, scopes: List[str], p
         except Exception as e:
             logger.warning(f"Error cleaning up temporary file {temp_file}: {e}")
 
-    # Save broadcast results to database
-    batch_id = await async_save_broadcast_to_db(",".join(scopes), preview, platform, all_sent_info)
+    # Mark the batch as complete (sent messages were already stored by the checkpoints)
+    # و ثبت نتیجه بر اساس مخاطبان همین ارسال تا تاریخچه به شمارش دوباره chats نیاز نداشته باشد
+    if batch_id:
+        # چت مالک عمداً رد می‌شود و نباید ناموفق حساب شود
+        owner_key = str(owner_id)
+        skipped_count = sum(1 for _, cid_str in ordered_targets if cid_str == owner_key)
+        scope_counts = {}
+        for scope, ids_set in target_ids_by_scope.items():
+            scope_ids = {str(c) for c in ids_set}
+            scope_sent = detailed_results.get(scope, {}).get('sent', 0) + len(delivered_ids & scope_ids)
+            scope_counts[scope] = {"target": len(scope_ids), "sent": scope_sent,
+                                   "failed": max(0, len(scope_ids - {owner_key}) - scope_sent)}
+        await async_db_execute("""
+            UPDATE broadcast_batches
+            SET status = 'done', checkpoint_cursor = ?, target_count = ?, sent_count = ?, failed_count = ?, scope_counts = ?
+            WHERE batch_id = ?
+        """, (len(ordered_targets), len(ordered_targets), total_sent, max(0, len(ordered_targets) - skipped_count - total_sent),
+              json.dumps(scope_counts), batch_id))
     
     # ذخیره آمار پست‌ها برای کانال‌ها و سنجاق پیام‌ها
-    for chat_id, message_id in all_sent_info:
-        # بررسی اینکه آیا چت یک کانال است
-        chat_info = db_fetchone("SELECT chat_type FROM chats WHERE chat_id = ? AND platform = ?", (str(chat_id), platform))
-        if chat_info and chat_info['chat_type'] == 'channel':
-            # تعیین نوع محتوا
-            content_type = 'text'
-            if photo_path:
-                content_type = 'photo'
-            elif video_path:
-                content_type = 'video'
-            elif document_path:
-                content_type = 'document'
-            
-            # ذخیره آمار پست
-            save_post_stats_to_db(str(chat_id), platform, str(message_id), content_type, preview)
-            
-            # سنجاق پیام در کانال‌ها اگر درخواست شده باشد
-            if pin_message:
-                try:
-                    await pin_chat_message(platform, str(chat_id), message_id, disable_notification=True)
-                    logger.info(f"[{platform}] Message {message_id} pinned in channel {chat_id}")
-                except Exception as e:
-                    logger.error(f"[{platform}] Failed to pin message {message_id} in channel {chat_id}: {e}")
+    # کانال‌ها با چند کوئری IN (نه یک کوئری همگام برای هر گیرنده) روی اتصال فقط‌خواندنی پیدا می‌شوند
+    sent_chat_ids = sorted({str(chat_id) for chat_id, _ in all_sent_info})
+    channel_ids: Set[str] = set()
+    for start in range(0, len(sent_chat_ids), 500):
+        chunk = sent_chat_ids[start:start + 500]
+        rows = await async_db_fetchall(
+            f"SELECT chat_id FROM chats WHERE platform = ? AND chat_type = 'channel' AND chat_id IN ({','.join('?' * len(chunk))})",
+            (platform, *chunk)
+        )
+        channel_ids.update(row['chat_id'] for row in rows)
+    channel_posts = [(chat_id, message_id) for chat_id, message_id in all_sent_info if str(chat_id) in channel_ids]
+    if channel_posts:
+        # تعیین نوع محتوا
+        content_type = 'text'
+        if photo_path:
+            content_type = 'photo'
+        elif video_path:
+            content_type = 'video'
+        elif document_path:
+            content_type = 'document'
+        post_rows = [(str(chat_id), platform, str(message_id), content_type, preview) for chat_id, message_id in channel_posts]
+
+        def _save_post_stats(conn):
+            conn.executemany("""
+                INSERT OR REPLACE INTO channel_posts_stats
+                (chat_id, platform, message_id, post_date, content_type, content_preview, updated_at)
+                VALUES (?, ?, ?, datetime('now'), ?, ?, datetime('now'))
+            """, post_rows)
+
+        # ذخیره آمار پست‌ها در یک کار نوشتن
+        try:
+            await asyncio.wrap_future(db_writer.submit(_save_post_stats))
+            logger.info(f"[{platform}] Post stats saved for {len(post_rows)} channel messages")
+        except Exception as e:
+            logger.error(f"Error saving post stats: {e}")
+
+    # سنجاق پیام در کانال‌ها اگر درخواست شده باشد
+    if pin_message:
+        for chat_id, message_id in channel_posts:
+            try:
+                await pin_chat_message(platform, str(chat_id), message_id, disable_notification=True)
+                logger.info(f"[{platform}] Message {message_id} pinned in channel {chat_id}")
+            except Exception as e:
+                logger.error(f"[{platform}] Failed to pin message {message_id} in channel {chat_id}: {e}")
     
     logger.info(f"[{platform.upper()}] Broadcast completed. Sent: {total_sent}, Failed: {total_failed}. Batch ID: {batch_id}")
     
@@ -5975,48 +7346,42 @@ async def perform_broadcast_async(app: TelegramApplication, scopes: List[str], p
     }
 
 async def delete_messages_async(app: TelegramApplication, batch_id: int, platform: str):
+    # پیام‌ها پیش از علامت‌گذاری خوانده می‌شوند؛ run_retention پیام‌های batch حذف‌شده را پاک می‌کند
+    messages = await async_fetch_batch_messages(batch_id)
+    
     # Mark batch as deleted instead of actually deleting messages
     db_execute("UPDATE broadcast_batches SET is_deleted = 1 WHERE batch_id = ?", (batch_id,))
     
     # For platforms that support message deletion, try to delete messages
     if (app and app.bot) or platform == 'ita':
         bot_instance = app.bot if app else None
-        messages = await async_db_fetchall("SELECT chat_id, message_id FROM sent_messages WHERE batch_id = ?", (batch_id,))
         deleted, failed = 0, 0
         
-        # Process deletions in batches of 20 to avoid rate limiting
-        batch_size = 20
-        for i in range(0, len(messages), batch_size):
-            batch = messages[i:i + batch_size]
-            tasks = []
-            
-            for row in batch:
-                chat_id = int(row['chat_id'])
-                message_id = int(row['message_id'])
-                
-                async def delete_single_message(c_id, m_id):
-                    try:
-                        if platform == 'ita':
-                            # Use Ita-specific delete function
-                            success = await delete_ita_message(str(c_id), m_id)
-                            return (c_id, m_id, success)
-                        else:
-                            # Use regular bot delete for Telegram/Bale
-                            await bot_instance.delete_message(chat_id=c_id, message_id=m_id)
-                            return (c_id, m_id, True)
-                    except Exception as e:
-                        error_msg = str(e).lower()
-                        # Check if it's a "message not found" error - this often means the message was already deleted
-                        if any(phrase in error_msg for phrase in ['message to delete not found', 'message not found', 'bad request: message to delete not found']):
-                            logger.info(f"[{platform}] Message {m_id} in chat {c_id} was already deleted or not found - treating as success")
-                            return (c_id, m_id, True)  # Treat as success since message is gone
-                        else:
-                            logger.warning(f"[{platform}] Delete failed for chat {c_id} message {m_id}: {e}")
-                            return (c_id, m_id, False)
-                
-                tasks.append(delete_single_message(chat_id, message_id))
+        # همه حذف‌ها همزمان شروع می‌شوند؛ rate governor ربات سرعت واقعی را تنظیم می‌کند
+        delete_semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY.get(platform, 10))
+        
+        async def delete_single_message(c_id, m_id):
+            try:
+                if platform == 'ita':
+                    # Use Ita-specific delete function
+                    async with delete_semaphore:
+                        success = await delete_ita_message(str(c_id), m_id)
+                    return (c_id, m_id, success)
+                else:
+                    # Use regular bot delete for Telegram/Bale
+                    await send_with_concurrency_control(delete_semaphore, bot_instance.delete_message, chat_id=c_id, message_id=m_id)
+                    return (c_id, m_id, True)
+            except Exception as e:
+                error_msg = str(e).lower()
+                # Check if it's a "message not found" error - this often means the message was already deleted
+                if any(phrase in error_msg for phrase in ['message to delete not found', 'message not found', 'bad request: message to delete not found']):
+                    logger.info(f"[{platform}] Message {m_id} in chat {c_id} was already deleted or not found - treating as success")
+                    return (c_id, m_id, True)  # Treat as success since message is gone
+                else:
+                    logger.warning(f"[{platform}] Delete failed for chat {c_id} message {m_id}: {e}")
+                    return (c_id, m_id, False)
         
-        # Process current batch in parallel
+        tasks = [delete_single_message(int(c_id), int(m_id)) for c_id, m_id in messages]
         results = await asyncio.gather(*tasks, return_exceptions=True)
         
         # Process results - handle exceptions properly
@@ -6036,20 +7401,15 @@ async def delete_messages_async(app: TelegramApplication, batch_id: int, platfor
             except (ValueError, TypeError) as e:
                 logger.error(f"[{platform}] Invalid result format: {result}, error: {e}")
                 failed += 1
-        
-        # Small delay between batches to avoid hitting rate limits
-        if i + batch_size < len(messages):
-            await asyncio.sleep(1)
     else:
         # For platforms that don't support message deletion through bot API
         if platform == 'ita':
             # Ita supports deletion through its own API
-            messages = await async_db_fetchall("SELECT chat_id, message_id FROM sent_messages WHERE batch_id = ?", (batch_id,))
             deleted, failed = 0, 0
             
-            for row in messages:
-                chat_id = str(row['chat_id'])
-                message_id = int(row['message_id'])
+            for c_id, m_id in messages:
+                chat_id = str(c_id)
+                message_id = int(m_id)
                 
                 try:
                     success = await delete_ita_message(chat_id, message_id)
@@ -6068,8 +7428,7 @@ async def delete_messages_async(app: TelegramApplication, batch_id: int, platfor
                         failed += 1
         else:
             # For other platforms that truly don't support message deletion, just mark as deleted
-            messages = await async_db_fetchall("SELECT chat_id, message_id FROM sent_messages WHERE batch_id = ?", (batch_id,))
-            deleted = len(messages) if messages else 0
+            deleted = len(messages)
             failed = 0
     
     # Batch is already marked as deleted in the database
@@ -7112,127 +8471,128 @@ def admin_dashboard():
         logger.error(f"[Flask] Error rendering index.html: {e}", exc_info=True)
         return "<h3>Multi Bot Dashboard</h3><p>API endpoints are available at /api/*.</p>"
 
+def compute_dashboard_stats() -> Dict[str, Dict[str, int]]:
+    """آمار داشبورد (تعداد چت‌ها و اعضا به تفکیک پلتفرم)؛ از طریق stats_cache فراخوانی می‌شود"""
+    # دریافت تعداد چت‌ها (بدون ادمین‌ها)
+    t_rows = db_fetchall("SELECT chat_type, COUNT(*) as cnt FROM chats WHERE platform='telegram' AND is_active=1 AND (chat_type != 'private' OR chat_id != ?) GROUP BY chat_type", (str(OWNER_ID),))
+    b_rows = db_fetchall("SELECT chat_type, COUNT(*) as cnt FROM chats WHERE platform='bale' AND is_active=1 AND (chat_type != 'private' OR chat_id != ?) GROUP BY chat_type", (str(BALE_OWNER_ID),))
+    i_rows = db_fetchall("SELECT chat_type, COUNT(*) as cnt FROM chats WHERE platform='ita' AND is_active=1 GROUP BY chat_type")
+    
+    telegram_counts = {r['chat_type']: r['cnt'] for r in t_rows}; 
+    bale_counts = {r['chat_type']: r['cnt'] for r in b_rows}; 
+    ita_counts = {r['chat_type']: r['cnt'] for r in i_rows}; 
+    
+    # دریافت آمار اعضا از جدول metrics (بدون ادمین‌ها)
+    telegram_members = db_fetchall("""
+        SELECT c.chat_type, SUM(m.members_count) as total_members
+        FROM chats_latest_metrics m
+        JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
+        WHERE m.platform = 'telegram' AND c.is_active=1 AND (c.chat_type != 'private' OR c.chat_id != ?)
+        GROUP BY c.chat_type
+    """, (str(OWNER_ID),))
+    telegram_member_counts = {r['chat_type']: r['total_members'] for r in telegram_members}
+    
+    bale_members = db_fetchall("""
+        SELECT c.chat_type, SUM(m.members_count) as total_members
+        FROM chats_latest_metrics m
+        JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
+        WHERE m.platform = 'bale' AND c.is_active=1 AND (c.chat_type != 'private' OR c.chat_id != ?)
+        GROUP BY c.chat_type
+    """, (str(BALE_OWNER_ID),))
+    bale_member_counts = {r['chat_type']: r['total_members'] for r in bale_members}
+    
+    ita_members = db_fetchall("""
+        SELECT c.chat_type, SUM(m.members_count) as total_members
+        FROM chats_latest_metrics m
+        JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
+        WHERE m.platform = 'ita' AND c.is_active=1 AND c.chat_type != 'private'
+        GROUP BY c.chat_type
+    """)
+    ita_member_counts = {r['chat_type']: r['total_members'] for r in ita_members}
+    
+    # اگر metrics خالی است، از جدول chats استفاده کن (هر کاربر = 1 عضو)
+    if not telegram_member_counts:
+        telegram_member_counts = {}
+        for chat_type, count in telegram_counts.items():
+            if chat_type == 'private':
+                telegram_member_counts[chat_type] = count  # هر کاربر private = 1 عضو
+            else:
+                telegram_member_counts[chat_type] = count
+    if not bale_member_counts:
+        bale_member_counts = {}
+        for chat_type, count in bale_counts.items():
+            if chat_type == 'private':
+                bale_member_counts[chat_type] = count  # هر کاربر private = 1 عضو
+            else:
+                bale_member_counts[chat_type] = count
+    if not ita_member_counts:
+        ita_member_counts = {}
+        for chat_type, count in ita_counts.items():
+            if chat_type == 'private':
+                ita_member_counts[chat_type] = count  # هر کاربر private = 1 عضو
+            else:
+                ita_member_counts[chat_type] = count
+    
+    # اطمینان از وجود کلیدها با مقدار پیش‌فرض 0 برای نمایش در داشبورد
+    # برای private chats، اگر تعداد اعضا 0 است، آن را برابر با تعداد چت‌ها قرار بده
+    telegram_private_members = telegram_member_counts.get("private", 0)
+    if telegram_private_members == 0 and telegram_counts.get("private", 0) > 0:
+        telegram_private_members = telegram_counts.get("private", 0)
+    
+    telegram_stats = {
+        "users": telegram_counts.get("private", 0),
+        "groups": telegram_counts.get("group", 0),
+        "channels": telegram_counts.get("channel", 0),
+        "users_members": telegram_private_members,
+        "groups_members": telegram_member_counts.get("group", 0),
+        "channels_members": telegram_member_counts.get("channel", 0),
+        "total_members": (telegram_private_members + 
+                         telegram_member_counts.get("group", 0) + 
+                         telegram_member_counts.get("channel", 0))
+    }
+    # برای Bale private chats
+    bale_private_members = bale_member_counts.get("private", 0)
+    if bale_private_members == 0 and bale_counts.get("private", 0) > 0:
+        bale_private_members = bale_counts.get("private", 0)
+    
+    bale_stats = {
+        "users": bale_counts.get("private", 0),
+        "groups": bale_counts.get("group", 0),
+        "channels": bale_counts.get("channel", 0),
+        "users_members": bale_private_members,
+        "groups_members": bale_member_counts.get("group", 0),
+        "channels_members": bale_member_counts.get("channel", 0),
+        "total_members": (bale_private_members + 
+                         bale_member_counts.get("group", 0) + 
+                         bale_member_counts.get("channel", 0))
+    }
+    # برای ITA private chats
+    ita_private_members = ita_member_counts.get("private", 0)
+    if ita_private_members == 0 and ita_counts.get("private", 0) > 0:
+        ita_private_members = ita_counts.get("private", 0)
+    
+    ita_stats = {
+        "users": ita_counts.get("private", 0),
+        "groups": ita_counts.get("group", 0),
+        "channels": ita_counts.get("channel", 0),
+        "users_members": ita_private_members,
+        "groups_members": ita_member_counts.get("group", 0),
+        "channels_members": ita_member_counts.get("channel", 0),
+        "total_members": (ita_private_members + 
+                         ita_member_counts.get("group", 0) + 
+                         ita_member_counts.get("channel", 0))
+    }
+    
+    return {"telegram": telegram_stats, "bale": bale_stats, "ita": ita_stats}
+
 @app.route('/api/stats')
 def api_stats():
     try: # مدیریت خطای کلی برای اطمینان از پاسخ JSON
-        # دریافت تعداد چت‌ها (بدون ادمین‌ها)
-        t_rows = db_fetchall("SELECT chat_type, COUNT(*) as cnt FROM chats WHERE platform='telegram' AND is_active=1 AND (chat_type != 'private' OR chat_id != ?) GROUP BY chat_type", (str(OWNER_ID),))
-        b_rows = db_fetchall("SELECT chat_type, COUNT(*) as cnt FROM chats WHERE platform='bale' AND is_active=1 AND (chat_type != 'private' OR chat_id != ?) GROUP BY chat_type", (str(BALE_OWNER_ID),))
-        i_rows = db_fetchall("SELECT chat_type, COUNT(*) as cnt FROM chats WHERE platform='ita' AND is_active=1 GROUP BY chat_type")
-        
-        telegram_counts = {r['chat_type']: r['cnt'] for r in t_rows}; 
-        bale_counts = {r['chat_type']: r['cnt'] for r in b_rows}; 
-        ita_counts = {r['chat_type']: r['cnt'] for r in i_rows}; 
-        
-        # دریافت آمار اعضا از جدول metrics (بدون ادمین‌ها)
-        telegram_members = db_fetchall("""
-            SELECT c.chat_type, SUM(m.members_count) as total_members
-            FROM chats_metrics m
-            JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
-            WHERE m.platform = 'telegram' AND c.is_active=1 AND (c.chat_type != 'private' OR c.chat_id != ?) AND m.date_key = (
-                SELECT MAX(date_key) FROM chats_metrics WHERE chat_id = m.chat_id AND platform = m.platform
-            )
-            GROUP BY c.chat_type
-        """, (str(OWNER_ID),))
-        telegram_member_counts = {r['chat_type']: r['total_members'] for r in telegram_members}
-        
-        bale_members = db_fetchall("""
-            SELECT c.chat_type, SUM(m.members_count) as total_members
-            FROM chats_metrics m
-            JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
-            WHERE m.platform = 'bale' AND c.is_active=1 AND (c.chat_type != 'private' OR c.chat_id != ?) AND m.date_key = (
-                SELECT MAX(date_key) FROM chats_metrics WHERE chat_id = m.chat_id AND platform = m.platform
-            )
-            GROUP BY c.chat_type
-        """, (str(BALE_OWNER_ID),))
-        bale_member_counts = {r['chat_type']: r['total_members'] for r in bale_members}
-        
-        ita_members = db_fetchall("""
-            SELECT c.chat_type, SUM(m.members_count) as total_members
-            FROM chats_metrics m
-            JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
-            WHERE m.platform = 'ita' AND c.is_active=1 AND c.chat_type != 'private' AND m.date_key = (
-                SELECT MAX(date_key) FROM chats_metrics WHERE chat_id = m.chat_id AND platform = m.platform
-            )
-            GROUP BY c.chat_type
-        """)
-        ita_member_counts = {r['chat_type']: r['total_members'] for r in ita_members}
-        
-        # اگر metrics خالی است، از جدول chats استفاده کن (هر کاربر = 1 عضو)
-        if not telegram_member_counts:
-            telegram_member_counts = {}
-            for chat_type, count in telegram_counts.items():
-                if chat_type == 'private':
-                    telegram_member_counts[chat_type] = count  # هر کاربر private = 1 عضو
-                else:
-                    telegram_member_counts[chat_type] = count
-        if not bale_member_counts:
-            bale_member_counts = {}
-            for chat_type, count in bale_counts.items():
-                if chat_type == 'private':
-                    bale_member_counts[chat_type] = count  # هر کاربر private = 1 عضو
-                else:
-                    bale_member_counts[chat_type] = count
-        if not ita_member_counts:
-            ita_member_counts = {}
-            for chat_type, count in ita_counts.items():
-                if chat_type == 'private':
-                    ita_member_counts[chat_type] = count  # هر کاربر private = 1 عضو
-                else:
-                    ita_member_counts[chat_type] = count
-        
-        # اطمینان از وجود کلیدها با مقدار پیش‌فرض 0 برای نمایش در داشبورد
-        # برای private chats، اگر تعداد اعضا 0 است، آن را برابر با تعداد چت‌ها قرار بده
-        telegram_private_members = telegram_member_counts.get("private", 0)
-        if telegram_private_members == 0 and telegram_counts.get("private", 0) > 0:
-            telegram_private_members = telegram_counts.get("private", 0)
-        
-        telegram_stats = {
-            "users": telegram_counts.get("private", 0),
-            "groups": telegram_counts.get("group", 0),
-            "channels": telegram_counts.get("channel", 0),
-            "users_members": telegram_private_members,
-            "groups_members": telegram_member_counts.get("group", 0),
-            "channels_members": telegram_member_counts.get("channel", 0),
-            "total_members": (telegram_private_members + 
-                             telegram_member_counts.get("group", 0) + 
-                             telegram_member_counts.get("channel", 0))
-        }
-        # برای Bale private chats
-        bale_private_members = bale_member_counts.get("private", 0)
-        if bale_private_members == 0 and bale_counts.get("private", 0) > 0:
-            bale_private_members = bale_counts.get("private", 0)
-        
-        bale_stats = {
-            "users": bale_counts.get("private", 0),
-            "groups": bale_counts.get("group", 0),
-            "channels": bale_counts.get("channel", 0),
-            "users_members": bale_private_members,
-            "groups_members": bale_member_counts.get("group", 0),
-            "channels_members": bale_member_counts.get("channel", 0),
-            "total_members": (bale_private_members + 
-                             bale_member_counts.get("group", 0) + 
-                             bale_member_counts.get("channel", 0))
-        }
-        # برای ITA private chats
-        ita_private_members = ita_member_counts.get("private", 0)
-        if ita_private_members == 0 and ita_counts.get("private", 0) > 0:
-            ita_private_members = ita_counts.get("private", 0)
-        
-        ita_stats = {
-            "users": ita_counts.get("private", 0),
-            "groups": ita_counts.get("group", 0),
-            "channels": ita_counts.get("channel", 0),
-            "users_members": ita_private_members,
-            "groups_members": ita_member_counts.get("group", 0),
-            "channels_members": ita_member_counts.get("channel", 0),
-            "total_members": (ita_private_members + 
-                             ita_member_counts.get("group", 0) + 
-                             ita_member_counts.get("channel", 0))
-        }
-        
-        response_data = {"telegram": telegram_stats, "bale": bale_stats, "ita": ita_stats}
-        return jsonify(response_data)
+        # داشبورد این endpoint را مدام poll می‌کند؛ نتیجه تا تغییر چت‌ها/metrics یا پایان TTL از کش داده می‌شود
+        response_data, cached = stats_cache.get_or_compute('api_stats', compute_dashboard_stats)
+        response = jsonify(response_data)
+        response.headers['X-Cache'] = 'hit' if cached else 'miss'
+        return response
     except Exception as e:
         logger.critical(f"[Flask API] Uncaught exception in /api/stats: {e}", exc_info=True)
         # در صورت خطا، آمار خالی برگردان
@@ -7243,10 +8603,260 @@ def api_stats():
         return jsonify({"telegram": empty_stats, "bale": empty_stats, "ita": empty_stats})
 
 
+# =========== Broadcast Job Queue ===========
+BROADCAST_JOB_WORKERS = getattr(config, 'BROADCAST_JOB_WORKERS', 2)
+BROADCAST_JOB_PROGRESS_INTERVAL = 2  # فاصله (ثانیه) ذخیره شمارنده‌های پیشرفت در دیتابیس
+BROADCAST_BOT_READY_TIMEOUT = getattr(config, 'BROADCAST_BOT_READY_TIMEOUT', 120)  # حداکثر انتظار (ثانیه) برای آماده شدن ربات
+
+broadcast_job_queue: "queue.Queue[int]" = queue.Queue()
+broadcast_job_progress: Dict[int, Dict[str, Dict[str, Any]]] = {}  # پیشرفت زنده job های در حال اجرا
+_broadcast_job_workers_started = False
+_broadcast_job_workers_lock = threading.Lock()
+_broadcast_job_progress_lock = threading.Lock()  # پلتفرم‌های یک job همزمان پیشرفت را به‌روز می‌کنند
+
+# ایتا loop ربات ندارد؛ یک event loop دائمی جدا برای ارسال‌های ایتا نگه می‌داریم
+ita_broadcast_loop: Optional[asyncio.AbstractEventLoop] = None
+_ita_broadcast_loop_lock = threading.Lock()
+
+def get_ita_broadcast_loop() -> asyncio.AbstractEventLoop:
+    """برگرداندن (و در صورت نیاز ساختن) event loop پس‌زمینه برای broadcast های ایتا"""
+    global ita_broadcast_loop
+    with _ita_broadcast_loop_lock:
+        if ita_broadcast_loop is None or ita_broadcast_loop.is_closed():
+            loop = asyncio.new_event_loop()
+            Thread(target=loop.run_forever, daemon=True, name="ita-broadcast-loop").start()
+            ita_broadcast_loop = loop
+        return ita_broadcast_loop
+
+def enqueue_broadcast_job(platform_tasks: List[Dict[str, Any]]) -> Optional[int]:
+    """ثبت job ارسال انبوه در دیتابیس و قرار دادن آن در صف worker ها"""
+    platforms = ",".join(task['platform'] for task in platform_tasks)
+    start_broadcast_job_workers()
+    job_id = db_execute(
+        "INSERT INTO broadcast_jobs (platforms, status, params) VALUES (?, 'queued', ?)",
+        (platforms, json.dumps(platform_tasks, ensure_ascii=False))
+    )
+    if job_id:
+        broadcast_job_queue.put(job_id)
+        logger.info(f"[Broadcast Job] Job {job_id} queued for platforms: {platforms}")
+    return job_id
+
+def _resolve_broadcast_target(platform: str) -> Tuple[Optional[asyncio.AbstractEventLoop], Optional[TelegramApplication], Any, Optional[str]]:
+    """برگرداندن (loop, app, owner_id, error) برای اجرای broadcast روی پلتفرم"""
+    if platform == 'telegram':
+        if not telegram_bot_loop or not telegram_app:
+            return None, None, None, "Telegram bot not initialized."
+        loop_target, app_target, owner_id = telegram_bot_loop, telegram_app, OWNER_ID
+    elif platform == 'bale':
+        if not bale_bot_loop or not bale_app:
+            return None, None, None, "Bale bot not initialized."
+        loop_target, app_target, owner_id = bale_bot_loop, bale_app, BALE_OWNER_ID
+    elif platform == 'ita':
+        loop_target, app_target, owner_id = get_ita_broadcast_loop(), None, ITA_OWNER_ID
+    else:
+        return None, None, None, f"Invalid platform: {platform}"
+    if loop_target.is_closed():
+        return None, None, None, f"Bot service for {platform} is not available. Please restart the application."
+    return loop_target, app_target, owner_id, None
+
+def _flush_broadcast_job_progress(job_id: int):
+    """ذخیره شمارنده‌های زنده job در دیتابیس"""
+    with _broadcast_job_progress_lock:
+        progress = broadcast_job_progress.get(job_id, {})
+        sent = sum(p.get('sent', 0) for p in progress.values())
+        failed = sum(p.get('failed', 0) for p in progress.values())
+        total = sum(p.get('total', 0) for p in progress.values())
+        progress_json = json.dumps(progress, ensure_ascii=False, default=str)
+    db_execute(
+        "UPDATE broadcast_jobs SET sent = ?, failed = ?, total = ?, progress = ? WHERE job_id = ?",
+        (sent, failed, total, progress_json, job_id)
+    )
+
+def _run_platform_broadcast(job_id: int, task: Dict[str, Any]) -> Dict[str, Any]:
+    """اجرای broadcast یک پلتفرم از job و انتظار برای پایان آن"""
+    platform = task['platform']
+    platform_started = time.monotonic()
+    progress = broadcast_job_progress[job_id][platform]
+    if 'result' in task:
+        progress['status'] = 'done'
+        return task['result']
+    if progress.get('status') == 'done' and 'result' in progress:
+        # این پلتفرم قبل از ری‌استارت کامل شده است
+        return progress['result']
+
+    # job های ادامه‌یافته پس از ری‌استارت ممکن است قبل از post_init ربات برداشته شوند
+    bot_token = {'telegram': TELEGRAM_BOT_TOKEN, 'bale': BALE_BOT_TOKEN}.get(platform)
+    if bot_token and len(bot_token) > 10 and not bot_ready_events[platform].is_set():
+        logger.info(f"[Broadcast Job] Job {job_id}: waiting for {platform} bot to initialize")
+        bot_ready_events[platform].wait(BROADCAST_BOT_READY_TIMEOUT)
+
+    loop_target, app_target, owner_id_target, error = _resolve_broadcast_target(platform)
+    if error:
+        logger.error(f"[Broadcast Job] Job {job_id}: {error}")
+        progress['status'] = 'failed'
+        return {"error": error, "platform": platform}
+
+    broadcast_kwargs = dict(task['kwargs'], app=app_target, owner_id=owner_id_target, progress=progress, job_id=job_id)
+    # ادامه batch نیمه‌کاره از آخرین checkpoint (در صورت ری‌استارت وسط ارسال)
+    unfinished_batch = db_fetchone(
+        "SELECT batch_id FROM broadcast_batches WHERE job_id = ? AND platform = ? AND status = 'running' ORDER BY batch_id DESC LIMIT 1",
+        (job_id, platform)
+    )
+    if unfinished_batch:
+        broadcast_kwargs['resume_batch_id'] = unfinished_batch['batch_id']
+        logger.info(f"[Broadcast Job] Job {job_id}: resuming {platform} batch {unfinished_batch['batch_id']}")
+    try:
+        fut_result = asyncio.run_coroutine_threadsafe(perform_broadcast_async(**broadcast_kwargs), loop_target)
+        while True:
+            try:
+                result = fut_result.result(timeout=BROADCAST_JOB_PROGRESS_INTERVAL)
+                break
+            except concurrent.futures.TimeoutError:
+                _flush_broadcast_job_progress(job_id)
+    except Exception as e:
+        logger.error(f"[Broadcast Job] Job {job_id}: error during broadcast for {platform}: {e}", exc_info=True)
+        progress['status'] = 'failed'
+        return {"error": f"Failed to perform broadcast: {str(e)}", "platform": platform}
+
+    progress['status'] = 'done'
+    logger.info(f"[Broadcast Job] Job {job_id}: {platform} finished in {time.monotonic() - platform_started:.1f}s")
+    # اضافه کردن اطلاعات جزئی محتوا به نتیجه API
+    if result and 'detailed_content_info' not in result:
+        result['detailed_content_info'] = result.get('preview_content', '')
+    with _broadcast_job_progress_lock:
+        progress['result'] = result
+    _flush_broadcast_job_progress(job_id)
+    return result
+
+def run_broadcast_job(job_id: int):
+    """اجرای کامل یک job ارسال انبوه و ذخیره نتیجه نهایی"""
+    # برداشتن اتمی job تا دو worker یک job را همزمان اجرا نکنند
+    with get_db_connection() as conn:
+        claimed = conn.execute(
+            "UPDATE broadcast_jobs SET status = 'running', started_at = CURRENT_TIMESTAMP WHERE job_id = ? AND status = 'queued'",
+            (job_id,)
+        ).rowcount
+        conn.commit()
+    if not claimed:
+        return
+    job = db_fetchone("SELECT params, progress FROM broadcast_jobs WHERE job_id = ?", (job_id,))
+    # پیشرفت ذخیره‌شده (در صورت ادامه پس از ری‌استارت) نقطه شروع است
+    broadcast_job_progress[job_id] = json.loads(job['progress']) if job['progress'] else {}
+    try:
+        platform_tasks = json.loads(job['params'] or '[]')
+        for task in platform_tasks:
+            broadcast_job_progress[job_id].setdefault(task['platform'], {'sent': 0, 'failed': 0, 'total': 0, 'status': 'queued'})
+
+        # پلتفرم‌ها مستقل هستند؛ همه همزمان روی loop خودشان اجرا می‌شوند و زمان کل برابر کندترین پلتفرم است
+        job_started = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(platform_tasks)),
+                                                   thread_name_prefix=f"broadcast-job-{job_id}") as executor:
+            results = list(executor.map(lambda task: _run_platform_broadcast(job_id, task), platform_tasks))
+        logger.info(f"[Broadcast Job] Job {job_id}: {len(platform_tasks)} platforms finished in {time.monotonic() - job_started:.1f}s")
+
+        # محاسبه آمار کلی
+        total_sent = sum(r.get('sent', 0) for r in results if 'sent' in r)
+        total_failed = sum(r.get('failed', 0) for r in results if 'failed' in r)
+        final_result = {
+            "sent": total_sent,
+            "failed": total_failed,
+            "platform_results": results,
+            "total_platforms": len(platform_tasks),
+            "successful_platforms": len([r for r in results if r.get('sent', 0) > 0])
+        }
+        _flush_broadcast_job_progress(job_id)
+        db_execute(
+            "UPDATE broadcast_jobs SET status = 'done', sent = ?, failed = ?, result = ?, finished_at = CURRENT_TIMESTAMP WHERE job_id = ?",
+            (total_sent, total_failed, json.dumps(final_result, ensure_ascii=False, default=str), job_id)
+        )
+        logger.info(f"[Broadcast Job] Job {job_id} done. Sent: {total_sent}, Failed: {total_failed}")
+    except Exception as e:
+        logger.error(f"[Broadcast Job] Job {job_id} failed: {e}", exc_info=True)
+        db_execute(
+            "UPDATE broadcast_jobs SET status = 'failed', error = ?, finished_at = CURRENT_TIMESTAMP WHERE job_id = ?",
+            (str(e), job_id)
+        )
+    finally:
+        broadcast_job_progress.pop(job_id, None)
+
+def broadcast_job_worker():
+    """worker پس‌زمینه: برداشتن job از صف و اجرای آن"""
+    while True:
+        job_id = broadcast_job_queue.get()
+        try:
+            run_broadcast_job(job_id)
+        except Exception as e:
+            logger.error(f"[Broadcast Job] Worker error on job {job_id}: {e}", exc_info=True)
+        finally:
+            broadcast_job_queue.task_done()
+
+def start_broadcast_job_workers():
+    """راه‌اندازی worker های صف ارسال (فقط یک بار) و بارگذاری مجدد job های منتظر پس از ری‌استارت"""
+    global _broadcast_job_workers_started
+    with _broadcast_job_workers_lock:
+        if _broadcast_job_workers_started:
+            return
+        _broadcast_job_workers_started = True
+
+        # batch های نیمه‌کاره بدون job (ارسال از داخل ربات) قابل ادامه نیستند: محتوا و پارامترهای ارسال
+        # فقط برای job ها ذخیره می‌شود؛ پیام‌های تحویل‌شده آن‌ها در sent_messages باقی می‌ماند
+        db_execute("""
+            UPDATE broadcast_batches SET status = 'interrupted'
+            WHERE status = 'running' AND (job_id IS NULL OR job_id NOT IN
+                (SELECT job_id FROM broadcast_jobs WHERE status IN ('queued', 'running')))
+        """)
+        # job هایی که هنگام توقف برنامه در حال اجرا بودند از آخرین checkpoint ادامه داده می‌شوند
+        db_execute("UPDATE broadcast_jobs SET status = 'queued' WHERE status = 'running'")
+        for row in db_fetchall("SELECT job_id FROM broadcast_jobs WHERE status = 'queued' ORDER BY job_id"):
+            broadcast_job_queue.put(row['job_id'])
+
+        for i in range(BROADCAST_JOB_WORKERS):
+            Thread(target=broadcast_job_worker, daemon=True, name=f"broadcast-job-worker-{i}").start()
+        logger.info(f"[Broadcast Job] Started {BROADCAST_JOB_WORKERS} broadcast job workers")
+
+@app.route('/api/broadcast_jobs/<int:job_id>', methods=['GET'])
+def api_broadcast_job_status(job_id: int):
+    """وضعیت و شمارنده‌های زنده یک job ارسال انبوه"""
+    try:
+        job = db_fetchone("""
+            SELECT job_id, platforms, status, sent, failed, total, progress, result, error,
+                   created_at, started_at, finished_at
+            FROM broadcast_jobs WHERE job_id = ?
+        """, (job_id,))
+        if not job:
+            return jsonify({"error": "Broadcast job not found."}), 404
+
+        live_progress = broadcast_job_progress.get(job_id)
+        if live_progress is not None:
+            platforms_progress = {platform: dict(p) for platform, p in live_progress.items()}
+            sent = sum(p.get('sent', 0) for p in platforms_progress.values())
+            failed = sum(p.get('failed', 0) for p in platforms_progress.values())
+            total = sum(p.get('total', 0) for p in platforms_progress.values())
+        else:
+            platforms_progress = json.loads(job['progress']) if job['progress'] else {}
+            sent, failed, total = job['sent'], job['failed'], job['total']
+
+        return jsonify({
+            "job_id": job['job_id'],
+            "status": job['status'],
+            "platforms": job['platforms'].split(',') if job['platforms'] else [],
+            "sent": sent,
+            "failed": failed,
+            "total": total,
+            "platform_progress": platforms_progress,
+            "result": json.loads(job['result']) if job['result'] else None,
+            "error": job['error'],
+            "created_at": job['created_at'],
+            "started_at": job['started_at'],
+            "finished_at": job['finished_at']
+        })
+    except Exception as e:
+        logger.error(f"[Flask API] Error in /api/broadcast_jobs/{job_id}: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/broadcast', methods=['POST'])
 def api_broadcast():
     try: # مدیریت خطاهای کلی Flask برای اطمینان از پاسخ JSON
-        import asyncio
         logger.info(f"[Flask API] Broadcast request received")
         
         # Check if request is JSON or form data
@@ -7393,35 +9003,15 @@ def api_broadcast():
             return jsonify({"error": "No valid content provided for broadcast (internal error in content type detection)."}), 400
 
 
-        # Handle multiple platforms
-        results = []
+        # Build one task per platform; the heavy sending runs in the background job workers
+        platform_tasks = []
         
         for platform in platforms:
             logger.info(f"[Flask API] Processing platform: {platform}")
             
-            loop_target, app_target, owner_id_target = None, None, None
-
-            if platform == 'telegram':
-                if not telegram_bot_loop or not telegram_app: 
-                    logger.error(f"[Flask API] Telegram bot not initialized")
-                    results.append({"error": "Telegram bot not initialized.", "platform": platform})
-                    continue
-                loop_target, app_target, owner_id_target = telegram_bot_loop, telegram_app, OWNER_ID
-                logger.info(f"[Flask API] Using Telegram bot")
-            elif platform == 'bale':
-                if not bale_bot_loop or not bale_app: 
-                    logger.error(f"[Flask API] Bale bot not initialized")
-                    results.append({"error": "Bale bot not initialized.", "platform": platform})
-                    continue
-                loop_target, app_target, owner_id_target = bale_bot_loop, bale_app, BALE_OWNER_ID
-                logger.info(f"[Flask API] Using Bale bot")
-            elif platform == 'ita':
-                # ایتا از API مستقیم استفاده می‌کند، نیازی به loop و app ندارد
-                loop_target, app_target, owner_id_target = None, None, ITA_OWNER_ID
-                logger.info(f"[Flask API] Using Ita direct API")
-            else:
+            if platform not in ('telegram', 'bale', 'ita'):
                 logger.error(f"[Flask API] Invalid platform: {platform}")
-                results.append({"error": f"Invalid platform: {platform}", "platform": platform})
+                platform_tasks.append({"platform": platform, "result": {"error": f"Invalid platform: {platform}", "platform": platform}})
                 continue
 
             # Get original media name from uploaded file
@@ -7431,9 +9021,24 @@ def api_broadcast():
                 if file and file.filename:
                     original_media_name = file.filename
 
+            broadcast_kwargs = {
+                'scopes': scopes, 'platform': platform,
+                'text': content_text_param, 
+                'photo_path': file_path if file_type == 'photo' else None,
+                'video_path': file_path if file_type == 'video' else None,
+                'document_path': file_path if file_type == 'document' else None,
+                'forward_from_chat_id': forward_from_chat_id if has_forwarding else None,
+                'forward_from_message_id': forward_from_message_id if has_forwarding else None,
+                'original_media_name': original_media_name,
+                'source_platform': 'telegram' if file_path and 'temp/' in file_path else platform,
+                'pin_message': pin_message,
+            }
+
             # Tag filtering logic
             tag_filter = request.form.get("tag_filter", "").strip()
             send_to_tagged = request.form.get("send_to_tagged", "false") == "true"
+            # any (پیش‌فرض): حداقل یکی از تگ‌ها، all: همه تگ‌ها
+            match_all_tags = request.form.get("tag_match", "any") == "all"
 
             # اگر گزینه تگ فعال است، فهرست چت‌ها را بر اساس تگ محدود کن
             if send_to_tagged and tag_filter:
@@ -7441,129 +9046,37 @@ def api_broadcast():
                 tag_list = [tag.strip() for tag in tag_filter.split(',') if tag.strip()]
                 logger.info(f"📌 Broadcasting only to chats with tags: {tag_list}")
                 
-                # ساخت query برای جستجوی چندین تگ
-                if len(tag_list) == 1:
-                    # یک تگ
-                    tagged_chats = db_fetchall("""
-                        SELECT chat_id, platform FROM chats WHERE tags LIKE ? AND platform = ?
-                    """, (f"%{tag_list[0]}%", platform))
-                else:
-                    # چندین تگ - استفاده از OR
-                    placeholders = ' OR '.join(['tags LIKE ?' for _ in tag_list])
-                    params = [f"%{tag}%" for tag in tag_list] + [platform]
-                    tagged_chats = db_fetchall(f"""
-                        SELECT chat_id, platform FROM chats WHERE ({placeholders}) AND platform = ?
-                    """, params)
-                
-                if not tagged_chats:
+                target_chats = get_target_ids_by_scope(scopes, platform, tags=tag_list, match_all_tags=match_all_tags)
+                if not any(target_chats.values()):
                     logger.warning(f"No chats found with tags '{tag_filter}' in platform '{platform}'. Skipping this platform.")
-                    results.append({
+                    platform_tasks.append({"platform": platform, "result": {
                         "sent": 0, 
                         "failed": 0, 
                         "batch_id": None, 
                         "platform": platform, 
                         "content_preview": f"No chats with tags '{tag_filter}' found in {platform}",
                         "skipped": True
-                    })
+                    }})
                     continue
 
-                # تبدیل به ساختار مناسب برای perform_broadcast_async
-                target_chats = {}
-                for chat in tagged_chats:
-                    platform_chat = chat["platform"]
-                    target_chats.setdefault(platform_chat, []).append(chat["chat_id"])
-
-                # اضافه کردن target_chats به broadcast_kwargs
-                broadcast_kwargs = {
-                    'app': app_target, 'scopes': scopes, 'platform': platform, 'owner_id': owner_id_target,
-                    'text': content_text_param, 
-                    'photo_path': file_path if file_type == 'photo' else None,
-                    'video_path': file_path if file_type == 'video' else None,
-                    'document_path': file_path if file_type == 'document' else None,
-                    'forward_from_chat_id': forward_from_chat_id if has_forwarding else None,
-                    'forward_from_message_id': forward_from_message_id if has_forwarding else None,
-                    'original_media_name': original_media_name,
-                    'source_platform': 'telegram' if file_path and 'temp/' in file_path else platform,
-                    'pin_message': pin_message,
-                    'target_chats': target_chats,
-                }
-            else:
-                broadcast_kwargs = {
-                    'app': app_target, 'scopes': scopes, 'platform': platform, 'owner_id': owner_id_target,
-                    'text': content_text_param, 
-                    'photo_path': file_path if file_type == 'photo' else None,
-                    'video_path': file_path if file_type == 'video' else None,
-                    'document_path': file_path if file_type == 'document' else None,
-                    'forward_from_chat_id': forward_from_chat_id if has_forwarding else None,
-                    'forward_from_message_id': forward_from_message_id if has_forwarding else None,
-                    'original_media_name': original_media_name,
-                    'source_platform': 'telegram' if file_path and 'temp/' in file_path else platform,
-                    'pin_message': pin_message,
-                }
+                # ساختار {scope: [chat_id, ...]} مناسب perform_broadcast_async (قابل ذخیره در params job)
+                broadcast_kwargs['target_chats'] = {scope: sorted(ids) for scope, ids in target_chats.items()}
 
             content_type = 'forwarding' if has_forwarding else ('text' if content_text_param and not file_type else file_type)
-            logger.info(f"[Flask API] Initiating broadcast for {platform} with scopes {scopes} and content type: {content_type}. File path: {file_path}. Text/Caption: {content_text_param}. Forward: {forward_from_chat_id}:{forward_from_message_id if has_forwarding else 'None'}")
-            
-            if platform == 'ita':
-                # ایتا از API مستقیم استفاده می‌کند، نیازی به asyncio.run_coroutine_threadsafe ندارد
-                result = asyncio.run(perform_broadcast_async(**broadcast_kwargs))
-                # اضافه کردن اطلاعات جزئی محتوا به نتیجه API
-                if result and 'detailed_content_info' not in result:
-                    result['detailed_content_info'] = result.get('preview_content', '')
-                results.append(result)
-            else:
-                # Check if the target loop is still running and not closed
-                if loop_target and loop_target.is_closed():
-                    logger.error(f"[Flask API] Target event loop for {platform} is closed. Cannot perform broadcast.")
-                    if file_path and os.path.exists(file_path): os.remove(file_path)
-                    results.append({"error": f"Bot service for {platform} is not available. Please restart the application.", "platform": platform})
-                    continue
-                
-                try:
-                    fut_result = asyncio.run_coroutine_threadsafe(perform_broadcast_async(**broadcast_kwargs), loop_target)
-                except RuntimeError as e:
-                    if "Event loop is closed" in str(e):
-                        logger.error(f"[Flask API] Event loop is closed for {platform}. Cannot perform broadcast.")
-                        if file_path and os.path.exists(file_path): os.remove(file_path)
-                        results.append({"error": f"Bot service for {platform} is not available. Please restart the application.", "platform": platform})
-                        continue
-                    else:
-                        raise e
-            
-                try:
-                    result = fut_result.result(timeout=120)
-                    # اضافه کردن اطلاعات جزئی محتوا به نتیجه API
-                    if result and 'detailed_content_info' not in result:
-                        result['detailed_content_info'] = result.get('preview_content', '')
-                    results.append(result)
-                except asyncio.TimeoutError:
-                    if file_path and os.path.exists(file_path): os.remove(file_path)
-                    logger.error(f"[Flask API] Broadcast timed out for {platform}. Temp file {file_path} deleted.")
-                    results.append({"error": "Broadcast operation timed out.", "platform": platform})
-                except RuntimeError as e:
-                    if "Event loop is closed" in str(e):
-                        logger.error(f"[Flask API] Event loop closed during broadcast for {platform}: {e}")
-                        if file_path and os.path.exists(file_path): os.remove(file_path)
-                        results.append({"error": f"Bot service for {platform} became unavailable during broadcast. Please restart the application.", "platform": platform})
-                    else:
-                        raise e
-                except Exception as e:
-                    if file_path and os.path.exists(file_path): os.remove(file_path)
-                    logger.error(f"[Flask API] Error during broadcast for {platform}: {e}. Temp file {file_path} deleted.", exc_info=True)
-                    results.append({"error": f"Failed to perform broadcast: {str(e)}", "platform": platform})
+            logger.info(f"[Flask API] Queueing broadcast for {platform} with scopes {scopes} and content type: {content_type}. File path: {file_path}. Text/Caption: {content_text_param}. Forward: {forward_from_chat_id}:{forward_from_message_id if has_forwarding else 'None'}")
+            platform_tasks.append({"platform": platform, "kwargs": broadcast_kwargs})
         
-        # محاسبه آمار کلی
-        total_sent = sum(r.get('sent', 0) for r in results if 'sent' in r)
-        total_failed = sum(r.get('failed', 0) for r in results if 'failed' in r)
+        job_id = enqueue_broadcast_job(platform_tasks)
+        if not job_id:
+            return jsonify({"error": "Failed to queue broadcast job."}), 500
         
-        # بازگشت نتیجه کلی
+        # پاسخ فوری؛ پیشرفت از طریق /api/broadcast_jobs/<job_id> قابل پیگیری است
         return jsonify({
-            "sent": total_sent,
-            "failed": total_failed,
-            "platform_results": results,
-            "total_platforms": len(platforms),
-            "successful_platforms": len([r for r in results if r.get('sent', 0) > 0])
-        })
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": f"/api/broadcast_jobs/{job_id}",
+            "total_platforms": len(platforms)
+        }), 202
     except Exception as e: # مدیریت خطاهای غیرمنتظره در خود مسیر Flask
         logger.critical(f"[Flask API] Uncaught exception in /api/broadcast: {e}", exc_info=True)
         return jsonify({"error": f"An unexpected server error occurred during broadcast: {str(e)}"}), 500
@@ -7581,51 +9094,28 @@ def api_history():
         # محاسبه offset
         offset = (page - 1) * limit
         
-        # دریافت تعداد کل رکوردها
-        total_count_query = """
-            SELECT COUNT(*) FROM broadcast_batches 
-            WHERE is_deleted = 0
-        """
-        total_count = db_fetchall(total_count_query)[0][0]
+        # دریافت تعداد کل رکوردها (ایندکس جزئی idx_broadcast_batches_history)
+        total_count = db_fetchone("SELECT COUNT(*) FROM broadcast_batches WHERE is_deleted = 0")[0]
         total_pages = (total_count + limit - 1) // limit  # محاسبه تعداد صفحات
         
-        # دریافت داده‌ها با صفحه‌بندی
+        # دریافت داده‌ها با صفحه‌بندی؛ نتیجه هر batch در پایان ارسال ثبت شده است
+        # (batchهای بدون شمارنده - در حال اجرا، متوقف‌شده یا قدیمی - از sent_messages و آرشیو آن شمرده می‌شوند)
         rows = db_fetchall("""
-            SELECT bb.batch_id, bb.scope, bb.platform, bb.content_preview, 
-                   bb.timestamp,
-                   COUNT(sm.message_id) as sent_count
+            SELECT bb.batch_id, bb.scope, bb.platform, bb.content_preview, bb.timestamp,
+                   bb.target_count, bb.failed_count, bb.scope_counts,
+                   COALESCE(bb.sent_count,
+                            (SELECT COUNT(*) FROM sent_messages sm WHERE sm.batch_id = bb.batch_id)
+                            + COALESCE((SELECT a.message_count FROM sent_messages_archive a WHERE a.batch_id = bb.batch_id), 0)) as sent_count
             FROM broadcast_batches bb
-            LEFT JOIN sent_messages sm ON bb.batch_id = sm.batch_id
             WHERE bb.is_deleted = 0
-            GROUP BY bb.batch_id, bb.scope, bb.platform, bb.content_preview, bb.timestamp
             ORDER BY bb.timestamp DESC 
             LIMIT ? OFFSET ?
         """, (limit, offset))
         
         result = []
         for r in rows:
-            # محاسبه تعداد ناموفق بر اساس scope و platform
-            target_count = 0
-            scopes = r['scope'].split(',') if r['scope'] else []
-            
-            # تخمین تعداد هدف بر اساس scope و platform
-            for scope in scopes:
-                scope = scope.strip()
-                if r['platform'] == 'telegram':
-                    count_query = "SELECT COUNT(*) FROM chats WHERE platform='telegram' AND is_active=1 AND chat_type=? AND (chat_type != 'private' OR chat_id != ?)"
-                    count_result = db_fetchall(count_query, (scope, str(OWNER_ID)))
-                elif r['platform'] == 'bale':
-                    count_query = "SELECT COUNT(*) FROM chats WHERE platform='bale' AND is_active=1 AND chat_type=? AND (chat_type != 'private' OR chat_id != ?)"
-                    count_result = db_fetchall(count_query, (scope, str(BALE_OWNER_ID)))
-                else:  # ita
-                    count_query = "SELECT COUNT(*) FROM chats WHERE platform='ita' AND is_active=1 AND chat_type=?"
-                    count_result = db_fetchall(count_query, (scope,))
-                
-                if count_result:
-                    target_count += count_result[0][0]
-            
             sent_count = r['sent_count'] or 0
-            failed_count = max(0, target_count - sent_count)
+            failed_count = r['failed_count'] or 0
             
             # تبدیل زمان به شمسی
             timestamp_shamsi = r['timestamp']
@@ -7653,6 +9143,8 @@ def api_history():
                 'content_preview': r['content_preview'], 
                 'sent': sent_count,
                 'failed': failed_count,
+                'target': r['target_count'],
+                'scope_counts': json.loads(r['scope_counts']) if r['scope_counts'] else None,
                 'timestamp': timestamp_shamsi
             })
         
@@ -7716,7 +9208,7 @@ def api_delete_broadcast_batch(batch_id: int):
             # ایتا از API مستقیم استفاده می‌کند، نیازی به loop و app ندارد
             # اجرای حذف پیام‌های ایتا به صورت مستقیم
             try:
-                result = asyncio.run(delete_messages_async(None, batch_id, platform))
+                result = asyncio.run(ita_client.run_and_close(delete_messages_async(None, batch_id, platform)))
                 return jsonify({"success": True, "deleted_from_platform": result.get('deleted',0), "failed_on_platform": result.get('failed',0)})
             except Exception as e:
                 logger.error(f"[Flask API] Error during ITA deletion for batch {batch_id}: {e}", exc_info=True)
@@ -7793,9 +9285,9 @@ def api_trigger_report(platform: str):
                     if platform == 'ita':
                         # ایتا از API مستقیم استفاده می‌کند - استفاده از asyncio.run برای sync context
                         try:
-                            chat_info = asyncio.run(get_ita_chat_info(cid_str))
+                            chat_info = asyncio.run(ita_client.run_and_close(get_ita_chat_info(cid_str)))
                             if chat_info:
-                                members = asyncio.run(get_ita_chat_member_count(cid_str))
+                                members = asyncio.run(ita_client.run_and_close(get_ita_chat_member_count(cid_str)))
                                 report_data.append({"ID": cid_str, "Title": chat_info.get('title', '') or (f"{chat_info.get('first_name', '')} {chat_info.get('last_name', '')}".strip()), 
                                                   "Type": ctype_db, "Members": members, "Username": chat_info.get('username', '')})
                             else:
@@ -7874,526 +9366,454 @@ def api_trigger_report(platform: str):
         logger.error(f"[Flask API] Error triggering report for {platform}: {e}", exc_info=True)
         return jsonify({"error": f"Failed to trigger report: {str(e)}"}), 500
 
+# تعداد ردیف‌هایی که در خروجی‌های stream شده با هم ارسال می‌شوند
+REPORT_STREAM_BATCH_ROWS = getattr(config, 'REPORT_STREAM_BATCH_ROWS', 500)
+
+# ستون‌های هر چت در گزارش جامع (ترتیب ستون‌های CSV)
+COMPREHENSIVE_REPORT_FIELDS = [
+    'chat_id', 'platform', 'chat_type', 'name', 'username', 'is_active', 'tags',
+    'created_at', 'last_active', 'current_members', 'last_metrics_update'
+]
+
+def _comprehensive_report_chats() -> Iterator[Dict[str, Any]]:
+    """
+    چت‌های گزارش جامع به ترتیب جدیدترین، ردیف به ردیف از cursor دیتابیس
+    ترتیب روی ایندکس idx_chats_list_created است تا بدون مرتب‌سازی کل جدول اولین ردیف فوراً برسد
+    """
+    sort_expr = CHAT_LIST_SORTS['created_at'][0]
+    for chat in db_iterate(f"""
+        SELECT c.chat_id, c.platform, c.chat_type, c.name, c.username, c.is_active, c.tags,
+               c.created_at, c.last_active,
+               COALESCE(m.members_count, 1) as current_members,
+               m.date_key as last_metrics_update
+        FROM chats c
+        LEFT JOIN chats_latest_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
+        ORDER BY {sort_expr} DESC, c.rowid DESC
+    """):
+        yield {
+            'chat_id': str(chat['chat_id']),
+            'platform': str(chat['platform']),
+            'chat_type': str(chat['chat_type']),
+            'name': str(chat['name']) if chat['name'] else None,
+            'username': str(chat['username']) if chat['username'] else None,
+            'is_active': bool(chat['is_active']),
+            'tags': str(chat['tags']) if chat['tags'] else None,
+            'created_at': str(chat['created_at']) if chat['created_at'] else None,
+            'last_active': str(chat['last_active']) if chat['last_active'] else None,
+            'current_members': int(chat['current_members']),
+            'last_metrics_update': str(chat['last_metrics_update']) if chat['last_metrics_update'] else None
+        }
+
+def build_comprehensive_summary() -> Dict[str, Any]:
+    """
+    بخش خلاصه گزارش جامع (زمان تولید، آمار هر پلتفرم، آمار ارسال‌ها)؛ همه تجمیع‌ها در SQL
+    - تعداد چت‌ها: چت‌های فعال بدون ادمین‌های تلگرام و بله
+    - تعداد اعضا: آخرین metrics گروه‌ها و کانال‌ها؛ اگر پلتفرمی metrics نداشت تعداد چت‌ها جایگزین می‌شود
+    """
+    rows = db_fetchall("""
+        SELECT c.platform, c.chat_type,
+               SUM(CASE WHEN c.is_active = 1
+                         AND NOT (c.chat_type = 'private' AND ((c.platform = 'telegram' AND c.chat_id = ?)
+                                                             OR (c.platform = 'bale' AND c.chat_id = ?)))
+                        THEN 1 ELSE 0 END) as cnt,
+               SUM(CASE WHEN c.chat_type != 'private' THEN m.members_count END) as total_members
+        FROM chats c
+        LEFT JOIN chats_latest_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
+        WHERE c.platform IN ('telegram', 'bale', 'ita')
+        GROUP BY c.platform, c.chat_type
+    """, (str(OWNER_ID), str(BALE_OWNER_ID)))
+    
+    counts = {pf: {} for pf in ('telegram', 'bale', 'ita')}
+    member_counts = {pf: {} for pf in ('telegram', 'bale', 'ita')}
+    for r in rows:
+        if r['cnt']:
+            counts[r['platform']][r['chat_type']] = r['cnt']
+        if r['total_members'] is not None:
+            member_counts[r['platform']][r['chat_type']] = r['total_members']
+    
+    summary = {}
+    for pf in ('telegram', 'bale', 'ita'):
+        # اگر metrics خالی است، از جدول chats استفاده کن
+        pf_members = member_counts[pf] or dict(counts[pf])
+        summary[pf] = {
+            "total_chats": sum(counts[pf].values()),
+            "total_members": sum(pf_members.values()),
+            "users": counts[pf].get("private", 0),
+            "groups": counts[pf].get("group", 0),
+            "channels": counts[pf].get("channel", 0),
+            "users_members": pf_members.get("private", 0),
+            "groups_members": pf_members.get("group", 0),
+            "channels_members": pf_members.get("channel", 0)
+        }
+    summary["grand_totals"] = {
+        "total_chats": sum(summary[pf]["total_chats"] for pf in ('telegram', 'bale', 'ita')),
+        "total_members": sum(summary[pf]["total_members"] for pf in ('telegram', 'bale', 'ita')),
+        "total_users": sum(summary[pf]["users"] for pf in ('telegram', 'bale', 'ita')),
+        "total_groups": sum(summary[pf]["groups"] for pf in ('telegram', 'bale', 'ita')),
+        "total_channels": sum(summary[pf]["channels"] for pf in ('telegram', 'bale', 'ita'))
+    }
+    
+    # آمار ارسال‌ها (شمارنده‌های ثبت‌شده در هر batch)
+    broadcast_stats = db_fetchall("""
+        SELECT platform, COUNT(*) as total_broadcasts, 
+               SUM(sent_count) as total_sent, 
+               SUM(failed_count) as total_failed
+        FROM broadcast_batches 
+        WHERE timestamp >= datetime('now', '-30 days')
+        GROUP BY platform
+    """)
+    
+    broadcast_data = {}
+    for stat in broadcast_stats:
+        broadcast_data[stat['platform']] = {
+            'total_broadcasts': int(stat['total_broadcasts']),
+            'total_sent': int(stat['total_sent'] or 0),
+            'total_failed': int(stat['total_failed'] or 0)
+        }
+    
+    # تبدیل زمان تولید گزارش به شمسی
+    report_time = datetime.now()
+    try:
+        import jdatetime
+        jdt = jdatetime.datetime.fromgregorian(year=report_time.year, month=report_time.month, day=report_time.day, 
+                                             hour=report_time.hour, minute=report_time.minute, second=report_time.second)
+        report_time_shamsi = jdt.strftime('%Y/%m/%d %H:%M:%S')
+    except Exception:
+        report_time_shamsi = report_time.strftime("%Y-%m-%d %H:%M:%S")
+    
+    return {
+        "report_generated_at": report_time_shamsi,
+        "summary": summary,
+        "broadcast_statistics": broadcast_data
+    }
+
 @app.route('/api/comprehensive_report', methods=['GET'])
 def api_comprehensive_report():
-    """گزارش جامع از تمام چت‌ها و آمار سیستم"""
+    """
+    گزارش جامع از تمام چت‌ها و آمار سیستم
+    پارامتر format:
+    - json (پیش‌فرض): یک سند JSON شامل detailed_chats
+    - ndjson: خط اول {"type": "summary", ...} و سپس هر چت در یک خط {"type": "chat", ...}
+    - csv: فقط لیست چت‌ها (با BOM برای اکسل)
+    در ndjson و csv ردیف‌ها همزمان با خواندن از دیتابیس ارسال می‌شوند و حافظه به تعداد چت‌ها وابسته نیست
+    """
     try:
-        # دریافت آمار کلی
-        stats_data = {}
-        
-        # آمار چت‌ها (بدون ادمین‌ها)
-        t_rows = db_fetchall("SELECT chat_type, COUNT(*) as cnt FROM chats WHERE platform='telegram' AND is_active=1 AND (chat_type != 'private' OR chat_id != ?) GROUP BY chat_type", (str(OWNER_ID),))
-        b_rows = db_fetchall("SELECT chat_type, COUNT(*) as cnt FROM chats WHERE platform='bale' AND is_active=1 AND (chat_type != 'private' OR chat_id != ?) GROUP BY chat_type", (str(BALE_OWNER_ID),))
-        i_rows = db_fetchall("SELECT chat_type, COUNT(*) as cnt FROM chats WHERE platform='ita' AND is_active=1 GROUP BY chat_type")
-        
-        telegram_counts = {r['chat_type']: r['cnt'] for r in t_rows}
-        bale_counts = {r['chat_type']: r['cnt'] for r in b_rows}
-        ita_counts = {r['chat_type']: r['cnt'] for r in i_rows}
-        
-        # آمار اعضا
-        telegram_members = db_fetchall("""
-            SELECT c.chat_type, SUM(m.members_count) as total_members
-            FROM chats_metrics m
-            JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
-            WHERE m.platform = 'telegram' AND c.chat_type != 'private' AND m.date_key = (
-                SELECT MAX(date_key) FROM chats_metrics WHERE chat_id = m.chat_id AND platform = m.platform
-            )
-            GROUP BY c.chat_type
-        """)
-        telegram_member_counts = {r['chat_type']: r['total_members'] for r in telegram_members}
-        
-        bale_members = db_fetchall("""
-            SELECT c.chat_type, SUM(m.members_count) as total_members
-            FROM chats_metrics m
-            JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
-            WHERE m.platform = 'bale' AND c.chat_type != 'private' AND m.date_key = (
-                SELECT MAX(date_key) FROM chats_metrics WHERE chat_id = m.chat_id AND platform = m.platform
-            )
-            GROUP BY c.chat_type
-        """)
-        bale_member_counts = {r['chat_type']: r['total_members'] for r in bale_members}
-        
-        ita_members = db_fetchall("""
-            SELECT c.chat_type, SUM(m.members_count) as total_members
-            FROM chats_metrics m
-            JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
-            WHERE m.platform = 'ita' AND c.chat_type != 'private' AND m.date_key = (
-                SELECT MAX(date_key) FROM chats_metrics WHERE chat_id = m.chat_id AND platform = m.platform
-            )
-            GROUP BY c.chat_type
-        """)
-        ita_member_counts = {r['chat_type']: r['total_members'] for r in ita_members}
-        
-        # اگر metrics خالی است، از جدول chats استفاده کن
-        if not telegram_member_counts:
-            telegram_member_counts = {chat_type: count for chat_type, count in telegram_counts.items()}
-        if not bale_member_counts:
-            bale_member_counts = {chat_type: count for chat_type, count in bale_counts.items()}
-        if not ita_member_counts:
-            ita_member_counts = {chat_type: count for chat_type, count in ita_counts.items()}
-        
-        # محاسبه مجموع‌ها
-        telegram_total_chats = sum(telegram_counts.values())
-        bale_total_chats = sum(bale_counts.values())
-        ita_total_chats = sum(ita_counts.values())
-        telegram_total_members = sum(telegram_member_counts.values()) if telegram_member_counts else 0
-        bale_total_members = sum(bale_member_counts.values()) if bale_member_counts else 0
-        ita_total_members = sum(ita_member_counts.values()) if ita_member_counts else 0
-        
-        # آمار ارسال‌ها
-        broadcast_stats = db_fetchall("""
-            SELECT platform, COUNT(*) as total_broadcasts, 
-                   SUM(sent_count) as total_sent, 
-                   SUM(failed_count) as total_failed
-            FROM broadcast_batches 
-            WHERE created_at >= datetime('now', '-30 days')
-            GROUP BY platform
-        """)
-        
-        broadcast_data = {}
-        for stat in broadcast_stats:
-            broadcast_data[stat['platform']] = {
-                'total_broadcasts': int(stat['total_broadcasts']),
-                'total_sent': int(stat['total_sent'] or 0),
-                'total_failed': int(stat['total_failed'] or 0)
-            }
-        
-        # لیست کامل چت‌ها (مرتب شده بر اساس آخرین عضویت)
-        all_chats_raw = db_fetchall("""
-            SELECT c.*, 
-                   COALESCE(m.members_count, 1) as current_members,
-                   m.date_key as last_metrics_update
-            FROM chats c
-            LEFT JOIN chats_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
-                AND m.date_key = (
-                    SELECT MAX(date_key) FROM chats_metrics 
-                    WHERE chat_id = c.chat_id AND platform = c.platform
-                )
-            ORDER BY c.created_at DESC, c.platform, c.chat_type, c.name
-        """)
-        
-        # تبدیل Row objects به dictionary برای JSON serialization
-        all_chats = []
-        for chat in all_chats_raw:
-            chat_dict = {
-                'chat_id': str(chat['chat_id']),
-                'platform': str(chat['platform']),
-                'chat_type': str(chat['chat_type']),
-                'name': str(chat['name']) if chat['name'] else None,
-                'username': str(chat['username']) if chat['username'] else None,
-                'is_active': bool(chat['is_active']),
-                'tags': str(chat['tags']) if chat['tags'] else None,
-                'created_at': str(chat['created_at']) if chat['created_at'] else None,
-                'last_active': str(chat['last_active']) if chat['last_active'] else None,
-                'current_members': int(chat['current_members']),
-                'last_metrics_update': str(chat['last_metrics_update']) if chat['last_metrics_update'] else None
-            }
-            all_chats.append(chat_dict)
-        
-        # ساخت گزارش جامع
-        # تبدیل زمان تولید گزارش به شمسی
-        report_time = datetime.now()
-        try:
-            import jdatetime
-            jdt = jdatetime.datetime.fromgregorian(year=report_time.year, month=report_time.month, day=report_time.day, 
-                                                 hour=report_time.hour, minute=report_time.minute, second=report_time.second)
-            report_time_shamsi = jdt.strftime('%Y/%m/%d %H:%M:%S')
-        except Exception:
-            report_time_shamsi = report_time.strftime("%Y-%m-%d %H:%M:%S")
-        
-        comprehensive_report = {
-            "report_generated_at": report_time_shamsi,
-            "summary": {
-                "telegram": {
-                    "total_chats": telegram_total_chats,
-                    "total_members": telegram_total_members,
-                    "users": telegram_counts.get("private", 0),
-                    "groups": telegram_counts.get("group", 0),
-                    "channels": telegram_counts.get("channel", 0),
-                    "users_members": telegram_member_counts.get("private", 0),
-                    "groups_members": telegram_member_counts.get("group", 0),
-                    "channels_members": telegram_member_counts.get("channel", 0)
-                },
-                "bale": {
-                    "total_chats": bale_total_chats,
-                    "total_members": bale_total_members,
-                    "users": bale_counts.get("private", 0),
-                    "groups": bale_counts.get("group", 0),
-                    "channels": bale_counts.get("channel", 0),
-                    "users_members": bale_member_counts.get("private", 0),
-                    "groups_members": bale_member_counts.get("group", 0),
-                    "channels_members": bale_member_counts.get("channel", 0)
-                },
-                "ita": {
-                    "total_chats": ita_total_chats,
-                    "total_members": ita_total_members,
-                    "users": ita_counts.get("private", 0),
-                    "groups": ita_counts.get("group", 0),
-                    "channels": ita_counts.get("channel", 0),
-                    "users_members": ita_member_counts.get("private", 0),
-                    "groups_members": ita_member_counts.get("group", 0),
-                    "channels_members": ita_member_counts.get("channel", 0)
-                },
-                "grand_totals": {
-                    "total_chats": telegram_total_chats + bale_total_chats + ita_total_chats,
-                    "total_members": telegram_total_members + bale_total_members + ita_total_members,
-                    "total_users": telegram_counts.get("private", 0) + bale_counts.get("private", 0) + ita_counts.get("private", 0),
-                    "total_groups": telegram_counts.get("group", 0) + bale_counts.get("group", 0) + ita_counts.get("group", 0),
-                    "total_channels": telegram_counts.get("channel", 0) + bale_counts.get("channel", 0) + ita_counts.get("channel", 0)
-                }
-            },
-            "broadcast_statistics": broadcast_data,
-            "detailed_chats": all_chats
-        }
-        
+        report_format = request.args.get('format', 'json').lower()
+        if report_format not in ('json', 'ndjson', 'csv'):
+            return jsonify({"error": "format must be one of: json, ndjson, csv"}), 400
+        
+        comprehensive_report = build_comprehensive_summary() if report_format != 'csv' else None
+        
+        if report_format == 'ndjson':
+            def generate_ndjson():
+                yield json.dumps({"type": "summary", **comprehensive_report}, ensure_ascii=False) + "\n"
+                lines = []
+                for chat in _comprehensive_report_chats():
+                    lines.append(json.dumps({"type": "chat", **chat}, ensure_ascii=False))
+                    if len(lines) >= REPORT_STREAM_BATCH_ROWS:
+                        yield "\n".join(lines) + "\n"
+                        lines = []
+                if lines:
+                    yield "\n".join(lines) + "\n"
+            return Response(generate_ndjson(), mimetype='application/x-ndjson')
+        
+        if report_format == 'csv':
+            def generate_csv():
+                buffer = io.StringIO()
+                writer = csv.DictWriter(buffer, fieldnames=COMPREHENSIVE_REPORT_FIELDS)
+                buffer.write('\ufeff')
+                writer.writeheader()
+                for index, chat in enumerate(_comprehensive_report_chats(), 1):
+                    writer.writerow(chat)
+                    if index % REPORT_STREAM_BATCH_ROWS == 0:
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+                yield buffer.getvalue()
+            filename = f"comprehensive_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+            return Response(generate_csv(), mimetype='text/csv',
+                            headers={'Content-Disposition': f'attachment; filename={filename}'})
+        
+        comprehensive_report["detailed_chats"] = list(_comprehensive_report_chats())
         return jsonify(comprehensive_report)
         
     except Exception as e:
         logger.error(f"[Flask API] Error generating comprehensive report: {e}", exc_info=True)
         return jsonify({"error": f"Failed to generate comprehensive report: {str(e)}"}), 500
 
-@app.route('/api/generate_excel_report', methods=['POST'])
-def api_generate_excel_report():
-    """تولید و دانلود گزارش اکسلی - دقیقاً مطابق گزارش جامع ربات"""
+# =========== Streaming Excel Report ===========
+EXCEL_PLATFORM_NAMES = {'telegram': 'تلگرام', 'bale': 'بله', 'ita': 'ایتا'}
+
+def _excel_platform_name(platform: str) -> str:
+    return EXCEL_PLATFORM_NAMES.get(platform, 'ایتا')
+
+def _excel_chat_link(platform: str, username: str) -> str:
+    if not username:
+        return ''
+    if platform == 'telegram':
+        return f"https://t.me/{username}"
+    if platform == 'bale':
+        return f"https://ble.ir/{username}"
+    if platform == 'ita':
+        return f"https://eitaa.com/{username}"
+    return ''
+
+@functools.lru_cache(maxsize=8192)
+def _jalali_day(date_key: str) -> Optional[str]:
+    """تبدیل YYYY-MM-DD به YYYY/MM/DD شمسی؛ هر روز فقط یک بار محاسبه می‌شود (تعداد روزهای متمایز کم است)"""
+    if not jdatetime:
+        return None
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "JSON data required"}), 400
-        
-        selected_platforms = data.get('platforms', ['telegram', 'bale', 'ita'])
-        if not isinstance(selected_platforms, list):
-            selected_platforms = [selected_platforms]
-        
-        # بررسی نصب pandas
-        try:
-            import pandas as pd
-            import openpyxl
-        except ImportError:
-            logger.error("pandas or openpyxl not installed. Please install them with: pip install pandas openpyxl")
-            return jsonify({"error": "pandas or openpyxl library not installed"}), 500
-        
-        # --- شیت ۱: لیست چت‌ها (مطابق ربات) ---
-        df_chats = pd.DataFrame()
-        rows_all = []
-        
-        for pf in selected_platforms:
-            db_rows = db_fetchall("SELECT chat_id, chat_type, name, username, created_at FROM chats WHERE platform= ?", (pf,))
-            for r in db_rows:
-                cid_str = r['chat_id']
-                cid = int(cid_str) if str(cid_str).lstrip('-').isdigit() else None
-                name_db, user_db, created_at = r['name'], r['username'], r['created_at']
-                
-                # اطلاعات پایه (بدون fetch_live_info برای سرعت)
-                name_final = name_db or ''
-                username_final = user_db or ''
-                link = ''
-                if username_final:
-                    if pf == 'telegram':
-                        link = f"https://t.me/{username_final}"
-                    elif pf == 'bale':
-                        link = f"https://ble.ir/{username_final}"
-                    elif pf == 'ita':
-                        link = f"https://eitaa.com/{username_final}"
-                
-                # تبدیل تاریخ به شمسی
-                date_display = created_at or ''
-                if created_at and jdatetime:
-                    try:
-                        y, m, d = int(created_at[0:4]), int(created_at[5:7]), int(created_at[8:10])
-                        hh, mm, ss = int(created_at[11:13]), int(created_at[14:16]), int(created_at[17:19])
-                        jdt = jdatetime.datetime.fromgregorian(year=y, month=m, day=d, hour=hh, minute=mm, second=ss)
-                        date_display = jdt.strftime('%Y/%m/%d %H:%M:%S')
-                    except Exception: 
-                        pass
-                
-                # تعداد اعضا از metrics
-                member_count = 1
-                if r['chat_type'] == 'private':
-                    # برای کاربران خصوصی، تعداد اعضا همیشه 1 است
-                    member_count = 1
-                else:
-                    try:
-                        member_row = db_fetchone("""
-                            SELECT members_count FROM chats_metrics 
-                            WHERE chat_id = ? AND platform = ? 
-                            ORDER BY date_key DESC LIMIT 1
-                        """, (cid_str, pf))
-                        if member_row and member_row['members_count']:
-                            member_count = member_row['members_count']
-                            # اگر تعداد اعضا صفر است، آن را به یک تبدیل کن
-                            if member_count == 0:
-                                member_count = 1
-                    except Exception:
-                        pass
-                
-                # دریافت تگ‌های چت
-                chat_tags = get_chat_tags(cid_str, pf) or 'ندارد'
-                
-                rows_all.append({
-                    'پلتفرم': 'تلگرام' if pf == 'telegram' else ('بله' if pf == 'bale' else 'ایتا'),
-                    'شناسه چت': cid_str, 'نوع چت': r['chat_type'], 'نام': name_final,
-                    'نام‌کاربری': username_final or 'ندارد', 'لینک': link or 'ندارد', 
-                    'تگ‌ها': chat_tags, 'تعداد اعضا': member_count,
-                    'تاریخ ثبت': date_display, '_sort': created_at or ''
-                })
-        
-        if rows_all:
-            df_chats = pd.DataFrame(rows_all)
-            if '_sort' in df_chats.columns: 
-                df_chats = df_chats.sort_values(by=['_sort'], ascending=False)
-            df_chats = df_chats[['پلتفرم','شناسه چت','نوع چت','نام','نام‌کاربری','لینک','تگ‌ها','تعداد اعضا','تاریخ ثبت']]
-        else:
-            df_chats = pd.DataFrame(columns=['پلتفرم','شناسه چت','نوع چت','نام','نام‌کاربری','لینک','تگ‌ها','تعداد اعضا','تاریخ ثبت'])
+        y, m, d = int(date_key[0:4]), int(date_key[5:7]), int(date_key[8:10])
+        return jdatetime.date.fromgregorian(year=y, month=m, day=d).strftime('%Y/%m/%d')
+    except Exception:
+        return None
+
+def _jalali_timestamp(timestamp: Optional[str], seconds: bool = True) -> Optional[str]:
+    """تبدیل YYYY-MM-DD HH:MM:SS به شمسی؛ بخش ساعت تغییر نمی‌کند پس فقط روز تبدیل می‌شود"""
+    if not timestamp or len(timestamp) < 19:
+        return timestamp
+    day = _jalali_day(timestamp[:10])
+    if day is None:
+        return timestamp
+    return f"{day} {timestamp[11:19] if seconds else timestamp[11:16]}"
+
+def _excel_chat_rows(selected_platforms: list) -> Iterator[list]:
+    """شیت لیست چت‌ها: چت + آخرین تعداد اعضا + تگ‌ها در یک کوئری، جدیدترین اول (روی idx_chats_list_created)"""
+    if not selected_platforms:
+        return
+    sort_expr = CHAT_LIST_SORTS['created_at'][0]
+    for r in db_iterate(f"""
+        SELECT c.platform, c.chat_id, c.chat_type, c.name, c.username, c.tags, c.created_at, m.members_count
+        FROM chats c
+        LEFT JOIN chats_latest_metrics m ON m.chat_id = c.chat_id AND m.platform = c.platform
+        WHERE c.platform IN ({','.join('?' * len(selected_platforms))})
+        ORDER BY {sort_expr} DESC, c.rowid DESC
+    """, tuple(selected_platforms)):
+        pf, username = r['platform'], r['username'] or ''
+        # برای کاربران خصوصی، تعداد اعضا همیشه 1 است
+        member_count = 1 if r['chat_type'] == 'private' else (r['members_count'] or 1)
+        yield [
+            _excel_platform_name(pf), r['chat_id'], r['chat_type'], r['name'] or '',
+            username or 'ندارد', _excel_chat_link(pf, username) or 'ندارد',
+            r['tags'] or 'ندارد', member_count, _jalali_timestamp(r['created_at']) or ''
+        ]
 
-        # --- شیت ۲: گزارش ارسال‌ها (مطابق ربات) ---
-        df_broadcasts = pd.DataFrame()
-        q_platforms = ' AND b.platform IN ({})'.format(','.join('?'*len(selected_platforms))) if selected_platforms else ''
-        params = selected_platforms
-        sql = f"""
+def _excel_broadcast_rows(selected_platforms: list) -> Iterator[list]:
+    """شیت گزارش ارسال‌ها: هر batch با تفکیک نوع چت‌های دریافت‌کننده"""
+    if not selected_platforms:
+        return
+    for r in db_iterate(f"""
         SELECT b.platform, b.batch_id, b.scope, b.content_preview, b.timestamp,
-               COUNT(s.message_id) as total_sent,
-               SUM(CASE WHEN c.chat_type = 'private' THEN 1 ELSE 0 END) as private_cnt,
-               SUM(CASE WHEN c.chat_type = 'group' THEN 1 ELSE 0 END) as group_cnt,
-               SUM(CASE WHEN c.chat_type = 'channel' THEN 1 ELSE 0 END) as channel_cnt
+               COUNT(s.message_id) + COALESCE(MAX(a.message_count), 0) as total_sent,
+               SUM(CASE WHEN c.chat_type = 'private' THEN 1 ELSE 0 END) + COALESCE(MAX(a.private_cnt), 0) as private_cnt,
+               SUM(CASE WHEN c.chat_type = 'group' THEN 1 ELSE 0 END) + COALESCE(MAX(a.group_cnt), 0) as group_cnt,
+               SUM(CASE WHEN c.chat_type = 'channel' THEN 1 ELSE 0 END) + COALESCE(MAX(a.channel_cnt), 0) as channel_cnt
         FROM broadcast_batches b
         LEFT JOIN sent_messages s ON b.batch_id = s.batch_id
+        LEFT JOIN sent_messages_archive a ON a.batch_id = b.batch_id
         LEFT JOIN chats c ON s.chat_id = c.chat_id AND b.platform = c.platform
-        WHERE 1=1 {q_platforms}
-        GROUP BY b.batch_id, b.platform, b.scope, b.content_preview, b.timestamp
+        WHERE b.platform IN ({','.join('?' * len(selected_platforms))})
+        GROUP BY b.batch_id
         ORDER BY b.timestamp DESC
-        """
-        
-        try:
-            rows_broadcasts = db_fetchall(sql, tuple(params))
-        except Exception as e:
-            logger.error(f"Error fetching broadcast data: {e}")
-            rows_broadcasts = []
-        
-        broadcast_data = []
-        if rows_broadcasts:
-            for r in rows_broadcasts:
-                tstamp = r['timestamp']
-                date_display = tstamp
-                if jdatetime and tstamp:
-                    try:
-                        y, m, d, hh, mm, ss = map(int, [tstamp[0:4], tstamp[5:7], tstamp[8:10], tstamp[11:13], tstamp[14:16], tstamp[17:19]])
-                        jdt = jdatetime.datetime.fromgregorian(year=y, month=m, day=d, hour=hh, minute=mm, second=ss)
-                        date_display = jdt.strftime('%Y/%m/%d %H:%M')
-                    except Exception: 
-                        pass
-                
-                platform_name = {
-                    'telegram': 'تلگرام',
-                    'bale': 'بله',
-                    'ita': 'ایتا'
-                }.get(r['platform'], r['platform'])
-                
-                broadcast_data.append({
-                    'پلتفرم': platform_name,
-                    'شناسه دسته': r['batch_id'], 'تاریخ': date_display, 'مقصدها': r['scope'],
-                    'پیش‌نمایش محتوا': r['content_preview'], 'تعداد کل ارسال': r['total_sent'] or 0,
-                    'کاربران': r['private_cnt'] or 0, 'گروه‌ها': r['group_cnt'] or 0, 'کانال‌ها': r['channel_cnt'] or 0,
-                    '_sort': tstamp
-                })
-        
-        if broadcast_data:
-            df_broadcasts = pd.DataFrame(broadcast_data)
-            if '_sort' in df_broadcasts.columns: 
-                df_broadcasts = df_broadcasts.sort_values(by=['_sort'], ascending=False)
-            df_broadcasts = df_broadcasts[['پلتفرم','شناسه دسته','تاریخ','مقصدها','پیش‌نمایش محتوا','تعداد کل ارسال','کاربران','گروه‌ها','کانال‌ها']]
-        else:
-            df_broadcasts = pd.DataFrame(columns=['پلتفرم','شناسه دسته','تاریخ','مقصدها','پیش‌نمایش محتوا','تعداد کل ارسال','کاربران','گروه‌ها','کانال‌ها'])
-
-        # --- شیت ۳: آمار روزانه اعضا (مطابق ربات) ---
-        df_daily_pivot = pd.DataFrame()
-        q_platforms_daily = ' AND m.platform IN ({})'.format(','.join('?'*len(selected_platforms))) if selected_platforms else ''
-        params_daily = selected_platforms
-        sql_daily = f"""
-        SELECT m.platform, m.chat_id, m.date_key, m.members_count,
-               c.chat_type, c.name, c.username
-        FROM chats_metrics m
-        LEFT JOIN chats c ON c.chat_id=m.chat_id AND c.platform=m.platform
-        WHERE 1=1 {q_platforms_daily} AND c.chat_type != 'private'
-        """
-        
-        try:
-            rows_daily = db_fetchall(sql_daily, tuple(params_daily))
-        except Exception as e:
-            logger.error(f"Error fetching daily data: {e}")
-            rows_daily = []
-        
-        daily_data = []
-        if rows_daily:
-            for r in rows_daily:
-                pf = r['platform']
-                uname, nm = r['username'] or '', r['name'] or ''
-                link = ''
-                if uname:
-                    if pf == 'telegram':
-                        link = f"https://t.me/{uname}"
-                    elif pf == 'bale':
-                        link = f"https://ble.ir/{uname}"
-                    elif pf == 'ita':
-                        link = f"https://eitaa.com/{uname}"
-                
-                date_display = r['date_key']
-                if jdatetime: 
-                    try:
-                        y,m,d = map(int, r['date_key'].split('-'))
-                        date_display = jdatetime.date.fromgregorian(year=y, month=m, day=d).strftime('%Y/%m/%d')
-                    except Exception: 
-                        pass
-                
-                daily_data.append({
-                    'پلتفرم': 'تلگرام' if pf=='telegram' else ('بله' if pf=='bale' else 'ایتا'), 
-                    'شناسه چت': r['chat_id'], 'نوع چت': r['chat_type'],
-                    'نام': nm, 'نام‌کاربری': uname, 'لینک': link, 'تاریخ': date_display,
-                    'تعداد اعضا': r['members_count'], '_date_key': r['date_key']
-                })
-        
-        if daily_data:
-            df_daily_raw = pd.DataFrame(daily_data)
-            if not df_daily_raw.empty:
-                idx_cols = ['پلتفرم','شناسه چت','نوع چت','نام','نام‌کاربری','لینک']
-                pivot = df_daily_raw.pivot_table(index=idx_cols, columns='_date_key', values='تعداد اعضا', aggfunc='last')
-                pivot = pivot.reindex(sorted(pivot.columns, reverse=True), axis=1)
-                date_map = df_daily_raw.drop_duplicates('_date_key').set_index('_date_key')['تاریخ'].to_dict()
-                pivot.rename(columns=date_map, inplace=True)
-                df_daily_pivot = pivot.reset_index()
-        else:
-            df_daily_pivot = pd.DataFrame(columns=['پلتفرم','شناسه چت','نوع چت','نام','نام‌کاربری','لینک'])
-
-        # --- شیت ۴: تحلیل رشد (مطابق ربات) ---
-        df_growth = pd.DataFrame()
-        q_platforms_growth = '({})'.format(','.join('?'*len(selected_platforms))) if selected_platforms else '()'
-        params_growth = selected_platforms
+    """, tuple(selected_platforms)):
+        yield [
+            EXCEL_PLATFORM_NAMES.get(r['platform'], r['platform']), r['batch_id'],
+            _jalali_timestamp(r['timestamp'], seconds=False), r['scope'], r['content_preview'],
+            r['total_sent'] or 0, r['private_cnt'] or 0, r['group_cnt'] or 0, r['channel_cnt'] or 0
+        ]
 
-        # محاسبه تاریخ شروع و پایان برای تحلیل رشد (30 روز گذشته)
-        from datetime import datetime as dt, timedelta
-        end_date = dt.now().strftime('%Y-%m-%d')
-        start_date = (dt.now() - timedelta(days=30)).strftime('%Y-%m-%d')
-        
-        sql_growth = f"""
+def _excel_daily_member_sheet(selected_platforms: list) -> Tuple[list, Iterator[list]]:
+    """
+    شیت آمار روزانه اعضا: هر چت یک ردیف و هر روز یک ستون (جدیدترین روز اول)
+    به جای pivot در pandas، ردیف‌های هر چت پشت سر هم (ترتیب کلید اصلی chats_metrics) خوانده و همان لحظه نوشته می‌شوند
+    """
+    idx_cols = ['پلتفرم', 'شناسه چت', 'نوع چت', 'نام', 'نام‌کاربری', 'لینک']
+    if not selected_platforms:
+        return idx_cols, iter(())
+    date_keys = [r['date_key'] for r in db_fetchall(f"""
+        SELECT DISTINCT m.date_key
+        FROM chats_metrics m
+        JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
+        WHERE m.platform IN ({','.join('?' * len(selected_platforms))}) AND c.chat_type != 'private'
+        ORDER BY m.date_key DESC
+    """, tuple(selected_platforms))]
+    header = idx_cols + [_jalali_day(d) or d for d in date_keys]
+
+    def rows() -> Iterator[list]:
+        # ترتیب ردیف‌ها مثل pivot قبلی: نام فارسی پلتفرم، سپس شناسه چت
+        for pf in sorted(selected_platforms, key=_excel_platform_name):
+            current, values = None, {}
+            for r in db_iterate("""
+                SELECT m.chat_id, m.date_key, m.members_count, c.chat_type, c.name, c.username
+                FROM chats_metrics m
+                JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
+                WHERE m.platform = ? AND c.chat_type != 'private'
+                ORDER BY m.chat_id, m.date_key
+            """, (pf,)):
+                if current is None or current[1] != r['chat_id']:
+                    if current is not None:
+                        yield current + [values.get(d) for d in date_keys]
+                    username = r['username'] or ''
+                    current = [_excel_platform_name(pf), r['chat_id'], r['chat_type'], r['name'] or '',
+                               username, _excel_chat_link(pf, username)]
+                    values = {}
+                values[r['date_key']] = r['members_count']
+            if current is not None:
+                yield current + [values.get(d) for d in date_keys]
+    return header, rows()
+
+def _excel_growth_rows(selected_platforms: list) -> Iterator[list]:
+    """شیت تحلیل رشد ۳۰ روز گذشته (اولین و آخرین metrics هر چت در بازه)"""
+    if not selected_platforms:
+        return
+    end_date = datetime.now().strftime('%Y-%m-%d')
+    start_date = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+    for r in db_iterate(f"""
         WITH rng AS (
           SELECT chat_id, platform,
                  MIN(date_key) AS d_start,
                  MAX(date_key) AS d_end
           FROM chats_metrics
-          WHERE date_key BETWEEN ? AND ? AND platform IN {q_platforms_growth}
+          WHERE date_key BETWEEN ? AND ? AND platform IN ({','.join('?' * len(selected_platforms))})
           GROUP BY chat_id, platform
-        ),
-        s AS (
-          SELECT m.chat_id, m.platform, m.members_count AS start_members
-          FROM chats_metrics m
-          JOIN rng ON rng.chat_id=m.chat_id AND rng.platform=m.platform AND rng.d_start=m.date_key
-        ),
-        e AS (
-          SELECT m.chat_id, m.platform, m.members_count AS end_members
-          FROM chats_metrics m
-          JOIN rng ON rng.chat_id=m.chat_id AND rng.platform=m.platform AND rng.d_end=m.date_key
         )
         SELECT r.platform, r.chat_id, r.d_start, r.d_end,
-               s.start_members, e.end_members,
+               s.members_count AS start_members, e.members_count AS end_members,
                c.chat_type, c.name, c.username
         FROM rng r
-        LEFT JOIN s ON s.chat_id=r.chat_id AND s.platform=r.platform
-        LEFT JOIN e ON e.chat_id=r.chat_id AND e.platform=r.platform
-        LEFT JOIN chats c ON c.chat_id=r.chat_id AND c.platform=r.platform
+        LEFT JOIN chats_metrics s ON s.chat_id = r.chat_id AND s.platform = r.platform AND s.date_key = r.d_start
+        LEFT JOIN chats_metrics e ON e.chat_id = r.chat_id AND e.platform = r.platform AND e.date_key = r.d_end
+        LEFT JOIN chats c ON c.chat_id = r.chat_id AND c.platform = r.platform
         WHERE c.is_active = 1 AND c.chat_type != 'private'
-        """
+    """, (start_date, end_date, *selected_platforms)):
+        pf, username = r['platform'], r['username'] or ''
+        start_m, end_m = r['start_members'] or 0, r['end_members'] or 0
+        growth = end_m - start_m
+        growth_pct = (growth / start_m * 100.0) if start_m > 0 else (100.0 if end_m > 0 else 0.0)
         
-        params_growth_with_dates = [start_date, end_date] + params_growth
+        # محاسبه تعداد روزها بین تاریخ شروع و پایان
         try:
-            rows_growth = db_fetchall(sql_growth, tuple(params_growth_with_dates))
-        except Exception as e:
-            logger.error(f"Error fetching growth data: {e}")
-            rows_growth = []
-        
-        growth_data = []
-        if rows_growth:
-            for r in rows_growth:
-                pf = r['platform']
-                uname, nm = r['username'] or '', r['name'] or ''
-                link = ''
-                if uname:
-                    if pf == 'telegram':
-                        link = f"https://t.me/{uname}"
-                    elif pf == 'bale':
-                        link = f"https://ble.ir/{uname}"
-                    elif pf == 'ita':
-                        link = f"https://eitaa.com/{uname}"
-                
-                start_m, end_m = r['start_members'] or 0, r['end_members'] or 0
-                growth = end_m - start_m
-                growth_pct = (growth / start_m * 100.0) if start_m > 0 else (100.0 if end_m > 0 else 0.0)
-                
-                # محاسبه تعداد روزها بین تاریخ شروع و پایان
-                try:
-                    start_date_obj = dt.strptime(r['d_start'], '%Y-%m-%d')
-                    end_date_obj = dt.strptime(r['d_end'], '%Y-%m-%d')
-                    days = (end_date_obj - start_date_obj).days + 1
-                except Exception:
-                    days = 1
-                
-                avg_daily = growth / float(days) if days > 0 else 0
-                start_disp, end_disp = r['d_start'], r['d_end']
-                
-                if jdatetime:
-                    try:
-                        y1,m1,d1 = map(int, start_disp.split('-'))
-                        y2,m2,d2 = map(int, end_disp.split('-'))
-                        start_disp = jdatetime.date.fromgregorian(year=y1, month=m1, day=d1).strftime('%Y/%m/%d')
-                        end_disp = jdatetime.date.fromgregorian(year=y2, month=m2, day=d2).strftime('%Y/%m/%d')
-                    except Exception: 
-                        pass
-                
-                growth_data.append({
-                    'پلتفرم': 'تلگرام' if pf=='telegram' else ('بله' if pf=='bale' else 'ایتا'),
-                    'شناسه چت': r['chat_id'], 'نوع چت': r['chat_type'], 'نام': nm,
-                    'نام‌کاربری': uname, 'لینک': link, 'اعضا در شروع': start_m,
-                    'اعضا در پایان': end_m, 'رشد خالص': growth, 'رشد درصدی': round(growth_pct, 2),
-                    'میانگین رشد روزانه': round(avg_daily, 2), 'تاریخ شروع': start_disp, 'تاریخ پایان': end_disp
-                })
+            days = (datetime.strptime(r['d_end'], '%Y-%m-%d') - datetime.strptime(r['d_start'], '%Y-%m-%d')).days + 1
+        except Exception:
+            days = 1
+        avg_daily = growth / float(days) if days > 0 else 0
         
-        if growth_data:
-            df_growth = pd.DataFrame(growth_data)
-        else:
-            df_growth = pd.DataFrame(columns=['پلتفرم','شناسه چت','نوع چت','نام','نام‌کاربری','لینک','اعضا در شروع','اعضا در پایان','رشد خالص','رشد درصدی','میانگین رشد روزانه','تاریخ شروع','تاریخ پایان'])
+        yield [
+            _excel_platform_name(pf), r['chat_id'], r['chat_type'], r['name'] or '',
+            username, _excel_chat_link(pf, username), start_m, end_m, growth, round(growth_pct, 2),
+            round(avg_daily, 2), _jalali_day(r['d_start']) or r['d_start'], _jalali_day(r['d_end']) or r['d_end']
+        ]
 
-        # --- ایجاد فایل اکسل با نام فارسی و تاریخ شمسی ---
-        import time
-        ts = int(time.time())
-        
-        # نام فایل با تاریخ شمسی
-        if jdatetime:
-            try:
-                now = dt.now()
-                jdt = jdatetime.datetime.fromgregorian(year=now.year, month=now.month, day=now.day, hour=now.hour, minute=now.minute)
-                date_str = jdt.strftime('%Y%m%d_%H%M')
-                filename = f"گزارش_مختصر_عملکرد_{date_str}.xlsx"
-            except Exception:
-                filename = f"گزارش_مختصر_عملکرد_{ts}.xlsx"
-        else:
-            filename = f"گزارش_مختصر_عملکرد_{ts}.xlsx"
-        
-        file_path = os.path.join(UPLOAD_FOLDER, filename)
-        
-        # --- شیت ۵: آمار ربات‌ها ---
-        df_bot_stats = generate_bot_statistics_sheet(selected_platforms)
+def _dataframe_rows(df) -> Iterator[list]:
+    """ردیف‌های یک DataFrame کوچک (شیت‌های آمار ربات) بدون NaN"""
+    for row in df.itertuples(index=False, name=None):
+        yield [None if isinstance(v, float) and v != v else v for v in row]
+
+def write_excel_streaming(file_path: str, sheets: List[Tuple[str, list, Iterable[list]]]) -> int:
+    """
+    نوشتن شیت‌ها به صورت جریانی: هر ردیف همان لحظه روی دیسک نوشته می‌شود
+    - اگر xlsxwriter نصب باشد در حالت constant_memory (چند برابر سریع‌تر)، وگرنه openpyxl در حالت write-only
+    sheets: [(نام شیت، سرستون‌ها، ردیف‌ها)]؛ خروجی: تعداد کل ردیف‌ها
+    """
+    total_rows = 0
+    try:
+        import xlsxwriter
+    except ImportError:
+        xlsxwriter = None
+    
+    if xlsxwriter:
+        # متن‌ها همان‌طور که هستند نوشته شوند (نامی که با = شروع شود فرمول نشود)
+        workbook = xlsxwriter.Workbook(file_path, {
+            'constant_memory': True, 'tmpdir': tempfile.gettempdir(),
+            'strings_to_formulas': False, 'strings_to_urls': False, 'strings_to_numbers': False
+        })
+        try:
+            for title, header, rows in sheets:
+                sheet = workbook.add_worksheet(title)
+                sheet.write_row(0, 0, header)
+                for row_index, row in enumerate(rows, 1):
+                    sheet.write_row(row_index, 0, row)
+                    total_rows += 1
+        finally:
+            workbook.close()
+        return total_rows
+    
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    for title, header, rows in sheets:
+        sheet = workbook.create_sheet(title=title)
+        sheet.append(header)
+        for row in rows:
+            sheet.append(row)
+            total_rows += 1
+    workbook.save(file_path)
+    return total_rows
+
+def excel_report_download_name() -> str:
+    """نام فایل گزارش اکسل با تاریخ شمسی"""
+    ts = int(time.time())
+    if jdatetime:
+        try:
+            now = datetime.now()
+            jdt = jdatetime.datetime.fromgregorian(year=now.year, month=now.month, day=now.day, hour=now.hour, minute=now.minute)
+            return f"گزارش_مختصر_عملکرد_{jdt.strftime('%Y%m%d_%H%M')}.xlsx"
+        except Exception:
+            pass
+    return f"گزارش_مختصر_عملکرد_{ts}.xlsx"
+
+def build_excel_report(selected_platforms: list, file_path: str):
+    """
+    ساخت گزارش اکسلی کامل (مطابق گزارش جامع ربات) در file_path
+    شیت‌ها ردیف به ردیف از cursor دیتابیس نوشته می‌شوند (حافظه به تعداد چت‌ها وابسته نیست)
+    """
+    # --- شیت ۵ و ۶: آمار ربات‌ها (جدول‌های کوچک) ---
+    df_bot_stats = generate_bot_statistics_sheet(selected_platforms)
+    df_daily_bot_stats = generate_daily_bot_statistics_sheet(selected_platforms)
+    
+    daily_header, daily_rows = _excel_daily_member_sheet(selected_platforms)
+    sheets = [
+        ("لیست چت‌ها", ['پلتفرم','شناسه چت','نوع چت','نام','نام‌کاربری','لینک','تگ‌ها','تعداد اعضا','تاریخ ثبت'],
+         _excel_chat_rows(selected_platforms)),
+        ("گزارش ارسال انبوه", ['پلتفرم','شناسه دسته','تاریخ','مقصدها','پیش‌نمایش محتوا','تعداد کل ارسال','کاربران','گروه‌ها','کانال‌ها'],
+         _excel_broadcast_rows(selected_platforms)),
+        ("آمار روزانه اعضا", daily_header, daily_rows),
+        ("تحلیل رشد", ['پلتفرم','شناسه چت','نوع چت','نام','نام‌کاربری','لینک','اعضا در شروع','اعضا در پایان','رشد خالص','رشد درصدی','میانگین رشد روزانه','تاریخ شروع','تاریخ پایان'],
+         _excel_growth_rows(selected_platforms)),
+        ("آمار ربات‌ها", [str(c) for c in df_bot_stats.columns], _dataframe_rows(df_bot_stats)),
+        ("آمار روزانه ربات‌ها", [str(c) for c in df_daily_bot_stats.columns], _dataframe_rows(df_daily_bot_stats)),
+    ]
+    
+    started = time.monotonic()
+    total_rows = write_excel_streaming(file_path, sheets)
+    logger.info(f"[Reports] Excel report written: {total_rows} rows in {time.monotonic() - started:.1f}s")
+
+@app.route('/api/generate_excel_report', methods=['POST'])
+def api_generate_excel_report():
+    """
+    تولید و دانلود گزارش اکسلی - دقیقاً مطابق گزارش جامع ربات
+    از طریق report_builder: اگر داده‌ها از ساخت قبلی تغییر نکرده باشند فایل کش‌شده فوراً برگردانده می‌شود
+    (برای ساخت پس‌زمینه بدون منتظر ماندن از POST /api/reports استفاده کنید)
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "JSON data required"}), 400
         
-        # --- شیت ۶: آمار روزانه ربات‌ها ---
-        df_daily_bot_stats = generate_daily_bot_statistics_sheet(selected_platforms)
+        selected_platforms = data.get('platforms', ['telegram', 'bale', 'ita'])
+        if not isinstance(selected_platforms, list):
+            selected_platforms = [selected_platforms]
         
-        with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-            df_chats.to_excel(writer, sheet_name="لیست چت‌ها", index=False)
-            df_broadcasts.to_excel(writer, sheet_name="گزارش ارسال انبوه", index=False)
-            df_daily_pivot.to_excel(writer, sheet_name="آمار روزانه اعضا", index=False)
-            df_growth.to_excel(writer, sheet_name="تحلیل رشد", index=False)
-            df_bot_stats.to_excel(writer, sheet_name="آمار ربات‌ها", index=False)
-            df_daily_bot_stats.to_excel(writer, sheet_name="آمار روزانه ربات‌ها", index=False)
+        # بررسی نصب openpyxl (نویسنده جایگزین وقتی xlsxwriter نصب نیست)
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            logger.error("openpyxl not installed. Please install it with: pip install openpyxl")
+            return jsonify({"error": "openpyxl library not installed"}), 500
         
-        # بازگرداندن فایل
-        return send_file(file_path, as_attachment=True, download_name=filename)
+        job = report_builder.submit('excel', selected_platforms)
+        job = report_builder.wait(job['job_id'], timeout=REPORT_SYNC_WAIT_SECONDS) or job
+        return send_report_or_pending(job, "Failed to generate Excel report")
         
     except Exception as e:
         logger.error(f"[Flask API] Error generating Excel report: {e}", exc_info=True)
@@ -8561,6 +9981,7 @@ def api_get_chat_administrators(platform: str, chat_id: str):
                 try:
                     return loop.run_until_complete(get_chat_administrators(platform, chat_id))
                 finally:
+                    ita_client.close_for_loop(loop)
                     loop.close()
             except Exception as e:
                 logger.error(f"Error in async execution: {e}")
@@ -8587,7 +10008,7 @@ def api_get_chat_members(platform: str, chat_id: str):
     try:
         # دریافت اعضای واقعی چت
         import asyncio
-        members = asyncio.run(get_chat_members(platform, chat_id))
+        members = asyncio.run(ita_client.run_and_close(get_chat_members(platform, chat_id)))
         
         # به‌روزرسانی ردیابی اعضای یکتا
         chat_type = 'channel' if chat_id.startswith('-100') else 'private'
@@ -8651,7 +10072,7 @@ def api_get_unique_member_stats():
 def populate_unique_members_from_existing_data():
     """پر کردن جداول unique_members و chat_memberships با داده‌های موجود"""
     try:
-        conn = sqlite3.connect(DB_FILE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         # دریافت تمام چت‌های فعال
@@ -8683,33 +10104,7 @@ def populate_unique_members_from_existing_data():
                 logger.info(f"Processing {len(members)} members for {platform} chat {chat_id}")
                 
                 # ذخیره اعضای یکتا و عضویت‌ها
-                for member in members:
-                    user_id = str(member.get('user_id', ''))
-                    if not user_id:
-                        continue
-                    
-                    # ذخیره عضو یکتا
-                    cursor.execute("""
-                        INSERT OR REPLACE INTO unique_members 
-                        (user_id, platform, first_name, last_name, username, is_bot, last_seen)
-                        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                    """, (
-                        user_id, 
-                        platform, 
-                        member.get('first_name'), 
-                        member.get('last_name'), 
-                        member.get('username'), 
-                        1 if member.get('is_bot', False) else 0
-                    ))
-                    
-                    # ذخیره عضویت در چت
-                    cursor.execute("""
-                        INSERT OR REPLACE INTO chat_memberships 
-                        (user_id, platform, chat_id, chat_type, joined_at, is_active)
-                        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, 1)
-                    """, (user_id, platform, chat_id, chat_type))
-                
-                conn.commit()
+                ingest_chat_members(platform, chat_id, chat_type, members)
                 logger.info(f"Successfully processed {platform} chat {chat_id}")
                 
             except Exception as e:
@@ -9248,7 +10643,7 @@ def api_promote_member():
         def run_async_promote():
             try:
                 # استفاده از asyncio.run در thread جداگانه
-                return asyncio.run(promote_chat_member(
+                return asyncio.run(ita_client.run_and_close(promote_chat_member(
                     platform=platform,
                     chat_id=chat_id,
                     user_id=user_id,
@@ -9258,7 +10653,7 @@ def api_promote_member():
                     can_restrict_members=data.get('can_restrict_members', True),
                     can_pin_messages=data.get('can_pin_messages', True),
                     can_promote_members=data.get('can_promote_members', False)
-                ))
+                )))
             except Exception as e:
                 logger.error(f"Error in async promote execution: {e}")
                 return False
@@ -9303,7 +10698,7 @@ def api_demote_member():
         def run_async_demote():
             try:
                 # استفاده از asyncio.run در thread جداگانه
-                return asyncio.run(demote_chat_member(platform, chat_id, user_id))
+                return asyncio.run(ita_client.run_and_close(demote_chat_member(platform, chat_id, user_id)))
             except Exception as e:
                 logger.error(f"Error in async demote execution: {e}")
                 return False
@@ -9339,12 +10734,12 @@ def api_pin_message():
         import asyncio
         
         # استفاده از asyncio.run به جای ایجاد loop جدید
-        success = asyncio.run(pin_chat_message(
+        success = asyncio.run(ita_client.run_and_close(pin_chat_message(
             platform=platform,
             chat_id=chat_id,
             message_id=message_id,
             disable_notification=data.get('disable_notification', False)
-        ))
+        )))
         
         return jsonify({
             'success': success,
@@ -9372,7 +10767,7 @@ def api_unpin_message():
         import asyncio
         
         # استفاده از asyncio.run به جای ایجاد loop جدید
-        success = asyncio.run(unpin_chat_message(platform, chat_id, message_id))
+        success = asyncio.run(ita_client.run_and_close(unpin_chat_message(platform, chat_id, message_id)))
         
         return jsonify({
             'success': success,
@@ -9406,21 +10801,21 @@ def api_edit_message():
         
         # استفاده از asyncio.run به جای ایجاد loop جدید
         if text:
-            success = asyncio.run(edit_message_text(
+            success = asyncio.run(ita_client.run_and_close(edit_message_text(
                 platform=platform,
                 chat_id=chat_id,
                 message_id=message_id,
                 text=text,
                 parse_mode=data.get('parse_mode', 'HTML')
-            ))
+            )))
         else:
-            success = asyncio.run(edit_message_caption(
+            success = asyncio.run(ita_client.run_and_close(edit_message_caption(
                 platform=platform,
                 chat_id=chat_id,
                 message_id=message_id,
                 caption=caption,
                 parse_mode=data.get('parse_mode', 'HTML')
-            ))
+            )))
         
         return jsonify({
             'success': success,
@@ -9452,7 +10847,7 @@ def api_send_poll():
         import asyncio
         
         # استفاده از asyncio.run به جای ایجاد loop جدید
-        success, message_id = asyncio.run(send_poll(
+        success, message_id = asyncio.run(ita_client.run_and_close(send_poll(
             platform=platform,
             chat_id=chat_id,
             question=question,
@@ -9464,7 +10859,7 @@ def api_send_poll():
             explanation=data.get('explanation'),
             open_period=data.get('open_period'),
             close_date=data.get('close_date')
-        ))
+        )))
         
         return jsonify({
             'success': success,
@@ -9477,27 +10872,25 @@ def api_send_poll():
 
 @app.route('/api/chats', methods=['GET'])
 def api_get_chats():
-    """دریافت لیست چت‌های ثبت شده"""
+    """
+    دریافت لیست چت‌های ثبت شده
+    با limit یا cursor صفحه‌بندی keyset فعال می‌شود (total و next_cursor در پاسخ)؛ بدون آن‌ها همه چت‌ها برگردانده می‌شوند
+    """
     try:
         platform = request.args.get('platform')
+        limit, cursor, sort = _chat_list_paging_args()
         
-        if platform:
-            query = "SELECT * FROM chats WHERE platform = ? AND is_active = 1 ORDER BY created_at DESC, name"
-            chats = db_fetchall(query, (platform,))
-        else:
-            query = "SELECT * FROM chats WHERE is_active = 1 ORDER BY created_at DESC, platform, name"
-            chats = db_fetchall(query)
-        
-        # تبدیل Row objects به dictionary برای JSON serialization
-        chats_list = []
-        for chat in chats:
-            chat_dict = dict(chat)
-            chats_list.append(chat_dict)
+        page = fetch_chats_page("c.*", platform=platform, active=True, sort=sort, limit=limit, cursor=cursor)
         
-        return jsonify({
+        response = {
             'success': True,
-            'chats': chats_list
-        })
+            'chats': page['rows']
+        }
+        if limit is not None:
+            response.update(total=page['total'], next_cursor=page['next_cursor'], limit=limit)
+        return jsonify(response)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"[Flask API] Error getting chats: {e}", exc_info=True)
         return jsonify({"error": f"Failed to get chats: {str(e)}"}), 500
@@ -9513,6 +10906,7 @@ def api_get_chats_by_segmentation():
         platform = request.args.get('platform')
         chat_type = request.args.get('chat_type')
         tags = request.args.get('tags')
+        match_all_tags = request.args.get('tag_match', 'any') == 'all'
         is_active = request.args.get('is_active')
         days_since_active = request.args.get('days_since_active')
         
@@ -9533,7 +10927,8 @@ def api_get_chats_by_segmentation():
             chat_type=chat_type,
             tags=tags,
             is_active=is_active_bool,
-            days_since_active=days_since_active_int
+            days_since_active=days_since_active_int,
+            match_all_tags=match_all_tags
         )
         
         return jsonify([dict(chat) for chat in chats])
@@ -9636,7 +11031,7 @@ def api_schedule_broadcast():
                 try:
                     # اجرای ارسال از دیتابیس
                     from flask import current_app
-                    asyncio.run(execute_scheduled_broadcast_from_db(scheduled_id, current_app))
+                    asyncio.run(ita_client.run_and_close(execute_scheduled_broadcast_from_db(scheduled_id, current_app)))
                 except Exception as e:
                     logger.error(f"Error executing scheduled broadcast {scheduled_id}: {e}")
             
@@ -9722,30 +11117,11 @@ async def execute_scheduled_broadcast(scheduled_id):
                         tag_list = [tag.strip() for tag in tag_filter.split(',') if tag.strip()]
                         logger.info(f"📌 Scheduled broadcast using tag filters: {tag_list}")
                         
-                        # ساخت query برای جستجوی چندین تگ
-                        if len(tag_list) == 1:
-                            # یک تگ
-                            tagged_chats = db_fetchall("""
-                                SELECT chat_id, platform FROM chats WHERE tags LIKE ? AND platform = ?
-                            """, (f"%{tag_list[0]}%", platform))
-                        else:
-                            # چندین تگ - استفاده از OR
-                            placeholders = ' OR '.join(['tags LIKE ?' for _ in tag_list])
-                            params = [f"%{tag}%" for tag in tag_list] + [platform]
-                            tagged_chats = db_fetchall(f"""
-                                SELECT chat_id, platform FROM chats WHERE ({placeholders}) AND platform = ?
-                            """, params)
-                        
-                        if not tagged_chats:
+                        target_chats = get_target_ids_by_scope(scopes, platform, tags=tag_list)
+                        if not any(target_chats.values()):
                             logger.warning(f"No chats found with tags: {tag_list} in platform: {platform}. Skipping this platform.")
                             continue
                         
-                        # تبدیل به ساختار مناسب
-                        target_chats = {}
-                        for chat in tagged_chats:
-                            platform_chat = chat["platform"]
-                            target_chats.setdefault(platform_chat, []).append(chat["chat_id"])
-                        
                         # ارسال با target_chats
                         if content_type == 'text':
                             await send_broadcast_message_with_targets(
@@ -10135,6 +11511,7 @@ def api_schedule_broadcast_old():
                     content_type, content_data, is_recurring, recurring_pattern
                 ))
             finally:
+                ita_client.close_for_loop(loop)
                 loop.close()
         
         broadcast_id = schedule_sync()
@@ -10227,6 +11604,7 @@ def api_force_sync():
                     loop.run_until_complete(discover_all_chats_from_api(platform))
                     return {platform: "synced"}
             finally:
+                ita_client.close_for_loop(loop)
                 loop.close()
         
         result = force_sync_sync()
@@ -10324,8 +11702,8 @@ def api_get_chats_by_tags():
         if not tags:
             return jsonify({"error": "tags are required"}), 400
         
-        chats = get_chats_by_tags(tags)
-        return jsonify({"success": True, "chats": chats})
+        chats = get_chats_by_tags(tags, match_all=data.get('match') == 'all', platform=data.get('platform'))
+        return jsonify({"success": True, "chats": [dict(chat) for chat in chats]})
     except Exception as e:
         logger.error(f"Error in api_get_chats_by_tags: {e}")
         return jsonify({"error": str(e)}), 500
@@ -10498,15 +11876,16 @@ def api_import_tags():
             return jsonify({"error": "Invalid file format"}), 400
         
         updated_count = 0
-        for chat_data in import_data['chats']:
-            chat_id = chat_data.get('chat_id')
-            platform = chat_data.get('platform')
-            tags = chat_data.get('tags', '')
-            
-            if chat_id and platform:
-                success = update_chat_tags(chat_id, platform, tags)
-                if success:
-                    updated_count += 1
+        with get_db_connection() as conn:
+            for chat_data in import_data['chats']:
+                chat_id = chat_data.get('chat_id')
+                platform = chat_data.get('platform')
+                tags = chat_data.get('tags', '')
+                
+                if chat_id and platform:
+                    if _apply_chat_tags(conn, str(chat_id), platform, tags):
+                        updated_count += 1
+            conn.commit()
         
         return jsonify({"success": True, "updated_count": updated_count, "message": f"Updated tags for {updated_count} chats"})
         
@@ -10527,13 +11906,13 @@ def api_growth_stats(platform: str):
 
 @app.route('/api/growth-report/<platform>', methods=['GET'])
 def api_growth_report(platform: str):
-    """تولید و دانلود گزارش رشد برای یک پلتفرم"""
+    """تولید و دانلود گزارش رشد برای یک پلتفرم (از کش report_builder در صورت عدم تغییر داده)"""
     try:
-        filepath = generate_growth_report(platform)
-        if filepath and os.path.exists(filepath):
-            return send_file(filepath, as_attachment=True, download_name=f"growth_report_{platform}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx")
-        else:
-            return jsonify({"error": "Failed to generate growth report"}), 500
+        job = report_builder.submit('growth', [platform])
+        job = report_builder.wait(job['job_id'], timeout=REPORT_SYNC_WAIT_SECONDS) or job
+        return send_report_or_pending(job, "Failed to generate growth report")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error in api_growth_report: {e}")
         return jsonify({"error": str(e)}), 500
@@ -10603,6 +11982,7 @@ def api_test_ita_member_count(chat_id: str):
         asyncio.set_event_loop(loop)
         
         result = loop.run_until_complete(test_ita_member_count(chat_id))
+        ita_client.close_for_loop(loop)
         loop.close()
         
         return jsonify({
@@ -10627,6 +12007,7 @@ def api_force_update_ita_member_count(chat_id: str):
         asyncio.set_event_loop(loop)
         
         result = loop.run_until_complete(force_update_ita_member_count(chat_id))
+        ita_client.close_for_loop(loop)
         loop.close()
         
         return jsonify(result)
@@ -10649,6 +12030,7 @@ def api_update_all_ita_member_counts():
         asyncio.set_event_loop(loop)
         
         loop.run_until_complete(check_and_update_ita_member_counts())
+        ita_client.close_for_loop(loop)
         loop.close()
         
         return jsonify({
@@ -10799,6 +12181,7 @@ def api_update_ita_snapshots():
             # ایجاد snapshot برای هر چت
             loop.run_until_complete(create_chat_snapshot(chat_id, 'ita', chat_type))
         
+        ita_client.close_for_loop(loop)
         loop.close()
         
         return jsonify({
@@ -10822,6 +12205,7 @@ def api_check_ita_member_counts():
         asyncio.set_event_loop(loop)
         
         loop.run_until_complete(check_and_update_ita_member_counts())
+        ita_client.close_for_loop(loop)
         loop.close()
         
         return jsonify({
@@ -11044,61 +12428,44 @@ def api_list_chats_v2():
     """
     API endpoint for listing registered chats with filters.
     This is an enhanced version with more filtering options.
+    With limit or cursor it returns one keyset page: {"chats", "total", "next_cursor"};
+    without them it returns the full JSON array as before.
     """
     try:
         # Get query parameters
         platform_filter = request.args.get('platform', 'all')
         type_filter = request.args.get('type', 'all')
         search_query = request.args.get('q', '').strip().lower()
+        limit, cursor, sort = _chat_list_paging_args()
         
         logger.info(f"Listing chats with filters - Platform: {platform_filter}, Type: {type_filter}, Search: {search_query}")
         
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Build the query
-            query = """
-                SELECT 
-                    chat_id, platform, chat_type, name, username, tags, 
-                    created_at, last_active,
-                    CASE 
-                        WHEN chat_type = 'private' THEN 1
-                        WHEN member_count IS NOT NULL AND member_count > 0 THEN member_count
-                        ELSE 0
-                    END as member_count
-                FROM chats
-                WHERE 1=1
-            """
-            
-            params = []
-            
-            # Apply filters
-            if platform_filter != 'all':
-                query += " AND platform = ?"
-                params.append(platform_filter)
-                
-            if type_filter != 'all':
-                query += " AND chat_type = ?"
-                params.append(type_filter)
-                
-            if search_query:
-                query += " AND (chat_id LIKE ? OR name LIKE ? OR username LIKE ?)"
-                search_term = f"%{search_query}%"
-                params.extend([search_term, search_term, search_term])
-            
-            # Order by platform and name
-            query += " ORDER BY created_at DESC, platform, LOWER(COALESCE(name, ''))"
-            
-            logger.debug(f"Executing query: {query} with params: {params}")
-            cursor.execute(query, params)
-            
-            # Convert rows to list of dicts
-            columns = [col[0] for col in cursor.description]
-            chats = [dict(zip(columns, row)) for row in cursor.fetchall()]
-            
-            logger.info(f"Found {len(chats)} matching chats")
+        page = fetch_chats_page(
+            """c.chat_id, c.platform, c.chat_type, c.name, c.username, c.tags,
+               c.created_at, c.last_active,
+               CASE 
+                   WHEN c.chat_type = 'private' THEN 1
+                   WHEN c.member_count IS NOT NULL AND c.member_count > 0 THEN c.member_count
+                   ELSE 0
+               END as member_count""",
+            platform=None if platform_filter == 'all' else platform_filter,
+            chat_type=None if type_filter == 'all' else type_filter,
+            search=search_query, sort=sort, limit=limit, cursor=cursor)
+        chats = page['rows']
+        
+        logger.info(f"Found {len(chats)} matching chats")
+        if limit is None:
             return jsonify(chats)
+        return jsonify({
+            'success': True,
+            'chats': chats,
+            'total': page['total'],
+            'next_cursor': page['next_cursor'],
+            'limit': limit
+        })
             
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Error listing chats: {str(e)}", exc_info=True)
         return jsonify({
@@ -11109,23 +12476,29 @@ def api_list_chats_v2():
 @app.route('/api/restore_chats', methods=['POST'])
 def api_restore_chats():
     """
-    API endpoint for restoring chats from backup database to main database.
+    API endpoint for restoring the main database from a snapshot.
     Use this only when main database is lost or corrupted.
+    Optional JSON body: {"backup": "<file name from /api/backups>"}; defaults to the newest snapshot.
     """
-    logger.info("Restore chats API called - restoring from backup to main database")
+    logger.info("Restore chats API called - restoring main database from snapshot")
     
     try:
-        result = restore_chats_from_backup()
+        data = request.get_json(silent=True) or {}
+        path = None
+        if data.get('backup'):
+            path = os.path.join(DB_BACKUP_DIR, os.path.basename(data['backup']))
+        result = restore_database_from_backup(path)
         
         if result:
             return jsonify({
                 'success': True,
-                'message': 'Chats restored successfully from backup database'
+                'backup': os.path.basename(result),
+                'message': 'Database restored successfully from backup'
             })
         else:
             return jsonify({
                 'success': False,
-                'error': 'Failed to restore chats from backup database'
+                'error': 'Failed to restore database from backup'
             }), 500
             
     except Exception as e:
@@ -11138,23 +12511,24 @@ def api_restore_chats():
 @app.route('/api/backup_chats', methods=['POST'])
 def api_backup_chats():
     """
-    API endpoint for updating backup database from main database.
-    This creates/updates bot_database.db with current data from multi_bot_platform.db
+    API endpoint for taking a snapshot of the main database.
+    This writes a new generation of multi_bot_platform.db into DB_BACKUP_DIR.
     """
-    logger.info("Backup chats API called - updating backup database from main database")
+    logger.info("Backup chats API called - taking database snapshot")
     
     try:
-        result = backup_chats_to_backup_db()
+        result = backup_database()
         
         if result:
             return jsonify({
                 'success': True,
-                'message': 'Chats backed up successfully to backup database'
+                'backup': os.path.basename(result),
+                'message': 'Database backed up successfully'
             })
         else:
             return jsonify({
                 'success': False,
-                'error': 'Failed to backup chats to backup database'
+                'error': 'Failed to back up database (or a backup is already running)'
             }), 500
             
     except Exception as e:
@@ -11164,14 +12538,55 @@ def api_backup_chats():
             'error': f'Unexpected error: {str(e)}'
         }), 500
 
+@app.route('/api/backups', methods=['GET'])
+def api_list_backups():
+    """
+    API endpoint for listing available database snapshots (newest first).
+    """
+    try:
+        backups = [{
+            'name': os.path.basename(path),
+            'size': os.path.getsize(path),
+            'created_at': datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+        } for path in list_database_backups()]
+        return jsonify({'success': True, 'backups': backups})
+    except Exception as e:
+        logger.error(f"Error listing backups: {e}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/retention', methods=['GET', 'POST'])
+def api_retention():
+    """
+    API endpoint for the data retention job.
+    GET returns a dry-run report (rows that would be archived/removed).
+    POST runs it now; optional JSON body: {"dry_run": true}.
+    """
+    try:
+        dry_run = request.method == 'GET' or bool((request.get_json(silent=True) or {}).get('dry_run'))
+        report = run_retention(dry_run=dry_run)
+        if report is None:
+            return jsonify({
+                'success': False,
+                'error': 'Retention failed (or is already running)'
+            }), 500
+        return jsonify({'success': True, 'report': report})
+    except Exception as e:
+        logger.error(f"Error in retention API: {e}", exc_info=True)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @app.route('/api/debug_chat_status/<platform>/<chat_id>', methods=['GET'])
 def api_debug_chat_status(platform: str, chat_id: str):
     """
     Debug endpoint to check chat status in database
     """
     try:
-        conn = sqlite3.connect(DB_FILE)
-        conn.row_factory = sqlite3.Row
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         # Check in main database
@@ -11181,19 +12596,19 @@ def api_debug_chat_status(platform: str, chat_id: str):
         )
         main_chat = cursor.fetchone()
         
-        # Check in backup database
-        backup_conn = sqlite3.connect('bot_database.db')
-        backup_conn.row_factory = sqlite3.Row
-        backup_cursor = backup_conn.cursor()
-        
-        backup_cursor.execute(
-            "SELECT * FROM chats WHERE chat_id = ? AND platform = ?",
-            (chat_id, platform)
-        )
-        backup_chat = backup_cursor.fetchone()
+        # Check in latest snapshot
+        backup_chat = None
+        backups = list_database_backups()
+        if backups:
+            backup_conn = sqlite3.connect(f"file:{backups[0]}?mode=ro", uri=True)
+            backup_conn.row_factory = sqlite3.Row
+            backup_chat = backup_conn.execute(
+                "SELECT * FROM chats WHERE chat_id = ? AND platform = ?",
+                (chat_id, platform)
+            ).fetchone()
+            backup_conn.close()
         
         conn.close()
-        backup_conn.close()
         
         return jsonify({
             'success': True,
@@ -11246,8 +12661,7 @@ def api_delete_chat():
         
         logger.info(f"Deleting chat - ID: {chat_id}, Platform: {platform}")
         
-        conn = sqlite3.connect(DB_FILE)
-        conn.row_factory = sqlite3.Row
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         try:
@@ -11291,15 +12705,9 @@ def api_delete_chat():
             conn.commit()
             
             if deleted_rows > 0:
+                chat_activity_registry.forget(chat_id, platform)
                 logger.info(f"Successfully deleted chat: {chat_id} from {platform}")
                 
-                # Update backup database after deletion
-                try:
-                    backup_chats_to_backup_db()
-                    logger.info(f"Backup updated after deleting chat {chat_id}")
-                except Exception as e:
-                    logger.warning(f"Backup update failed after deleting chat {chat_id}: {e}")
-                
                 conn.close()
                 return jsonify({
                     'success': True,
@@ -11433,6 +12841,7 @@ def api_register_ita_chat_full():
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             success = loop.run_until_complete(register_ita_chat_with_full_info(chat_id, chat_type, name, username))
+            ita_client.close_for_loop(loop)
             loop.close()
             
             if success:
@@ -11507,6 +12916,7 @@ def api_register_ita_smart():
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             success = loop.run_until_complete(register_ita_chat_with_full_info(chat_id, chat_type, name, username))
+            ita_client.close_for_loop(loop)
             loop.close()
             
             if success:
@@ -11597,6 +13007,7 @@ def api_register_ita_from_message():
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             success = loop.run_until_complete(register_ita_chat_with_full_info(chat_id, chat_type, name, username, message_data))
+            ita_client.close_for_loop(loop)
             loop.close()
             
             if success:
@@ -11681,6 +13092,7 @@ def api_register_ita_advanced_smart():
                 # استفاده از روش بدون ارسال پیام
                 success = loop.run_until_complete(register_ita_chat_with_full_info(chat_id, chat_type, name, username))
             
+            ita_client.close_for_loop(loop)
             loop.close()
             
             if success:
@@ -11750,6 +13162,7 @@ def api_test_ita_detection():
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             test_results = loop.run_until_complete(test_ita_smart_detection(chat_id))
+            ita_client.close_for_loop(loop)
             loop.close()
             
             logger.info(f"[Flask API] Detection test completed for {chat_id}")
@@ -11842,6 +13255,7 @@ def api_register_ita_from_sent_message():
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             success = loop.run_until_complete(register_ita_chat_with_full_info(chat_id, chat_type, name, username, message_response))
+            ita_client.close_for_loop(loop)
             loop.close()
             
             if success:
@@ -11911,6 +13325,7 @@ def api_test_ita_advanced_smart():
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             test_results = loop.run_until_complete(test_ita_advanced_smart_gui_style(chat_id))
+            ita_client.close_for_loop(loop)
             loop.close()
             
             logger.info(f"[Flask API] Advanced smart detection test completed for {chat_id}")
@@ -11956,7 +13371,7 @@ def api_sync_all_member_counts():
             for chat_id, platform, chat_type in chats:
                 try:
                     # دریافت تعداد اعضا از API
-                    member_count = asyncio.run(get_chat_member_count(str(chat_id), platform, chat_type))
+                    member_count = asyncio.run(ita_client.run_and_close(get_chat_member_count(str(chat_id), platform, chat_type)))
                     
                     if member_count > 0:
                         # به‌روزرسانی در جدول chats
@@ -12097,68 +13512,41 @@ def api_get_chats_with_member_count():
     
     پارامترهای اختیاری:
     - platform: فیلتر بر اساس پلتفرم (ita, tlg)
-    - limit: تعداد رکوردها (پیش‌فرض: 100)
-    - offset: شروع از رکورد (پیش‌فرض: 0)
+    - limit: تعداد رکوردها (پیش‌فرض: 100، حداکثر CHAT_LIST_MAX_LIMIT)
+    - cursor: مقدار next_cursor پاسخ قبلی (صفحه‌بندی keyset)
+    - offset: شروع از رکورد (پیش‌فرض: 0؛ فقط بدون cursor، برای سازگاری)
     """
     try:
         logger.info("📋 [Flask API] Get chats with member count request received")
         
         # دریافت پارامترها
         platform = request.args.get('platform')
-        limit = int(request.args.get('limit', 100))
+        limit, cursor, sort = _chat_list_paging_args(default_limit=100)
         offset = int(request.args.get('offset', 0))
         
         logger.info(f"[Flask API] Getting chats with member count - platform: {platform}, limit: {limit}, offset: {offset}")
         
-        # ساخت کوئری
-        where_clause = ""
-        params = []
-        
-        if platform:
-            where_clause = "WHERE c.platform = ?"
-            params.append(platform)
-        
-        query = f"""
-            SELECT 
-                c.chat_id,
-                c.platform,
-                c.name,
-                c.username,
-                c.chat_type,
-                c.created_at,
-                cm.members_count,
-                cm.date_key as last_updated
-            FROM chats c
-            LEFT JOIN chats_metrics cm ON c.chat_id = cm.chat_id AND c.platform = cm.platform
-            {where_clause}
-            ORDER BY c.created_at DESC
-            LIMIT ? OFFSET ?
-        """
-        
-        params.extend([limit, offset])
-        
-        # اجرای کوئری
-        results = db_fetchall(query, params)
+        page = fetch_chats_page(
+            "c.chat_id, c.platform, c.name, c.username, c.chat_type, c.created_at, cm.members_count, cm.date_key as last_updated",
+            platform=platform, sort=sort, limit=limit, cursor=cursor, offset=offset,
+            join="LEFT JOIN chats_latest_metrics cm ON c.chat_id = cm.chat_id AND c.platform = cm.platform")
         
         # فرمت کردن نتایج
         chats = []
-        for row in results:
+        for row in page['rows']:
             chat = {
-                'chat_id': row[0],
-                'platform': row[1],
-                'name': row[2] or 'Unknown',
-                'username': row[3] or 'None',
-                'chat_type': row[4],
-                'created_at': row[5],
-                'member_count': row[6] if row[6] is not None else 'Unknown',
-                'last_updated': row[7]
+                'chat_id': row['chat_id'],
+                'platform': row['platform'],
+                'name': row['name'] or 'Unknown',
+                'username': row['username'] or 'None',
+                'chat_type': row['chat_type'],
+                'created_at': row['created_at'],
+                'member_count': row['members_count'] if row['members_count'] is not None else 'Unknown',
+                'last_updated': row['last_updated']
             }
             chats.append(chat)
         
-        # شمارش کل رکوردها
-        count_query = f"SELECT COUNT(*) FROM chats c {where_clause}"
-        count_params = params[:-2] if platform else []
-        total_count = db_fetchone(count_query, count_params)[0]
+        total_count = page['total']
         
         logger.info(f"[Flask API] Retrieved {len(chats)} chats with member count")
         
@@ -12168,9 +13556,12 @@ def api_get_chats_with_member_count():
             "total_count": total_count,
             "limit": limit,
             "offset": offset,
-            "has_more": (offset + limit) < total_count
+            "next_cursor": page['next_cursor'],
+            "has_more": page['next_cursor'] is not None
         })
         
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
     except Exception as e:
         logger.error(f"[Flask API] Error getting chats with member count: {e}")
         return jsonify({
@@ -12341,11 +13732,11 @@ def api_analyze_chat():
         
         # Analyze based on platform
         if platform.lower() == 'ita':
-            result = asyncio.run(_get_ita_advanced_smart_info(chat_id))
+            result = asyncio.run(ita_client.run_and_close(_get_ita_advanced_smart_info(chat_id)))
         elif platform.lower() == 'telegram':
-            result = asyncio.run(_get_telegram_chat_info(chat_id))
+            result = asyncio.run(ita_client.run_and_close(_get_telegram_chat_info(chat_id)))
         elif platform.lower() == 'bale':
-            result = asyncio.run(_get_bale_chat_info(chat_id))
+            result = asyncio.run(ita_client.run_and_close(_get_bale_chat_info(chat_id)))
         else:
             return jsonify({"success": False, "error": "Unsupported platform"}), 400
         
@@ -12398,6 +13789,7 @@ def api_register_ita_chat():
                         loop = asyncio.new_event_loop()
                         asyncio.set_event_loop(loop)
                         result = loop.run_until_complete(get_ita_chat_info(str(chat_id)))
+                        ita_client.close_for_loop(loop)
                         loop.close()
                         return result
                     except Exception as e:
@@ -12537,6 +13929,7 @@ def api_force_update_ita_chat_names():
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         updated_count = loop.run_until_complete(force_update_ita_chat_names())
+        ita_client.close_for_loop(loop)
         loop.close()
         
         return jsonify({
@@ -12603,6 +13996,7 @@ def api_get_ita_chat_title(username: str):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         title = loop.run_until_complete(get_ita_chat_title_from_username(username))
+        ita_client.close_for_loop(loop)
         loop.close()
         
         return jsonify({
@@ -12677,6 +14071,7 @@ def api_update_ita_chat_name(chat_id: str):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         chat_info = loop.run_until_complete(get_ita_chat_info_simple(chat_id))
+        ita_client.close_for_loop(loop)
         loop.close()
         
         if chat_info and chat_info.get('title'):
@@ -12743,6 +14138,7 @@ def api_test_ita_chat_simple(chat_id: str):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         chat_info = loop.run_until_complete(get_ita_chat_info_simple(chat_id))
+        ita_client.close_for_loop(loop)
         loop.close()
         
         if chat_info:
@@ -12796,6 +14192,7 @@ def api_test_ita_api():
                     # Test send_ita_message
                     success, message_id = loop.run_until_complete(send_ita_message(str(chat_id), test_message))
                     
+                    ita_client.close_for_loop(loop)
                     loop.close()
                     return {
                         "chat_info": chat_info,
@@ -12885,6 +14282,7 @@ def api_sync_telegram_channel(chat_id: str):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         result = loop.run_until_complete(sync_channel())
+        ita_client.close_for_loop(loop)
         loop.close()
         
         return jsonify(result)
@@ -13002,6 +14400,7 @@ def api_scan_telegram_channels():
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         result = loop.run_until_complete(scan_channels())
+        ita_client.close_for_loop(loop)
         loop.close()
         
         return jsonify(result)
@@ -13102,6 +14501,7 @@ def api_add_telegram_channel():
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         result = loop.run_until_complete(add_channel())
+        ita_client.close_for_loop(loop)
         loop.close()
         
         return jsonify(result)
@@ -13181,6 +14581,7 @@ def api_force_register_telegram_channel(chat_id: str):
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         result = loop.run_until_complete(force_register_channel())
+        ita_client.close_for_loop(loop)
         loop.close()
         
         return jsonify(result)
@@ -13318,6 +14719,7 @@ def api_monitor_telegram_channels():
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         result = loop.run_until_complete(monitor_channels())
+        ita_client.close_for_loop(loop)
         loop.close()
         
         return jsonify(result)
@@ -13406,6 +14808,7 @@ def api_start_channel_monitoring():
                 loop = asyncio.new_event_loop()
                 asyncio.set_event_loop(loop)
                 loop.run_until_complete(monitor_channels_periodic())
+                ita_client.close_for_loop(loop)
                 loop.close()
             
             monitoring_thread = threading.Thread(target=run_monitoring, daemon=True)
@@ -13450,7 +14853,8 @@ def api_clear_all_database():
             'unique_members',
             'chat_memberships',
             'scheduled_broadcasts',
-            'broadcast_dedupe'
+            'broadcast_dedupe',
+            'broadcast_jobs'
         ]
         
         cleared_tables = []
@@ -13517,6 +14921,8 @@ def api_reset_database():
         
         # Check if database exists
         if os.path.exists(DB_FILE):
+            # اتصال‌های باز pool به فایل قدیمی اشاره می‌کنند
+            db_connection_pool.close_all()
             # Delete the database file
             os.remove(DB_FILE)
             logger.info(f"🔄 [Reset Database] Deleted database file: {DB_FILE}")
@@ -13546,18 +14952,14 @@ def api_list_chats():
     """
     try:
         platform = request.args.get('platform', 'all')
+        limit, cursor, sort = _chat_list_paging_args()
         
-        if platform == 'all':
-            query = "SELECT chat_id, chat_type, platform, name, username, created_at, last_active, is_active FROM chats ORDER BY created_at DESC, platform, chat_type, name"
-            params = ()
-        else:
-            query = "SELECT chat_id, chat_type, platform, name, username, created_at, last_active, is_active FROM chats WHERE platform = ? ORDER BY created_at DESC, chat_type, name"
-            params = (platform,)
-        
-        rows = db_fetchall(query, params)
+        page = fetch_chats_page(
+            "c.chat_id, c.chat_type, c.platform, c.name, c.username, c.created_at, c.last_active, c.is_active",
+            platform=None if platform == 'all' else platform, sort=sort, limit=limit, cursor=cursor)
         
         chats = []
-        for row in rows:
+        for row in page['rows']:
             # For private chats, set member count to 1
             member_count = 1 if row['chat_type'] == 'private' else 0
             chats.append({
@@ -13575,10 +14977,13 @@ def api_list_chats():
         return jsonify({
             "success": True,
             "chats": chats,
-            "total": len(chats),
+            "total": len(chats) if limit is None else page['total'],
+            "next_cursor": page['next_cursor'],
             "platform": platform
         })
         
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error in list chats: {e}")
         return jsonify({"error": str(e)}), 500
@@ -13617,6 +15022,7 @@ def api_clear_cache():
                     loop.run_until_complete(discover_all_chats_from_api(platform))
                     return {platform: "cleared_and_synced"}
             finally:
+                ita_client.close_for_loop(loop)
                 loop.close()
         
         result = clear_and_sync()
@@ -13661,6 +15067,7 @@ async def tele_post_init(application: TelegramApplication):
     global telegram_app, telegram_bot_loop
     telegram_app = application
     telegram_bot_loop = asyncio.get_running_loop()
+    bot_ready_events['telegram'].set()
     logger.info(f"[Telegram] Bot initialized and ready.")
     # فعال‌سازی برنامه‌ریز ثبت روزانه اعضا
     asyncio.create_task(metrics_post_init(application, 'telegram'))
@@ -13669,6 +15076,7 @@ async def bale_post_init(application: TelegramApplication):
     global bale_app, bale_bot_loop
     bale_app = application
     bale_bot_loop = asyncio.get_running_loop()
+    bot_ready_events['bale'].set()
     logger.info(f"[Bale] Bot initialized and ready.")
     # فعال‌سازی برنامه‌ریز ثبت روزانه اعضا
     asyncio.create_task(metrics_post_init(application, 'bale'))
@@ -13834,13 +15242,14 @@ async def export_handler_base(update: TelegramUpdate, context: TelegramContextTy
     broadcast_data = []
     sql = f"""
     SELECT b.batch_id, b.scope, b.content_preview, b.timestamp,
-           COUNT(s.message_id) as total_sent,
-           SUM(CASE WHEN c.chat_type = 'private' THEN 1 ELSE 0 END) as private_cnt,
-           SUM(CASE WHEN c.chat_type = 'group' THEN 1 ELSE 0 END) as group_cnt,
-           SUM(CASE WHEN c.chat_type = 'channel' THEN 1 ELSE 0 END) as channel_cnt,
+           COUNT(s.message_id) + COALESCE(MAX(a.message_count), 0) as total_sent,
+           SUM(CASE WHEN c.chat_type = 'private' THEN 1 ELSE 0 END) + COALESCE(MAX(a.private_cnt), 0) as private_cnt,
+           SUM(CASE WHEN c.chat_type = 'group' THEN 1 ELSE 0 END) + COALESCE(MAX(a.group_cnt), 0) as group_cnt,
+           SUM(CASE WHEN c.chat_type = 'channel' THEN 1 ELSE 0 END) + COALESCE(MAX(a.channel_cnt), 0) as channel_cnt,
            b.platform as platform  -- Explicitly specify the platform column from broadcast_batches
     FROM broadcast_batches b
     LEFT JOIN sent_messages s ON b.batch_id = s.batch_id
+    LEFT JOIN sent_messages_archive a ON a.batch_id = b.batch_id
     LEFT JOIN chats c ON s.chat_id = c.chat_id AND b.platform = c.platform
     WHERE b.platform = '{platform}'
     GROUP BY b.batch_id, b.scope, b.content_preview, b.timestamp, b.platform
@@ -14032,10 +15441,11 @@ async def button_handler_base(update: TelegramUpdate, context: TelegramContextTy
             batch = db_fetchone("""
                 SELECT batch_id, platform, scope, content_preview, 
                        strftime('%Y-%m-%d %H:%M', timestamp) as ts,
-                       (SELECT COUNT(*) FROM sent_messages WHERE batch_id = ?) as message_count
+                       (SELECT COUNT(*) FROM sent_messages WHERE batch_id = ?)
+                       + COALESCE((SELECT message_count FROM sent_messages_archive WHERE batch_id = ?), 0) as message_count
                 FROM broadcast_batches 
                 WHERE batch_id = ?
-            """, (batch_id, batch_id))
+            """, (batch_id, batch_id, batch_id))
             
             if batch and hasattr(batch, 'keys'):
                 batch = {key: batch[key] for key in batch.keys()}
@@ -14168,9 +15578,10 @@ async def button_handler_base(update: TelegramUpdate, context: TelegramContextTy
                 
             batch_info = db_fetchall("""
                 SELECT b.platform, b.content_preview, b.batch_id, 
-                       COUNT(s.message_id) as message_count
+                       COUNT(s.message_id) + COALESCE(MAX(a.message_count), 0) as message_count
                 FROM broadcast_batches b
                 LEFT JOIN sent_messages s ON b.batch_id = s.batch_id
+                LEFT JOIN sent_messages_archive a ON a.batch_id = b.batch_id
                 WHERE b.batch_id = ?
                 GROUP BY b.batch_id
             """, (batch_id,))
@@ -14458,12 +15869,13 @@ async def button_handler_base(update: TelegramUpdate, context: TelegramContextTy
                 params = selected_platforms
                 sql = f"""
                 SELECT b.platform, b.batch_id, b.scope, b.content_preview, b.timestamp,
-                       COUNT(s.message_id) as total_sent,
-                       SUM(CASE WHEN c.chat_type = 'private' THEN 1 ELSE 0 END) as private_cnt,
-                       SUM(CASE WHEN c.chat_type = 'group' THEN 1 ELSE 0 END) as group_cnt,
-                       SUM(CASE WHEN c.chat_type = 'channel' THEN 1 ELSE 0 END) as channel_cnt
+                       COUNT(s.message_id) + COALESCE(MAX(a.message_count), 0) as total_sent,
+                       SUM(CASE WHEN c.chat_type = 'private' THEN 1 ELSE 0 END) + COALESCE(MAX(a.private_cnt), 0) as private_cnt,
+                       SUM(CASE WHEN c.chat_type = 'group' THEN 1 ELSE 0 END) + COALESCE(MAX(a.group_cnt), 0) as group_cnt,
+                       SUM(CASE WHEN c.chat_type = 'channel' THEN 1 ELSE 0 END) + COALESCE(MAX(a.channel_cnt), 0) as channel_cnt
                 FROM broadcast_batches b
                 LEFT JOIN sent_messages s ON b.batch_id = s.batch_id
+                LEFT JOIN sent_messages_archive a ON a.batch_id = b.batch_id
                 LEFT JOIN chats c ON s.chat_id = c.chat_id AND b.platform = c.platform
                 WHERE 1=1 {q_platforms}
                 GROUP BY b.batch_id, b.platform, b.scope, b.content_preview, b.timestamp
@@ -15163,11 +16575,11 @@ async def message_handler_base(update: TelegramUpdate, context: TelegramContextT
         chat_name = getattr(chat, 'title', None) or getattr(chat, 'first_name', None) or ''
         chat_username = getattr(chat, 'username', None)
         
-        # ثبت چت با لاگ‌گیری بهتر
+        # ثبت فعالیت چت (چت‌های شناخته‌شده فقط last_active را در حافظه به‌روز می‌کنند)
         try:
-            success = register_chat(str(chat.id), chat.type, platform, name=chat_name, username=chat_username)
+            success = touch_chat(str(chat.id), chat.type, platform, name=chat_name, username=chat_username)
             if success:
-                logger.info(f"[{platform}] Successfully registered chat {chat.id} ({chat.type}) - Name: {chat_name}, Username: {chat_username}")
+                logger.debug(f"[{platform}] Registered activity for chat {chat.id} ({chat.type}) - Name: {chat_name}, Username: {chat_username}")
             else:
                 logger.error(f"[{platform}] Failed to register chat {chat.id} ({chat.type})")
         except Exception as e:
@@ -15214,9 +16626,9 @@ async def message_handler_base(update: TelegramUpdate, context: TelegramContextT
                     chat_name = getattr(chat, 'title', None) or getattr(chat, 'first_name', None) or ''
                     chat_username = getattr(chat, 'username', None)
                     
-                    success = register_chat(str(chat.id), chat.type, platform, name=chat_name, username=chat_username)
+                    success = touch_chat(str(chat.id), chat.type, platform, name=chat_name, username=chat_username)
                     if success:
-                        logger.info(f"[{platform}] Updated channel info {chat.id} - Name: {chat_name}, Username: {chat_username}")
+                        logger.debug(f"[{platform}] Updated channel info {chat.id} - Name: {chat_name}, Username: {chat_username}")
         except Exception as e:
             logger.warning(f"[{platform}] Error monitoring channel {chat.id}: {e}")
     
@@ -15435,20 +16847,7 @@ async def message_handler_base(update: TelegramUpdate, context: TelegramContextT
                     logger.warning(f"[{platform}] No targets found for {send_platform_name}")
                     return {'sent': 0, 'failed': 0, 'batch_id': None, 'platform': send_platform_name, 'content_preview': None}
 
-                # Dedupe guard per (platform, content) to avoid repeated multi-sends
-                dedupe_key = build_broadcast_key(
-                    send_platform_name,
-                    content_text,
-                    content_image_id,
-                    content_video_id,
-                    content_document_id,
-                    forward_chat_id,
-                    forward_message_id,
-                    platform  # source platform
-                )
-                if is_duplicate_broadcast(dedupe_key):
-                    logger.info(f"[{send_platform_name}] Duplicate broadcast detected within TTL. Skipping.")
-                    return {'sent': 0, 'failed': 0, 'batch_id': None, 'platform': send_platform_name, 'content_preview': 'duplicate-skipped'}
+                # Dedupe guard is applied once inside perform_broadcast_async (same platform + content + targets)
                 
                 # Prioritize media types: photo > video > document > audio
                 media_photo = content_image_id if content_image_id else None
@@ -15675,19 +17074,19 @@ async def message_handler_base(update: TelegramUpdate, context: TelegramContextT
 
 async def handle_rate_limit_with_backoff(func, *args, max_retries=3, **kwargs):
     """
-    تابع کمکی برای مدیریت rate limiting با exponential backoff
+    تابع کمکی برای ارسال از طریق rate governor ربات؛ در RetryAfter کل ربات متوقف و دوباره تلاش می‌شود
     """
+    governor = rate_governor_for_bot(getattr(func, '__self__', None))
     for attempt in range(max_retries):
+        await governor.acquire(kwargs.get('chat_id', args[0] if args else None))
         try:
             return await func(*args, **kwargs)
         except RetryAfter as e:
+            governor.penalize(min(retry_after_seconds(e) + 1, 60))  # Cap at 60 seconds
             if attempt == max_retries - 1:
                 logger.error(f"Rate limit exceeded after {max_retries} attempts")
                 raise
-            
-            wait_time = min(e.retry_after + (2 ** attempt), 60)  # Cap at 60 seconds
-            logger.warning(f"Rate limit hit, waiting {wait_time}s (attempt {attempt + 1}/{max_retries})")
-            await asyncio.sleep(wait_time)
+            logger.warning(f"Rate limit hit, retrying after governor pause (attempt {attempt + 1}/{max_retries})")
         except Exception as e:
             # For other exceptions, don't retry
             raise e
@@ -15723,6 +17122,7 @@ async def send_with_concurrency_control(semaphore, func, *args, **kwargs):
                             result = new_loop.run_until_complete(handle_rate_limit_with_backoff(func, *args, **kwargs))
                             return result
                         finally:
+                            ita_client.close_for_loop(new_loop)
                             new_loop.close()
                 except Exception as loop_error:
                     logger.error(f"Failed to use Telegram Event Loop: {loop_error}")
@@ -15730,6 +17130,49 @@ async def send_with_concurrency_control(semaphore, func, *args, **kwargs):
             else:
                 raise e
 
+def extract_sent_file_id(sent_msg, media_type: str) -> Optional[str]:
+    """
+    استخراج file_id از پیام ارسال‌شده برای استفاده مجدد در ارسال‌های بعدی
+    """
+    if sent_msg is None:
+        return None
+    if media_type == 'photo' and getattr(sent_msg, 'photo', None):
+        # بزرگ‌ترین سایز عکس آخرین عنصر است
+        return sent_msg.photo[-1].file_id
+    # پلتفرم ممکن است نوع رسانه را تغییر دهد (مثلا ویدیو به صورت document برگردد)
+    for attr in (media_type, 'video', 'document', 'animation', 'audio'):
+        media = getattr(sent_msg, attr, None)
+        if media and getattr(media, 'file_id', None):
+            return media.file_id
+    return None
+
+async def upload_media_with_retry(send_func, media_type: str, file_path: str, filename: str, max_retries: int = 3, **kwargs):
+    """
+    آپلود فایل محلی با تلاش مجدد در خطاهای موقت شبکه و RetryAfter
+    """
+    governor = rate_governor_for_bot(getattr(send_func, '__self__', None))
+    for attempt in range(max_retries):
+        await governor.acquire(kwargs.get('chat_id'))
+        try:
+            with open(file_path, 'rb') as media_file:
+                kwargs[media_type] = InputFile(media_file, filename=filename)
+                return await send_func(**kwargs)
+        except RetryAfter as e:
+            governor.penalize(min(retry_after_seconds(e) + 1, 60))
+            if attempt == max_retries - 1:
+                raise
+            wait_time = 0  # انتظار توسط governor اعمال می‌شود
+        except BadRequest:
+            # خطاهای BadRequest/Forbidden مختص چت هستند و تکرار نمی‌شوند
+            raise
+        except NetworkError:
+            # TimedOut و قطعی‌های موقت شبکه
+            if attempt == max_retries - 1:
+                raise
+            wait_time = 2 ** attempt
+        logger.warning(f"Upload of {media_type} failed, retrying in {wait_time}s (attempt {attempt + 1}/{max_retries})")
+        await asyncio.sleep(wait_time)
+
 async def safe_reply_text(msg, text, **kwargs):
     """
     تابع کمکی برای ارسال reply_text با exception handling
@@ -16148,24 +17591,37 @@ async def show_scheduling_queue(context, platform: str, user_id: int, queue_type
 # Async database functions to prevent blocking
 async def async_db_execute(query: str, params: tuple = ()):
     """
-    اجرای کوئری دیتابیس به صورت async
+    اجرای کوئری دیتابیس به صورت async از طریق thread نویسنده (commit دسته‌ای)
     """
-    loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, db_execute, query, params)
+    try:
+        return await asyncio.wrap_future(db_writer.execute(query, params))
+    except sqlite3.Error as e:
+        logger.error(f"DB Execute Error: {e}")
+        return None
+
+async def async_db_executemany(query: str, seq_of_params):
+    """
+    اجرای یک کوئری برای چند ردیف به صورت async از طریق thread نویسنده
+    """
+    try:
+        return await asyncio.wrap_future(db_writer.executemany(query, seq_of_params))
+    except sqlite3.Error as e:
+        logger.error(f"DB ExecuteMany Error: {e}")
+        return None
 
 async def async_db_fetchone(query: str, params: tuple = ()):
     """
-    دریافت یک رکورد از دیتابیس به صورت async
+    دریافت یک رکورد از دیتابیس به صورت async (اتصال فقط‌خواندنی)
     """
     loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, db_fetchone, query, params)
+    return await loop.run_in_executor(_db_read_executor, db_read_fetchone, query, params)
 
 async def async_db_fetchall(query: str, params: tuple = ()):
     """
-    دریافت تمام رکوردها از دیتابیس به صورت async
+    دریافت تمام رکوردها از دیتابیس به صورت async (اتصال فقط‌خواندنی)
     """
     loop = asyncio.get_running_loop()
-    return await loop.run_in_executor(None, db_fetchall, query, params)
+    return await loop.run_in_executor(_db_read_executor, db_read_fetchall, query, params)
 
 # =================================================================
 # --- Segmentation Functions ---
@@ -16173,9 +17629,10 @@ async def async_db_fetchall(query: str, params: tuple = ()):
 
 def get_chats_by_segmentation(platform: str = None, chat_type: str = None, 
                              tags: str = None, is_active: bool = None, 
-                             days_since_active: int = None) -> List[Dict]:
+                             days_since_active: int = None, match_all_tags: bool = False) -> List[Dict]:
     """
     دریافت چت‌ها بر اساس معیارهای segmentation
+    tags: یک یا چند تگ جدا شده با کاما (OR، یا AND با match_all_tags)
     """
     conditions = []
     params = []
@@ -16188,9 +17645,10 @@ def get_chats_by_segmentation(platform: str = None, chat_type: str = None,
         conditions.append("chat_type = ?")
         params.append(chat_type)
     
-    if tags:
-        conditions.append("tags LIKE ?")
-        params.append(f"%{tags}%")
+    if split_tags(tags):
+        condition, tag_params = chat_tags_condition(tags, platform, match_all_tags)
+        conditions.append(condition)
+        params.extend(tag_params)
     
     if is_active is not None:
         conditions.append("is_active = ?")
@@ -16211,17 +17669,25 @@ def get_chats_by_segmentation(platform: str = None, chat_type: str = None,
     
     return db_fetchall(query, tuple(params))
 
+def _apply_chat_tags(conn, chat_id: str, platform: str, tags) -> bool:
+    """نوشتن تگ‌ها در chats.tags و chat_tags بدون commit"""
+    tags = ','.join(split_tags(tags))
+    cursor = conn.execute("UPDATE chats SET tags = ? WHERE chat_id = ? AND platform = ?",
+                          (tags, chat_id, platform))
+    if cursor.rowcount == 0:
+        return False
+    sync_chat_tags(conn, chat_id, platform, tags)
+    return True
+
 def update_chat_tags(chat_id: str, platform: str, tags: str):
     """
     به‌روزرسانی تگ‌های یک چت
     """
     try:
         with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE chats SET tags = ? WHERE chat_id = ? AND platform = ?", 
-                         (tags, chat_id, platform))
+            updated = _apply_chat_tags(conn, chat_id, platform, tags)
             conn.commit()
-            return cursor.rowcount > 0
+            return updated
     except sqlite3.Error as e:
         logger.error(f"DB Execute Error in update_chat_tags: {e}")
         return False
@@ -16239,6 +17705,7 @@ def deactivate_chat(chat_id: str, platform: str):
     """
     db_execute("UPDATE chats SET is_active = 0 WHERE chat_id = ? AND platform = ?", 
                (chat_id, platform))
+    chat_activity_registry.forget(chat_id, platform)
 
 # =================================================================
 # --- Scheduler Functions ---
@@ -16253,6 +17720,14 @@ def init_scheduler():
     scheduler = BackgroundScheduler()
     scheduler.start()
     logger.info("BackgroundScheduler initialized and started")
+    
+    # ادغام دوره‌ای journal پشتیبان چت‌ها در snapshot
+    scheduler.add_job(compact_chats_backup, trigger=IntervalTrigger(hours=1), id="compact_chats_backup", replace_existing=True)
+    # snapshot دوره‌ای کل دیتابیس
+    scheduler.add_job(backup_database, trigger=IntervalTrigger(hours=DB_BACKUP_INTERVAL_HOURS), id="backup_database", replace_existing=True)
+    # آرشیو/پاکسازی روزانه داده‌های قدیمی
+    if RETENTION_ENABLED:
+        scheduler.add_job(run_retention, trigger=CronTrigger(hour=RETENTION_HOUR, minute=30), id="data_retention", replace_existing=True)
 
 def schedule_broadcast(scheduled_time, platform: str, scopes: List[str], 
                            content_text: str = None, content_type: str = None, 
@@ -16691,7 +18166,8 @@ async def execute_scheduled_broadcast_from_db(broadcast_id: int, app):
                 
                 # ذخیره در دیتابیس
                 if all_sent_messages:
-                    batch_id = await async_save_broadcast_to_db(scope_str, content_preview, platform_str, all_sent_messages)
+                    batch_id = await async_save_broadcast_to_db(scope_str, content_preview, platform_str, all_sent_messages,
+                                                                failed_count=result.get('failed', 0))
                     logger.info(f"Scheduled broadcast {broadcast_id} results saved to history with batch_id: {batch_id}")
                 else:
                     logger.warning(f"No sent messages to save for scheduled broadcast {broadcast_id}")
@@ -17031,19 +18507,22 @@ def run_telegram_bot():
 
         logger.info("[Telegram] Polling for updates starting...")
         # اضافه کردن تنظیمات برای حل مشکل Conflict
-        app.run_polling(drop_pending_updates=True, allowed_updates=['message', 'callback_query', 'my_chat_member'], stop_signals=None)
+        app.run_polling(drop_pending_updates=True, allowed_updates=['message', 'callback_query', 'my_chat_member'], stop_signals=None, close_loop=False)
     except Exception as e:
         if "Conflict" in str(e):
             logger.warning("[Telegram] Conflict detected - another bot instance may be running. Retrying in 5 seconds...")
             time.sleep(5)
             try:
-                app.run_polling(drop_pending_updates=True, allowed_updates=['message', 'callback_query', 'my_chat_member'], stop_signals=None)
+                app.run_polling(drop_pending_updates=True, allowed_updates=['message', 'callback_query', 'my_chat_member'], stop_signals=None, close_loop=False)
             except Exception as retry_error:
                 logger.critical(f"[Telegram] Critical error during retry: {retry_error}", exc_info=True)
         else:
             logger.critical(f"[Telegram] Critical error during bot execution: {e}", exc_info=True)
     finally:
-        if loop and not loop.is_closed(): loop.close()
+        # loop توسط run_polling بسته نمی‌شود تا pool ایتای همین loop قبل از بستن آن بسته شود
+        if loop and not loop.is_closed():
+            ita_client.close_for_loop(loop)
+            loop.close()
         logger.info("[Telegram] Bot stopped.")
 
 def restart_telegram_bot():
@@ -17056,6 +18535,7 @@ def restart_telegram_bot():
         
         # بستن Event Loop قبلی اگر باز است
         if telegram_bot_loop and not telegram_bot_loop.is_closed():
+            ita_client.close_for_loop(telegram_bot_loop)
             telegram_bot_loop.close()
         
         # ایجاد Event Loop جدید
@@ -17101,11 +18581,14 @@ def run_bale_bot():
         app.add_handler(MessageHandler(filters.ALL, lambda u, c: message_handler_base(u, c, 'bale', BALE_OWNER_ID)))
 
         logger.info("[Bale] Polling for updates starting...")
-        app.run_polling(stop_signals=None)
+        app.run_polling(stop_signals=None, close_loop=False)
     except Exception as e:
         logger.critical(f"[Bale] Critical error during bot execution: {e}", exc_info=True)
     finally:
-        if loop and not loop.is_closed(): loop.close()
+        # loop توسط run_polling بسته نمی‌شود تا pool ایتای همین loop قبل از بستن آن بسته شود
+        if loop and not loop.is_closed():
+            ita_client.close_for_loop(loop)
+            loop.close()
         logger.info("[Bale] Bot stopped.")
 
 
@@ -17158,7 +18641,7 @@ async def schedule_ita_member_check_task():
         
         # بررسی روزانه ساعت 1 صبح (برای آمار روزانه)
         scheduler.add_job(
-            lambda: asyncio.run(check_and_update_ita_member_counts(is_daily_update=True)),
+            lambda: asyncio.run(ita_client.run_and_close(check_and_update_ita_member_counts(is_daily_update=True))),
             'cron',
             hour=1,
             minute=0,
@@ -17177,7 +18660,7 @@ async def schedule_ita_member_check_task():
         
         # زمان‌بندی به‌روزرسانی آمار بازدید پست‌ها (هر 6 ساعت - کاهش فرکانس)
         scheduler.add_job(
-            lambda: asyncio.run(update_channel_posts_views(None, 'telegram')),
+            lambda: asyncio.run(ita_client.run_and_close(update_channel_posts_views(None, 'telegram'))),
             'interval',
             hours=6,
             id='update_telegram_posts_views',
@@ -17185,7 +18668,7 @@ async def schedule_ita_member_check_task():
         )
         
         scheduler.add_job(
-            lambda: asyncio.run(update_channel_posts_views(None, 'bale')),
+            lambda: asyncio.run(ita_client.run_and_close(update_channel_posts_views(None, 'bale'))),
             'interval',
             hours=6,
             id='update_bale_posts_views',
@@ -17193,7 +18676,7 @@ async def schedule_ita_member_check_task():
         )
         
         scheduler.add_job(
-            lambda: asyncio.run(update_channel_posts_views(None, 'ita')),
+            lambda: asyncio.run(ita_client.run_and_close(update_channel_posts_views(None, 'ita'))),
             'interval',
             hours=6,
             id='update_ita_posts_views',
@@ -17269,6 +18752,9 @@ def main():
         # راه‌اندازی scheduler
         init_scheduler()  # فراخوانی مستقیم و همگام
         
+        # راه‌اندازی worker های صف ارسال انبوه
+        start_broadcast_job_workers()
+        
         threads = []
 
         flask_thread = Thread(target=run_flask, daemon=True)
@@ -17320,40 +18806,111 @@ def main():
         print("\nApplication stopped. Goodbye!")
 
 
+# =========== Chat Backup Journal ===========
+# snapshot فشرده (همان فرمت قبلی chats_backup.json) + journal افزایشی JSONL
+CHATS_BACKUP_SNAPSHOT = "chats_backup.json"
+CHATS_BACKUP_JOURNAL = "chats_backup.journal.jsonl"
+CHATS_BACKUP_COMPACT_BYTES = getattr(config, 'CHATS_BACKUP_COMPACT_BYTES', 5 * 1024 * 1024)
+_chats_backup_lock = threading.Lock()
+_chats_backup_compacting = threading.Lock()
+
 def save_chat_to_backup(chat_id: str, chat_type: str, platform: str, name: str = None, username: str = None, tags: str = None):
-    """ذخیره اطلاعات چت در فایل backup"""
+    """افزودن اطلاعات چت به انتهای journal پشتیبان (بدون بازنویسی کل فایل)"""
     try:
-        backup_file = "chats_backup.json"
-        current_time = datetime.now().isoformat()
-        
-        # خواندن فایل backup موجود
-        if os.path.exists(backup_file):
-            with open(backup_file, 'r', encoding='utf-8') as f:
-                backup_data = json.load(f)
-        else:
-            backup_data = {}
-        
-        # اضافه کردن چت جدید
-        chat_key = f"{platform}_{chat_id}"
-        backup_data[chat_key] = {
+        record = {
             "chat_id": chat_id,
             "platform": platform,
             "chat_type": chat_type,
             "name": name,
             "username": username,
             "tags": tags or "",
-            "last_updated": current_time
+            "last_updated": datetime.now().isoformat()
         }
-        
-        # ذخیره فایل backup
-        with open(backup_file, 'w', encoding='utf-8') as f:
-            json.dump(backup_data, f, ensure_ascii=False, indent=2)
-        
-        logger.info(f"[Backup] Saved chat {chat_id} ({platform}) to backup file")
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+        with _chats_backup_lock:
+            # حالت باینری: خط ناقص ممکن است وسط یک کاراکتر چندبایتی فارسی قطع شده باشد
+            with open(CHATS_BACKUP_JOURNAL, 'ab+') as f:
+                # اگر خط آخر بر اثر crash ناقص مانده، رکورد جدید در خط جداگانه نوشته شود
+                if f.tell() > 0:
+                    f.seek(f.tell() - 1)
+                    if f.read(1) != b"\n":
+                        line = b"\n" + line
+                f.write(line)
+                journal_size = f.tell()
+        
+        logger.debug(f"[Backup] Journaled chat {chat_id} ({platform})")
+        
+        if journal_size > CHATS_BACKUP_COMPACT_BYTES and not _chats_backup_compacting.locked():
+            Thread(target=compact_chats_backup, daemon=True, name="chats-backup-compaction").start()
         
     except Exception as e:
         logger.error(f"Error saving chat to backup: {e}")
 
+def _read_chats_backup_journal(path: str, backup_data: Dict[str, Dict[str, Any]]) -> int:
+    """اعمال رکوردهای یک فایل journal روی داده‌های snapshot؛ خط ناقص یا خراب (crash) نادیده گرفته می‌شود"""
+    if not os.path.exists(path):
+        return 0
+    applied = 0
+    with open(path, 'rb') as f:
+        for raw_line in f:
+            try:
+                record = json.loads(raw_line.decode('utf-8'))
+                key = f"{record['platform']}_{record['chat_id']}"
+            except (UnicodeDecodeError, ValueError, KeyError, TypeError):
+                logger.warning(f"[Backup] Skipping corrupt journal line in {path}")
+                continue
+            backup_data[key] = record
+            applied += 1
+    return applied
+
+def load_chats_backup() -> Dict[str, Dict[str, Any]]:
+    """خواندن snapshot و replay کردن journal ها (شامل journal نیمه‌کاره compaction)"""
+    backup_data: Dict[str, Dict[str, Any]] = {}
+    if os.path.exists(CHATS_BACKUP_SNAPSHOT):
+        with open(CHATS_BACKUP_SNAPSHOT, 'r', encoding='utf-8') as f:
+            backup_data = json.load(f)
+    _read_chats_backup_journal(CHATS_BACKUP_JOURNAL + ".compacting", backup_data)
+    _read_chats_backup_journal(CHATS_BACKUP_JOURNAL, backup_data)
+    return backup_data
+
+def compact_chats_backup() -> int:
+    """
+    ادغام journal در snapshot
+    - journal ابتدا با rename کنار گذاشته می‌شود تا نوشتن‌های جدید در فایل تازه ادامه یابد
+    - snapshot جدید در فایل موقت نوشته و با os.replace به صورت اتمی جایگزین می‌شود
+    """
+    if not _chats_backup_compacting.acquire(blocking=False):
+        return 0
+    try:
+        compacting_path = CHATS_BACKUP_JOURNAL + ".compacting"
+        with _chats_backup_lock:
+            # اگر compaction قبلی وسط کار متوقف شده باشد، فایل compacting هنوز وجود دارد
+            if os.path.exists(CHATS_BACKUP_JOURNAL) and not os.path.exists(compacting_path):
+                os.replace(CHATS_BACKUP_JOURNAL, compacting_path)
+        if not os.path.exists(compacting_path):
+            return 0
+
+        backup_data: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(CHATS_BACKUP_SNAPSHOT):
+            with open(CHATS_BACKUP_SNAPSHOT, 'r', encoding='utf-8') as f:
+                backup_data = json.load(f)
+        applied = _read_chats_backup_journal(compacting_path, backup_data)
+
+        tmp_path = CHATS_BACKUP_SNAPSHOT + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(backup_data, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, CHATS_BACKUP_SNAPSHOT)
+        os.remove(compacting_path)
+        logger.info(f"[Backup] Compacted {applied} journal records into snapshot ({len(backup_data)} chats)")
+        return applied
+    except Exception as e:
+        logger.error(f"[Backup] Error compacting chats backup: {e}", exc_info=True)
+        return 0
+    finally:
+        _chats_backup_compacting.release()
+
 
 def get_chat_tags(chat_id: str, platform: str):
     """دریافت تگ‌های یک چت"""
@@ -17367,41 +18924,19 @@ def get_chat_tags(chat_id: str, platform: str):
 def get_all_tags():
     """دریافت تمام تگ‌های موجود"""
     try:
-        results = db_fetchall("SELECT DISTINCT tags FROM chats WHERE tags IS NOT NULL AND tags != ''")
-        all_tags = set()
-        for result in results:
-            if result['tags']:
-                tags = [tag.strip() for tag in result['tags'].split(',') if tag.strip()]
-                all_tags.update(tags)
-        return sorted(list(all_tags))
+        return [row['tag'] for row in db_fetchall("SELECT DISTINCT tag FROM chat_tags ORDER BY tag")]
     except Exception as e:
         logger.error(f"Error getting all tags: {e}")
         return []
 
-def get_chats_by_tags(tags: list):
-    """دریافت چت‌ها بر اساس تگ‌ها"""
+def get_chats_by_tags(tags: list, match_all: bool = False, platform: str = None):
+    """دریافت چت‌ها بر اساس تگ‌ها (حداقل یکی از تگ‌ها، یا همه با match_all)"""
     try:
-        if not tags:
+        if not split_tags(tags):
             return []
         
-        # ساخت query برای جستجوی تگ‌ها
-        tag_conditions = []
-        params = []
-        for tag in tags:
-            tag_conditions.append("tags LIKE ?")
-            params.append(f"%{tag}%")
-        
-        query = f"SELECT * FROM chats WHERE {' OR '.join(tag_conditions)}"
-        results = db_fetchall(query, params)
-        
-        # فیلتر کردن نتایج برای اطمینان از وجود تگ
-        filtered_results = []
-        for result in results:
-            chat_tags = [t.strip() for t in result['tags'].split(',') if t.strip()] if result['tags'] else []
-            if any(tag in chat_tags for tag in tags):
-                filtered_results.append(result)
-        
-        return filtered_results
+        condition, params = chat_tags_condition(tags, platform, match_all)
+        return db_fetchall(f"SELECT * FROM chats WHERE {condition}", tuple(params))
     except Exception as e:
         logger.error(f"Error getting chats by tags: {e}")
         return []
@@ -17416,25 +18951,27 @@ def calculate_growth_stats(platform: str, days: int = 7):
         # آمار فعلی
         current_stats = db_fetchall("""
             SELECT c.chat_type, SUM(m.members_count) as total_members, COUNT(*) as chat_count
-            FROM chats_metrics m
+            FROM chats_latest_metrics m
             JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
-            WHERE m.platform = ? AND c.is_active = 1 AND m.date_key = (
-                SELECT MAX(date_key) FROM chats_metrics WHERE chat_id = m.chat_id AND platform = m.platform
-            )
+            WHERE m.platform = ? AND c.is_active = 1
             GROUP BY c.chat_type
         """, (platform,))
         
         # آمار گذشته
+        # یک seek روی کلید اصلی chats_metrics به ازای هر چت
         past_stats = db_fetchall("""
-            SELECT c.chat_type, SUM(m.members_count) as total_members, COUNT(*) as chat_count
-            FROM chats_metrics m
-            JOIN chats c ON c.chat_id = m.chat_id AND c.platform = m.platform
-            WHERE m.platform = ? AND c.is_active = 1 AND m.date_key = (
-                SELECT MAX(date_key) FROM chats_metrics 
-                WHERE chat_id = m.chat_id AND platform = m.platform AND date_key <= ?
+            SELECT chat_type, SUM(members_count) as total_members, COUNT(members_count) as chat_count
+            FROM (
+                SELECT c.chat_type, (
+                    SELECT members_count FROM chats_metrics
+                    WHERE chat_id = c.chat_id AND platform = c.platform AND date_key <= ?
+                    ORDER BY date_key DESC LIMIT 1
+                ) AS members_count
+                FROM chats c
+                WHERE c.platform = ? AND c.is_active = 1
             )
-            GROUP BY c.chat_type
-        """, (platform, past_date))
+            GROUP BY chat_type
+        """, (past_date, platform))
         
         # تبدیل به dictionary
         current_dict = {r['chat_type']: {'members': r['total_members'], 'chats': r['chat_count']} for r in current_stats}
@@ -17532,15 +19069,15 @@ def save_daily_bot_statistics_snapshot():
                 SELECT c.chat_type, 
                        COALESCE(SUM(m.members_count), 0) as total_members
                 FROM chats c
-                LEFT JOIN chats_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
-                    AND m.date_key = (
-                        SELECT MAX(date_key) FROM chats_metrics 
-                        WHERE chat_id = c.chat_id AND platform = c.platform 
-                        AND is_daily_snapshot = 1
-                    )
+                LEFT JOIN (
+                    SELECT chat_id, platform, MAX(date_key) AS date_key, members_count
+                    FROM chats_metrics
+                    WHERE platform = ? AND is_daily_snapshot = 1
+                    GROUP BY chat_id, platform
+                ) m ON c.chat_id = m.chat_id AND c.platform = m.platform
                 WHERE c.platform = ? AND c.is_active = 1
                 GROUP BY c.chat_type
-            """, (platform,))
+            """, (platform, platform))
             
             # اگر snapshot روزانه موجود نیست، از آخرین metrics استفاده کن
             if not any(r['total_members'] > 0 for r in member_stats):
@@ -17548,11 +19085,7 @@ def save_daily_bot_statistics_snapshot():
                     SELECT c.chat_type, 
                            COALESCE(SUM(m.members_count), 0) as total_members
                     FROM chats c
-                    LEFT JOIN chats_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
-                        AND m.date_key = (
-                            SELECT MAX(date_key) FROM chats_metrics 
-                            WHERE chat_id = c.chat_id AND platform = c.platform
-                        )
+                    LEFT JOIN chats_latest_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
                     WHERE c.platform = ? AND c.is_active = 1 AND c.chat_type != 'private'
                     GROUP BY c.chat_type
                 """, (platform,))
@@ -17643,15 +19176,15 @@ def generate_bot_statistics_sheet(selected_platforms: list):
                        COALESCE(SUM(m.members_count), 0) as total_members,
                        COUNT(DISTINCT c.chat_id) as chat_count
                 FROM chats c
-                LEFT JOIN chats_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
-                    AND m.date_key = (
-                        SELECT MAX(date_key) FROM chats_metrics 
-                        WHERE chat_id = c.chat_id AND platform = c.platform 
-                        AND is_daily_snapshot = 1
-                    )
+                LEFT JOIN (
+                    SELECT chat_id, platform, MAX(date_key) AS date_key, members_count
+                    FROM chats_metrics
+                    WHERE platform = ? AND is_daily_snapshot = 1
+                    GROUP BY chat_id, platform
+                ) m ON c.chat_id = m.chat_id AND c.platform = m.platform
                 WHERE c.platform = ? AND c.is_active = 1
                 GROUP BY c.chat_type
-            """, (platform,))
+            """, (platform, platform))
             
             # اگر snapshot روزانه موجود نیست، از آخرین metrics استفاده کن
             if not any(r['total_members'] > 0 for r in member_stats):
@@ -17660,11 +19193,7 @@ def generate_bot_statistics_sheet(selected_platforms: list):
                            COALESCE(SUM(m.members_count), 0) as total_members,
                            COUNT(DISTINCT c.chat_id) as chat_count
                     FROM chats c
-                    LEFT JOIN chats_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
-                        AND m.date_key = (
-                            SELECT MAX(date_key) FROM chats_metrics 
-                            WHERE chat_id = c.chat_id AND platform = c.platform
-                        )
+                    LEFT JOIN chats_latest_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
                     WHERE c.platform = ? AND c.is_active = 1
                     GROUP BY c.chat_type
                 """, (platform,))
@@ -17747,8 +19276,7 @@ def generate_bot_statistics_sheet(selected_platforms: list):
                 {r['chat_type']: r['total_members'] for r in db_fetchall("""
                     SELECT c.chat_type, COALESCE(SUM(m.members_count), 0) as total_members
                     FROM chats c
-                    LEFT JOIN chats_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
-                        AND m.date_key = (SELECT MAX(date_key) FROM chats_metrics WHERE chat_id = c.chat_id AND platform = c.platform)
+                    LEFT JOIN chats_latest_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
                     WHERE c.platform = ? AND c.is_active = 1
                     GROUP BY c.chat_type
                 """, (p,))}
@@ -17759,8 +19287,7 @@ def generate_bot_statistics_sheet(selected_platforms: list):
                 {r['chat_type']: r['total_members'] for r in db_fetchall("""
                     SELECT c.chat_type, COALESCE(SUM(m.members_count), 0) as total_members
                     FROM chats c
-                    LEFT JOIN chats_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
-                        AND m.date_key = (SELECT MAX(date_key) FROM chats_metrics WHERE chat_id = c.chat_id AND platform = c.platform)
+                    LEFT JOIN chats_latest_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
                     WHERE c.platform = ? AND c.is_active = 1
                     GROUP BY c.chat_type
                 """, (p,))}
@@ -17771,8 +19298,7 @@ def generate_bot_statistics_sheet(selected_platforms: list):
                 {r['chat_type']: r['total_members'] for r in db_fetchall("""
                     SELECT c.chat_type, COALESCE(SUM(m.members_count), 0) as total_members
                     FROM chats c
-                    LEFT JOIN chats_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
-                        AND m.date_key = (SELECT MAX(date_key) FROM chats_metrics WHERE chat_id = c.chat_id AND platform = c.platform)
+                    LEFT JOIN chats_latest_metrics m ON c.chat_id = m.chat_id AND c.platform = m.platform
                     WHERE c.platform = ? AND c.is_active = 1
                     GROUP BY c.chat_type
                 """, (p,))}
@@ -18048,8 +19574,8 @@ def generate_daily_bot_statistics_sheet(selected_platforms: list):
         # بازگرداندن DataFrame خالی در صورت خطا
         return pd.DataFrame(columns=['پلتفرم - نوع', 'نوع آمار'])
 
-def generate_growth_report(platform: str):
-    """تولید گزارش رشد برای یک پلتفرم"""
+def generate_growth_report(platform: str, filepath: Optional[str] = None):
+    """تولید گزارش رشد برای یک پلتفرم (در filepath، یا فایلی با نام تاریخ‌دار کنار app.py)"""
     try:
         import pandas as pd
         from datetime import datetime
@@ -18095,8 +19621,9 @@ def generate_growth_report(platform: str):
         df = pd.DataFrame(data)
         
         # ذخیره فایل Excel
-        filename = f"growth_report_{platform}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-        filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+        if not filepath:
+            filename = f"growth_report_{platform}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+            filepath = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
         
         with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
             df.to_excel(writer, sheet_name='گزارش رشد', index=False)
@@ -18120,16 +19647,242 @@ def generate_growth_report(platform: str):
         logger.error(f"Error generating growth report for {platform}: {e}")
         return None
 
+# =========== Report Builder ===========
+REPORT_CACHE_DIR = getattr(config, 'REPORT_CACHE_DIR', os.path.join(UPLOAD_FOLDER, 'report_cache'))
+REPORT_CACHE_MAX_FILES = getattr(config, 'REPORT_CACHE_MAX_FILES', 20)
+REPORT_BUILDER_WORKERS = getattr(config, 'REPORT_BUILDER_WORKERS', 1)
+# حداکثر انتظار endpointهای قدیمی (دانلود مستقیم) پیش از برگرداندن 202 و شناسه job
+REPORT_SYNC_WAIT_SECONDS = getattr(config, 'REPORT_SYNC_WAIT_SECONDS', 60)
+# با تغییر ساختار گزارش‌ها افزایش دهید تا فایل‌های کش قدیمی استفاده نشوند
+REPORT_FORMAT_VERSION = 1
+
+def report_data_version() -> str:
+    """
+    اثر انگشت ارزان داده‌های گزارش‌ها: شمارنده‌های data_versions، snapshotهای آمار ربات و تاریخ امروز
+    (بازه‌های گزارش نسبت به امروز است، پس کش هر روز خودبه‌خود باطل می‌شود)
+    """
+    versions = {r['name']: r['version'] for r in db_fetchall("SELECT name, version FROM data_versions")}
+    snapshots_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots')
+    snapshots = []
+    if os.path.isdir(snapshots_dir):
+        for entry in os.scandir(snapshots_dir):
+            if entry.name.startswith('bot_statistics_') and entry.name.endswith('.json'):
+                snapshots.append((entry.name, entry.stat().st_mtime_ns))
+    fingerprint = json.dumps([REPORT_FORMAT_VERSION, datetime.now().strftime('%Y-%m-%d'), versions, sorted(snapshots)])
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:16]
+
+def build_bot_statistics_report(selected_platforms: list, file_path: str):
+    """فایل اکسل آمار ربات‌ها (شیت‌های ۵ و ۶ گزارش کامل)"""
+    df_bot_stats = generate_bot_statistics_sheet(selected_platforms)
+    df_daily_bot_stats = generate_daily_bot_statistics_sheet(selected_platforms)
+    write_excel_streaming(file_path, [
+        ("آمار ربات‌ها", [str(c) for c in df_bot_stats.columns], _dataframe_rows(df_bot_stats)),
+        ("آمار روزانه ربات‌ها", [str(c) for c in df_daily_bot_stats.columns], _dataframe_rows(df_daily_bot_stats)),
+    ])
+
+def build_growth_report(selected_platforms: list, file_path: str):
+    if not generate_growth_report(selected_platforms[0], file_path):
+        raise RuntimeError(f"Failed to generate growth report for {selected_platforms[0]}")
+
+# نوع گزارش: (سازنده(platforms, file_path)، نام فایل دانلود، فقط یک پلتفرم؟)
+REPORT_TYPES: Dict[str, Tuple[Callable[[list, str], Any], Callable[[list], str], bool]] = {
+    'excel': (build_excel_report, lambda platforms: excel_report_download_name(), False),
+    'bot_statistics': (build_bot_statistics_report,
+                       lambda platforms: f"bot_statistics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx", False),
+    'growth': (build_growth_report,
+               lambda platforms: f"growth_report_{platforms[0]}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx", True),
+}
+
+class ReportBuilder:
+    """
+    ساخت گزارش‌ها در thread پس‌زمینه با کش فایل نتیجه روی دیسک
+    - کلید کش: نوع گزارش + پلتفرم‌ها + report_data_version؛ تا وقتی داده تغییر نکند فایل قبلی فوراً برگردانده می‌شود
+    - درخواست‌های همزمان با یک کلید به همان job می‌رسند (فقط یک بار ساخته می‌شود)
+    - فقط REPORT_CACHE_MAX_FILES فایل آخر نگه داشته می‌شود
+    """
+
+    MAX_JOBS = 200
+
+    def __init__(self, cache_dir: str, max_files: int, workers: int):
+        self.cache_dir = cache_dir
+        self.max_files = max(1, max_files)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="report-builder")
+        self._jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._building: Dict[str, str] = {}  # کلید کش -> job_id در حال ساخت
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        info = {k: v for k, v in job.items() if not k.startswith('_')}
+        if job['status'] == 'done':
+            info['download_url'] = f"/api/reports/{job['job_id']}/download"
+        return info
+
+    def submit(self, report_type: str, platforms: List[str]) -> Dict[str, Any]:
+        """ثبت درخواست گزارش؛ خروجی وضعیت job (status=done و cached=True اگر از کش آمده باشد). ValueError برای ورودی نامعتبر"""
+        if report_type not in REPORT_TYPES:
+            raise ValueError(f"Unknown report type: {report_type}")
+        builder, download_name, single_platform = REPORT_TYPES[report_type]
+        platforms = sorted({str(p) for p in platforms if p})
+        if not platforms:
+            raise ValueError("At least one platform is required")
+        if single_platform and len(platforms) != 1:
+            raise ValueError(f"Report type '{report_type}' needs exactly one platform")
+        
+        key = f"{report_type}_{'-'.join(platforms)}_{report_data_version()}"
+        path = os.path.join(self.cache_dir, key + ".xlsx")
+        with self._lock:
+            building_id = self._building.get(key)
+            if building_id:
+                return self._public(self._jobs[building_id])
+            job = {
+                'job_id': uuid.uuid4().hex, 'type': report_type, 'platforms': platforms,
+                'status': 'queued', 'cached': False, 'error': None,
+                'created_at': time.time(), 'finished_at': None,
+                '_path': path, '_download_name': download_name(platforms), '_future': None,
+            }
+            self._jobs[job['job_id']] = job
+            self._prune_jobs()
+            if os.path.exists(path):
+                os.utime(path)  # برای حذف قدیمی‌ترین فایل‌ها در _prune_cache
+                job.update(status='done', cached=True, finished_at=time.time())
+                return self._public(job)
+            self._building[key] = job['job_id']
+            job['_future'] = self._executor.submit(self._build, job, key, builder)
+        logger.info(f"[Reports] Queued {report_type} report for {platforms} (job {job['job_id']})")
+        return self._public(job)
+
+    def _build(self, job: Dict[str, Any], key: str, builder: Callable[[list, str], Any]):
+        job['status'] = 'running'
+        # پسوند xlsx لازم است (pandas موتور را از پسوند تشخیص می‌دهد)؛ نقطه ابتدای نام آن را از _prune_cache مستثنی می‌کند
+        tmp_path = os.path.join(self.cache_dir, f".{job['job_id']}.tmp.xlsx")
+        started = time.monotonic()
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            builder(job['platforms'], tmp_path)
+            os.replace(tmp_path, job['_path'])
+            job['status'] = 'done'
+            logger.info(f"[Reports] Built {job['type']} report {key} in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            job.update(status='failed', error=str(e))
+            logger.error(f"[Reports] Failed to build {job['type']} report {key}: {e}", exc_info=True)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        finally:
+            job['finished_at'] = time.time()
+            with self._lock:
+                self._building.pop(key, None)
+        self._prune_cache()
+
+    def _prune_jobs(self):
+        """حذف قدیمی‌ترین jobها بیش از MAX_JOBS؛ jobهای در حال ساخت هرگز حذف نمی‌شوند (با _lock)"""
+        if len(self._jobs) <= self.MAX_JOBS:
+            return
+        building = set(self._building.values())
+        for job_id in [j for j in self._jobs if j not in building][:len(self._jobs) - self.MAX_JOBS]:
+            del self._jobs[job_id]
+
+    def _prune_cache(self):
+        try:
+            entries = sorted((e for e in os.scandir(self.cache_dir) if e.name.endswith('.xlsx') and not e.name.startswith('.')),
+                             key=lambda e: e.stat().st_mtime, reverse=True)
+        except OSError:
+            return
+        for entry in entries[self.max_files:]:
+            try:
+                os.remove(entry.path)
+            except OSError as e:
+                logger.warning(f"[Reports] Could not remove cached report {entry.name}: {e}")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        return self._public(job) if job else None
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """منتظر ماندن تا پایان job یا timeout (برای endpointهای قدیمی که فایل را مستقیم برمی‌گردانند)"""
+        job = self._jobs.get(job_id)
+        if not job:
+            return None
+        if job['_future'] is not None:
+            concurrent.futures.wait([job['_future']], timeout=timeout)
+        return self._public(job)
+
+    def file_of(self, job_id: str) -> Optional[Tuple[str, str]]:
+        """(مسیر فایل، نام دانلود) برای job تمام‌شده"""
+        job = self._jobs.get(job_id)
+        if not job or job['status'] != 'done' or not os.path.exists(job['_path']):
+            return None
+        return job['_path'], job['_download_name']
+
+report_builder = ReportBuilder(REPORT_CACHE_DIR, REPORT_CACHE_MAX_FILES, REPORT_BUILDER_WORKERS)
+
+def send_report_file(job: Dict[str, Any]):
+    """ارسال فایل گزارش تمام‌شده؛ 404 اگر فایل کش در این فاصله حذف شده باشد"""
+    report_file = report_builder.file_of(job['job_id'])
+    if not report_file:
+        return jsonify({"success": False, "error": "Report file is not available; request it again"}), 404
+    path, download_name = report_file
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=download_name,
+                     mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+def send_report_or_pending(job: Dict[str, Any], error_message: str):
+    """
+    پاسخ endpointهای دانلود مستقیم پس از report_builder.wait: فایل اگر آماده است،
+    وگرنه 202 با شناسه job تا کلاینت از GET /api/reports/<job_id> پیگیری کند (thread درخواست نگه داشته نمی‌شود)
+    """
+    if job['status'] == 'done':
+        return send_report_file(job)
+    if job['status'] == 'failed':
+        return jsonify({"error": f"{error_message}: {job['error']}"}), 500
+    return jsonify({"success": True, **job, "status_url": f"/api/reports/{job['job_id']}"}), 202
+
+@app.route('/api/reports', methods=['POST'])
+def api_request_report():
+    """
+    درخواست ساخت گزارش در پس‌زمینه
+    JSON: {"type": "excel" | "bot_statistics" | "growth", "platforms": [...]}
+    پاسخ: job (202 اگر در صف/در حال ساخت، 200 اگر از کش آماده است)؛ وضعیت از GET /api/reports/<job_id>
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        platforms = data.get('platforms', ['telegram', 'bale', 'ita'])
+        if not isinstance(platforms, list):
+            platforms = [platforms]
+        job = report_builder.submit(data.get('type', 'excel'), platforms)
+        return jsonify({"success": True, **job}), (200 if job['status'] == 'done' else 202)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    except Exception as e:
+        logger.error(f"[Flask API] Error requesting report: {e}", exc_info=True)
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/api/reports/<job_id>', methods=['GET'])
+def api_report_status(job_id: str):
+    """وضعیت یک job گزارش"""
+    job = report_builder.get(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Report job not found"}), 404
+    return jsonify({"success": True, **job})
+
+@app.route('/api/reports/<job_id>/download', methods=['GET'])
+def api_report_download(job_id: str):
+    """دانلود فایل گزارش تمام‌شده"""
+    job = report_builder.get(job_id)
+    if not job:
+        return jsonify({"success": False, "error": "Report job not found"}), 404
+    if job['status'] != 'done':
+        return jsonify({"success": False, "status": job['status'], "error": job['error'] or "Report is not ready yet"}), 409
+    return send_report_file(job)
+
 def restore_chats_from_backup():
-    """بازیابی چت‌ها از فایل backup"""
+    """بازیابی چت‌ها از snapshot و journal پشتیبان"""
     try:
-        backup_file = "chats_backup.json"
-        if not os.path.exists(backup_file):
+        if not any(os.path.exists(path) for path in
+                   (CHATS_BACKUP_SNAPSHOT, CHATS_BACKUP_JOURNAL, CHATS_BACKUP_JOURNAL + ".compacting")):
             logger.info("[Backup] No backup file found")
             return 0
         
-        with open(backup_file, 'r', encoding='utf-8') as f:
-            backup_data = json.load(f)
+        backup_data = load_chats_backup()
         
         restored_count = 0
         for chat_key, chat_info in backup_data.items():
@@ -18204,7 +19957,7 @@ def auto_daily_stats_collection(max_retries: int = 3):
                         logger.warning(f"   ⏳ Attempt {attempt}/{max_retries} after {retry_delay}s delay...")
                         time.sleep(retry_delay)
                     
-                    member_count = asyncio.run(get_chat_member_count(chat_id, platform, chat_type))
+                    member_count = asyncio.run(ita_client.run_and_close(get_chat_member_count(chat_id, platform, chat_type)))
                     
                     # ذخیره در جدول metrics
                     date_key = datetime.now().strftime('%Y-%m-%d')
@@ -18910,13 +20663,8 @@ if __name__ == "__main__":
     try:
         logger.info("Starting application...")
         
-        # Initialize backup system on startup
-        try:
-            logger.info("Initializing backup system...")
-            backup_chats_to_backup_db()
-            logger.info("✅ Backup system initialized - bot_database.db updated from main database")
-        except Exception as e:
-            logger.warning(f"⚠️ Backup system initialization failed: {e}")
+        # snapshot اولیه در پس‌زمینه تا راه‌اندازی ربات‌ها منتظر نماند
+        Thread(target=backup_database, daemon=True, name="db-backup").start()
         
         main()
     except Exception as e:
@@ -80,10 +80,3 @@ def setup_context(app):
     def after_request(response):
         """Run after each request"""
         return response
-    
-    @app.teardown_appcontext
-    def close_db(error):
-        """Close database connections"""
-        from app.utils import database
-        database.db_close_all()
-
@@ -2,8 +2,11 @@
 Database utilities and helpers
 """
 
+import os
 import sqlite3
 import logging
+import threading
+from urllib.parse import quote
 from functools import wraps
 from pathlib import Path
 
@@ -27,22 +30,123 @@ def set_db_file(db_path):
     """Set the database file path"""
     global DB_FILE
     DB_FILE = db_path
+    _pool.close_all()
+
+CACHED_STATEMENTS = 512
+MAX_IDLE_PER_THREAD = 4
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+)
+
+class PooledConnection(sqlite3.Connection):
+    """Connection that returns to its thread's pool on `with` exit or close()"""
+    _pool = None
+    _pool_generation = 0
+    _owner_thread = None
+    _checked_out = False
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        result = super().__exit__(exc_type, exc_value, traceback)
+        self._pool.release(self)
+        return result
+
+    def close(self):
+        self._pool.release(self)
+
+    def close_connection(self):
+        super().close()
+
+class ConnectionPool:
+    """
+    Per-thread pool of long-lived connections, configured once when opened.
+    Nested connections in one thread get separate connections, as before.
+    Shared by app.py and the app package.
+    """
+
+    def __init__(self, db_file=None, pragmas=CONNECTION_PRAGMAS, max_idle_per_thread=MAX_IDLE_PER_THREAD,
+                 read_only=False, cached_statements=CACHED_STATEMENTS):
+        self.db_file = db_file
+        self.pragmas = pragmas
+        self.max_idle_per_thread = max_idle_per_thread
+        self.read_only = read_only
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._generation = 0
+
+    def _idle(self):
+        idle = getattr(self._local, 'idle', None)
+        if idle is None:
+            idle = self._local.idle = []
+        return idle
+
+    def _connect(self):
+        db_file = self.db_file or _get_db_file()
+        if self.read_only:
+            conn = sqlite3.connect(f"file:{quote(os.path.abspath(db_file))}?mode=ro", uri=True, timeout=10,
+                                   check_same_thread=False, factory=PooledConnection,
+                                   cached_statements=self.cached_statements)
+        else:
+            conn = sqlite3.connect(db_file, timeout=10, check_same_thread=False,
+                                   factory=PooledConnection, cached_statements=self.cached_statements)
+        conn.row_factory = sqlite3.Row
+        for pragma in self.pragmas:
+            try:
+                conn.execute(pragma)
+            except sqlite3.Error as e:
+                logger.warning(f"[DB] Could not apply '{pragma}': {e}")
+        conn._pool = self
+        conn._pool_generation = self._generation
+        conn._owner_thread = threading.get_ident()
+        logger.debug(f"[DB] Opened pooled connection to {db_file}")
+        return conn
+
+    def acquire(self):
+        idle = self._idle()
+        conn = None
+        while idle:
+            candidate = idle.pop()
+            if candidate._pool_generation == self._generation:
+                conn = candidate
+                break
+            candidate.close_connection()
+        if conn is None:
+            conn = self._connect()
+        conn._checked_out = True
+        return conn
+
+    def release(self, conn):
+        if not conn._checked_out:
+            return
+        conn._checked_out = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close_connection()
+            return
+        idle = self._idle()
+        if (conn._owner_thread == threading.get_ident() and conn._pool_generation == self._generation
+                and len(idle) < self.max_idle_per_thread):
+            idle.append(conn)
+        else:
+            conn.close_connection()
+
+    def close_all(self):
+        """Invalidate every pooled connection (e.g. after the DB file changes)"""
+        self._generation += 1
+        for conn in self._idle():
+            conn.close_connection()
+        self._local.idle = []
+
+_pool = ConnectionPool()
 
 def get_db_connection():
-    """Get database connection with optimized settings"""
-    db_file = _get_db_file()
-    logger.debug(f"[DB] Connecting to database: {db_file}")
-    conn = sqlite3.connect(db_file, timeout=10, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    
-    # Optimize for concurrent access
-    conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA synchronous=NORMAL")
-    conn.execute("PRAGMA cache_size=10000")
-    conn.execute("PRAGMA temp_store=MEMORY")
-    
-    logger.debug("[DB] Database connection established")
-    return conn
+    """Get a pooled database connection (WAL, tuned PRAGMAs, statement cache)"""
+    return _pool.acquire()
 
 def db_execute(query, params=None):
     """Execute a database query"""
@@ -63,13 +167,13 @@ def db_fetchone(query, params=None):
     """Fetch one row from database"""
     try:
         with get_db_connection() as conn:
-            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             if params:
                 cursor.execute(query, params)
             else:
                 cursor.execute(query)
-            return dict(cursor.fetchone()) if cursor.rowcount > 0 else None
+            row = cursor.fetchone()
+            return dict(row) if row else None
     except Exception as e:
         logger.error(f"[DB] Error fetching one: {e}")
         return None
@@ -78,7 +182,6 @@ def db_fetchall(query, params=None):
     """Fetch all rows from database"""
     try:
         with get_db_connection() as conn:
-            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             if params:
                 cursor.execute(query, params)
@@ -106,7 +209,6 @@ def db_transaction(queries):
         return False
 
 def db_close_all():
-    """Close all database connections (for cleanup)"""
-    # SQLite connections are closed automatically when using context manager
-    pass
+    """Close all pooled database connections (only when the DB file changes, not per request)"""
+    _pool.close_all()
 
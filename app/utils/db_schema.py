@@ -10,6 +10,15 @@ logger = logging.getLogger(__name__)
 def init_database_schema(conn):
     """Initialize database schema with all tables"""
     
+    # Versioned databases are owned by SCHEMA_MIGRATIONS in app.py, which also runs the
+    # data backfills. user_version is never stamped here, so a database created by this
+    # function still replays every app.py migration step (all steps are idempotent).
+    if conn.execute("PRAGMA user_version").fetchone()[0] > 0:
+        return
+    
+    # Only takes effect on a new database (must precede journal_mode)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    
     # Enable WAL mode for better concurrency
     conn.execute("PRAGMA journal_mode=WAL")
     conn.execute("PRAGMA synchronous=NORMAL")
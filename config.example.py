@@ -33,3 +33,81 @@ KAVENEGAR_API_KEY = "YOUR_KAVENEGAR_API_KEY_HERE"
 # Payping API Token (for payment gateway)
 # Get from: https://payping.io/dashboard/api
 PAYPING_TOKEN = "YOUR_PAYPING_TOKEN_HERE"
+
+# Broadcast fan-out: number of concurrent send workers per platform (optional)
+# BROADCAST_CONCURRENCY = {'telegram': 25, 'bale': 10, 'ita': 5}
+
+# Ita HTTP client pool (optional)
+# ITA_HTTP_MAX_CONNECTIONS = 20
+# ITA_HTTP_MAX_CONCURRENCY = 10
+
+# Number of background workers executing queued broadcast jobs (optional)
+# BROADCAST_JOB_WORKERS = 2
+
+# Seconds between broadcast progress checkpoints, i.e. the resume point after a restart (optional)
+# BROADCAST_CHECKPOINT_INTERVAL = 2
+
+# Per-bot send budget used by the shared rate governor (optional, overrides defaults per key)
+# rate = messages/second for the whole bot, group_interval = min seconds between messages to one group/channel
+# RATE_LIMITS = {
+#     'telegram': {'rate': 30, 'burst': 30, 'group_interval': 3.0},
+#     'bale': {'rate': 15, 'burst': 15, 'group_interval': 1.0},
+#     'ita': {'rate': 10, 'burst': 10, 'group_interval': 1.0},
+# }
+
+# Also record broadcast dedupe keys in SQLite so several processes share them (optional)
+# BROADCAST_DEDUPE_PERSIST = False
+
+# Seconds between batched last_active flushes for chats seen in incoming messages (optional)
+# CHAT_ACTIVITY_FLUSH_INTERVAL = 5
+
+# Journal size (bytes) that triggers compaction of the chat backup journal into chats_backup.json (optional)
+# CHATS_BACKUP_COMPACT_BYTES = 5 * 1024 * 1024
+
+# Full database snapshots via the SQLite online backup API, copied in one step from a WAL read snapshot (optional)
+# DB_BACKUP_DIR = 'backups'
+# DB_BACKUP_GENERATIONS = 7
+# DB_BACKUP_INTERVAL_HOURS = 6
+
+# Single DB writer thread: max writes per transaction and how long (seconds) to wait for more writes to join a batch (optional)
+# DB_WRITER_MAX_BATCH = 500
+# DB_WRITER_LINGER = 0.005
+# Threads serving async reads from read-only connections (optional)
+# DB_READER_THREADS = 4
+
+# Rows per executemany chunk when ingesting chat members in bulk (optional)
+# MEMBER_INGEST_CHUNK = 1000
+
+# Daily data retention job (optional). A days value of 0 disables that step.
+# RETENTION_ENABLED = True
+# RETENTION_HOUR = 3
+# Move sent_messages of older batches into the compressed sent_messages_archive table
+# RETENTION_SENT_MESSAGES_DAYS = 90
+# Keep one chats_metrics point per week for data older than this
+# RETENTION_METRICS_DAILY_DAYS = 180
+# RETENTION_POSTS_STATS_DAYS = 0
+# RETENTION_PURGE_DELETED_BATCHES = True
+# Rows per write transaction and free pages released per incremental vacuum step
+# RETENTION_CHUNK_SIZE = 2000
+# RETENTION_VACUUM_PAGES = 2000
+# Pause in seconds between incremental vacuum steps so writers can get in
+# RETENTION_VACUUM_STEP_SLEEP = 0.005
+# One-time full VACUUM to switch an existing database to incremental auto_vacuum (blocks writes while it runs)
+# RETENTION_CONVERT_AUTO_VACUUM = False
+
+# Upper bound in seconds for cached /api/stats results; any chat or metrics change (tracked in data_versions) invalidates them earlier (optional)
+# STATS_CACHE_TTL = 30
+
+# Chat list endpoints (/api/chats, /api/list_chats_v2, ...): page size when only a cursor is given, and the upper cap for limit (optional)
+# CHAT_LIST_DEFAULT_LIMIT = 100
+# CHAT_LIST_MAX_LIMIT = 1000
+
+# Rows sent per chunk by streamed exports such as /api/comprehensive_report?format=ndjson|csv (optional)
+# REPORT_STREAM_BATCH_ROWS = 500
+
+# Background report builder (/api/reports): finished Excel files are cached on disk until the underlying data changes (optional)
+# REPORT_CACHE_DIR = "uploads/report_cache"
+# REPORT_CACHE_MAX_FILES = 20
+# REPORT_BUILDER_WORKERS = 1
+# Seconds /api/generate_excel_report and /api/growth-report wait before answering 202 with the job id
+# REPORT_SYNC_WAIT_SECONDS = 60